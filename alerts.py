@@ -0,0 +1,118 @@
+""" Alertas de vencimento mantidos em memória.
+
+O AlertEngine guarda os lotes com saldo que vencem dentro do maior prazo de
+alerta e os reavalia apenas quando algo muda: uma gravação (eventos do
+change_bus) ou a virada do dia. As contagens por faixa de prazo (7, 15 e 30
+dias) ficam calculadas até a próxima mudança.
+"""
+
+from datetime import date, datetime
+
+from models import DoacaoRecebida, Lote
+
+
+# Faixas de alerta, em dias até o vencimento
+ALERT_THRESHOLDS = (7, 15, 30)
+
+
+def _as_date(value):
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class AlertEngine:
+    """ Lotes que vencem em até max(thresholds) dias, agrupados por faixa.
+
+    O prazo conta a partir de hoje, inclusive: um lote que vence hoje tem
+    days_left 0 e cai na primeira faixa; um lote já vencido não é alerta.
+
+    load() substitui todos os alertas (carga inicial, virada do dia);
+    apply_change() atualiza só os lotes afetados por um ChangeEvent de
+    doacoes_recebidas ou doacoes_realizadas.
+    """
+
+    def __init__(self, conn, thresholds=ALERT_THRESHOLDS):
+        self.thresholds = tuple(sorted(thresholds))
+        self.horizon = self.thresholds[-1]
+        self.doacao_recebida_model = DoacaoRecebida(conn)
+        self.lote_model = Lote(conn)
+        self.today = None
+        self._alerts = {}    # id_doacao_recebida -> linha de iter_expiring_items
+        self._sorted = None  # cache de items()
+        self._counts = None  # cache de counts()
+
+    def refresh(self, today=None):
+        """ Recarrega todos os alertas a partir do banco """
+        today = _as_date(today)
+        self.load(self.doacao_recebida_model.get_expiring_items(self.horizon, today=today), today)
+
+    def load(self, rows, today=None):
+        """ Substitui os alertas por rows (resultado de get_expiring_items(horizon, today)) """
+        self.today = _as_date(today)
+        self._alerts = {row["id_doacao_recebida"]: row for row in rows}
+        self._invalidate()
+
+    def check_day(self, today=None):
+        """ True se o dia mudou desde a última carga (e os alertas precisam ser recarregados) """
+        return self.today != _as_date(today)
+
+    def apply_change(self, event):
+        """ Atualiza os alertas após uma gravação; retorna False se for preciso recarregar tudo """
+        if self.today is None or event.pk is None:
+            return False
+        if event.table == "doacoes_recebidas":
+            if event.operation == "delete":
+                self._alerts.pop(event.pk, None)
+                self._invalidate()
+                return True
+            self._reload_donations([event.pk])
+            return True
+        if event.table == "doacoes_realizadas" and event.operation == "insert":
+            # Uma doação nova só reduz o saldo dos lotes de onde saiu
+            allocations = self.lote_model.get_allocations(event.pk)
+            self._reload_donations({allocation["id_doacao_recebida"] for allocation in allocations})
+            return True
+        # Alterar ou excluir uma doação realizada devolve saldo a lotes que não se sabe mais quais são
+        return False
+
+    def _reload_donations(self, donation_ids):
+        donation_ids = list(donation_ids)
+        for donation_id in donation_ids:
+            self._alerts.pop(donation_id, None)
+        for row in self.doacao_recebida_model.iter_expiring_items(self.horizon, today=self.today, donation_ids=donation_ids):
+            self._alerts[row["id_doacao_recebida"]] = row
+        self._invalidate()
+
+    def _invalidate(self):
+        self._sorted = None
+        self._counts = None
+
+    def days_left(self, alert):
+        return (date.fromisoformat(alert["data_validade"]) - self.today).days
+
+    def bucket(self, alert):
+        """ Menor faixa (7, 15 ou 30) em que o lote se enquadra """
+        days = self.days_left(alert)
+        for threshold in self.thresholds:
+            if days <= threshold:
+                return threshold
+        return None
+
+    def items(self, threshold=None):
+        """ Alertas em ordem de validade; com threshold, só os que vencem em até threshold dias """
+        if self._sorted is None:
+            self._sorted = sorted(self._alerts.values(), key=lambda alert: (alert["data_validade"], alert["id_doacao_recebida"]))
+        if threshold is None:
+            return list(self._sorted)
+        return [alert for alert in self._sorted if self.days_left(alert) <= threshold]
+
+    def counts(self):
+        """ Número de lotes por faixa: {7: vencem em 0-7 dias, 15: em 8-15, 30: em 16-30} """
+        if self._counts is None:
+            self._counts = dict.fromkeys(self.thresholds, 0)
+            for alert in self._alerts.values():
+                self._counts[self.bucket(alert)] += 1
+        return dict(self._counts)
@@ -0,0 +1,173 @@
+""" Planejamento da distribuição do estoque entre os beneficiários, de acordo com os alimentos necessários.
+
+plan_distribution percorre uma única vez os lotes ainda válidos, na ordem de
+validade (os que vencem primeiro saem primeiro), e entrega cada um aos
+beneficiários que têm aquele tipo de alimento entre as necessidades
+(necessidades_beneficiario): primeiro quem o indicou como necessidade 1,
+depois 2 e 3, e entre eles na ordem de cadastro, uma porção para cada. O
+resultado é uma lista de linhas (beneficiário, item, quantidade) que pode ser
+revista e registrada de uma vez com commit_plan.
+
+Tipos de alimento e necessidades são comparados por validators.normalize_key
+("Feijão" atende "feijao"); a porção vale na unidade base da grandeza (kg, L
+ou un): itens em gramas entram convertidos (porção 1 = 1000 g), e unidades
+sem conversão (ex.: kg e pacote) são repartidas separadamente. As linhas do
+plano trazem a quantidade na unidade do próprio item.
+
+Uso: python allocation_planner.py estoque_doacoes.db --porcao 2 --dias 30
+"""
+
+import argparse
+import sqlite3
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+
+from models import DATABASE, LOT_EPSILON, DoacaoRealizada, get_db_connection
+from validators import normalize_key
+
+
+DEFAULT_PORTION = 1.0
+
+
+def _iso(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def plan_distribution(conn, portion=DEFAULT_PORTION, portions=None, max_days=None, today=None):
+    """ Proposta de distribuição do estoque atual.
+
+    portion é a quantidade entregue a cada beneficiário por tipo de alimento,
+    na unidade base; portions ({nome do alimento: porção}) a substitui para
+    alguns tipos.
+    max_days restringe o plano aos lotes que vencem em até max_days dias
+    (None: todos os lotes válidos). Retorna uma lista de dicionários com
+    id_beneficiario, beneficiario_nome, prioridade, id_item, nome_item,
+    marca, unidade, quantidade e data_validade (do primeiro lote usado),
+    ordenada por beneficiário e item.
+    """
+    today = date.fromisoformat(_iso(today)) if today else date.today()
+    custom_portions = {normalize_key(name): value for name, value in (portions or {}).items()}
+    cursor = conn.cursor()
+    cursor.row_factory = None
+
+    cursor.execute("""
+        SELECT i.id_item, i.nome_item, i.marca, i.unidade, u.id_unidade_base, u.fator
+        FROM itens i JOIN unidades u ON u.id_unidade = i.id_unidade
+    """)
+    items = {row[0]: row for row in cursor.fetchall()}
+
+    # Beneficiários por alimento necessário, já na ordem de atendimento
+    cursor.execute("""
+        SELECT n.alimento, n.id_beneficiario, n.prioridade, b.nome
+        FROM necessidades_beneficiario n
+        JOIN beneficiarios b ON b.id_beneficiario = n.id_beneficiario
+        ORDER BY n.prioridade, n.id_beneficiario
+    """)
+    needs = {}
+    for alimento, beneficiary_id, priority, name in cursor.fetchall():
+        needing = needs.setdefault(normalize_key(alimento), {})
+        # O mesmo alimento repetido nas necessidades conta uma vez, na maior prioridade
+        needing.setdefault(beneficiary_id, (priority, name))
+
+    params = [today.isoformat()]
+    horizon = ""
+    if max_days is not None:
+        horizon = "AND data_validade <= ?"
+        params.append((today + timedelta(days=max_days)).isoformat())
+    cursor.execute(f"""
+        SELECT id_item, data_validade, SUM(quantidade_restante) FROM lotes
+        WHERE quantidade_restante > 0 AND data_validade >= ? {horizon}
+        GROUP BY id_item, data_validade
+        ORDER BY data_validade, id_item
+    """, params)
+
+    queues = {}
+    plan = {}
+    for item_id, validity, available in cursor:
+        item = items.get(item_id)
+        if item is None:
+            continue
+        food = normalize_key(item[1])
+        # Porções e disponível na unidade base; a linha do plano volta para a unidade do item
+        key = (food, item[4])
+        factor = item[5]
+        available *= factor
+        queue = queues.get(key)
+        if queue is None:
+            share = custom_portions.get(food, portion)
+            queue = queues[key] = deque(
+                [beneficiary_id, priority, name, share]
+                for beneficiary_id, (priority, name) in needs.get(food, {}).items()
+            ) if share > 0 else deque()
+        while available > LOT_EPSILON and queue:
+            entry = queue[0]
+            given = min(entry[3], available)
+            line = plan.get((entry[0], item_id))
+            if line is None:
+                line = plan[(entry[0], item_id)] = {
+                    "id_beneficiario": entry[0], "beneficiario_nome": entry[2], "prioridade": entry[1],
+                    "id_item": item_id, "nome_item": item[1], "marca": item[2], "unidade": item[3],
+                    "quantidade": 0.0, "data_validade": validity,
+                }
+            line["quantidade"] += given / factor
+            available -= given
+            entry[3] -= given
+            if entry[3] <= LOT_EPSILON:
+                queue.popleft()
+    return sorted(plan.values(), key=lambda line: (line["id_beneficiario"], normalize_key(line["nome_item"]),
+                                                   line["marca"] or "", line["id_item"]))
+
+
+def commit_plan(conn, plan, data_doacao=None):
+    """ Registra as linhas do plano como doações realizadas em uma única transação (DoacaoRealizada.save_many).
+
+    Cada doação consome os lotes do item em ordem FEFO, só os válidos em
+    data_doacao (use o mesmo dia do today do plano). As linhas são gravadas na
+    ordem em que plan_distribution entregou cada item (prioridade, depois
+    beneficiário), de modo que cada uma recebe os mesmos lotes do plano e a
+    data_validade mostrada. Retorna a quantidade de doações registradas, ou
+    None se alguma não puder ser registrada (por exemplo, se o estoque mudou
+    desde o planejamento); nesse caso nada é gravado.
+    """
+    data_doacao = _iso(data_doacao) or date.today().isoformat()
+    lines = sorted(plan, key=lambda line: (line["id_item"], line["prioridade"], line["id_beneficiario"]))
+    return DoacaoRealizada(conn).save_many(
+        {"id_beneficiario": line["id_beneficiario"], "id_item": line["id_item"],
+         "quantidade": line["quantidade"], "data_doacao": data_doacao}
+        for line in lines
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Planeja a distribuição do estoque conforme as necessidades dos beneficiários")
+    parser.add_argument("db", nargs="?", default=DATABASE)
+    parser.add_argument("--porcao", type=float, default=DEFAULT_PORTION, help="quantidade por beneficiário e tipo de alimento")
+    parser.add_argument("--dias", type=int, help="só lotes que vencem nos próximos DIAS dias")
+    parser.add_argument("--registrar", action="store_true", help="registra o plano como doações realizadas")
+    args = parser.parse_args(argv)
+    conn = get_db_connection(args.db)
+    try:
+        started = time.perf_counter()
+        plan = plan_distribution(conn, args.porcao, max_days=args.dias)
+        elapsed = time.perf_counter() - started
+        for line in plan[:50]:
+            print(f"{line['beneficiario_nome']}: {line['quantidade']:.2f} {line['unidade']} de {line['nome_item']} "
+                  f"({line['marca']}, validade {line['data_validade']})")
+        beneficiaries = len({line["id_beneficiario"] for line in plan})
+        print(f"{len(plan)} doações para {beneficiaries} beneficiários planejadas em {elapsed:.3f} s.")
+        if args.registrar and plan:
+            count = commit_plan(conn, plan)
+            print(f"{count} doações registradas." if count is not None else "O plano não pôde ser registrado.")
+    except sqlite3.Error as e:
+        print(f"Erro ao planejar a distribuição: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
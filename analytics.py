@@ -0,0 +1,394 @@
+""" Análises do histórico de doações sobre arrays NumPy em colunas.
+
+LedgerSnapshot.load lê doacoes_recebidas e doacoes_realizadas em blocos
+direto do cursor para arrays compactos (dia como inteiro de dias desde
+01/01/1970, itens e pessoas como int32, quantidades como float64) e as
+operações (estoque em uma data, entradas e saídas por período, totais por
+doador ou beneficiário) são vetorizadas. Os totais por doador e beneficiário
+somam quantidade_canonica (na unidade base: kg, L ou un), já que misturam itens.
+
+Os arrays ficam gravados em .npy ao lado do banco e são abertos com
+memory-map nas cargas seguintes. A chave do cache é o contador de
+versao_dados (incrementado pelos triggers quando uma doação é alterada ou
+excluída); doações novas apenas acrescentam linhas, lidas a partir do último
+id guardado.
+
+NumPy é opcional: sem ele o módulo importa, mas HAS_NUMPY é False e
+LedgerSnapshot.load levanta RuntimeError.
+
+Uso: python analytics.py estoque_doacoes.db --data 2025-06-30
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from models import DATABASE, get_db_connection
+
+
+HAS_NUMPY = np is not None
+EPOCH = date(1970, 1, 1)
+# Linhas lidas por fetchmany ao montar os arrays
+CHUNK_SIZE = 65536
+# Dia (inteiro desde 01/01/1970) calculado pelo SQLite; datas inválidas viram 0
+_DAY_SQL = "IFNULL(CAST(julianday({0}) - 2440587.5 AS INTEGER), 0)"
+# Por tabela: (coluna id, [(nome no array, tipo, expressão SQL)])
+LEDGER_TABLES = {
+    'doacoes_recebidas': ('id_doacao_recebida', [
+        ('id', 'int64', 'id_doacao_recebida'),
+        ('dia', 'int32', _DAY_SQL.format('data_recebimento')),
+        ('id_item', 'int32', 'id_item'),
+        ('id_doador', 'int32', 'id_doador'),
+        ('quantidade', 'float64', 'quantidade'),
+        ('quantidade_canonica', 'float64', 'IFNULL(quantidade_canonica, quantidade)'),
+    ]),
+    'doacoes_realizadas': ('id_doacao_realizada', [
+        ('id', 'int64', 'id_doacao_realizada'),
+        ('dia', 'int32', _DAY_SQL.format('data_doacao')),
+        ('id_item', 'int32', 'id_item'),
+        ('id_beneficiario', 'int32', 'id_beneficiario'),
+        ('quantidade', 'float64', 'quantidade'),
+        ('quantidade_canonica', 'float64', 'IFNULL(quantidade_canonica, quantidade)'),
+    ]),
+}
+PERIODS = ('dia', 'semana', 'mes')
+# Dias da média móvel de saídas usada na previsão de esgotamento
+FORECAST_WINDOW = 28
+
+
+def to_day(value):
+    """ date, datetime ou texto ISO (YYYY-MM-DD) para dias desde 01/01/1970 """
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return (value - EPOCH).days
+
+
+def default_cache_dir(conn):
+    """ Pasta do cache ao lado do arquivo do banco (<banco>-analise); None para bancos em memória """
+    path = next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main'), "")
+    return f"{path}-analise" if path else None
+
+
+def _read_versions(conn):
+    return {row[0]: row[1] for row in conn.execute("SELECT tabela, versao FROM versao_dados")}
+
+
+def _read_rows(conn, table, after_id, chunk_size):
+    """ Colunas de table com id > after_id, lidas em blocos de chunk_size linhas """
+    id_column, columns = LEDGER_TABLES[table]
+    dtype = np.dtype([(name, kind) for name, kind, _ in columns])
+    cursor = conn.cursor()
+    # Tuplas simples: sqlite3.Row custaria uma conversão por linha
+    cursor.row_factory = None
+    cursor.execute(f"SELECT {', '.join(sql for _, _, sql in columns)} FROM {table} WHERE {id_column} > ? ORDER BY {id_column}",
+                   (after_id,))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(np.fromiter(rows, dtype=dtype, count=len(rows)))
+    records = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    # Uma coluna contígua por campo (as operações percorrem uma coluna por vez)
+    return {name: np.ascontiguousarray(records[name]) for name, _, _ in columns}
+
+
+def _cache_files(cache_dir, table, version):
+    _, columns = LEDGER_TABLES[table]
+    return {name: os.path.join(cache_dir, f"{table}-v{version}-{name}.npy") for name, _, _ in columns}
+
+
+def _load_cached(cache_dir, table, version):
+    files = _cache_files(cache_dir, table, version)
+    if not all(os.path.exists(path) for path in files.values()):
+        return None
+    try:
+        return {name: np.load(path, mmap_mode='r') for name, path in files.items()}
+    except (OSError, ValueError) as e:
+        print(f"Erro ao abrir o cache de análise de {table}: {e}")
+        return None
+
+
+def _save_cached(cache_dir, table, version, arrays):
+    """ Grava os arrays da versão (arquivo temporário + os.replace) e apaga as versões antigas """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name, path in _cache_files(cache_dir, table, version).items():
+            temporary = f"{path}.tmp"
+            with open(temporary, "wb") as file:
+                np.save(file, arrays[name])
+            os.replace(temporary, path)
+        current = set(os.path.basename(path) for path in _cache_files(cache_dir, table, version).values())
+        for filename in os.listdir(cache_dir):
+            if filename.startswith(f"{table}-v") and filename.endswith(".npy") and filename not in current:
+                os.remove(os.path.join(cache_dir, filename))
+    except OSError as e:
+        print(f"Erro ao gravar o cache de análise de {table}: {e}")
+
+
+class LedgerSnapshot:
+    """ Doações recebidas e realizadas em arrays por coluna (received/distributed: nome -> array) """
+
+    def __init__(self, received, distributed, versions=None):
+        self.received = received
+        self.distributed = distributed
+        self.versions = versions or {}
+
+    @classmethod
+    def load(cls, conn, cache_dir=None, use_cache=True, chunk_size=CHUNK_SIZE):
+        """ Lê as doações (ou o cache em disco) em uma única transação de leitura.
+
+        cache_dir None usa default_cache_dir(conn). Com use_cache=False (ou
+        banco em memória) tudo é lido do banco e nada é gravado.
+        """
+        if not HAS_NUMPY:
+            raise RuntimeError("NumPy não está instalado (pip install numpy)")
+        if use_cache and cache_dir is None:
+            cache_dir = default_cache_dir(conn)
+        use_cache = use_cache and cache_dir is not None
+        # Versão e linhas lidas do mesmo instantâneo do banco
+        began = not conn.in_transaction
+        if began:
+            conn.execute("BEGIN")
+        try:
+            versions = _read_versions(conn)
+            tables = {}
+            for table in LEDGER_TABLES:
+                version = versions.get(table, 0)
+                arrays = _load_cached(cache_dir, table, version) if use_cache else None
+                last_id = int(arrays['id'][-1]) if arrays is not None and len(arrays['id']) else 0
+                new_rows = _read_rows(conn, table, last_id, chunk_size)
+                if arrays is None:
+                    arrays = new_rows
+                elif len(new_rows['id']):
+                    arrays = {name: np.concatenate([arrays[name], new_rows[name]]) for name in arrays}
+                else:
+                    tables[table] = arrays
+                    continue
+                if use_cache:
+                    _save_cached(cache_dir, table, version, arrays)
+                tables[table] = arrays
+        finally:
+            if began:
+                conn.commit()
+        return cls(tables['doacoes_recebidas'], tables['doacoes_realizadas'], versions)
+
+    def __len__(self):
+        return len(self.received['id']) + len(self.distributed['id'])
+
+    def stock_as_of(self, when):
+        """ Saldo de cada item ao fim do dia when: array indexado por id_item (recebido - realizado) """
+        day = to_day(when)
+        size = int(max(self.received['id_item'].max(initial=0), self.distributed['id_item'].max(initial=0))) + 1
+        received = self.received['dia'] <= day
+        distributed = self.distributed['dia'] <= day
+        return (np.bincount(self.received['id_item'][received], weights=self.received['quantidade'][received], minlength=size)
+                - np.bincount(self.distributed['id_item'][distributed], weights=self.distributed['quantidade'][distributed],
+                              minlength=size))
+
+    def flow_histogram(self, start, end, period='dia', id_item=None):
+        """ Entradas e saídas por período entre start e end (inclusive).
+
+        Retorna (inícios dos períodos como datetime64[D], quantidade recebida,
+        quantidade distribuída), com todos os períodos da faixa, inclusive os
+        sem movimentação. Semanas começam na segunda-feira.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"período inválido: {period} (use {', '.join(PERIODS)})")
+        start_day, end_day = to_day(start), to_day(end)
+        if end_day < start_day:
+            raise ValueError("a data final é anterior à inicial")
+        first_bin, last_bin = _bins(np.array([start_day, end_day]), period)
+        size = int(last_bin - first_bin) + 1
+        series = []
+        for data in (self.received, self.distributed):
+            mask = (data['dia'] >= start_day) & (data['dia'] <= end_day)
+            if id_item is not None:
+                mask &= data['id_item'] == id_item
+            bins = _bins(data['dia'][mask], period) - first_bin
+            series.append(np.bincount(bins, weights=data['quantidade'][mask], minlength=size))
+        starts = np.arange(first_bin, last_bin + 1)
+        if period == 'mes':
+            starts = starts.astype('datetime64[M]').astype('datetime64[D]')
+        elif period == 'semana':
+            starts = (starts * 7 - 3).astype('datetime64[D]')
+        else:
+            starts = starts.astype('datetime64[D]')
+        return starts, series[0], series[1]
+
+    def donor_totals(self, start=None, end=None):
+        """ (id_doador, quantidade total na unidade base, número de doações) por doador, do maior total para o menor """
+        return _totals(self.received, 'id_doador', start, end)
+
+    def beneficiary_totals(self, start=None, end=None):
+        """ (id_beneficiario, quantidade total na unidade base, número de doações) por beneficiário, do maior total para o menor """
+        return _totals(self.distributed, 'id_beneficiario', start, end)
+
+
+def _bins(days, period):
+    """ Índice do período de cada dia: o próprio dia, a semana (1970-01-01 foi quinta-feira) ou o mês """
+    if period == 'mes':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if period == 'semana':
+        return (days.astype(np.int64) + 3) // 7
+    return days.astype(np.int64)
+
+
+def _totals(data, key, start, end):
+    mask = np.ones(len(data['id']), dtype=bool)
+    if start is not None:
+        mask &= data['dia'] >= to_day(start)
+    if end is not None:
+        mask &= data['dia'] <= to_day(end)
+    keys = data[key][mask]
+    totals = np.bincount(keys, weights=data['quantidade_canonica'][mask])
+    counts = np.bincount(keys, minlength=len(totals))
+    ids = np.flatnonzero(counts)
+    order = np.argsort(-totals[ids], kind='stable')
+    ids = ids[order]
+    return ids, totals[ids], counts[ids]
+
+
+def depletion_forecast(conn, today=None, window=FORECAST_WINDOW):
+    """ Previsão de esgotamento de cada tipo de alimento (nome_item e unidade base), calculada para todos de uma vez.
+
+    saida_diaria é a média das saídas nos últimos window dias (inclusive hoje,
+    a partir de movimentacao_diaria). dias_cobertura divide o que há nos lotes
+    ainda válidos por essa média; dias_ate_esgotar consome os lotes na ordem
+    de validade (FEFO) nesse ritmo, e a parte de cada lote que vence antes de
+    ser usada não conta (quantidade_vencendo). Sem saídas na janela, os prazos
+    são None e todo o estoque conta como vencendo. As quantidades são
+    convertidas pelo fator da unidade de cada item (500 g entram como 0,5 kg),
+    como em get_grouped_stock. Retorna uma lista de
+    dicionários ordenada por nome_item e unidade, só com os tipos que têm
+    estoque ou saídas.
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError("NumPy não está instalado (pip install numpy)")
+    today = to_day(today or date.today())
+    first_day = (EPOCH + timedelta(days=today - window + 1)).isoformat()
+    today_text = (EPOCH + timedelta(days=today)).isoformat()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    # As consultas agregam por id_item (sem JOIN, só índices); o agrupamento por tipo
+    # de alimento e a conversão de unidade são feitos com os mapas id_item -> tipo e fator
+    cursor.execute("""
+        SELECT i.id_item, t.nome, b.nome, u.fator FROM itens i
+        JOIN tipos_alimento t ON t.id_tipo = i.id_tipo
+        JOIN unidades u ON u.id_unidade = i.id_unidade
+        JOIN unidades b ON b.id_unidade = u.id_unidade_base
+    """)
+    items = cursor.fetchall()
+    keys = sorted({(nome_item, unidade) for _, nome_item, unidade, _ in items})
+    index = {key: position for position, key in enumerate(keys)}
+    size = len(keys)
+    item_type = np.zeros(max((row[0] for row in items), default=0) + 1, dtype=np.int64)
+    item_type[[row[0] for row in items]] = [index[(row[1], row[2])] for row in items]
+    item_factor = np.ones(len(item_type))
+    item_factor[[row[0] for row in items]] = [row[3] for row in items]
+
+    cursor.execute("""
+        SELECT id_item, SUM(quantidade_distribuida) FROM movimentacao_diaria
+        WHERE dia >= ? AND dia <= ?
+        GROUP BY id_item
+    """, (first_day, today_text))
+    distributed = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 2)
+    distributed_items = distributed[:, 0].astype(np.int64)
+    rate = np.bincount(item_type[distributed_items], weights=distributed[:, 1] * item_factor[distributed_items],
+                       minlength=size) / window
+
+    # Lotes vencidos não entram: já não podem ser distribuídos
+    cursor.execute(f"""
+        SELECT id_item, {_DAY_SQL.format('data_validade')}, SUM(quantidade_restante) FROM lotes
+        WHERE quantidade_restante > 0 AND data_validade >= ?
+        GROUP BY id_item, data_validade
+    """, (today_text,))
+    lots = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+    lot_items = lots[:, 0].astype(np.int64)
+    lot_type = item_type[lot_items]
+    lots[:, 2] *= item_factor[lot_items]
+    # Ordem de consumo dentro de cada tipo de alimento: validade
+    order = np.lexsort((lots[:, 1], lot_type))
+    lot_type, lot_days, lot_quantity = lot_type[order], lots[order, 1] - today + 1, lots[order, 2]
+
+    # Lotes em uma matriz (tipo de alimento x posição na ordem de validade); as posições
+    # que sobram têm quantidade 0. Cada coluna é processada para todos os tipos de uma vez
+    counts = np.bincount(lot_type, minlength=size)
+    rank = np.arange(len(lot_type)) - np.repeat(np.cumsum(counts) - counts, counts)
+    width = int(counts.max(initial=0))
+    usable_days = np.full((size, width), np.inf)
+    quantity = np.zeros((size, width))
+    usable_days[lot_type, rank] = lot_days
+    quantity[lot_type, rank] = lot_quantity
+
+    has_rate = rate > 0
+    safe_rate = np.where(has_rate, rate, 1.0)
+    elapsed = np.zeros(size)
+    used_quantity = np.zeros(size)
+    for column in range(width):
+        # Dias para consumir o lote, limitados ao que falta para ele vencer
+        duration = np.where(has_rate, quantity[:, column] / safe_rate, 0.0)
+        used = np.minimum(duration, np.maximum(usable_days[:, column] - elapsed, 0.0))
+        elapsed += used
+        used_quantity += used * rate
+    stock = np.bincount(lot_type, weights=lot_quantity, minlength=size)
+    expiring = np.maximum(stock - used_quantity, 0.0)
+    cover = np.where(has_rate, stock / safe_rate, np.inf)
+
+    forecast = []
+    for position, (nome_item, unidade) in enumerate(keys):
+        if not has_rate[position] and not stock[position]:
+            continue
+        days_left = float(elapsed[position]) if has_rate[position] else None
+        forecast.append({
+            "nome_item": nome_item,
+            "unidade": unidade,
+            "saida_diaria": float(rate[position]),
+            "quantidade_em_lotes": float(stock[position]),
+            "dias_cobertura": float(cover[position]) if has_rate[position] else None,
+            "dias_ate_esgotar": days_left,
+            "data_esgotamento": (EPOCH + timedelta(days=today + int(days_left))).isoformat() if days_left is not None else None,
+            "quantidade_vencendo": float(expiring[position]),
+        })
+    return forecast
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumo do histórico de doações calculado com NumPy")
+    parser.add_argument("db", nargs="?", default=DATABASE)
+    parser.add_argument("--data", default=date.today().isoformat(), help="data do saldo de estoque (YYYY-MM-DD)")
+    parser.add_argument("--sem-cache", action="store_true", help="lê tudo do banco, sem usar nem gravar o cache")
+    args = parser.parse_args(argv)
+    if not HAS_NUMPY:
+        parser.error("NumPy não está instalado (pip install numpy)")
+    conn = get_db_connection(args.db)
+    try:
+        started = time.perf_counter()
+        snapshot = LedgerSnapshot.load(conn, use_cache=not args.sem_cache)
+        print(f"{len(snapshot)} doações carregadas em {time.perf_counter() - started:.3f} s.")
+        started = time.perf_counter()
+        stock = snapshot.stock_as_of(args.data)
+        donors, totals, counts = snapshot.donor_totals()
+        print(f"Saldo em {args.data}: {np.count_nonzero(stock > 0)} itens com estoque, {stock[stock > 0].sum():.1f} no total "
+              f"(calculado em {time.perf_counter() - started:.3f} s).")
+        for donor_id, total, count in zip(donors[:10], totals[:10], counts[:10]):
+            print(f"Doador {donor_id}: {total:.1f} em {count} doações")
+    except sqlite3.Error as e:
+        print(f"Erro ao ler o banco: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
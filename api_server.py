@@ -0,0 +1,539 @@
+""" Servidor HTTP/JSON local sobre os modelos, para registrar doações a partir de tablets.
+
+As conexões HTTP são atendidas por asyncio em uma única thread; cada consulta
+ou gravação no SQLite roda em um ThreadPoolExecutor de tamanho fixo, com as
+conexões de um ConnectionPool (uma por thread de trabalho), de modo que uma
+consulta lenta não segura as demais requisições. A serialização em JSON também
+acontece na thread de trabalho.
+
+Rotas (todas respondem JSON; erros vêm como {"erro": "mensagem"}):
+
+    GET  /doadores, /beneficiarios, /itens        ?after_id=&limit=&busca=
+    GET  /doadores/<id>, /beneficiarios/<id>, /itens/<id>
+    POST /doadores, /beneficiarios
+    GET  /doacoes-recebidas, /doacoes-realizadas  ?after_id=&limit=
+    GET  /doacoes-recebidas/<id>, /doacoes-realizadas/<id>
+    POST /doacoes-recebidas, /doacoes-realizadas
+    GET  /estoque, /estoque/itens                 (com ETag)
+    GET  /estoque/historico                       ?data= (saldo de cada item ao fim da data, com ETag)
+    GET  /alertas                                 ?dias=&limit= (com ETag)
+    GET  /relatorios/movimentacao                 ?inicio=&fim=&periodo=dia|semana|mes&item=&por_item=0|1 (com ETag)
+
+As listas são paginadas por chave: a resposta traz {"registros": [...],
+"proximo": id}, e a página seguinte é pedida com ?after_id=<proximo>
+("proximo" é null na última página).
+
+Uso: python api_server.py --host 0.0.0.0 --porta 8080
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import validators
+from alerts import ALERT_THRESHOLDS, AlertEngine
+from database import create_tables
+from models import (DATABASE, REPORT_PERIODS, Beneficiario, ConnectionPool, DoacaoRealizada, DoacaoRecebida, Doador, Item,
+                    Lote, MovimentacaoDiaria, RetratoSaldo, get_db_connection, query_cache)
+from stock_snapshots import SnapshotWorker
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_LINES = 100
+# Faixa do INTEGER do SQLite; ids fora dela dariam OverflowError ao consultar
+SQLITE_INT_MIN = -2 ** 63
+SQLITE_INT_MAX = 2 ** 63 - 1
+# Conexão keep-alive ociosa por mais que isso é encerrada
+KEEP_ALIVE_TIMEOUT = 30
+# Faixa padrão do relatório de movimentação quando inicio não é informado
+DEFAULT_REPORT_DAYS = 365
+# Tabelas lidas pelos alertas (get_expiring_items)
+ALERT_TABLES = ("lotes", "doacoes_recebidas", "doadores", "itens")
+
+Request = namedtuple("Request", ["method", "path", "query", "headers", "body", "params"])
+
+
+class HTTPError(Exception):
+    """ Erro devolvido ao cliente com o status indicado """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_bytes(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _int_param(request, name, default=None, minimum=None, maximum=None):
+    values = request.query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Parâmetro {name} deve ser um número inteiro.")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum) \
+            or not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Parâmetro {name} fora do intervalo permitido.")
+    return value
+
+
+def _path_id(request, message):
+    """ Id capturado na rota; fora da faixa do SQLite não há registro, então é 404 """
+    value = int(request.params[0])
+    if value > SQLITE_INT_MAX:
+        raise HTTPError(HTTPStatus.NOT_FOUND, message)
+    return value
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b"null")
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Corpo da requisição não é um JSON válido.")
+    if not isinstance(data, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "O corpo deve ser um objeto JSON.")
+    return data
+
+
+def _text(data, field):
+    value = data.get(field)
+    return "" if value is None else str(value).strip()
+
+
+def _required_int(data, field, message):
+    try:
+        value = int(data[field])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, message)
+    if not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, message)
+    return value
+
+
+def _quantity(data):
+    try:
+        return validators.parse_quantity(data.get("quantidade"))
+    except (TypeError, ValueError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Quantidade inválida. Deve ser um número positivo.")
+
+
+def _date(data, field, required=False):
+    value = _text(data, field)
+    if not value:
+        if required:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"O campo {field} é obrigatório.")
+        return datetime.now().strftime("%Y-%m-%d")
+    try:
+        return validators.parse_date(value)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Data inválida em {field}. Use DD/MM/YYYY ou YYYY-MM-DD.")
+
+
+def _date_param(request, name, default):
+    values = request.query.get(name)
+    if not values:
+        return default
+    try:
+        return validators.parse_date(values[0])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Parâmetro {name} deve ser uma data (DD/MM/YYYY ou YYYY-MM-DD).")
+
+
+def _cached(conn, key, tables, build):
+    """ Resultado de build() guardado no QueryCache da conexão, descartado quando as tabelas mudam """
+    cache = query_cache(conn)
+    cache.check_version(conn)
+    found, value = cache.get(key)
+    if not found:
+        value = build()
+        cache.put(key, tables, value)
+    return value
+
+
+def _page(rows, limit, id_column):
+    """ Resposta paginada a partir de até limit + 1 linhas (a sobra indica que há próxima página) """
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {"registros": rows, "proximo": rows[-1][id_column] if has_more else None}
+
+
+class Api:
+    """ Rotas da API; cada handler recebe (conn, request) e roda em uma thread de trabalho """
+
+    def __init__(self):
+        self.routes = []
+        for model, path in ((Doador, "doadores"), (Beneficiario, "beneficiarios"), (Item, "itens")):
+            self.route("GET", rf"/{path}", self.list_records(model))
+            self.route("GET", rf"/{path}/(\d+)", self.get_record(model))
+        self.route("POST", r"/doadores", self.create_person(Doador, "doador"))
+        self.route("POST", r"/beneficiarios", self.create_person(Beneficiario, "beneficiário"))
+        for model, path in ((DoacaoRecebida, "doacoes-recebidas"), (DoacaoRealizada, "doacoes-realizadas")):
+            self.route("GET", rf"/{path}", self.list_donations(model))
+            self.route("GET", rf"/{path}/(\d+)", self.get_donation(model))
+        self.route("POST", r"/doacoes-recebidas", self.create_received_donation)
+        self.route("POST", r"/doacoes-realizadas", self.create_distributed_donation)
+        self.route("GET", r"/estoque", self.stock, etag=True)
+        self.route("GET", r"/estoque/itens", self.stock_items, etag=True)
+        self.route("GET", r"/estoque/historico", self.stock_as_of, etag=True)
+        self.route("GET", r"/alertas", self.alerts, etag=True)
+        self.route("GET", r"/relatorios/movimentacao", self.flow_report, etag=True)
+
+    def route(self, method, pattern, handler, etag=False):
+        self.routes.append((method, re.compile(pattern + r"/?"), handler, etag))
+
+    def resolve(self, method, path):
+        """ (handler, parâmetros da URL, usa ETag); HTTPError 404/405 se não houver rota """
+        allowed = False
+        for route_method, pattern, handler, etag in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                if route_method == method:
+                    return handler, match.groups(), etag
+                allowed = True
+        if allowed:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Método não permitido para este recurso.")
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Recurso não encontrado.")
+
+    @staticmethod
+    def list_records(model_class):
+        def handler(conn, request):
+            model = model_class(conn)
+            limit = _int_param(request, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+            query = request.query.get("busca", [""])[0]
+            if query:
+                return {"registros": model.search(query, limit), "proximo": None}
+            after_id = _int_param(request, "after_id")
+            return _page(model.iter_all(after_id=after_id, limit=limit + 1), limit, model.id_column_name)
+        return handler
+
+    @staticmethod
+    def get_record(model_class):
+        def handler(conn, request):
+            record = model_class(conn).get_by_id(_path_id(request, "Registro não encontrado."))
+            if record is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "Registro não encontrado.")
+            return record
+        return handler
+
+    @staticmethod
+    def create_person(model_class, label):
+        def handler(conn, request):
+            data = _json_body(request)
+            record = {field: _text(data, field) for field in ("nome", "telefone", "email", "endereco")}
+            if model_class is Beneficiario:
+                for field in ("alimento_necessidade_1", "alimento_necessidade_2", "alimento_necessidade_3"):
+                    record[field] = _text(data, field)
+            if not record["nome"]:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"O nome do {label} é obrigatório!")
+            if record["telefone"] and not validators.validate_phone(record["telefone"]):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Telefone inválido. Deve conter somente números e ter DDD+número (10 ou 11 dígitos).")
+            if record["email"] and not validators.validate_email(record["email"]):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Email inválido.")
+            model = model_class(conn)
+            record_id = model.save(record)
+            if record_id is None:
+                raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"Não foi possível cadastrar o {label}.")
+            return HTTPStatus.CREATED, model.get_by_id(record_id)
+        return handler
+
+    @staticmethod
+    def list_donations(model_class):
+        def handler(conn, request):
+            model = model_class(conn)
+            limit = _int_param(request, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+            rows = model.iter_all_with_details(after_id=_int_param(request, "after_id"), limit=limit + 1)
+            return _page(rows, limit, model.id_column_name)
+        return handler
+
+    @staticmethod
+    def get_donation(model_class):
+        def handler(conn, request):
+            record = model_class(conn).get_with_details(_path_id(request, "Doação não encontrada."))
+            if record is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "Doação não encontrada.")
+            return record
+        return handler
+
+    @staticmethod
+    def create_received_donation(conn, request):
+        """ Como o formulário de entrada: o item vem por id_item ou por nome_item/marca/unidade (criado se não existir) """
+        data = _json_body(request)
+        donor_id = _required_int(data, "id_doador", "Informe um id_doador válido.")
+        if Doador(conn).get_by_id(donor_id) is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Doador {donor_id} não cadastrado.")
+        quantity = _quantity(data)
+        validity = _date(data, "data_validade", required=True)
+        received = _date(data, "data_recebimento")
+        item_model = Item(conn)
+        donation_model = DoacaoRecebida(conn)
+        # Item novo e doação ficam na mesma transação: ou os dois são gravados, ou nenhum
+        try:
+            with donation_model.transaction():
+                if data.get("id_item") is not None:
+                    item_id = _required_int(data, "id_item", "Informe um id_item válido.")
+                    if item_model.get_by_id(item_id) is None:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Item {item_id} não cadastrado.")
+                else:
+                    name, brand, unit = _text(data, "nome_item"), _text(data, "marca"), _text(data, "unidade")
+                    if not name or not unit:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Informe id_item ou nome_item e unidade.")
+                    item = item_model.get_by_name_brand_unit(name, brand, unit)
+                    item_id = item["id_item"] if item else item_model.save({"nome_item": name, "marca": brand, "unidade": unit})
+                donation_id = donation_model.save({"id_doador": donor_id, "id_item": item_id, "quantidade": quantity,
+                                                   "data_recebimento": received, "data_validade": validity})
+                if item_id is None or donation_id is None:
+                    raise sqlite3.Error("falha ao gravar a doação recebida")
+        except sqlite3.Error:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, "Não foi possível registrar a doação recebida.")
+        return HTTPStatus.CREATED, donation_model.get_with_details(donation_id)
+
+    @staticmethod
+    def create_distributed_donation(conn, request):
+        """ Como o formulário de saída: confere o beneficiário e o saldo dos lotes antes de gravar """
+        data = _json_body(request)
+        beneficiary_id = _required_int(data, "id_beneficiario", "Informe um id_beneficiario válido.")
+        item_id = _required_int(data, "id_item", "Informe um id_item válido.")
+        quantity = _quantity(data)
+        if Beneficiario(conn).get_by_id(beneficiary_id) is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Beneficiário {beneficiary_id} não cadastrado.")
+        item = Item(conn).get_by_id(item_id)
+        if item is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Item {item_id} não cadastrado.")
+        day = _date(data, "data_doacao")
+        # Só os lotes válidos na data da doação, os mesmos que allocate_fefo consome
+        available = Lote(conn).get_available_quantity(item_id, day)
+        if available < quantity:
+            raise HTTPError(HTTPStatus.CONFLICT, f"Estoque insuficiente para {item['nome_item']} ({item['marca']}). Disponível: {available:.2f}")
+        model = DoacaoRealizada(conn)
+        donation_id = model.save({"id_beneficiario": beneficiary_id, "id_item": item_id, "quantidade": quantity,
+                                  "data_doacao": day})
+        if donation_id is None:
+            # Outra estação consumiu os lotes entre a conferência e a gravação
+            raise HTTPError(HTTPStatus.CONFLICT, "Não foi possível registrar a doação realizada: estoque insuficiente.")
+        return HTTPStatus.CREATED, model.get_with_details(donation_id)
+
+    @staticmethod
+    def stock(conn, request):
+        return DoacaoRecebida(conn).get_grouped_stock()
+
+    @staticmethod
+    def stock_items(conn, request):
+        return DoacaoRecebida(conn).get_all_stock_items()
+
+    @staticmethod
+    def stock_as_of(conn, request):
+        day = _date_param(request, "data", date.today().isoformat())
+        return {"data": day, "itens": RetratoSaldo(conn).get_stock_as_of(day)}
+
+    @staticmethod
+    def alerts(conn, request):
+        days = _int_param(request, "dias", ALERT_THRESHOLDS[-1], 0, ALERT_THRESHOLDS[-1])
+        limit = _int_param(request, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        today = date.today()
+
+        def build():
+            engine = AlertEngine(conn)
+            engine.refresh(today)
+            counts = engine.counts()
+            alerts = engine.items(days)
+            # As contagens cobrem todos os lotes; a lista traz só os limit que vencem primeiro
+            return {
+                "data": today.isoformat(),
+                "contagens": {str(threshold): counts[threshold] for threshold in engine.thresholds},
+                "total": len(alerts),
+                "alertas": [dict(alert, dias_restantes=engine.days_left(alert)) for alert in alerts[:limit]],
+            }
+        # Montar os alertas percorre todos os lotes que vencem no prazo: a resposta fica no
+        # QueryCache da conexão até a próxima gravação nas tabelas lidas
+        return _cached(conn, ("api", "alertas", today, days, limit), ALERT_TABLES, build)
+
+    @staticmethod
+    def flow_report(conn, request):
+        end = _date_param(request, "fim", date.today().isoformat())
+        start = _date_param(request, "inicio", (date.fromisoformat(end) - timedelta(days=DEFAULT_REPORT_DAYS)).isoformat())
+        period = (request.query.get("periodo") or ["mes"])[0]
+        if period not in REPORT_PERIODS:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Parâmetro periodo deve ser {', '.join(REPORT_PERIODS)}.")
+        item = (request.query.get("item") or [""])[0].strip() or None
+        by_item = _int_param(request, "por_item", 1, 0, 1) == 1
+        return {
+            "inicio": start,
+            "fim": end,
+            "periodo": period,
+            "series": MovimentacaoDiaria(conn).get_flow_report(start, end, period, item, by_item),
+        }
+
+
+class ApiServer:
+    """ Servidor HTTP/1.1 (com keep-alive) que despacha as rotas de Api para o pool de threads """
+
+    def __init__(self, db_file=DATABASE, workers=DEFAULT_WORKERS, profile=None):
+        self.api = Api()
+        self.pool = ConnectionPool(db_file, size=workers, profile=profile)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-sqlite")
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+                if not request_line:
+                    return
+                keep_alive = await self.handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            return
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line, reader, writer):
+        """ Lê uma requisição, responde e indica se a conexão continua aberta """
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            self.write_response(writer, HTTPStatus.BAD_REQUEST, _json_bytes({"erro": "Requisição inválida."}), keep_alive=False)
+            return False
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.write_response(writer, HTTPStatus.BAD_REQUEST, _json_bytes({"erro": "Content-Length inválido."}), keep_alive=False)
+            return False
+        if length > MAX_BODY_SIZE:
+            self.write_response(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, _json_bytes({"erro": "Corpo muito grande."}), keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        status, payload, extra_headers = await self.dispatch(method.upper(), url.path, parse_qs(url.query), headers, body)
+        self.write_response(writer, status, payload, keep_alive, extra_headers, head_only=method.upper() == "HEAD")
+        return keep_alive
+
+    async def dispatch(self, method, path, query, headers, body):
+        """ (status, corpo JSON, cabeçalhos extras) para a requisição """
+        lookup_method = "GET" if method == "HEAD" else method
+        try:
+            handler, params, etag = self.api.resolve(lookup_method, path)
+            request = Request(method, path, query, headers, body, params)
+            loop = asyncio.get_running_loop()
+            status, payload = await loop.run_in_executor(self.executor, self.execute, handler, request)
+        except HTTPError as e:
+            return e.status, _json_bytes({"erro": e.message}), {}
+        if not etag:
+            return status, payload, {}
+        # O ETag é o hash do corpo: o cliente que já tem esta versão recebe 304 sem corpo
+        tag = '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+        if tag in (value.strip() for value in headers.get("if-none-match", "").split(",")):
+            return HTTPStatus.NOT_MODIFIED, b"", {"ETag": tag}
+        return status, payload, {"ETag": tag, "Cache-Control": "no-cache"}
+
+    def execute(self, handler, request):
+        """ Roda na thread de trabalho: chama o handler com uma conexão do pool e serializa o resultado """
+        try:
+            with self.pool.connection() as conn:
+                result = handler(conn, request)
+            status = HTTPStatus.OK
+            if isinstance(result, tuple):
+                status, result = result
+            return status, _json_bytes(result)
+        except HTTPError as e:
+            return e.status, _json_bytes({"erro": e.message})
+        except Exception as e:
+            print(f"Erro ao atender {request.method} {request.path}: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _json_bytes({"erro": "Erro interno do servidor."})
+
+    @staticmethod
+    def write_response(writer, status, payload, keep_alive, extra_headers=None, head_only=False):
+        status = HTTPStatus(status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        if status != HTTPStatus.NOT_MODIFIED:
+            lines.append("Content-Type: application/json; charset=utf-8")
+        lines.append(f"Content-Length: {len(payload)}")
+        lines.extend(f"{name}: {value}" for name, value in (extra_headers or {}).items())
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if not head_only:
+            writer.write(payload)
+
+
+async def serve(db_file=DATABASE, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    server = ApiServer(db_file, workers)
+    await server.start(host, port)
+    # Retratos do saldo para /estoque/historico, como na interface
+    snapshot_worker = SnapshotWorker(db_file).start()
+    print(f"API do estoque em http://{host}:{server.port} (banco: {db_file}, {workers} threads)")
+    try:
+        await server.server.serve_forever()
+    finally:
+        snapshot_worker.stop(wait=False)
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor HTTP/JSON do estoque de doações")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="endereço de escuta (0.0.0.0 para aceitar outros dispositivos)")
+    parser.add_argument("--porta", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=DATABASE, help="banco de dados SQLite")
+    parser.add_argument("--threads", type=int, default=DEFAULT_WORKERS, help="threads (e conexões) para o SQLite")
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection(args.db)
+    create_tables(conn)
+    conn.close()
+    try:
+        asyncio.run(serve(args.db, args.host, args.porta, args.threads))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
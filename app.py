@@ -1,20 +1,63 @@
+import os
+import math
+import sqlite3
 import tkinter as tk
-from tkinter import ttk, messagebox
-from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, get_db_connection
+from tkinter import ttk, messagebox, filedialog
+from models import (DATABASE, UNIT_CHOICES, Doador, Beneficiario, Item, Lote, DoacaoRecebida, DoacaoRealizada, RetratoSaldo,
+                    change_bus, get_db_connection, query_cache)
+import query_trace
+import analytics
+import allocation_planner
+import report_export
+from stock_snapshots import SnapshotWorker
 from database import create_tables
+from query_executor import QueryExecutor
+from alerts import AlertEngine
+from search_index import NameIndex
 from datetime import datetime, timedelta
-import re # Para validação de regex
+import validators
+from widgets import PagedTreeview, apply_row_change, apply_rows_diff, format_date_br
 
 class EstoqueApp(tk.Tk):
-    def __init__(self):
+    # Intervalo (ms) em que os resultados das consultas em segundo plano são entregues à interface
+    QUERY_POLL_INTERVAL = 50
+    # Espera (ms) após a última tecla antes de filtrar um combobox com busca
+    SEARCH_DEBOUNCE = 150
+    # Intervalo (ms) da verificação de virada do dia para os alertas de vencimento
+    ALERT_DAY_CHECK_INTERVAL = 60000
+
+    def __init__(self, db_file=DATABASE):
         super().__init__()
         self.title("Sistema de Gerenciamento de Estoque de Doações")
         self.geometry("1200x800") # Aumenta o tamanho da janela
 
+        # ESTOQUE_TRACE=1 liga o rastreamento das consultas desde a abertura, com resumo ao sair
+        if os.environ.get("ESTOQUE_TRACE"):
+            query_trace.enable_tracing(int(os.environ.get("ESTOQUE_SLOW_MS", query_trace.DEFAULT_SLOW_MS)),
+                                       dump_on_exit=True)
+
         # Conexão com o banco de dados
-        self.db_conn = get_db_connection("estoque_doacoes.db")
+        self.db_file = db_file
+        self.db_conn = get_db_connection(db_file)
         create_tables(self.db_conn) # Garante que as tabelas existam
 
+        # Consultas de leitura rodam numa thread com conexão própria; as gravações ficam em db_conn
+        self.executor = QueryExecutor(db_file)
+        self.poll_queries()
+        # Retratos mensais do saldo (consulta "Saldo em Data") gravados em segundo plano
+        self.snapshot_worker = SnapshotWorker(db_file).start()
+
+        # Índices dos comboboxes com busca, carregados em segundo plano e mantidos pelos eventos do change_bus
+        self.donor_index = NameIndex()
+        self.beneficiary_index = NameIndex()
+        self.item_name_index = NameIndex()
+        self.item_brand_index = NameIndex()
+        self._debounce_jobs = {}
+
+        self.create_menu()
+        self.export_dialog = None
+        self.export_job = None
+
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(expand=True, fill="both", padx=10, pady=10)
 
@@ -24,6 +67,7 @@ class EstoqueApp(tk.Tk):
         self.item_model = Item(conn=self.db_conn)
         self.doacao_recebida_model = DoacaoRecebida(conn=self.db_conn)
         self.doacao_realizada_model = DoacaoRealizada(conn=self.db_conn)
+        self.lote_model = Lote(conn=self.db_conn)
 
         self.create_donor_tab()
         self.create_beneficiary_tab()
@@ -33,27 +77,148 @@ class EstoqueApp(tk.Tk):
         self.create_entries_tab() # Nova aba para Entradas
         self.create_exits_tab() # Nova aba para Saídas
         self.create_alerts_tab()
+        self.create_planning_tab()
+        self.create_stock_history_tab()
+        self.create_diagnostics_tab() # Oculta; Ctrl+Shift+D mostra
+
+        # Cada aba assina apenas as tabelas que exibe e se atualiza de forma incremental
+        self._pending_refreshes = []
+        self._subscriptions = [
+            ("doadores", self.on_donor_changed),
+            ("beneficiarios", self.on_beneficiary_changed),
+            ("itens", self.on_item_changed),
+            ("doacoes_recebidas", self.on_received_donation_changed),
+            ("doacoes_realizadas", self.on_distributed_donation_changed),
+        ]
+        for table, callback in self._subscriptions:
+            change_bus.subscribe(table, callback)
 
         # Garante que a conexão seja fechada ao sair da aplicação
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def on_closing(self):
+        for table, callback in self._subscriptions:
+            change_bus.unsubscribe(table, callback)
+        self.executor.shutdown(wait=False)
+        self.snapshot_worker.stop(wait=False)
+        self.cancel_export()
         if self.db_conn:
             self.db_conn.close()
         self.destroy()
 
-    # Funções de validação
+    def poll_queries(self):
+        self.executor.poll()
+        self.after(self.QUERY_POLL_INTERVAL, self.poll_queries)
+
+    def schedule_refresh(self, refresh):
+        """ Agenda uma recarga para quando a interface ficar ociosa, juntando eventos repetidos """
+        if refresh in self._pending_refreshes:
+            return
+        self._pending_refreshes.append(refresh)
+        if len(self._pending_refreshes) == 1:
+            self.after_idle(self._run_pending_refreshes)
+
+    def _run_pending_refreshes(self):
+        refreshes, self._pending_refreshes = self._pending_refreshes, []
+        for refresh in refreshes:
+            refresh()
+
+    def debounce(self, name, func):
+        """ Executa func só quando passar SEARCH_DEBOUNCE ms sem nova chamada com o mesmo nome """
+        job = self._debounce_jobs.pop(name, None)
+        if job:
+            self.after_cancel(job)
+
+        def run():
+            self._debounce_jobs.pop(name, None)
+            func()
+        self._debounce_jobs[name] = self.after(self.SEARCH_DEBOUNCE, run)
+
+    def filter_combobox(self, combobox, index):
+        combobox['values'] = index.search(combobox.get())
+
+    def set_search_index(self, attribute, combobox):
+        """ Callback de consulta que troca o índice de um combobox pelo recém-construído """
+        def callback(index):
+            setattr(self, attribute, index)
+            self.filter_combobox(combobox, index)
+        return callback
+
+    @staticmethod
+    def donor_label(donor):
+        return f"{donor['nome']} (ID: {donor['id_doador']})"
+
+    @staticmethod
+    def beneficiary_label(beneficiary):
+        return f"{beneficiary['nome']} (ID: {beneficiary['id_beneficiario']})"
+
+    # Eventos do change_bus (models.ChangeEvent)
+    def on_donor_changed(self, event):
+        if not apply_row_change(self.donor_tree, event, self.donor_row_values):
+            self.schedule_refresh(self.load_donors)
+        if event.pk is None:
+            self.schedule_refresh(self.load_donor_combobox)
+            return
+        if event.operation == "delete":
+            self.donor_index.remove(event.pk)
+        else:
+            donor = self.doador_model.get_by_id(event.pk)
+            if donor:
+                self.donor_index.add(event.pk, donor["nome"], self.donor_label(donor))
+        self.filter_combobox(self.received_donor_combobox, self.donor_index)
+
+    def on_beneficiary_changed(self, event):
+        if not apply_row_change(self.beneficiary_tree, event, self.beneficiary_row_values):
+            self.schedule_refresh(self.load_beneficiaries)
+        if event.pk is None:
+            self.schedule_refresh(self.load_beneficiary_combobox)
+            return
+        if event.operation == "delete":
+            self.beneficiary_index.remove(event.pk)
+        else:
+            beneficiary = self.beneficiario_model.get_by_id(event.pk)
+            if beneficiary:
+                self.beneficiary_index.add(event.pk, beneficiary["nome"], self.beneficiary_label(beneficiary))
+        self.filter_combobox(self.distributed_beneficiary_combobox, self.beneficiary_index)
+
+    def on_item_changed(self, event):
+        if event.operation == "insert" and event.pk is not None:
+            # Um item novo só pode acrescentar um nome/marca aos índices (de valores distintos)
+            item = self.item_model.get_by_id(event.pk)
+            self.item_name_index.add(item["nome_item"], item["nome_item"])
+            if item["marca"]:
+                self.item_brand_index.add(item["marca"], item["marca"])
+            self.filter_combobox(self.received_item_name_combobox, self.item_name_index)
+            self.filter_combobox(self.received_item_brand_combobox, self.item_brand_index)
+        else:
+            self.schedule_refresh(self.load_item_name_combobox)
+            self.schedule_refresh(self.load_item_brand_combobox)
+        self.schedule_refresh(self.load_item_unit_combobox)
+
+    def on_received_donation_changed(self, event):
+        if event.pk is None:
+            self.schedule_refresh(self.load_entries_data)
+        else:
+            self.entries_view.apply_change(event, self.doacao_recebida_model.get_with_details)
+        self.schedule_refresh(self.load_stock_data)
+        self.update_alerts(event)
+        self.schedule_refresh(self.refresh_distributed_item_names)
+
+    def on_distributed_donation_changed(self, event):
+        if event.pk is None:
+            self.schedule_refresh(self.load_exits_data)
+        else:
+            self.exits_view.apply_change(event, self.doacao_realizada_model.get_with_details)
+        self.schedule_refresh(self.load_stock_data)
+        self.update_alerts(event)
+        self.schedule_refresh(self.refresh_distributed_item_names)
+
+    # Funções de validação (regras em validators.py, compartilhadas com o importador)
     def validate_phone(self, phone):
-        # Remove caracteres não numéricos para validação do comprimento
-        phone_digits = re.sub(r'\D', '', phone)
-        # Regex para (DD)NNNNN-NNNN ou NNNNN-NNNN (com ou sem parênteses no DDD)
-        # Permite espaços e hífens, mas valida apenas dígitos
-        # O número deve ter 10 ou 11 dígitos (com DDD)
-        return re.fullmatch(r'\(?\d{2}\)?\s?\d{4,5}-?\d{4}', phone) is not None and (len(phone_digits) == 10 or len(phone_digits) == 11)
+        return validators.validate_phone(phone)
 
     def validate_email(self, email):
-        # Regex para validação de email mais robusta
-        return re.fullmatch(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None
+        return validators.validate_email(email)
 
     def create_donor_tab(self):
         frame = ttk.Frame(self.notebook)
@@ -122,8 +287,6 @@ class EstoqueApp(tk.Tk):
         if self.doador_model.save(data):
             messagebox.showinfo("Sucesso", "Doador cadastrado com sucesso!")
             self.clear_donor_form()
-            self.load_donors()
-            self.load_donor_combobox() # Atualiza combobox de doadores
         else:
             messagebox.showerror("Erro", "Não foi possível cadastrar o doador.")
 
@@ -133,13 +296,21 @@ class EstoqueApp(tk.Tk):
         self.donor_email_entry.delete(0, tk.END)
         self.donor_address_entry.delete(0, tk.END)
 
+    def donor_row_values(self, donor_id):
+        donor = self.doador_model.get_by_id(donor_id)
+        if not donor:
+            return None
+        return (donor["id_doador"], donor["nome"], donor["telefone"], donor["email"], donor["endereco"])
+
     def load_donors(self):
+        self.executor.submit("donors", lambda conn: Doador(conn).get_all(), self.show_donors)
+
+    def show_donors(self, donors):
         for i in self.donor_tree.get_children():
             self.donor_tree.delete(i)
         
-        donors = self.doador_model.get_all()
         for donor in donors:
-            self.donor_tree.insert("", "end", values=(donor["id_doador"], donor["nome"], donor["telefone"], donor["email"], donor["endereco"]))
+            self.donor_tree.insert("", "end", iid=str(donor["id_doador"]), values=(donor["id_doador"], donor["nome"], donor["telefone"], donor["email"], donor["endereco"]))
 
     def create_beneficiary_tab(self):
         frame = ttk.Frame(self.notebook)
@@ -232,7 +403,6 @@ class EstoqueApp(tk.Tk):
         if self.beneficiario_model.save(data):
             messagebox.showinfo("Sucesso", "Beneficiário cadastrado com sucesso!")
             self.clear_beneficiary_form()
-            self.load_beneficiaries()
         else:
             messagebox.showerror("Erro", "Não foi possível cadastrar o beneficiário.")
 
@@ -245,13 +415,25 @@ class EstoqueApp(tk.Tk):
         self.beneficiary_food_needed2_entry.delete(0, tk.END)
         self.beneficiary_food_needed3_entry.delete(0, tk.END)
 
+    def beneficiary_row_values(self, beneficiary_id):
+        beneficiary = self.beneficiario_model.get_by_id(beneficiary_id)
+        if not beneficiary:
+            return None
+        return (
+            beneficiary["id_beneficiario"], beneficiary["nome"], beneficiary["telefone"],
+            beneficiary["email"], beneficiary["endereco"], beneficiary["alimento_necessidade_1"],
+            beneficiary["alimento_necessidade_2"], beneficiary["alimento_necessidade_3"]
+        )
+
     def load_beneficiaries(self):
+        self.executor.submit("beneficiaries", lambda conn: Beneficiario(conn).get_all(), self.show_beneficiaries)
+
+    def show_beneficiaries(self, beneficiaries):
         for i in self.beneficiary_tree.get_children():
             self.beneficiary_tree.delete(i)
         
-        beneficiaries = self.beneficiario_model.get_all()
         for beneficiary in beneficiaries:
-            self.beneficiary_tree.insert("", "end", values=(
+            self.beneficiary_tree.insert("", "end", iid=str(beneficiary["id_beneficiario"]), values=(
                 beneficiary["id_beneficiario"], beneficiary["nome"], beneficiary["telefone"],
                 beneficiary["email"], beneficiary["endereco"], beneficiary["alimento_necessidade_1"],
                 beneficiary["alimento_necessidade_2"], beneficiary["alimento_necessidade_3"]
@@ -285,9 +467,11 @@ class EstoqueApp(tk.Tk):
         self.received_item_brand_combobox.bind("<KeyRelease>", self.update_item_brand_list)
         self.load_item_brand_combobox()
 
-        tk.Label(form_frame, text="Unidade (ex: kg, litro):").grid(row=3, column=0, padx=5, pady=5, sticky="w")
-        self.received_item_unit_entry = tk.Entry(form_frame, width=40)
-        self.received_item_unit_entry.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+        # Unidade com Combobox (unidades com conversão e as já usadas) e entrada livre
+        tk.Label(form_frame, text="Unidade:").grid(row=3, column=0, padx=5, pady=5, sticky="w")
+        self.received_item_unit_combobox = ttk.Combobox(form_frame, width=37)
+        self.received_item_unit_combobox.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+        self.load_item_unit_combobox()
 
         tk.Label(form_frame, text="Quantidade:").grid(row=4, column=0, padx=5, pady=5, sticky="w")
         self.received_quantity_entry = tk.Entry(form_frame, width=20)
@@ -300,43 +484,56 @@ class EstoqueApp(tk.Tk):
 
         ttk.Button(form_frame, text="Registrar Doação Recebida", command=self.save_received_donation).grid(row=6, column=0, columnspan=2, pady=10)
 
+    def set_combobox_values(self, combobox):
+        """ Callback de consulta que preenche as opções de um combobox """
+        def callback(values):
+            combobox['values'] = values
+        return callback
+
+    # A cada tecla a busca é adiada (debounce) e feita no índice em memória, sem consultar o banco
     def update_donor_list(self, event):
-        search_term = self.received_donor_combobox.get().lower()
-        donors = self.doador_model.get_all()
-        filtered_donors = [f"{d['nome']} (ID: {d['id_doador']})" for d in donors if search_term in d['nome'].lower()]
-        self.received_donor_combobox['values'] = filtered_donors
+        self.debounce("donor", lambda: self.filter_combobox(self.received_donor_combobox, self.donor_index))
 
     def load_donor_combobox(self):
-        donors = self.doador_model.get_all()
-        self.received_donor_combobox['values'] = [f"{d['nome']} (ID: {d['id_doador']})" for d in donors]
+        self.executor.submit(
+            "donor_index",
+            lambda conn: NameIndex.build((d['id_doador'], d['nome'], self.donor_label(d)) for d in Doador(conn).iter_all()),
+            self.set_search_index("donor_index", self.received_donor_combobox))
 
     def update_item_name_list(self, event):
-        search_term = self.received_item_name_combobox.get().lower()
-        items = self.item_model.get_all()
-        filtered_items = sorted(list(set([i['nome_item'] for i in items if search_term in i['nome_item'].lower()])))
-        self.received_item_name_combobox['values'] = filtered_items
+        self.debounce("item_name", lambda: self.filter_combobox(self.received_item_name_combobox, self.item_name_index))
 
     def load_item_name_combobox(self):
-        items = self.item_model.get_all()
-        unique_item_names = sorted(list(set([i['nome_item'] for i in items])))
-        self.received_item_name_combobox['values'] = unique_item_names
+        self.executor.submit(
+            "item_name_index",
+            lambda conn: NameIndex.build((name, name, name) for name in Item(conn).get_dimension_names('nome_item')),
+            self.set_search_index("item_name_index", self.received_item_name_combobox))
 
     def update_item_brand_list(self, event):
-        search_term = self.received_item_brand_combobox.get().lower()
-        items = self.item_model.get_all()
-        filtered_brands = sorted(list(set([i['marca'] for i in items if i['marca'] and search_term in i['marca'].lower()])))
-        self.received_item_brand_combobox['values'] = filtered_brands
+        self.debounce("item_brand", lambda: self.filter_combobox(self.received_item_brand_combobox, self.item_brand_index))
 
     def load_item_brand_combobox(self):
-        items = self.item_model.get_all()
-        unique_item_brands = sorted(list(set([i['marca'] for i in items if i['marca']])))
-        self.received_item_brand_combobox['values'] = unique_item_brands
+        self.executor.submit(
+            "item_brand_index",
+            lambda conn: NameIndex.build((brand, brand, brand) for brand in Item(conn).get_dimension_names('marca')),
+            self.set_search_index("item_brand_index", self.received_item_brand_combobox))
+
+    def load_item_unit_combobox(self):
+        def unit_names(conn):
+            # Sugestões fixas primeiro; das já usadas entram só as de chave diferente ("KG" = "kg")
+            known = {validators.normalize_key(choice) for choice in UNIT_CHOICES}
+            used = [name for name in Item(conn).get_dimension_names('unidade') if validators.normalize_key(name) not in known]
+            return list(UNIT_CHOICES) + used
+
+        def show(names):
+            self.received_item_unit_combobox["values"] = names
+        self.executor.submit("item_units", unit_names, show)
 
     def save_received_donation(self):
         selected_donor_text = self.received_donor_combobox.get()
         item_name = self.received_item_name_combobox.get().strip()
         item_brand = self.received_item_brand_combobox.get().strip()
-        item_unit = self.received_item_unit_entry.get().strip()
+        item_unit = self.received_item_unit_combobox.get().strip()
         quantity_str = self.received_quantity_entry.get().strip()
         validity_date_str = self.received_validity_date_entry.get().strip()
 
@@ -353,12 +550,9 @@ class EstoqueApp(tk.Tk):
 
         # Validação de Quantidade
         try:
-            quantity = float(quantity_str)
-            if quantity <= 0:
-                messagebox.showerror("Erro", "A quantidade deve ser um número positivo.")
-                return
-        except ValueError:
-            messagebox.showerror("Erro", "Quantidade inválida. Digite um número.")
+            quantity = validators.parse_quantity(quantity_str)
+        except ValueError as e:
+            messagebox.showerror("Erro", str(e))
             return
 
         # Validação e conversão da Data de Validade (DD/MM/YYYY para YYYY-MM-DD)
@@ -368,43 +562,45 @@ class EstoqueApp(tk.Tk):
             messagebox.showerror("Erro", "Formato de Data de Validade inválido. Use DD/MM/YYYY.")
             return
 
-        # Verificar se o item já existe ou criar um novo
-        existing_item = self.item_model.get_by_name_brand_unit(item_name, item_brand, item_unit)
-        if existing_item:
-            item_id = existing_item["id_item"]
-        else:
-            item_data = {"nome_item": item_name, "marca": item_brand, "unidade": item_unit}
-            item_id = self.item_model.save(item_data)
-            if not item_id:
-                messagebox.showerror("Erro", "Não foi possível cadastrar o item.")
-                return
-
-        donation_data = {
-            "id_doador": donor_id,
-            "id_item": item_id,
-            "quantidade": quantity,
-            "data_recebimento": datetime.now().strftime("%Y-%m-%d"),
-            "data_validade": validity_date
-        }
-
-        print(f"Attempting to save received donation with data: {donation_data}") # Debug print
+        # Item e doação são gravados na mesma transação: se a doação falhar,
+        # o item recém-criado também é desfeito
+        try:
+            with self.doacao_recebida_model.transaction():
+                # Verificar se o item já existe ou criar um novo
+                existing_item = self.item_model.get_by_name_brand_unit(item_name, item_brand, item_unit)
+                if existing_item:
+                    item_id = existing_item["id_item"]
+                else:
+                    item_data = {"nome_item": item_name, "marca": item_brand, "unidade": item_unit}
+                    item_id = self.item_model.save(item_data)
+                    if not item_id:
+                        raise sqlite3.Error("Não foi possível cadastrar o item.")
+
+                donation_data = {
+                    "id_doador": donor_id,
+                    "id_item": item_id,
+                    "quantidade": quantity,
+                    "data_recebimento": datetime.now().strftime("%Y-%m-%d"),
+                    "data_validade": validity_date
+                }
+
+                print(f"Attempting to save received donation with data: {donation_data}") # Debug print
+
+                if not self.doacao_recebida_model.save(donation_data):
+                    raise sqlite3.Error("Não foi possível registrar a doação recebida.")
+        except sqlite3.Error as e:
+            messagebox.showerror("Erro", str(e))
+            return
 
-        if self.doacao_recebida_model.save(donation_data):
-            messagebox.showinfo("Sucesso", "Doação recebida registrada com sucesso!")
-            self.clear_received_donation_form()
-            self.load_stock_data()
-            self.load_entries_data()
-            self.load_alerts_data()
-            self.load_item_name_combobox() # Recarrega para incluir novos tipos/marcas
-            self.load_item_brand_combobox()
-        else:
-            messagebox.showerror("Erro", "Não foi possível registrar a doação recebida.")
+        # As abas afetadas se atualizam pelos eventos do change_bus
+        messagebox.showinfo("Sucesso", "Doação recebida registrada com sucesso!")
+        self.clear_received_donation_form()
 
     def clear_received_donation_form(self):
         self.received_donor_combobox.set("")
         self.received_item_name_combobox.set("")
         self.received_item_brand_combobox.set("")
-        self.received_item_unit_entry.delete(0, tk.END)
+        self.received_item_unit_combobox.set("")
         self.received_quantity_entry.delete(0, tk.END)
         self.received_validity_date_entry.delete(0, tk.END)
         self.received_validity_date_entry.insert(0, datetime.now().strftime("%d/%m/%Y"))
@@ -455,20 +651,25 @@ class EstoqueApp(tk.Tk):
         self.load_distributed_item_name_combobox()
 
     def update_beneficiary_list(self, event):
-        search_term = self.distributed_beneficiary_combobox.get().lower()
-        beneficiaries = self.beneficiario_model.get_all()
-        filtered_beneficiaries = [f"{b['nome']} (ID: {b['id_beneficiario']})" for b in beneficiaries if search_term in b['nome'].lower()]
-        self.distributed_beneficiary_combobox['values'] = filtered_beneficiaries
+        self.debounce("beneficiary", lambda: self.filter_combobox(self.distributed_beneficiary_combobox, self.beneficiary_index))
 
     def load_beneficiary_combobox(self):
-        beneficiaries = self.beneficiario_model.get_all()
-        self.distributed_beneficiary_combobox['values'] = [f"{b['nome']} (ID: {b['id_beneficiario']})" for b in beneficiaries]
+        self.executor.submit(
+            "beneficiary_index",
+            lambda conn: NameIndex.build((b['id_beneficiario'], b['nome'], self.beneficiary_label(b)) for b in Beneficiario(conn).iter_all()),
+            self.set_search_index("beneficiary_index", self.distributed_beneficiary_combobox))
+
+    def refresh_distributed_item_names(self):
+        # Carrega apenas os tipos de alimentos que têm estoque, sem mexer na seleção atual.
+        # get_all_stock_items fica no cache da conexão da thread: a escolha de tipo e de
+        # marca que vem a seguir reaproveita a mesma leitura
+        self.executor.submit(
+            "distributed_item_names",
+            lambda conn: sorted(list(set([item['nome_item'] for item in DoacaoRecebida(conn).get_all_stock_items()]))),
+            self.set_combobox_values(self.distributed_item_name_combobox))
 
     def load_distributed_item_name_combobox(self):
-        # Carrega apenas os tipos de alimentos que têm estoque
-        stock_items = self.doacao_recebida_model.get_all_stock_items()
-        unique_item_names = sorted(list(set([item['nome_item'] for item in stock_items])))
-        self.distributed_item_name_combobox['values'] = unique_item_names
+        self.refresh_distributed_item_names()
         self.distributed_item_name_combobox.set("") # Limpa a seleção
         self.distributed_item_brand_combobox.set("")
         self.distributed_item_brand_combobox['values'] = []
@@ -479,13 +680,15 @@ class EstoqueApp(tk.Tk):
         selected_item_name = self.distributed_item_name_combobox.get()
         if selected_item_name:
             # Carrega as marcas disponíveis para o tipo de alimento selecionado
-            stock_items = self.doacao_recebida_model.get_all_stock_items()
-            available_brands = sorted(list(set([item['marca'] for item in stock_items if item['nome_item'] == selected_item_name and item['marca']])))
-            self.distributed_item_brand_combobox['values'] = available_brands
+            self.executor.submit(
+                "distributed_brands",
+                lambda conn: sorted(list(set([item['marca'] for item in DoacaoRecebida(conn).get_all_stock_items() if item['nome_item'] == selected_item_name and item['marca']]))),
+                self.set_combobox_values(self.distributed_item_brand_combobox))
             self.distributed_item_brand_combobox.set("") # Limpa a seleção da marca
             self.distributed_item_unit_label.config(text="")
             self.distributed_validity_date_label.config(text="")
         else:
+            self.executor.cancel("distributed_brands")
             self.distributed_item_brand_combobox['values'] = []
             self.distributed_item_brand_combobox.set("")
             self.distributed_item_unit_label.config(text="")
@@ -496,20 +699,25 @@ class EstoqueApp(tk.Tk):
         selected_brand = self.distributed_item_brand_combobox.get()
         if selected_item_name and selected_brand:
             # Encontra o item específico para preencher unidade e data de validade
-            stock_items = self.doacao_recebida_model.get_all_stock_items()
-            found_item = None
-            for item in stock_items:
-                if item['nome_item'] == selected_item_name and item['marca'] == selected_brand:
-                    found_item = item
-                    break
-            if found_item:
-                self.distributed_item_unit_label.config(text=found_item['unidade'])
-                # Formata a data de validade para DD/MM/YYYY
-                validity_date_obj = datetime.strptime(found_item['data_validade'], "%Y-%m-%d")
-                self.distributed_validity_date_label.config(text=validity_date_obj.strftime("%d/%m/%Y"))
-            else:
-                self.distributed_item_unit_label.config(text="")
-                self.distributed_validity_date_label.config(text="")
+            # (o primeiro registro ainda válido é o lote que será consumido primeiro, FEFO)
+            today = datetime.now().strftime("%Y-%m-%d")
+            def find_item(conn):
+                for item in DoacaoRecebida(conn).get_all_stock_items():
+                    if (item['nome_item'] == selected_item_name and item['marca'] == selected_brand
+                            and item['data_validade'] >= today):
+                        return item
+                return None
+            self.executor.submit("distributed_lot", find_item, self.show_distributed_lot)
+        else:
+            self.executor.cancel("distributed_lot")
+            self.distributed_item_unit_label.config(text="")
+            self.distributed_validity_date_label.config(text="")
+
+    def show_distributed_lot(self, found_item):
+        if found_item:
+            self.distributed_item_unit_label.config(text=found_item['unidade'])
+            # Formata a data de validade para DD/MM/YYYY
+            self.distributed_validity_date_label.config(text=format_date_br(found_item['data_validade']))
         else:
             self.distributed_item_unit_label.config(text="")
             self.distributed_validity_date_label.config(text="")
@@ -533,12 +741,9 @@ class EstoqueApp(tk.Tk):
 
         # Validação de Quantidade
         try:
-            quantity = float(quantity_str)
-            if quantity <= 0:
-                messagebox.showerror("Erro", "A quantidade deve ser um número positivo.")
-                return
-        except ValueError:
-            messagebox.showerror("Erro", "Quantidade inválida. Digite um número.")
+            quantity = validators.parse_quantity(quantity_str)
+        except ValueError as e:
+            messagebox.showerror("Erro", str(e))
             return
 
         # Obter item_id com base no nome e marca selecionados
@@ -548,8 +753,9 @@ class EstoqueApp(tk.Tk):
             return
         item_id = item_info["id_item"]
 
-        # Verificar estoque
-        current_stock = self.doacao_recebida_model.get_stock_by_item(item_id)
+        # Verificar estoque (quantidade restante nos lotes que serão consumidos: os que ainda não venceram)
+        today = datetime.now().strftime("%Y-%m-%d")
+        current_stock = self.lote_model.get_available_quantity(item_id, today)
         if current_stock < quantity:
             messagebox.showerror("Erro", f"Estoque insuficiente para {item_name} ({item_brand}). Disponível: {current_stock:.2f}")
             return
@@ -558,15 +764,12 @@ class EstoqueApp(tk.Tk):
             "id_beneficiario": beneficiary_id,
             "id_item": item_id,
             "quantidade": quantity,
-            "data_doacao": datetime.now().strftime("%Y-%m-%d")
+            "data_doacao": today
         }
 
         if self.doacao_realizada_model.save(donation_data):
             messagebox.showinfo("Sucesso", "Doação realizada registrada com sucesso!")
             self.clear_distributed_donation_form()
-            self.load_stock_data()
-            self.load_exits_data()
-            self.load_distributed_item_name_combobox() # Recarrega para refletir mudanças no estoque
         else:
             messagebox.showerror("Erro", "Não foi possível registrar a doação realizada.")
 
@@ -582,137 +785,156 @@ class EstoqueApp(tk.Tk):
         frame = ttk.Frame(self.notebook)
         self.notebook.add(frame, text="Estoque Atual")
 
-        columns = ("#1", "#2", "#3")
+        # Colunas 4 a 7: previsão de esgotamento (analytics.depletion_forecast), preenchidas se o NumPy estiver instalado
+        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7")
         self.stock_tree = ttk.Treeview(frame, columns=columns, show="headings")
         self.stock_tree.heading("#1", text="Tipo de Alimento")
         self.stock_tree.heading("#2", text="Unidade")
         self.stock_tree.heading("#3", text="Quantidade Total")
+        self.stock_tree.heading("#4", text=f"Saída Média/Dia ({analytics.FORECAST_WINDOW} dias)")
+        self.stock_tree.heading("#5", text="Dias de Cobertura")
+        self.stock_tree.heading("#6", text="Previsão de Esgotamento")
+        self.stock_tree.heading("#7", text="Vence Antes do Uso")
 
         self.stock_tree.column("#1", width=200)
         self.stock_tree.column("#2", width=100)
         self.stock_tree.column("#3", width=150, anchor="center")
+        for column in ("#4", "#5", "#6", "#7"):
+            self.stock_tree.column(column, width=150, anchor="center")
 
         self.stock_tree.pack(expand=True, fill="both", padx=10, pady=10)
+        self._grouped_stock = []
+        self._stock_forecast = {}
         self.load_stock_data()
 
     def load_stock_data(self):
-        for i in self.stock_tree.get_children():
-            self.stock_tree.delete(i)
-        
-        grouped_stock = self.doacao_recebida_model.get_grouped_stock()
-        for item in grouped_stock:
-            # Correção da f-string: usar aspas diferentes para o f-string e para a chave do dicionário
-            self.stock_tree.insert("", "end", values=(item["nome_item"], item["unidade"], f"{item['quantidade_total']:.2f}"))
+        self.executor.submit("stock", lambda conn: DoacaoRecebida(conn).get_grouped_stock(), self.show_stock_data)
+        # A previsão chega em seguida, em um pedido separado: os totais não esperam por ela
+        if analytics.HAS_NUMPY:
+            self.executor.submit("stock_forecast", analytics.depletion_forecast, self.show_stock_forecast)
+
+    def show_stock_data(self, grouped_stock):
+        self._grouped_stock = grouped_stock
+        self.refresh_stock_tree()
+
+    def show_stock_forecast(self, forecast):
+        self._stock_forecast = {(row["nome_item"], row["unidade"]): row for row in forecast}
+        self.refresh_stock_tree()
+
+    def refresh_stock_tree(self):
+        # Só as linhas cujo total ou previsão mudou são alteradas no Treeview
+        rows = []
+        for item in self._grouped_stock:
+            forecast = self._stock_forecast.get((item["nome_item"], item["unidade"]))
+            if forecast is None:
+                forecast_values = ("", "", "", "")
+            elif forecast["dias_ate_esgotar"] is None:
+                forecast_values = ("0.00", "sem saídas", "", f"{forecast['quantidade_vencendo']:.2f}")
+            else:
+                forecast_values = (f"{forecast['saida_diaria']:.2f}", f"{forecast['dias_cobertura']:.0f}",
+                                   format_date_br(forecast["data_esgotamento"]),
+                                   f"{forecast['quantidade_vencendo']:.2f}" if forecast["quantidade_vencendo"] > 0.005 else "")
+            rows.append((f"{item['nome_item']}|{item['unidade']}",
+                         (item["nome_item"], item["unidade"], f"{item['quantidade_total']:.2f}") + forecast_values))
+        apply_rows_diff(self.stock_tree, rows)
 
     def create_entries_tab(self):
         frame = ttk.Frame(self.notebook)
         self.notebook.add(frame, text="Entradas (Doações Recebidas)")
 
-        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7", "#8")
-        self.entries_tree = ttk.Treeview(frame, columns=columns, show="headings")
-        self.entries_tree.heading("#1", text="ID Doação")
-        self.entries_tree.heading("#2", text="Doador")
-        self.entries_tree.heading("#3", text="Tipo de Alimento")
-        self.entries_tree.heading("#4", text="Marca")
-        self.entries_tree.heading("#5", text="Unidade")
-        self.entries_tree.heading("#6", text="Quantidade")
-        self.entries_tree.heading("#7", text="Data Recebimento")
-        self.entries_tree.heading("#8", text="Data Validade")
-
-        self.entries_tree.column("#1", width=80, anchor="center")
-        self.entries_tree.column("#2", width=150)
-        self.entries_tree.column("#3", width=120)
-        self.entries_tree.column("#4", width=100)
-        self.entries_tree.column("#5", width=80)
-        self.entries_tree.column("#6", width=80, anchor="center")
-        self.entries_tree.column("#7", width=100, anchor="center")
-        self.entries_tree.column("#8", width=100, anchor="center")
-
-        self.entries_tree.pack(expand=True, fill="both", padx=10, pady=10)
+        # Apenas uma janela de linhas fica carregada; as páginas são buscadas conforme a rolagem
+        columns = [
+            ("ID Doação", 80, "center"),
+            ("Doador", 150, None),
+            ("Tipo de Alimento", 120, None),
+            ("Marca", 100, None),
+            ("Unidade", 80, None),
+            ("Quantidade", 80, "center"),
+            ("Data Recebimento", 100, "center"),
+            ("Data Validade", 100, "center"),
+        ]
+        self.entries_view = PagedTreeview(
+            frame, columns, "id_doacao_recebida",
+            fetch_page=lambda conn, after_id, before_id, limit: list(DoacaoRecebida(conn).iter_all_with_details(
+                after_id=after_id, before_id=before_id, limit=limit)),
+            format_page=self.format_entries_page,
+            count_rows=lambda conn: DoacaoRecebida(conn).count(),
+            executor=self.executor, key="entries")
+        self.entries_tree = self.entries_view.tree
+        self.entries_view.pack(expand=True, fill="both", padx=10, pady=10)
         self.load_entries_data()
 
+    def format_entries_page(self, entries):
+        return [(
+            entry["id_doacao_recebida"],
+            entry["doador_nome"],
+            entry["nome_item"],
+            entry["marca"],
+            entry["unidade"],
+            f"{entry['quantidade']:.2f}", # Formata quantidade
+            format_date_br(entry["data_recebimento"]),
+            format_date_br(entry["data_validade"])
+        ) for entry in entries]
+
     def load_entries_data(self):
-        for i in self.entries_tree.get_children():
-            self.entries_tree.delete(i)
-        
-        entries = self.doacao_recebida_model.get_all_with_details()
-        for entry in entries:
-            # Formata a data de validade para DD/MM/YYYY
-            validity_date_obj = datetime.strptime(entry['data_validade'], "%Y-%m-%d")
-            formatted_validity_date = validity_date_obj.strftime("%d/%m/%Y")
-            
-            # Formata a data de recebimento para DD/MM/YYYY
-            received_date_obj = datetime.strptime(entry['data_recebimento'], "%Y-%m-%d")
-            formatted_received_date = received_date_obj.strftime("%d/%m/%Y")
-
-            self.entries_tree.insert("", "end", values=(
-                entry["id_doacao_recebida"],
-                entry["doador_nome"],
-                entry["nome_item"],
-                entry["marca"],
-                entry["unidade"],
-                f"{entry['quantidade']:.2f}", # Formata quantidade
-                formatted_received_date,
-                formatted_validity_date
-            ))
+        self.entries_view.refresh()
 
     def create_exits_tab(self):
         frame = ttk.Frame(self.notebook)
         self.notebook.add(frame, text="Saídas (Doações Realizadas)")
 
-        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7")
-        self.exits_tree = ttk.Treeview(frame, columns=columns, show="headings")
-        self.exits_tree.heading("#1", text="ID Doação")
-        self.exits_tree.heading("#2", text="Beneficiário")
-        self.exits_tree.heading("#3", text="Tipo de Alimento")
-        self.exits_tree.heading("#4", text="Marca")
-        self.exits_tree.heading("#5", text="Unidade")
-        self.exits_tree.heading("#6", text="Quantidade")
-        self.exits_tree.heading("#7", text="Data Doação")
-
-        self.exits_tree.column("#1", width=80, anchor="center")
-        self.exits_tree.column("#2", width=150)
-        self.exits_tree.column("#3", width=120)
-        self.exits_tree.column("#4", width=100)
-        self.exits_tree.column("#5", width=80)
-        self.exits_tree.column("#6", width=80, anchor="center")
-        self.exits_tree.column("#7", width=100, anchor="center")
-
-        self.exits_tree.pack(expand=True, fill="both", padx=10, pady=10)
+        columns = [
+            ("ID Doação", 80, "center"),
+            ("Beneficiário", 150, None),
+            ("Tipo de Alimento", 120, None),
+            ("Marca", 100, None),
+            ("Unidade", 80, None),
+            ("Quantidade", 80, "center"),
+            ("Data Doação", 100, "center"),
+        ]
+        self.exits_view = PagedTreeview(
+            frame, columns, "id_doacao_realizada",
+            fetch_page=lambda conn, after_id, before_id, limit: list(DoacaoRealizada(conn).iter_all_with_details(
+                after_id=after_id, before_id=before_id, limit=limit)),
+            format_page=self.format_exits_page,
+            count_rows=lambda conn: DoacaoRealizada(conn).count(),
+            executor=self.executor, key="exits")
+        self.exits_tree = self.exits_view.tree
+        self.exits_view.pack(expand=True, fill="both", padx=10, pady=10)
         self.load_exits_data()
 
+    def format_exits_page(self, exits):
+        return [(
+            exit_item["id_doacao_realizada"],
+            exit_item["beneficiario_nome"],
+            exit_item["nome_item"],
+            exit_item["marca"],
+            exit_item["unidade"],
+            f"{exit_item['quantidade']:.2f}", # Formata quantidade
+            format_date_br(exit_item["data_doacao"])
+        ) for exit_item in exits]
+
     def load_exits_data(self):
-        for i in self.exits_tree.get_children():
-            self.exits_tree.delete(i)
-        
-        exits = self.doacao_realizada_model.get_all_with_details()
-        for exit_item in exits:
-            # Formata a data de doação para DD/MM/YYYY
-            donation_date_obj = datetime.strptime(exit_item['data_doacao'], "%Y-%m-%d")
-            formatted_donation_date = donation_date_obj.strftime("%d/%m/%Y")
-
-            self.exits_tree.insert("", "end", values=(
-                exit_item["id_doacao_realizada"],
-                exit_item["beneficiario_nome"],
-                exit_item["nome_item"],
-                exit_item["marca"],
-                exit_item["unidade"],
-                f"{exit_item['quantidade']:.2f}", # Formata quantidade
-                formatted_donation_date
-            ))
+        self.exits_view.refresh()
 
     def create_alerts_tab(self):
         frame = ttk.Frame(self.notebook)
         self.notebook.add(frame, text="Alertas de Vencimento")
 
-        columns = ("#1", "#2", "#3", "#4", "#5", "#6")
+        # Lotes com saldo que vencem em até 30 dias, mantidos pelo AlertEngine (alerts.py)
+        self.alert_engine = AlertEngine(self.db_conn)
+        self.alerts_summary_label = ttk.Label(frame, text="")
+        self.alerts_summary_label.pack(fill="x", padx=10, pady=(10, 0))
+
+        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7")
         self.alerts_tree = ttk.Treeview(frame, columns=columns, show="headings")
         self.alerts_tree.heading("#1", text="ID Doação Recebida")
         self.alerts_tree.heading("#2", text="Tipo de Alimento")
         self.alerts_tree.heading("#3", text="Marca")
         self.alerts_tree.heading("#4", text="Unidade")
-        self.alerts_tree.heading("#5", text="Quantidade")
+        self.alerts_tree.heading("#5", text="Quantidade Restante")
         self.alerts_tree.heading("#6", text="Data Validade")
+        self.alerts_tree.heading("#7", text="Dias Restantes")
 
         self.alerts_tree.column("#1", width=120, anchor="center")
         self.alerts_tree.column("#2", width=150)
@@ -720,36 +942,391 @@ class EstoqueApp(tk.Tk):
         self.alerts_tree.column("#4", width=80)
         self.alerts_tree.column("#5", width=80, anchor="center")
         self.alerts_tree.column("#6", width=100, anchor="center")
+        self.alerts_tree.column("#7", width=80, anchor="center")
 
         self.alerts_tree.pack(expand=True, fill="both", padx=10, pady=10)
         self.load_alerts_data()
+        self.after(self.ALERT_DAY_CHECK_INTERVAL, self.check_alerts_day)
 
-        # Atualiza os alertas a cada 60 segundos (1 minuto)
-        self.after(60000, self.load_alerts_data)
+    def check_alerts_day(self):
+        # Os prazos só mudam na virada do dia; entre uma e outra os alertas seguem as gravações
+        if self.alert_engine.check_day():
+            self.load_alerts_data()
+            self.load_stock_data() # A previsão de esgotamento também conta a partir de hoje
+        self.after(self.ALERT_DAY_CHECK_INTERVAL, self.check_alerts_day)
 
-    def load_alerts_data(self):
-        for i in self.alerts_tree.get_children():
-            self.alerts_tree.delete(i)
-        
-        # Alertas para itens com 30 dias ou menos para vencer
-        expiring_items = self.doacao_recebida_model.get_expiring_items(30)
-        for item in expiring_items:
-            # Formata a data de validade para DD/MM/YYYY
-            validity_date_obj = datetime.strptime(item['data_validade'], "%Y-%m-%d")
-            formatted_validity_date = validity_date_obj.strftime("%d/%m/%Y")
+    def update_alerts(self, event):
+        if self.alert_engine.apply_change(event):
+            self.show_alerts_data()
+        else:
+            self.schedule_refresh(self.load_alerts_data)
 
-            self.alerts_tree.insert("", "end", values=(
+    def load_alerts_data(self):
+        today = datetime.now().date()
+        horizon = self.alert_engine.horizon
+        self.executor.submit(
+            "alerts",
+            lambda conn: DoacaoRecebida(conn).get_expiring_items(horizon, today=today),
+            lambda rows: self.show_alerts_data(rows, today))
+
+    def show_alerts_data(self, expiring_items=None, today=None):
+        if expiring_items is not None:
+            self.alert_engine.load(expiring_items, today)
+        counts = self.alert_engine.counts()
+        summary = []
+        lower = 0
+        for threshold in self.alert_engine.thresholds:
+            summary.append(f"Vencem em {lower} a {threshold} dias: {counts[threshold]}")
+            lower = threshold + 1
+        self.alerts_summary_label.config(text="   |   ".join(summary))
+        apply_rows_diff(self.alerts_tree, [
+            (str(item["id_doacao_recebida"]), (
                 item["id_doacao_recebida"],
                 item["nome_item"],
                 item["marca"],
                 item["unidade"],
                 f"{item['quantidade']:.2f}", # Formata quantidade
-                formatted_validity_date
+                format_date_br(item["data_validade"]),
+                self.alert_engine.days_left(item)
             ))
+            for item in self.alert_engine.items()
+        ])
+
+    def create_planning_tab(self):
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text="Planejar Distribuição")
+
+        # Proposta de distribuição do estoque conforme os alimentos necessários (allocation_planner.py)
+        controls = ttk.Frame(frame)
+        controls.pack(fill="x", padx=10, pady=(10, 0))
+        ttk.Label(controls, text="Porção por beneficiário:").pack(side="left", padx=(0, 5))
+        self.plan_portion_entry = ttk.Entry(controls, width=8)
+        self.plan_portion_entry.insert(0, f"{allocation_planner.DEFAULT_PORTION:g}")
+        self.plan_portion_entry.pack(side="left")
+        ttk.Label(controls, text="Só lotes que vencem em até (dias, vazio = todos):").pack(side="left", padx=(15, 5))
+        self.plan_days_entry = ttk.Entry(controls, width=6)
+        self.plan_days_entry.pack(side="left")
+        ttk.Button(controls, text="Planejar", command=self.load_distribution_plan).pack(side="left", padx=(15, 5))
+        self.plan_commit_button = ttk.Button(controls, text="Registrar todas", command=self.commit_distribution_plan,
+                                             state="disabled")
+        self.plan_commit_button.pack(side="left", padx=5)
+        self.plan_summary_label = ttk.Label(frame, text="")
+        self.plan_summary_label.pack(fill="x", padx=10, pady=(5, 0))
+
+        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7")
+        self.plan_tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for column, text, width in (("#1", "Beneficiário", 200), ("#2", "Necessidade", 90), ("#3", "Tipo de Alimento", 150),
+                                    ("#4", "Marca", 100), ("#5", "Unidade", 80), ("#6", "Quantidade", 90),
+                                    ("#7", "Validade", 100)):
+            self.plan_tree.heading(column, text=text)
+            self.plan_tree.column(column, width=width, anchor="center" if column in ("#2", "#6", "#7") else "w")
+        self.plan_tree.pack(expand=True, fill="both", padx=10, pady=10)
+        self._distribution_plan = []
+
+    def load_distribution_plan(self):
+        try:
+            portion = float(self.plan_portion_entry.get().strip().replace(",", "."))
+            days_text = self.plan_days_entry.get().strip()
+            max_days = int(days_text) if days_text else None
+        except ValueError:
+            messagebox.showerror("Erro", "Porção e dias devem ser números.")
+            return
+        if not (math.isfinite(portion) and portion > 0) or (max_days is not None and max_days < 0):
+            messagebox.showerror("Erro", "A porção deve ser positiva e os dias não podem ser negativos.")
+            return
+        self.plan_commit_button.config(state="disabled")
+        self.plan_summary_label.config(text="Planejando...")
+        self.executor.submit(
+            "distribution_plan",
+            lambda conn: allocation_planner.plan_distribution(conn, portion, max_days=max_days),
+            self.show_distribution_plan)
+
+    def show_distribution_plan(self, plan):
+        self._distribution_plan = plan
+        beneficiaries = len({line["id_beneficiario"] for line in plan})
+        self.plan_summary_label.config(text=f"{len(plan)} doações para {beneficiaries} beneficiários.")
+        self.plan_commit_button.config(state="normal" if plan else "disabled")
+        apply_rows_diff(self.plan_tree, [
+            (f"{line['id_beneficiario']}|{line['id_item']}", (
+                self.beneficiary_label({"id_beneficiario": line["id_beneficiario"], "nome": line["beneficiario_nome"]}),
+                line["prioridade"],
+                line["nome_item"],
+                line["marca"],
+                line["unidade"],
+                f"{line['quantidade']:.2f}",
+                format_date_br(line["data_validade"])
+            ))
+            for line in plan
+        ])
+
+    def commit_distribution_plan(self):
+        plan = self._distribution_plan
+        if not plan or not messagebox.askyesno("Confirmar", f"Registrar {len(plan)} doações realizadas?"):
+            return
+        count = allocation_planner.commit_plan(self.db_conn, plan)
+        if count is None:
+            messagebox.showerror("Erro", "Não foi possível registrar o plano (o estoque pode ter mudado). Planeje novamente.")
+            return
+        messagebox.showinfo("Sucesso", f"{count} doações realizadas registradas com sucesso!")
+        self.show_distribution_plan([])
+
+    def create_stock_history_tab(self):
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text="Saldo em Data")
+
+        # Saldo de cada item ao fim de uma data passada (RetratoSaldo.get_stock_as_of), para auditoria
+        controls = ttk.Frame(frame)
+        controls.pack(fill="x", padx=10, pady=(10, 0))
+        ttk.Label(controls, text="Data (DD/MM/YYYY):").pack(side="left", padx=(0, 5))
+        self.stock_history_date_entry = ttk.Entry(controls, width=12)
+        self.stock_history_date_entry.insert(0, (datetime.now() - timedelta(days=1)).strftime("%d/%m/%Y"))
+        self.stock_history_date_entry.pack(side="left")
+        ttk.Button(controls, text="Consultar", command=self.load_stock_as_of).pack(side="left", padx=(15, 5))
+        self.stock_history_summary_label = ttk.Label(frame, text="")
+        self.stock_history_summary_label.pack(fill="x", padx=10, pady=(5, 0))
+
+        columns = ("#1", "#2", "#3", "#4")
+        self.stock_history_tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for column, text, width in (("#1", "Tipo de Alimento", 200), ("#2", "Marca", 150), ("#3", "Unidade", 100),
+                                    ("#4", "Quantidade", 120)):
+            self.stock_history_tree.heading(column, text=text)
+            self.stock_history_tree.column(column, width=width, anchor="center" if column == "#4" else "w")
+        self.stock_history_tree.pack(expand=True, fill="both", padx=10, pady=10)
+
+    def load_stock_as_of(self):
+        try:
+            day = validators.parse_date(self.stock_history_date_entry.get())
+        except ValueError:
+            messagebox.showerror("Erro", "Formato de data inválido. Use DD/MM/YYYY.")
+            return
+        self.stock_history_summary_label.config(text="Calculando...")
+        self.executor.submit("stock_as_of", lambda conn: (day, RetratoSaldo(conn).get_stock_as_of(day)), self.show_stock_as_of)
+
+    def show_stock_as_of(self, result):
+        day, rows = result
+        self.stock_history_summary_label.config(text=f"{len(rows)} itens com saldo ao fim de {format_date_br(day)}.")
+        apply_rows_diff(self.stock_history_tree, [
+            (str(row["id_item"]), (row["nome_item"], row["marca"], row["unidade"], f"{row['quantidade']:.2f}"))
+            for row in rows
+        ])
+
+    def create_menu(self):
+        menubar = tk.Menu(self)
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Exportar relatório...", command=self.open_export_dialog)
+        file_menu.add_separator()
+        file_menu.add_command(label="Sair", command=self.on_closing)
+        menubar.add_cascade(label="Arquivo", menu=file_menu)
+        self.config(menu=menubar)
+
+    def open_export_dialog(self):
+        if self.export_dialog and self.export_dialog.winfo_exists():
+            self.export_dialog.lift()
+            return
+        # Exportação de entradas, saídas, estoque e alertas (report_export.py) em uma thread própria
+        dialog = self.export_dialog = tk.Toplevel(self)
+        dialog.title("Exportar relatório")
+        dialog.transient(self)
+        dialog.resizable(False, False)
+        dialog.protocol("WM_DELETE_WINDOW", self.close_export_dialog)
+        self.export_reports = {spec["titulo"]: report for report, spec in report_export.REPORTS.items()}
+        self.export_formats = {"CSV": ('csv', ".csv"), "JSON Lines": ('jsonl', ".jsonl"), "Excel (XLSX)": ('xlsx', ".xlsx")}
+
+        ttk.Label(dialog, text="Relatório:").grid(row=0, column=0, padx=10, pady=5, sticky="w")
+        self.export_report_combobox = ttk.Combobox(dialog, values=list(self.export_reports), state="readonly", width=25)
+        self.export_report_combobox.current(0)
+        self.export_report_combobox.grid(row=0, column=1, padx=10, pady=5, sticky="w")
+        ttk.Label(dialog, text="Formato:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
+        self.export_format_combobox = ttk.Combobox(dialog, values=list(self.export_formats), state="readonly", width=25)
+        self.export_format_combobox.current(0)
+        self.export_format_combobox.grid(row=1, column=1, padx=10, pady=5, sticky="w")
+        self.export_gzip_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dialog, text="Compactar com gzip (CSV e JSON Lines)",
+                        variable=self.export_gzip_var).grid(row=2, column=1, padx=10, pady=5, sticky="w")
+        ttk.Label(dialog, text="Data inicial (DD/MM/YYYY, opcional):").grid(row=3, column=0, padx=10, pady=5, sticky="w")
+        self.export_start_entry = ttk.Entry(dialog, width=12)
+        self.export_start_entry.grid(row=3, column=1, padx=10, pady=5, sticky="w")
+        ttk.Label(dialog, text="Data final (DD/MM/YYYY, opcional):").grid(row=4, column=0, padx=10, pady=5, sticky="w")
+        self.export_end_entry = ttk.Entry(dialog, width=12)
+        self.export_end_entry.grid(row=4, column=1, padx=10, pady=5, sticky="w")
+        ttk.Label(dialog, text="Tipo de Alimento (opcional):").grid(row=5, column=0, padx=10, pady=5, sticky="w")
+        self.export_item_entry = ttk.Entry(dialog, width=28)
+        self.export_item_entry.grid(row=5, column=1, padx=10, pady=5, sticky="w")
+
+        self.export_progressbar = ttk.Progressbar(dialog, length=360, mode="determinate")
+        self.export_progressbar.grid(row=6, column=0, columnspan=2, padx=10, pady=(10, 0), sticky="we")
+        self.export_status_label = ttk.Label(dialog, text="")
+        self.export_status_label.grid(row=7, column=0, columnspan=2, padx=10, pady=5, sticky="w")
+        buttons = ttk.Frame(dialog)
+        buttons.grid(row=8, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="e")
+        self.export_start_button = ttk.Button(buttons, text="Exportar...", command=self.start_export)
+        self.export_start_button.pack(side="left", padx=5)
+        self.export_cancel_button = ttk.Button(buttons, text="Cancelar", command=self.cancel_export, state="disabled")
+        self.export_cancel_button.pack(side="left", padx=5)
+
+    def start_export(self):
+        report = self.export_reports[self.export_report_combobox.get()]
+        fmt, extension = self.export_formats[self.export_format_combobox.get()]
+        compress = self.export_gzip_var.get() and fmt != 'xlsx'
+        start_text, end_text = self.export_start_entry.get().strip(), self.export_end_entry.get().strip()
+        try:
+            start = validators.parse_date(start_text) if start_text else None
+            end = validators.parse_date(end_text) if end_text else None
+        except ValueError:
+            messagebox.showerror("Erro", "Formato de data inválido. Use DD/MM/YYYY.", parent=self.export_dialog)
+            return
+        if start and end and start > end:
+            messagebox.showerror("Erro", "A data inicial deve ser anterior à final.", parent=self.export_dialog)
+            return
+        path = filedialog.asksaveasfilename(parent=self.export_dialog, defaultextension=extension,
+                                            filetypes=[(self.export_format_combobox.get(), f"*{extension}")],
+                                            initialfile=f"{report}-{datetime.now():%Y%m%d}{extension}")
+        if not path:
+            return
+        if compress and not path.lower().endswith(".gz"):
+            path += ".gz"
+        self.export_job = report_export.ExportJob(self.db_file, report, path, fmt=fmt, compress=compress, start=start,
+                                                  end=end, nome_item=self.export_item_entry.get().strip() or None).start()
+        self.export_start_button.config(state="disabled")
+        self.export_cancel_button.config(state="normal")
+        self.export_progressbar.config(value=0)
+        self.export_status_label.config(text="Contando as linhas...")
+        self.poll_export()
+
+    def cancel_export(self):
+        if self.export_job:
+            self.export_job.cancel()
+
+    def close_export_dialog(self):
+        # Fechar a janela interrompe a exportação em andamento (o arquivo parcial é apagado)
+        self.cancel_export()
+        self.export_dialog.destroy()
+
+    def poll_export(self):
+        job = self.export_job
+        if not self.export_dialog or not self.export_dialog.winfo_exists():
+            return
+        if not job.finished:
+            if job.total is not None:
+                self.export_progressbar.config(maximum=max(job.total, 1), value=job.done)
+                self.export_status_label.config(text=f"{job.done} de {job.total} linhas exportadas...")
+            self.after(200, self.poll_export)
+            return
+        self.export_start_button.config(state="normal")
+        self.export_cancel_button.config(state="disabled")
+        if job.error is None:
+            self.export_progressbar.config(maximum=max(job.rows, 1), value=job.rows)
+            self.export_status_label.config(text=f"{job.rows} linhas exportadas em {job.elapsed:.1f} s.")
+            messagebox.showinfo("Exportar relatório", f"{job.rows} linhas exportadas para {job.path}.", parent=self.export_dialog)
+        elif isinstance(job.error, report_export.ExportCancelled):
+            self.export_progressbar.config(value=0)
+            self.export_status_label.config(text="Exportação cancelada.")
+        else:
+            self.export_status_label.config(text="")
+            messagebox.showerror("Erro", f"Não foi possível exportar o relatório: {job.error}", parent=self.export_dialog)
+
+    def create_diagnostics_tab(self):
+        # Aba de suporte: estatísticas das consultas SQL (query_trace.py), fora da lista de abas
+        self.diagnostics_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.diagnostics_frame, text="Diagnóstico")
+        self.notebook.hide(self.diagnostics_frame)
+        self.bind_all("<Control-Shift-D>", lambda event: self.toggle_diagnostics_tab())
+
+        controls = ttk.Frame(self.diagnostics_frame)
+        controls.pack(fill="x", padx=10, pady=(10, 0))
+        self.tracing_var = tk.BooleanVar(value=query_trace.active_tracer() is not None)
+        ttk.Checkbutton(controls, text="Registrar consultas SQL", variable=self.tracing_var,
+                        command=self.set_tracing).pack(side="left")
+        ttk.Label(controls, text="Lentas a partir de (ms):").pack(side="left", padx=(15, 5))
+        self.slow_ms_spinbox = ttk.Spinbox(controls, from_=1, to=60000, width=7)
+        tracer = query_trace.active_tracer()
+        self.slow_ms_spinbox.set(tracer.slow_ms if tracer else query_trace.DEFAULT_SLOW_MS)
+        self.slow_ms_spinbox.pack(side="left")
+        ttk.Button(controls, text="Atualizar", command=self.refresh_diagnostics).pack(side="left", padx=(15, 5))
+        ttk.Button(controls, text="Zerar", command=self.reset_diagnostics).pack(side="left", padx=5)
+        ttk.Button(controls, text="Salvar resumo...", command=self.save_diagnostics).pack(side="left", padx=5)
+        self.diagnostics_status_label = ttk.Label(self.diagnostics_frame, text="")
+        self.diagnostics_status_label.pack(fill="x", padx=10, pady=(5, 0))
+
+        columns = ("#1", "#2", "#3", "#4", "#5", "#6", "#7", "#8")
+        self.diagnostics_tree = ttk.Treeview(self.diagnostics_frame, columns=columns, show="headings", height=12)
+        for column, text, width in (("#1", "Consulta", 520), ("#2", "Execuções", 80), ("#3", "Total (ms)", 90),
+                                    ("#4", "Média (ms)", 80), ("#5", "p95 (ms)", 80), ("#6", "Máx (ms)", 80),
+                                    ("#7", "Linhas", 80), ("#8", "Erros", 60)):
+            self.diagnostics_tree.heading(column, text=text)
+            self.diagnostics_tree.column(column, width=width, anchor="w" if column == "#1" else "center")
+        self.diagnostics_tree.pack(expand=True, fill="both", padx=10, pady=10)
+
+        ttk.Label(self.diagnostics_frame, text="Consultas lentas (com o plano de execução):").pack(fill="x", padx=10)
+        self.slow_queries_text = tk.Text(self.diagnostics_frame, height=12, wrap="none")
+        self.slow_queries_text.pack(expand=True, fill="both", padx=10, pady=(0, 10))
+
+    def toggle_diagnostics_tab(self):
+        if self.notebook.tab(self.diagnostics_frame, "state") == "hidden":
+            self.notebook.add(self.diagnostics_frame) # Readicionar uma aba oculta a mostra de novo
+            self.notebook.select(self.diagnostics_frame)
+            self.refresh_diagnostics()
+        else:
+            self.notebook.hide(self.diagnostics_frame)
+
+    def set_tracing(self):
+        if self.tracing_var.get():
+            try:
+                slow_ms = int(self.slow_ms_spinbox.get())
+            except ValueError:
+                slow_ms = query_trace.DEFAULT_SLOW_MS
+            query_trace.enable_tracing(slow_ms)
+        else:
+            query_trace.disable_tracing()
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        stats = query_cache(self.db_conn).stats()
+        cache_text = f"Cache de consultas (conexão principal): {stats['hits']} acertos, {stats['misses']} faltas, {stats['entradas']} entradas"
+        tracer = query_trace.active_tracer()
+        if tracer is None:
+            self.diagnostics_status_label.config(text=f"Registro de consultas desligado.   |   {cache_text}")
+            apply_rows_diff(self.diagnostics_tree, [])
+            self.slow_queries_text.delete("1.0", tk.END)
+            return
+        summary = tracer.summary()
+        self.diagnostics_status_label.config(
+            text=f"Desde {tracer.started:%d/%m/%Y %H:%M:%S}: {sum(row['execucoes'] for row in summary)} comandos, "
+                 f"{len(tracer.slow_queries)} lentos   |   {cache_text}")
+        apply_rows_diff(self.diagnostics_tree, [
+            (row["consulta"], (row["consulta"], row["execucoes"], f"{row['total_ms']:.1f}", f"{row['media_ms']:.2f}",
+                               f"{row['p95_ms']:.2f}", f"{row['max_ms']:.2f}", row["linhas"], row["erros"]))
+            for row in summary
+        ])
+        self.slow_queries_text.delete("1.0", tk.END)
+        for entry in reversed(tracer.slow_queries):
+            self.slow_queries_text.insert(tk.END, f"{entry['quando']}  {entry['ms']:.2f} ms, {entry['linhas']} linha(s)\n{entry['sql']}\n")
+            for line in entry["plano"]:
+                self.slow_queries_text.insert(tk.END, f"    {line}\n")
+            self.slow_queries_text.insert(tk.END, "\n")
+
+    def reset_diagnostics(self):
+        tracer = query_trace.active_tracer()
+        if tracer:
+            tracer.reset()
+        self.refresh_diagnostics()
+
+    def save_diagnostics(self):
+        tracer = query_trace.active_tracer()
+        if tracer is None:
+            messagebox.showinfo("Diagnóstico", "Ligue o registro de consultas SQL antes de salvar o resumo.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Texto", "*.txt")],
+                                            initialfile=f"consultas-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(tracer.format_summary(limit=None))
+        except OSError as e:
+            messagebox.showerror("Erro", f"Não foi possível salvar o resumo: {e}")
 
 
 if __name__ == "__main__":
     app = EstoqueApp()
     app.mainloop()
-
-
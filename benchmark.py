@@ -0,0 +1,264 @@
+""" Mede o tempo de cada consulta dos modelos e de cada carga de aba da interface.
+
+Os resultados são gravados em JSON (com o commit, a versão do SQLite e o
+tamanho das tabelas) para comparar versões do código sobre o mesmo banco,
+de preferência um gerado por synthetic_data.py com a mesma semente:
+
+    python synthetic_data.py bench.db --doacoes-recebidas 1000000 --doacoes-realizadas 800000
+    python benchmark.py bench.db --saida antes.json
+    (altera o código)
+    python benchmark.py bench.db --saida depois.json --comparar antes.json
+
+As consultas com cache (QueryCache) são medidas com o cache vazio. As cargas
+das abas (EstoqueApp.load_*) medem o tempo até a aba estar preenchida, com a
+janela oculta; sem display disponível elas são puladas.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from models import (Beneficiario, DoacaoRealizada, DoacaoRecebida, Doador, Item, Lote, get_db_connection,
+                    query_cache)
+
+
+DEFAULT_REPEAT = 5
+# Diferença a partir da qual --comparar aponta regressão (1.2 = 20% mais lento)
+DEFAULT_TOLERANCE = 1.2
+# Quantas vezes cada consulta por ID é repetida (IDs sorteados) em uma medição
+LOOKUPS = 200
+APP_LOADS = ["load_donors", "load_beneficiaries", "load_donor_combobox", "load_beneficiary_combobox",
+             "load_item_name_combobox", "load_item_brand_combobox", "load_distributed_item_name_combobox",
+             "load_stock_data", "load_entries_data", "load_exits_data", "load_alerts_data"]
+TABLES = ["doadores", "beneficiarios", "itens", "doacoes_recebidas", "doacoes_realizadas", "lotes", "alocacoes_lote"]
+
+
+def _sample_ids(conn, table, id_column, count, rng):
+    ids = [row[0] for row in conn.execute(f"SELECT {id_column} FROM {table}")]
+    return [rng.choice(ids) for _ in range(count)] if ids else []
+
+
+def _count_rows(result):
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1 if result is not None else 0
+
+
+def model_benchmarks(conn, seed=0):
+    """ Lista de (nome, função) que executam cada consulta dos modelos e retornam o número de linhas """
+    rng = random.Random(seed)
+    donor_ids = _sample_ids(conn, "doadores", "id_doador", LOOKUPS, rng)
+    item_ids = _sample_ids(conn, "itens", "id_item", LOOKUPS, rng)
+    received_ids = _sample_ids(conn, "doacoes_recebidas", "id_doacao_recebida", LOOKUPS, rng)
+    distributed_ids = _sample_ids(conn, "doacoes_realizadas", "id_doacao_realizada", LOOKUPS, rng)
+    items = [Item(conn).get_by_id(item_id) for item_id in item_ids[:20]]
+    donor, beneficiary, item = Doador(conn), Beneficiario(conn), Item(conn)
+    lot, received, distributed = Lote(conn), DoacaoRecebida(conn), DoacaoRealizada(conn)
+
+    def lookups(function, ids):
+        return lambda: sum(_count_rows(function(value)) for value in ids)
+
+    def first_page(model, method="iter_all", size=50):
+        return lambda: len(list(getattr(model, method)(before_id=2 ** 62, limit=size)))
+
+    return [
+        ("Doador.get_all", lambda: len(donor.get_all())),
+        ("Doador.count", lambda: donor.count()),
+        ("Doador.get_by_id", lookups(donor.get_by_id, donor_ids)),
+        ("Doador.search", lambda: len(donor.search("mar")) + len(donor.search("silva santos"))),
+        ("Beneficiario.get_all", lambda: len(beneficiary.get_all())),
+        ("Beneficiario.search", lambda: len(beneficiary.search("creche"))),
+        ("Item.get_all", lambda: len(item.get_all())),
+        ("Item.search", lambda: len(item.search("leite"))),
+        ("Item.get_by_name_brand_unit", lambda: sum(
+            _count_rows(item.get_by_name_brand_unit(i["nome_item"], i["marca"], i["unidade"])) for i in items if i)),
+        ("Item.get_by_name_brand", lambda: sum(_count_rows(item.get_by_name_brand(i["nome_item"], i["marca"])) for i in items if i)),
+        ("Lote.get_available_lots", lookups(lot.get_available_lots, item_ids[:50])),
+        ("Lote.get_available_quantity", lookups(lot.get_available_quantity, item_ids[:50])),
+        ("Lote.get_allocations", lookups(lot.get_allocations, distributed_ids)),
+        ("DoacaoRecebida.get_all_with_details", lambda: len(received.get_all_with_details())),
+        ("DoacaoRecebida.iter_all_with_details[ultima_pagina]", first_page(received, "iter_all_with_details")),
+        ("DoacaoRecebida.get_with_details", lookups(received.get_with_details, received_ids)),
+        ("DoacaoRecebida.get_expiring_items", lambda: len(received.get_expiring_items(30))),
+        ("DoacaoRecebida.get_stock_by_item", lookups(received.get_stock_by_item, item_ids[:50])),
+        ("DoacaoRecebida.get_grouped_stock", lambda: len(received.get_grouped_stock())),
+        ("DoacaoRecebida.get_all_stock_items", lambda: len(received.get_all_stock_items())),
+        ("DoacaoRealizada.get_all_with_details", lambda: len(distributed.get_all_with_details())),
+        ("DoacaoRealizada.iter_all_with_details[ultima_pagina]", first_page(distributed, "iter_all_with_details")),
+        ("DoacaoRealizada.get_with_details", lookups(distributed.get_with_details, distributed_ids)),
+    ]
+
+
+def _summary(name, timings, rows):
+    ordered = sorted(timings)
+    return {
+        "nome": name,
+        "repeticoes": len(timings),
+        "linhas": rows,
+        "min_ms": round(ordered[0] * 1000, 3),
+        "mediana_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def run_model_benchmarks(conn, repeat=DEFAULT_REPEAT, only=None):
+    results = []
+    cache = query_cache(conn)
+    for name, function in model_benchmarks(conn):
+        if only and not any(part in name for part in only):
+            continue
+        timings, rows = [], 0
+        for _ in range(repeat):
+            cache.clear()
+            started = time.perf_counter()
+            rows = function()
+            timings.append(time.perf_counter() - started)
+        results.append(_summary(name, timings, rows))
+    return results
+
+
+def run_app_benchmarks(db_file, repeat=DEFAULT_REPEAT, only=None, timeout=600):
+    """ Mede EstoqueApp.load_* até os callbacks terminarem; retorna (resultados, motivo de ter pulado) """
+    if os.name != "nt" and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+        return [], "sem display disponível"
+    try:
+        import tkinter
+        from app import EstoqueApp
+        app = EstoqueApp(db_file)
+    except (ImportError, tkinter.TclError) as e:
+        return [], f"interface indisponível: {e}"
+
+    pending = []
+    submit = app.executor.submit
+
+    def counted_submit(key, func, callback=None, errback=None):
+        # Cada pedido conta até seu callback (ou errback) ser chamado dentro de poll()
+        pending.append(key)
+        def done(result, handler=callback):
+            pending.remove(key)
+            if handler:
+                handler(result)
+        def failed(error, handler=errback):
+            pending.remove(key)
+            if handler:
+                handler(error)
+        return submit(key, func, done, failed)
+
+    def wait_idle():
+        deadline = time.perf_counter() + timeout
+        while pending and time.perf_counter() < deadline:
+            app.update()
+            time.sleep(0.001)
+        app.update_idletasks()
+
+    results = []
+    try:
+        app.withdraw()
+        app.executor.submit = counted_submit
+        wait_idle()  # cargas feitas pela própria janela ao abrir
+        for name in APP_LOADS:
+            if only and not any(part in name for part in only):
+                continue
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                getattr(app, name)()
+                wait_idle()
+                timings.append(time.perf_counter() - started)
+            results.append(_summary(f"EstoqueApp.{name}", timings, None))
+    finally:
+        app.on_closing()
+    return results, None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(db_file, repeat=DEFAULT_REPEAT, only=None, include_app=True):
+    conn = get_db_connection(db_file)
+    try:
+        sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in TABLES}
+        results = run_model_benchmarks(conn, repeat, only)
+    finally:
+        conn.close()
+    app_results, skipped = run_app_benchmarks(db_file, repeat, only) if include_app else ([], "desativado")
+    return {
+        "meta": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+            "banco": os.path.basename(db_file),
+            "tabelas": sizes,
+            "repeticoes": repeat,
+            "interface_pulada": skipped,
+        },
+        "resultados": results + app_results,
+    }
+
+
+def compare(previous, current, tolerance=DEFAULT_TOLERANCE):
+    """ Linhas (nome, antes_ms, depois_ms, razão, regressão) para as medições presentes nos dois resultados """
+    before = {result["nome"]: result["mediana_ms"] for result in previous["resultados"]}
+    rows = []
+    for result in current["resultados"]:
+        if result["nome"] not in before:
+            continue
+        old, new = before[result["nome"]], result["mediana_ms"]
+        ratio = new / old if old else float("inf") if new else 1.0
+        rows.append((result["nome"], old, new, ratio, ratio > tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das consultas dos modelos e das cargas da interface")
+    parser.add_argument("db", help="banco de dados a medir (ex.: gerado por synthetic_data.py)")
+    parser.add_argument("--repeticoes", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--saida", help="arquivo JSON para os resultados (padrão: benchmark-<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=DEFAULT_TOLERANCE,
+                        help="razão depois/antes acima da qual a medição é apontada como regressão")
+    parser.add_argument("--filtro", action="append", help="mede só os nomes que contêm este texto (pode repetir)")
+    parser.add_argument("--sem-interface", action="store_true", help="não mede EstoqueApp.load_*")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"banco {args.db} não encontrado (gere um com synthetic_data.py)")
+
+    report = run(args.db, args.repeticoes, args.filtro, not args.sem_interface)
+    output = args.saida or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    for result in report["resultados"]:
+        print(f"{result['nome']:<55} {result['mediana_ms']:>10.2f} ms (p95 {result['p95_ms']:.2f})")
+    if report["meta"]["interface_pulada"]:
+        print(f"Cargas da interface não medidas: {report['meta']['interface_pulada']}.")
+    print(f"Resultados gravados em {output}.")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as file:
+            previous = json.load(file)
+        regressions = 0
+        for name, old, new, ratio, regression in compare(previous, report, args.tolerancia):
+            regressions += regression
+            print(f"{'REGRESSÃO ' if regression else ''}{name}: {old:.2f} -> {new:.2f} ms ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
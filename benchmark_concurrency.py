@@ -0,0 +1,122 @@
+""" Mede leituras e gravações simultâneas no mesmo arquivo, como várias estações de cadastro.
+
+Cada estação é um processo com a sua própria conexão: as que gravam registram
+doações recebidas e realizadas (que leem os lotes e depois gravam), as que
+leem consultam o estoque agrupado e uma página de doações. O mesmo cenário
+roda com cada perfil de conexão em um banco novo, e o resultado mostra
+operações por segundo, latências e quantas operações falharam (ex.: "database
+is locked").
+
+Uso: python benchmark_concurrency.py --escritores 3 --leitores 2 --segundos 5
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import create_tables
+from models import (LEGACY_PROFILE, SHARED_PROFILE, Beneficiario, DoacaoRealizada, DoacaoRecebida, Doador, Item,
+                    get_db_connection)
+
+PROFILES = {"padrao_sqlite": LEGACY_PROFILE, "wal": SHARED_PROFILE}
+ITEMS = 20
+
+
+def prepare_database(db_file, profile, donations=2000):
+    conn = get_db_connection(db_file, profile)
+    create_tables(conn)
+    Doador(conn).save({"nome": "Doador Benchmark", "telefone": "", "email": "", "endereco": ""})
+    Beneficiario(conn).save({"nome": "Beneficiário Benchmark", "telefone": "", "email": "", "endereco": "",
+                             "alimento_necessidade_1": "", "alimento_necessidade_2": "", "alimento_necessidade_3": ""})
+    Item(conn).save_many({"nome_item": f"Item {i}", "marca": "Marca", "unidade": "kg"} for i in range(ITEMS))
+    today = datetime.now()
+    DoacaoRecebida(conn).save_many(
+        {"id_doador": 1, "id_item": i % ITEMS + 1, "quantidade": 100,
+         "data_recebimento": today.strftime("%Y-%m-%d"),
+         "data_validade": (today + timedelta(days=30 + i % 300)).strftime("%Y-%m-%d")}
+        for i in range(donations))
+    conn.close()
+
+
+def station(db_file, profile, role, seed, deadline, results):
+    conn = get_db_connection(db_file, profile)
+    received, distributed = DoacaoRecebida(conn), DoacaoRealizada(conn)
+    today = datetime.now().strftime("%Y-%m-%d")
+    latencies, failures, step = [], 0, seed
+    # Os modelos imprimem os erros do SQLite; aqui eles só são contados
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.time() < deadline:
+            step += 1
+            started = time.perf_counter()
+            if role == "escrita":
+                item_id = step % ITEMS + 1
+                if step % 2:
+                    ok = received.save({"id_doador": 1, "id_item": item_id, "quantidade": 10, "data_recebimento": today,
+                                        "data_validade": "2030-01-01"}) is not None
+                else:
+                    ok = distributed.save({"id_beneficiario": 1, "id_item": item_id, "quantidade": 1,
+                                           "data_doacao": today}) is not None
+            else:
+                try:
+                    received.get_grouped_stock()
+                    ok = len(list(received.iter_all_with_details(before_id=10 ** 9, limit=200))) > 0
+                except Exception:
+                    ok = False
+            latencies.append(time.perf_counter() - started)
+            failures += not ok
+    conn.close()
+    results.put((role, latencies, failures))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def run_profile(name, profile, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_file = os.path.join(tmpdir, "estoque.db")
+        prepare_database(db_file, profile)
+        results = multiprocessing.Queue()
+        deadline = time.time() + 1 + seconds
+        processes = [multiprocessing.Process(target=station, args=(db_file, profile, role, i * 1000, deadline, results))
+                     for i, role in enumerate(["escrita"] * writers + ["leitura"] * readers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    summary = {"perfil": name}
+    for role in ("escrita", "leitura"):
+        latencies = [value for r, values, _ in collected if r == role for value in values]
+        failures = sum(f for r, _, f in collected if r == role)
+        summary[role] = {
+            "operacoes_por_segundo": round((len(latencies) - failures) / seconds, 1),
+            "falhas": failures,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "max_ms": round(max(latencies, default=0) * 1000, 2),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de leituras e gravações simultâneas")
+    parser.add_argument("--escritores", type=int, default=3, help="estações que gravam")
+    parser.add_argument("--leitores", type=int, default=2, help="estações que só consultam")
+    parser.add_argument("--segundos", type=float, default=5)
+    parser.add_argument("--perfil", choices=sorted(PROFILES), action="append", help="perfil a medir (padrão: todos)")
+    args = parser.parse_args(argv)
+    for name in args.perfil or PROFILES:
+        print(json.dumps(run_profile(name, PROFILES[name], args.escritores, args.leitores, args.segundos), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,267 @@
+""" Importação em massa de doadores, beneficiários e doações recebidas.
+
+Os registros são lidos de arquivos CSV ou JSON Lines em fluxo (um gerador por
+etapa: leitura -> validação -> lotes), validados com as mesmas regras da
+interface e gravados com executemany em lotes grandes, tudo em uma única
+transação. Linhas rejeitadas vão para um arquivo à parte com o motivo.
+
+Uso:
+    python3 bulk_import.py doacoes planilha.csv
+    python3 bulk_import.py doadores doadores.jsonl --rejeitados erros.csv
+"""
+
+import argparse
+import csv
+import json
+import sqlite3
+import time
+from datetime import datetime
+from itertools import islice
+
+import validators
+from database import create_tables
+from models import DATABASE, ChangeEvent, change_bus, get_db_connection, intern_item, invalidate_cached_reads
+
+
+DEFAULT_BATCH_SIZE = 5000
+
+DONOR_COLUMNS = ("nome", "telefone", "email", "endereco")
+BENEFICIARY_COLUMNS = DONOR_COLUMNS + ("alimento_necessidade_1", "alimento_necessidade_2", "alimento_necessidade_3")
+DONATION_COLUMNS = ("id_doador", "id_item", "quantidade", "data_recebimento", "data_validade")
+
+
+def read_records(path, delimiter=None):
+    """ Gera (número da linha, registro) a partir de um arquivo CSV ou JSON Lines """
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {"_erro": f"JSON inválido: {e}", "_linha": line.rstrip("\n")}
+                    continue
+                # Números, listas e textos soltos também são JSON válido, mas não são registros
+                if not isinstance(record, dict):
+                    yield line_number, {"_erro": "A linha não é um objeto JSON.", "_linha": line.rstrip("\n")}
+                    continue
+                yield line_number, record
+        return
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if delimiter is None:
+            # Planilhas em português costumam ser exportadas com ';'
+            sample = f.readline()
+            delimiter = ";" if sample.count(";") > sample.count(",") else ","
+            f.seek(0)
+        reader = csv.DictReader(f, delimiter=delimiter)
+        # Linha 1 é o cabeçalho
+        for line_number, record in enumerate(reader, start=2):
+            yield line_number, record
+
+
+def _text(record, column):
+    value = record.get(column)
+    return "" if value is None else str(value).strip()
+
+
+def convert_person(record, columns):
+    """ Valida um doador/beneficiário e retorna a tupla de valores na ordem de columns """
+    values = {column: _text(record, column) for column in columns}
+    if not values["nome"]:
+        raise ValueError("O nome é obrigatório.")
+    if values["telefone"] and not validators.validate_phone(values["telefone"]):
+        raise ValueError("Telefone inválido. Deve conter somente números e ter DDD+número (10 ou 11 dígitos).")
+    if values["email"] and not validators.validate_email(values["email"]):
+        raise ValueError("Email inválido.")
+    return tuple(values[column] for column in columns)
+
+
+class DonationConverter:
+    """ Valida doações recebidas e resolve (ou cria) o item de cada linha.
+
+    Os itens existentes e os IDs de doadores são carregados uma vez; itens
+    novos são inseridos na transação corrente e entram no cache de chaves.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        # Chaves normalizadas (como as das dimensões de itens) -> id_item
+        self.item_ids = {}
+        for row in conn.execute("SELECT id_item, nome_item, marca, unidade FROM itens"):
+            self.item_ids.setdefault(tuple(validators.normalize_key(text) for text in row[1:]), row[0])
+        self.donor_ids = {row[0] for row in conn.execute("SELECT id_doador FROM doadores")}
+        self.today = datetime.now().strftime("%Y-%m-%d")
+        self.items_created = 0
+
+    def resolve_item(self, nome_item, marca, unidade):
+        key = tuple(validators.normalize_key(text) for text in (nome_item, marca, unidade))
+        item_id = self.item_ids.get(key)
+        if item_id is None:
+            item_id, created = intern_item(self.cursor, nome_item, marca, unidade)
+            self.item_ids[key] = item_id
+            self.items_created += created
+        return item_id
+
+    def __call__(self, record):
+        try:
+            donor_id = int(_text(record, "id_doador"))
+        except ValueError:
+            raise ValueError("ID do doador inválido.")
+        if donor_id not in self.donor_ids:
+            raise ValueError(f"Doador {donor_id} não cadastrado.")
+        nome_item = _text(record, "nome_item")
+        unidade = _text(record, "unidade")
+        if not nome_item or not unidade:
+            raise ValueError("Tipo de alimento e unidade são obrigatórios.")
+        try:
+            quantity = validators.parse_quantity(_text(record, "quantidade"))
+        except ValueError:
+            raise ValueError("Quantidade inválida. Deve ser um número positivo.")
+        try:
+            validity_date = validators.parse_date(_text(record, "data_validade"))
+        except ValueError:
+            raise ValueError("Data de Validade inválida. Use DD/MM/YYYY.")
+        received_date = _text(record, "data_recebimento")
+        if received_date:
+            try:
+                received_date = validators.parse_date(received_date)
+            except ValueError:
+                raise ValueError("Data de Recebimento inválida. Use DD/MM/YYYY.")
+        else:
+            received_date = self.today
+        item_id = self.resolve_item(nome_item, _text(record, "marca"), unidade)
+        return (donor_id, item_id, quantity, received_date, validity_date)
+
+
+class RejectWriter:
+    """ Grava as linhas rejeitadas (linha, motivo e registro original em JSON) em CSV """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line_number, record, reason):
+        if self._writer is None:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["linha", "erro", "registro"])
+        self._writer.writerow([line_number, reason, json.dumps(record, ensure_ascii=False)])
+        self.count += 1
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def validated_rows(records, converter, rejects):
+    """ Gera as tuplas válidas e desvia as inválidas para rejects """
+    for line_number, record in records:
+        if "_erro" in record:
+            rejects.write(line_number, record.get("_linha"), record["_erro"])
+            continue
+        try:
+            yield converter(record)
+        except ValueError as e:
+            rejects.write(line_number, record, str(e))
+        except (TypeError, KeyError) as e:
+            # Uma linha com formato inesperado não desfaz a importação inteira
+            rejects.write(line_number, record, f"Registro inválido: {e}")
+
+
+def batched(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_file(conn, kind, path, rejects_path=None, batch_size=DEFAULT_BATCH_SIZE, delimiter=None):
+    """ Importa um arquivo em uma única transação e retorna um resumo da importação.
+
+    kind é 'doadores', 'beneficiarios' ou 'doacoes'. Em caso de erro do banco a
+    transação inteira é desfeita e o erro é propagado.
+    """
+    if kind == "doadores":
+        table, columns = "doadores", DONOR_COLUMNS
+        converter = lambda record: convert_person(record, DONOR_COLUMNS)
+    elif kind == "beneficiarios":
+        table, columns = "beneficiarios", BENEFICIARY_COLUMNS
+        converter = lambda record: convert_person(record, BENEFICIARY_COLUMNS)
+    elif kind == "doacoes":
+        table, columns = "doacoes_recebidas", DONATION_COLUMNS
+        converter = DonationConverter(conn)
+    else:
+        raise ValueError(f"Tipo de importação desconhecido: {kind}")
+
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    rejects = RejectWriter(rejects_path or f"{path}.rejeitados.csv")
+    imported = 0
+    started = time.perf_counter()
+    try:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        rows = validated_rows(read_records(path, delimiter), converter, rejects)
+        for batch in batched(rows, batch_size):
+            conn.executemany(sql, batch)
+            imported += len(batch)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        rejects.close()
+        # As linhas foram gravadas com SQL direto, fora dos modelos
+        invalidate_cached_reads(conn, table, "itens")
+    elapsed = time.perf_counter() - started
+    # Importação é uma alteração em massa: quem exibe a tabela recarrega tudo
+    if getattr(converter, "items_created", 0):
+        change_bus.publish(ChangeEvent("itens", "insert", None))
+    if imported:
+        change_bus.publish(ChangeEvent(table, "insert", None))
+    return {
+        "importados": imported,
+        "rejeitados": rejects.count,
+        "itens_criados": getattr(converter, "items_created", 0),
+        "arquivo_rejeitados": rejects.path if rejects.count else None,
+        "segundos": elapsed,
+        "linhas_por_segundo": (imported + rejects.count) / elapsed if elapsed else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importação em massa para o estoque de doações")
+    parser.add_argument("tipo", choices=["doadores", "beneficiarios", "doacoes"])
+    parser.add_argument("arquivo", help="arquivo .csv ou .jsonl")
+    parser.add_argument("--db", default=DATABASE, help="banco de dados SQLite")
+    parser.add_argument("--rejeitados", help="arquivo CSV para as linhas rejeitadas (padrão: <arquivo>.rejeitados.csv)")
+    parser.add_argument("--lote", type=int, default=DEFAULT_BATCH_SIZE, help="linhas por executemany")
+    parser.add_argument("--delimitador", help="delimitador do CSV (padrão: detectado entre ',' e ';')")
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection(args.db)
+    create_tables(conn)
+    try:
+        summary = import_file(conn, args.tipo, args.arquivo, args.rejeitados, args.lote, args.delimitador)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Erro na importação, nenhuma linha foi gravada: {e}")
+        return 1
+    finally:
+        conn.close()
+    print(f"{summary['importados']} linha(s) importada(s), {summary['rejeitados']} rejeitada(s) "
+          f"em {summary['segundos']:.2f}s ({summary['linhas_por_segundo']:.0f} linhas/s).")
+    if summary["itens_criados"]:
+        print(f"{summary['itens_criados']} item(ns) novo(s) cadastrado(s).")
+    if summary["arquivo_rejeitados"]:
+        print(f"Linhas rejeitadas gravadas em {summary['arquivo_rejeitados']}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,17 +1,24 @@
 import sqlite3
+import sys
+from models import (FTS_TABLES, ITEM_DIMENSIONS, LOT_EPSILON, ModelConnection, allocate_fefo, invalidate_cached_reads,
+                    resolve_item_columns, set_unit_conversion, unit_conversion)
+
+# Tolerância para comparar somas de quantidades REAL (acúmulo de arredondamento)
+STOCK_BALANCE_TOLERANCE = 1e-6
 
 def create_connection(db_file):
     """ Cria uma conexão com o banco de dados SQLite especificado por db_file """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        # ModelConnection: as migrações usam o estado de conexão dos modelos (cache, transações)
+        conn = sqlite3.connect(db_file, factory=ModelConnection)
         return conn
     except sqlite3.Error as e:
         print(e)
     return conn
 
 def create_tables(conn):
-    """ Cria as tabelas do banco de dados """
+    """ Cria as tabelas do banco de dados e aplica as migrações pendentes """
     try:
         cursor = conn.cursor()
         # Tabela Doadores
@@ -34,16 +41,6 @@ def create_tables(conn):
                 endereco TEXT
             );
         """)
-        # Adicionar novas colunas à tabela beneficiarios se não existirem
-        cursor.execute("""
-            ALTER TABLE beneficiarios ADD COLUMN alimento_necessidade_1 TEXT;
-        """)
-        cursor.execute("""
-            ALTER TABLE beneficiarios ADD COLUMN alimento_necessidade_2 TEXT;
-        """)
-        cursor.execute("""
-            ALTER TABLE beneficiarios ADD COLUMN alimento_necessidade_3 TEXT;
-        """)
         # Tabela Itens
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS itens (
@@ -80,15 +77,802 @@ def create_tables(conn):
         """)
         conn.commit()
     except sqlite3.Error as e:
-        # Ignorar erros se a coluna já existe
-        if "duplicate column name" not in str(e):
-            print(e)
+        print(e)
+        return
+    apply_migrations(conn)
+
+def get_schema_version(conn):
+    """ Retorna a versão do esquema gravada em PRAGMA user_version """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn):
+    """ Aplica, em ordem, as migrações com número maior que PRAGMA user_version.
+
+    Cada migração roda em sua própria transação junto com a atualização de
+    user_version, de modo que é aplicada exatamente uma vez. Em caso de erro a
+    migração é desfeita e as seguintes não são aplicadas.
+    """
+    current_version = get_schema_version(conn)
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version:d}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Erro ao aplicar a migração {version} ({description}): {e}")
+            return False
+    return True
+
+def _migration_beneficiary_needs(cursor):
+    """ Adiciona os campos de alimentos necessários à tabela beneficiarios """
+    cursor.execute("PRAGMA table_info(beneficiarios)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    # Bancos antigos podem já ter as colunas, adicionadas antes do controle de versão
+    for column in ("alimento_necessidade_1", "alimento_necessidade_2", "alimento_necessidade_3"):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE beneficiarios ADD COLUMN {column} TEXT")
+
+def _migration_stock_ledger(cursor):
+    """ Cria a tabela saldo_estoque e os triggers que a mantêm atualizada.
+
+    O saldo de cada item é ajustado pelos triggers na mesma transação de cada
+    INSERT/UPDATE/DELETE em doacoes_recebidas e doacoes_realizadas. O saldo
+    inicial é reconstruído a partir do histórico.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS saldo_estoque (
+            id_item INTEGER PRIMARY KEY,
+            quantidade REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (id_item) REFERENCES itens (id_item)
+        );
+    """)
+    # Entradas somam ao saldo
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_recebida_insert
+        AFTER INSERT ON doacoes_recebidas
+        BEGIN
+            INSERT INTO saldo_estoque (id_item, quantidade) VALUES (NEW.id_item, NEW.quantidade)
+            ON CONFLICT(id_item) DO UPDATE SET quantidade = quantidade + excluded.quantidade;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_recebida_update
+        AFTER UPDATE OF id_item, quantidade ON doacoes_recebidas
+        BEGIN
+            UPDATE saldo_estoque SET quantidade = quantidade - OLD.quantidade WHERE id_item = OLD.id_item;
+            INSERT INTO saldo_estoque (id_item, quantidade) VALUES (NEW.id_item, NEW.quantidade)
+            ON CONFLICT(id_item) DO UPDATE SET quantidade = quantidade + excluded.quantidade;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_recebida_delete
+        AFTER DELETE ON doacoes_recebidas
+        BEGIN
+            UPDATE saldo_estoque SET quantidade = quantidade - OLD.quantidade WHERE id_item = OLD.id_item;
+        END;
+    """)
+    # Saídas subtraem do saldo
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_realizada_insert
+        AFTER INSERT ON doacoes_realizadas
+        BEGIN
+            INSERT INTO saldo_estoque (id_item, quantidade) VALUES (NEW.id_item, -NEW.quantidade)
+            ON CONFLICT(id_item) DO UPDATE SET quantidade = quantidade + excluded.quantidade;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_realizada_update
+        AFTER UPDATE OF id_item, quantidade ON doacoes_realizadas
+        BEGIN
+            UPDATE saldo_estoque SET quantidade = quantidade + OLD.quantidade WHERE id_item = OLD.id_item;
+            INSERT INTO saldo_estoque (id_item, quantidade) VALUES (NEW.id_item, -NEW.quantidade)
+            ON CONFLICT(id_item) DO UPDATE SET quantidade = quantidade + excluded.quantidade;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_saldo_realizada_delete
+        AFTER DELETE ON doacoes_realizadas
+        BEGIN
+            UPDATE saldo_estoque SET quantidade = quantidade + OLD.quantidade WHERE id_item = OLD.id_item;
+        END;
+    """)
+    _rebuild_stock_balance(cursor)
+
+def _migration_query_indexes(cursor):
+    """ Cria os índices usados pelas consultas de models.py """
+    # Item.get_by_name_brand_unit e Item.get_by_name_brand (prefixo do índice)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_itens_nome_marca_unidade ON itens (nome_item, marca, unidade)")
+    # Consultas por item e agrupamento por lote (id_item, data_validade)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_recebidas_item_validade ON doacoes_recebidas (id_item, data_validade)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_realizadas_item ON doacoes_realizadas (id_item)")
+    # Filtros por faixa de datas (vencimento, recebimento e doação)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_recebidas_validade ON doacoes_recebidas (data_validade)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_recebidas_recebimento ON doacoes_recebidas (data_recebimento)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_realizadas_data ON doacoes_realizadas (data_doacao)")
+    # Chaves estrangeiras usadas nos JOINs com doadores e beneficiarios
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_recebidas_doador ON doacoes_recebidas (id_doador)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doacoes_realizadas_beneficiario ON doacoes_realizadas (id_beneficiario)")
+
+def _migration_stock_lots(cursor):
+    """ Cria os lotes (um por doação recebida) e as alocações FEFO das doações realizadas.
+
+    Os triggers mantêm os lotes ao inserir, alterar ou excluir doações recebidas
+    e devolvem as alocações ao excluir uma doação realizada. A alocação de novas
+    doações realizadas é feita por models.allocate_fefo. O histórico existente é
+    reprocessado em ordem de registro.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lotes (
+            id_lote INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_doacao_recebida INTEGER NOT NULL UNIQUE,
+            id_item INTEGER NOT NULL,
+            data_validade TEXT NOT NULL,
+            quantidade_restante REAL NOT NULL,
+            FOREIGN KEY (id_doacao_recebida) REFERENCES doacoes_recebidas (id_doacao_recebida),
+            FOREIGN KEY (id_item) REFERENCES itens (id_item)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alocacoes_lote (
+            id_alocacao INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_doacao_realizada INTEGER NOT NULL,
+            id_lote INTEGER NOT NULL,
+            quantidade REAL NOT NULL,
+            FOREIGN KEY (id_doacao_realizada) REFERENCES doacoes_realizadas (id_doacao_realizada),
+            FOREIGN KEY (id_lote) REFERENCES lotes (id_lote)
+        );
+    """)
+    # Lotes com saldo por item, já na ordem de consumo (validade, id_lote)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lotes_disponiveis ON lotes (id_item, data_validade) WHERE quantidade_restante > 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alocacoes_lote_realizada ON alocacoes_lote (id_doacao_realizada)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alocacoes_lote_lote ON alocacoes_lote (id_lote)")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_insert
+        AFTER INSERT ON doacoes_recebidas
+        BEGIN
+            INSERT INTO lotes (id_doacao_recebida, id_item, data_validade, quantidade_restante)
+            VALUES (NEW.id_doacao_recebida, NEW.id_item, NEW.data_validade, NEW.quantidade);
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_update
+        AFTER UPDATE OF id_item, quantidade, data_validade ON doacoes_recebidas
+        BEGIN
+            UPDATE lotes SET
+                id_item = NEW.id_item,
+                data_validade = NEW.data_validade,
+                quantidade_restante = quantidade_restante + NEW.quantidade - OLD.quantidade
+            WHERE id_doacao_recebida = NEW.id_doacao_recebida;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_delete
+        AFTER DELETE ON doacoes_recebidas
+        BEGIN
+            DELETE FROM alocacoes_lote WHERE id_lote IN (
+                SELECT id_lote FROM lotes WHERE id_doacao_recebida = OLD.id_doacao_recebida
+            );
+            DELETE FROM lotes WHERE id_doacao_recebida = OLD.id_doacao_recebida;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_realizada_delete
+        AFTER DELETE ON doacoes_realizadas
+        BEGIN
+            UPDATE lotes SET quantidade_restante = quantidade_restante + (
+                SELECT SUM(a.quantidade) FROM alocacoes_lote a
+                WHERE a.id_lote = lotes.id_lote AND a.id_doacao_realizada = OLD.id_doacao_realizada
+            )
+            WHERE id_lote IN (SELECT id_lote FROM alocacoes_lote WHERE id_doacao_realizada = OLD.id_doacao_realizada);
+            DELETE FROM alocacoes_lote WHERE id_doacao_realizada = OLD.id_doacao_realizada;
+        END;
+    """)
+    cursor.execute("""
+        INSERT INTO lotes (id_doacao_recebida, id_item, data_validade, quantidade_restante)
+        SELECT id_doacao_recebida, id_item, data_validade, quantidade FROM doacoes_recebidas
+        ORDER BY id_doacao_recebida
+    """)
+    cursor.execute("SELECT id_doacao_realizada, id_item, quantidade FROM doacoes_realizadas ORDER BY id_doacao_realizada")
+    for id_doacao_realizada, id_item, quantidade in cursor.fetchall():
+        # Saídas antigas além do que havia em lotes ficam apenas parcialmente alocadas
+        allocate_fefo(cursor, id_doacao_realizada, id_item, quantidade, None)
+
+def _migration_full_text_search(cursor):
+    """ Cria índices FTS5 (external content) de doadores, beneficiários e itens.
+
+    O tokenizador unicode61 com remove_diacritics 2 ignora acentos e
+    maiúsculas ("Joao" encontra "João"); os índices de prefixo (1 a 6
+    caracteres) evitam juntar as listas de todos os termos que começam com o
+    texto digitado nas buscas por início de palavra. Os triggers mantêm o índice a cada INSERT, UPDATE e
+    DELETE na tabela de conteúdo, e o 'rebuild' indexa os registros existentes.
+    """
+    for table, (fts_table, id_column, columns) in FTS_TABLES.items():
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {column_list},
+                content='{table}', content_rowid='{id_column}',
+                tokenize='unicode61 remove_diacritics 2', prefix='1 2 3 4 5 6'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{id_column}, {new_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{id_column}, {old_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{id_column}, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{id_column}, {new_values});
+            END
+        """)
+        cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+def _migration_expiry_index(cursor):
+    """ Índice parcial por validade dos lotes com saldo, usado pelos alertas de vencimento """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lotes_validade_disponiveis ON lotes (data_validade) WHERE quantidade_restante > 0")
+
+# Colunas de movimentacao_diaria alimentadas por cada tabela de doações: (coluna de data, quantidade, contagem)
+DAILY_FLOW_SOURCES = {
+    'doacoes_recebidas': ('data_recebimento', 'quantidade_recebida', 'entradas'),
+    'doacoes_realizadas': ('data_doacao', 'quantidade_distribuida', 'saidas'),
+}
+
+def _migration_daily_flow(cursor):
+    """ Cria movimentacao_diaria (entradas e saídas por dia e item) e os triggers que a mantêm.
+
+    Cada INSERT/UPDATE/DELETE em doacoes_recebidas e doacoes_realizadas ajusta
+    a linha (dia, id_item) correspondente na mesma transação; linhas sem
+    nenhuma doação são removidas. Os relatórios por período
+    (MovimentacaoDiaria.get_flow_report) somam essas linhas em vez das doações.
+    O histórico existente é consolidado ao criar a tabela.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movimentacao_diaria (
+            dia TEXT NOT NULL,
+            id_item INTEGER NOT NULL,
+            quantidade_recebida REAL NOT NULL DEFAULT 0,
+            quantidade_distribuida REAL NOT NULL DEFAULT 0,
+            entradas INTEGER NOT NULL DEFAULT 0,
+            saidas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, id_item),
+            FOREIGN KEY (id_item) REFERENCES itens (id_item)
+        ) WITHOUT ROWID;
+    """)
+    for table, (date_column, quantity_column, count_column) in DAILY_FLOW_SOURCES.items():
+        # Datas fora do formato ISO ficam com o texto original em vez de impedir a gravação
+        new_day = f"COALESCE(date(NEW.{date_column}), NEW.{date_column})"
+        old_day = f"COALESCE(date(OLD.{date_column}), OLD.{date_column})"
+        add_new = f"""
+            INSERT INTO movimentacao_diaria (dia, id_item, {quantity_column}, {count_column})
+            VALUES ({new_day}, NEW.id_item, NEW.quantidade, 1)
+            ON CONFLICT(dia, id_item) DO UPDATE SET
+                {quantity_column} = {quantity_column} + excluded.{quantity_column},
+                {count_column} = {count_column} + 1;
+        """
+        remove_old = f"""
+            UPDATE movimentacao_diaria SET
+                {quantity_column} = {quantity_column} - OLD.quantidade,
+                {count_column} = {count_column} - 1
+            WHERE dia = {old_day} AND id_item = OLD.id_item;
+            DELETE FROM movimentacao_diaria
+            WHERE dia = {old_day} AND id_item = OLD.id_item AND entradas = 0 AND saidas = 0;
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacao_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN {add_new} END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacao_{table}_update
+            AFTER UPDATE OF id_item, quantidade, {date_column} ON {table}
+            BEGIN {add_new} {remove_old} END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacao_{table}_delete
+            AFTER DELETE ON {table}
+            BEGIN {remove_old} END;
+        """)
+    _rebuild_daily_flow(cursor)
+
+def _migration_data_version(cursor):
+    """ Cria versao_dados: um contador por tabela de doações, incrementado pelos triggers.
+
+    O contador muda quando uma doação é alterada ou excluída, ou inserida com
+    id menor que o maior existente. Inserções comuns (id crescente) não o
+    alteram: quem guarda cópias das doações (analytics.py) lê só as linhas
+    com id maior que o último que já tem.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS versao_dados (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    for table, id_column in (('doacoes_recebidas', 'id_doacao_recebida'), ('doacoes_realizadas', 'id_doacao_realizada')):
+        cursor.execute("INSERT OR IGNORE INTO versao_dados (tabela, versao) VALUES (?, 0)", (table,))
+        bump = f"UPDATE versao_dados SET versao = versao + 1 WHERE tabela = '{table}';"
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_versao_{table}_insert
+            AFTER INSERT ON {table}
+            WHEN NEW.{id_column} < (SELECT MAX({id_column}) FROM {table})
+            BEGIN {bump} END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_versao_{table}_update
+            AFTER UPDATE ON {table}
+            BEGIN {bump} END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_versao_{table}_delete
+            AFTER DELETE ON {table}
+            BEGIN {bump} END;
+        """)
+
+def _migration_available_lots_covering_index(cursor):
+    """ Troca idx_lotes_disponiveis por um índice que também cobre quantidade_restante.
+
+    Com id_lote na chave a ordem FEFO (data_validade, id_lote) continua vindo do
+    índice, e as somas e leituras de saldo dos lotes (allocate_fefo,
+    get_available_quantity, get_all_stock_items, previsão de esgotamento) não
+    precisam mais ler a tabela.
+    """
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_lotes_disponiveis_saldo
+        ON lotes (id_item, data_validade, id_lote, quantidade_restante) WHERE quantidade_restante > 0
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_lotes_disponiveis")
+
+def _migration_beneficiary_needs_table(cursor):
+    """ Cria necessidades_beneficiario: uma linha por alimento necessário (1 a 3) de cada beneficiário.
+
+    Os triggers copiam alimento_necessidade_1..3 (sem espaços nas pontas;
+    campos vazios não geram linha) a cada INSERT/UPDATE/DELETE em
+    beneficiarios. O índice por alimento responde "quem precisa de X" sem
+    percorrer os beneficiários.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS necessidades_beneficiario (
+            id_beneficiario INTEGER NOT NULL,
+            prioridade INTEGER NOT NULL,
+            alimento TEXT NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (id_beneficiario, prioridade),
+            FOREIGN KEY (id_beneficiario) REFERENCES beneficiarios (id_beneficiario)
+        ) WITHOUT ROWID;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_necessidades_alimento ON necessidades_beneficiario (alimento)")
+    copy_needs = """
+        INSERT INTO necessidades_beneficiario (id_beneficiario, prioridade, alimento)
+        SELECT NEW.id_beneficiario, prioridade, alimento FROM (
+            SELECT 1 AS prioridade, trim(NEW.alimento_necessidade_1) AS alimento
+            UNION ALL SELECT 2, trim(NEW.alimento_necessidade_2)
+            UNION ALL SELECT 3, trim(NEW.alimento_necessidade_3)
+        ) WHERE alimento IS NOT NULL AND alimento != '';
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_necessidades_insert
+        AFTER INSERT ON beneficiarios
+        BEGIN {copy_needs} END;
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_necessidades_update
+        AFTER UPDATE OF alimento_necessidade_1, alimento_necessidade_2, alimento_necessidade_3 ON beneficiarios
+        BEGIN
+            DELETE FROM necessidades_beneficiario WHERE id_beneficiario = OLD.id_beneficiario;
+            {copy_needs}
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_necessidades_delete
+        AFTER DELETE ON beneficiarios
+        BEGIN
+            DELETE FROM necessidades_beneficiario WHERE id_beneficiario = OLD.id_beneficiario;
+        END;
+    """)
+    cursor.execute("""
+        INSERT INTO necessidades_beneficiario (id_beneficiario, prioridade, alimento)
+        SELECT id_beneficiario, prioridade, alimento FROM (
+            SELECT id_beneficiario, 1 AS prioridade, trim(alimento_necessidade_1) AS alimento FROM beneficiarios
+            UNION ALL SELECT id_beneficiario, 2, trim(alimento_necessidade_2) FROM beneficiarios
+            UNION ALL SELECT id_beneficiario, 3, trim(alimento_necessidade_3) FROM beneficiarios
+        ) WHERE alimento IS NOT NULL AND alimento != ''
+    """)
+
+def _migration_item_dimensions(cursor):
+    """ Cria as dimensões tipos_alimento, marcas e unidades e liga itens a elas por IDs inteiros.
+
+    Cada dimensão guarda o nome exibido e a chave normalizada (normalize_key),
+    única. Itens com as três chaves iguais ("Arroz", "arroz " e "ARROZ" da
+    mesma marca e unidade) são fundidos no de menor id_item: as doações passam
+    para ele, levando junto lotes, saldo e movimentação pelos triggers, e os
+    demais são excluídos. As colunas de texto de itens passam a guardar o nome
+    da dimensão (a grafia do item mais antigo). Os triggers trg_itens_dimensoes_*
+    impedem gravar itens sem os três IDs (ver models.resolve_item_columns).
+    """
+    cursor.execute("PRAGMA table_info(itens)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for table, id_column in ITEM_DIMENSIONS.values():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {id_column} INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome TEXT NOT NULL,
+                chave TEXT NOT NULL UNIQUE
+            );
+        """)
+        if id_column not in existing_columns:
+            cursor.execute(f"ALTER TABLE itens ADD COLUMN {id_column} INTEGER REFERENCES {table} ({id_column})")
+
+    cursor.execute("SELECT id_item, nome_item, marca, unidade FROM itens ORDER BY id_item")
+    survivors = {}
+    updates = []
+    merged = []
+    for id_item, *texts in cursor.fetchall():
+        # As colunas de conversão de unidades só existem a partir da migração 12
+        item = resolve_item_columns(cursor, dict(zip(ITEM_DIMENSIONS, texts)), convert_units=False)
+        key = (item['id_tipo'], item['id_marca'], item['id_unidade'])
+        if key in survivors:
+            merged.append((survivors[key], id_item))
+            continue
+        survivors[key] = id_item
+        updates.append((item['nome_item'], item['marca'], item['unidade'], *key, id_item))
+    cursor.executemany("""
+        UPDATE itens SET nome_item = ?, marca = ?, unidade = ?, id_tipo = ?, id_marca = ?, id_unidade = ?
+        WHERE id_item = ?
+    """, updates)
+    for table in ('doacoes_recebidas', 'doacoes_realizadas'):
+        cursor.executemany(f"UPDATE {table} SET id_item = ? WHERE id_item = ?", merged)
+    duplicates = [(duplicate,) for _, duplicate in merged]
+    cursor.executemany("DELETE FROM saldo_estoque WHERE id_item = ?", duplicates)
+    cursor.executemany("DELETE FROM itens WHERE id_item = ?", duplicates)
+
+    # Busca por (tipo, marca, unidade) e, pelo prefixo, por (tipo, marca)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_itens_dimensoes ON itens (id_tipo, id_marca, id_unidade)")
+    # Estoque agrupado por tipo e unidade: percorre o índice já na ordem do GROUP BY (id_item vem no índice)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_itens_tipo_unidade ON itens (id_tipo, id_unidade)")
+    cursor.execute("DROP INDEX IF EXISTS idx_itens_nome_marca_unidade")
+    missing_ids = " OR ".join(f"NEW.{id_column} IS NULL" for _, id_column in ITEM_DIMENSIONS.values())
+    guard = "SELECT RAISE(ABORT, 'item sem tipo de alimento, marca ou unidade (use models.resolve_item_columns)');"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_itens_dimensoes_insert
+        BEFORE INSERT ON itens WHEN {missing_ids}
+        BEGIN {guard} END;
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_itens_dimensoes_update
+        BEFORE UPDATE OF {", ".join(id_column for _, id_column in ITEM_DIMENSIONS.values())} ON itens WHEN {missing_ids}
+        BEGIN {guard} END;
+    """)
+
+# Tabelas de doações e suas colunas de ID (triggers de quantidade_canonica e de versao_dados)
+DONATION_TABLES = {
+    'doacoes_recebidas': 'id_doacao_recebida',
+    'doacoes_realizadas': 'id_doacao_realizada',
+}
+
+def _migration_unit_conversion(cursor):
+    """ Converte as quantidades para a unidade base de cada grandeza (kg, L ou un).
+
+    unidades ganha grandeza, id_unidade_base e fator (models.UNIT_REGISTRY:
+    500 g = 0,5 kg); as unidades fora da tabela são a própria base. As doações
+    ganham quantidade_canonica = quantidade * fator da unidade do item,
+    preenchida pelos triggers ao gravar e recalculada quando o item muda de
+    unidade ou o fator muda. O trigger de versao_dados deixa de contar o
+    preenchimento de quantidade_canonica logo após um INSERT, para que as
+    inserções continuem sem invalidar as cópias das doações (analytics.py).
+    """
+    cursor.execute("PRAGMA table_info(unidades)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, definition in (('grandeza', "TEXT"),
+                               ('id_unidade_base', "INTEGER REFERENCES unidades (id_unidade)"),
+                               ('fator', "REAL NOT NULL DEFAULT 1")):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE unidades ADD COLUMN {column} {definition}")
+    cursor.execute("SELECT id_unidade, chave FROM unidades ORDER BY id_unidade")
+    for id_unidade, key in cursor.fetchall():
+        set_unit_conversion(cursor, id_unidade, key)
+
+    item_factor = "(SELECT u.fator FROM itens i JOIN unidades u ON u.id_unidade = i.id_unidade WHERE i.id_item = {0}.id_item)"
+    for table, id_column in DONATION_TABLES.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'quantidade_canonica' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN quantidade_canonica REAL")
+        fill = f"""
+            UPDATE {table} SET quantidade_canonica = NEW.quantidade * {item_factor.format('NEW')}
+            WHERE {id_column} = NEW.{id_column};
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_canonica_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN {fill} END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_canonica_{table}_update
+            AFTER UPDATE OF id_item, quantidade ON {table}
+            BEGIN {fill} END;
+        """)
+        # Só o preenchimento que segue o INSERT (quantidade_canonica nula -> valor, nada mais muda)
+        # deixa de incrementar a versão; recálculos por mudança de unidade ou fator continuam contando
+        unchanged = " AND ".join(f"OLD.{column} IS NEW.{column}" for column in columns if column != 'quantidade_canonica')
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_versao_{table}_update")
+        cursor.execute(f"""
+            CREATE TRIGGER trg_versao_{table}_update
+            AFTER UPDATE ON {table}
+            WHEN NOT (OLD.quantidade_canonica IS NULL AND NEW.quantidade_canonica IS NOT NULL AND {unchanged})
+            BEGIN UPDATE versao_dados SET versao = versao + 1 WHERE tabela = '{table}'; END;
+        """)
+        cursor.execute(f"UPDATE {table} SET quantidade_canonica = quantidade * {item_factor.format(table)}")
+
+    recompute_item = "".join(f"""
+        UPDATE {table} SET quantidade_canonica = quantidade * (SELECT fator FROM unidades WHERE id_unidade = NEW.id_unidade)
+        WHERE id_item = NEW.id_item;""" for table in DONATION_TABLES)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_canonica_itens_update
+        AFTER UPDATE OF id_unidade ON itens
+        BEGIN {recompute_item} END;
+    """)
+    recompute_unit = "".join(f"""
+        UPDATE {table} SET quantidade_canonica = quantidade * NEW.fator
+        WHERE id_item IN (SELECT id_item FROM itens WHERE id_unidade = NEW.id_unidade);""" for table in DONATION_TABLES)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_canonica_unidades_update
+        AFTER UPDATE OF fator ON unidades WHEN OLD.fator IS NOT NEW.fator
+        BEGIN {recompute_unit} END;
+    """)
+
+def _migration_stock_snapshots(cursor):
+    """ Cria retratos_saldo: o saldo de cada item ao fim de dias passados (fins de mês, por exemplo).
+
+    Os retratos são gravados por RetratoSaldo.refresh_snapshots (em segundo plano
+    na interface, ver stock_snapshots.py); RetratoSaldo.get_stock_as_of parte do
+    retrato mais próximo e aplica só as linhas de movimentacao_diaria entre ele
+    e a data pedida. Uma doação gravada, alterada ou excluída com data até um
+    retrato o torna inválido: os triggers de movimentacao_diaria apagam os
+    retratos a partir daquele dia, que são refeitos na próxima atualização.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS retratos_saldo (
+            dia TEXT PRIMARY KEY,
+            gerado_em TEXT NOT NULL
+        );
+    """)
+    # Só itens com saldo diferente de zero; a chave (dia, id_item) dá o retrato inteiro de um dia
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS retratos_saldo_itens (
+            dia TEXT NOT NULL,
+            id_item INTEGER NOT NULL,
+            quantidade REAL NOT NULL,
+            PRIMARY KEY (dia, id_item),
+            FOREIGN KEY (dia) REFERENCES retratos_saldo (dia),
+            FOREIGN KEY (id_item) REFERENCES itens (id_item)
+        ) WITHOUT ROWID;
+    """)
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_retratos_{event.lower()}
+            AFTER {event} ON movimentacao_diaria
+            WHEN EXISTS (SELECT 1 FROM retratos_saldo WHERE dia >= {row}.dia)
+            BEGIN
+                DELETE FROM retratos_saldo_itens WHERE dia >= {row}.dia;
+                DELETE FROM retratos_saldo WHERE dia >= {row}.dia;
+            END;
+        """)
+
+def _migration_lot_update_guards(cursor):
+    """ Impede alterações de doações recebidas que desencontrariam o lote das suas alocações.
+
+    trg_lote_recebida_update ajusta o lote pela diferença de quantidade e leva
+    o lote para o novo item, mas as alocações continuam onde estavam: baixar a
+    quantidade abaixo do que já foi distribuído deixaria quantidade_restante
+    negativa, e trocar o item de um lote já consumido poria as saídas do item
+    antigo no lote do novo. Nos dois casos a alteração é recusada; exclua ou
+    ajuste antes as doações realizadas que consumiram o lote.
+    """
+    allocated = """(SELECT COALESCE(SUM(a.quantidade), 0) FROM alocacoes_lote a
+                     JOIN lotes l ON l.id_lote = a.id_lote
+                     WHERE l.id_doacao_recebida = NEW.id_doacao_recebida)"""
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_quantidade_guard
+        BEFORE UPDATE OF quantidade ON doacoes_recebidas
+        WHEN NEW.quantidade < OLD.quantidade AND NEW.quantidade < {allocated} - {LOT_EPSILON}
+        BEGIN SELECT RAISE(ABORT, 'quantidade menor que a já distribuída deste lote'); END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_item_guard
+        BEFORE UPDATE OF id_item ON doacoes_recebidas
+        WHEN NEW.id_item IS NOT OLD.id_item AND EXISTS (
+            SELECT 1 FROM alocacoes_lote a JOIN lotes l ON l.id_lote = a.id_lote
+            WHERE l.id_doacao_recebida = NEW.id_doacao_recebida
+        )
+        BEGIN SELECT RAISE(ABORT, 'o lote desta doação já foi distribuído; não é possível trocar o item'); END;
+    """)
+
+def _migration_package_units(cursor):
+    """ Converte as unidades de embalagem já gravadas ("5kg", "500g", "1L").
+
+    Até aqui elas ficavam fora de UNIT_REGISTRY, como base de si mesmas com
+    fator 1; agora valem o número vezes o fator da unidade (models.unit_conversion).
+    O trigger trg_canonica_unidades_update recalcula quantidade_canonica das
+    doações dos itens nessas unidades.
+    """
+    cursor.execute("SELECT id_unidade, chave FROM unidades WHERE grandeza IS NULL ORDER BY id_unidade")
+    for id_unidade, key in cursor.fetchall():
+        if unit_conversion(key)[0] is not None:
+            set_unit_conversion(cursor, id_unidade, key)
+
+def _migration_lot_delete_guard(cursor):
+    """ Impede excluir uma doação recebida cujo lote já foi distribuído.
+
+    trg_lote_recebida_delete apaga o lote e as alocações, mas as doações
+    realizadas continuam descontadas em saldo_estoque: o saldo ficaria menor
+    que a soma dos lotes e o FEFO entregaria quantidades que já saíram. A
+    exclusão é recusada; exclua antes as doações realizadas que consumiram o lote.
+    """
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lote_recebida_delete_guard
+        BEFORE DELETE ON doacoes_recebidas
+        WHEN EXISTS (
+            SELECT 1 FROM alocacoes_lote a JOIN lotes l ON l.id_lote = a.id_lote
+            WHERE l.id_doacao_recebida = OLD.id_doacao_recebida
+        )
+        BEGIN SELECT RAISE(ABORT, 'o lote desta doação já foi distribuído; não é possível excluí-la'); END;
+    """)
+
+# Migrações numeradas: (versão, descrição, função que recebe o cursor).
+# Nunca altere uma migração já publicada; acrescente uma nova ao final.
+MIGRATIONS = [
+    (1, "campos de alimentos necessários em beneficiarios", _migration_beneficiary_needs),
+    (2, "saldo de estoque materializado", _migration_stock_ledger),
+    (3, "índices das consultas de models.py", _migration_query_indexes),
+    (4, "lotes e alocação FEFO", _migration_stock_lots),
+    (5, "busca textual (FTS5) em doadores, beneficiários e itens", _migration_full_text_search),
+    (6, "índice de validade dos lotes com saldo", _migration_expiry_index),
+    (7, "movimentação diária de entradas e saídas", _migration_daily_flow),
+    (8, "contador de versão das doações", _migration_data_version),
+    (9, "índice de cobertura dos lotes com saldo", _migration_available_lots_covering_index),
+    (10, "tabela de alimentos necessários dos beneficiários", _migration_beneficiary_needs_table),
+    (11, "dimensões de tipo de alimento, marca e unidade dos itens", _migration_item_dimensions),
+    (12, "conversão de unidades e quantidade canônica das doações", _migration_unit_conversion),
+    (13, "retratos periódicos do saldo de estoque", _migration_stock_snapshots),
+    (14, "proteção dos lotes já distribuídos ao alterar doações recebidas", _migration_lot_update_guards),
+    (15, "conversão das unidades de embalagem", _migration_package_units),
+    (16, "proteção dos lotes já distribuídos ao excluir doações recebidas", _migration_lot_delete_guard),
+]
+
+def _rebuild_stock_balance(cursor):
+    cursor.execute("DELETE FROM saldo_estoque")
+    cursor.execute("""
+        INSERT INTO saldo_estoque (id_item, quantidade)
+        SELECT id_item, SUM(quantidade) FROM (
+            SELECT id_item, quantidade FROM doacoes_recebidas
+            UNION ALL
+            SELECT id_item, -quantidade FROM doacoes_realizadas
+        )
+        GROUP BY id_item
+    """)
+
+def rebuild_stock_balance(conn):
+    """ Recalcula saldo_estoque do zero a partir das somas brutas das doações """
+    try:
+        _rebuild_stock_balance(conn.cursor())
+        conn.commit()
+        invalidate_cached_reads(conn, 'saldo_estoque')
+        return True
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao reconstruir o saldo de estoque: {e}")
+        return False
+
+# Movimentação diária calculada a partir das doações (mesmas colunas de movimentacao_diaria)
+DAILY_FLOW_FROM_DONATIONS = """
+    SELECT dia, id_item, SUM(quantidade_recebida) AS quantidade_recebida, SUM(quantidade_distribuida) AS quantidade_distribuida,
+           SUM(entradas) AS entradas, SUM(saidas) AS saidas
+    FROM (
+        SELECT COALESCE(date(data_recebimento), data_recebimento) AS dia, id_item,
+               quantidade AS quantidade_recebida, 0 AS quantidade_distribuida, 1 AS entradas, 0 AS saidas
+        FROM doacoes_recebidas
+        UNION ALL
+        SELECT COALESCE(date(data_doacao), data_doacao), id_item, 0, quantidade, 0, 1
+        FROM doacoes_realizadas
+    )
+    GROUP BY dia, id_item
+"""
+
+def _rebuild_daily_flow(cursor):
+    cursor.execute("DELETE FROM movimentacao_diaria")
+    cursor.execute(f"""
+        INSERT INTO movimentacao_diaria (dia, id_item, quantidade_recebida, quantidade_distribuida, entradas, saidas)
+        {DAILY_FLOW_FROM_DONATIONS}
+    """)
+
+def rebuild_daily_flow(conn):
+    """ Recalcula movimentacao_diaria do zero a partir do histórico de doações """
+    try:
+        _rebuild_daily_flow(conn.cursor())
+        conn.commit()
+        invalidate_cached_reads(conn, 'movimentacao_diaria')
+        return True
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao reconstruir a movimentação diária: {e}")
+        return False
+
+def check_daily_flow(conn):
+    """ Compara movimentacao_diaria com as doações; retorna as linhas (dia, id_item) divergentes """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT dia, id_item FROM (
+            SELECT dia, id_item, quantidade_recebida, quantidade_distribuida, entradas, saidas FROM movimentacao_diaria
+            UNION ALL
+            SELECT dia, id_item, -quantidade_recebida, -quantidade_distribuida, -entradas, -saidas FROM ({DAILY_FLOW_FROM_DONATIONS})
+        )
+        GROUP BY dia, id_item
+        HAVING ABS(SUM(quantidade_recebida)) > ? OR ABS(SUM(quantidade_distribuida)) > ? OR SUM(entradas) != 0 OR SUM(saidas) != 0
+    """, (STOCK_BALANCE_TOLERANCE, STOCK_BALANCE_TOLERANCE))
+    return [{"dia": row[0], "id_item": row[1]} for row in cursor.fetchall()]
+
+def check_stock_balance(conn):
+    """ Compara saldo_estoque com as somas brutas das doações.
+
+    Retorna a lista de divergências como dicionários com id_item, saldo
+    (valor materializado) e esperado (recebido - realizado). Lista vazia
+    significa que o saldo está consistente.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id_item, SUM(saldo) AS saldo, SUM(esperado) AS esperado FROM (
+            SELECT id_item, quantidade AS saldo, 0 AS esperado FROM saldo_estoque
+            UNION ALL
+            SELECT id_item, 0, quantidade FROM doacoes_recebidas
+            UNION ALL
+            SELECT id_item, 0, -quantidade FROM doacoes_realizadas
+        )
+        GROUP BY id_item
+        HAVING ABS(SUM(saldo) - SUM(esperado)) > ?
+    """, (STOCK_BALANCE_TOLERANCE,))
+    return [{"id_item": row[0], "saldo": row[1], "esperado": row[2]} for row in cursor.fetchall()]
 
 if __name__ == '__main__':
     database = "estoque_doacoes.db"
     conn = create_connection(database)
     if conn:
         create_tables(conn)
+        if "--rebuild-saldo" in sys.argv:
+            if rebuild_stock_balance(conn):
+                print("Saldo de estoque reconstruído a partir do histórico.")
+        if "--check-saldo" in sys.argv:
+            divergencias = check_stock_balance(conn)
+            for d in divergencias:
+                print(f"Item {d['id_item']}: saldo {d['saldo']:.4f}, esperado {d['esperado']:.4f}")
+            if divergencias:
+                print(f"{len(divergencias)} item(ns) com saldo divergente. Use --rebuild-saldo para corrigir.")
+            else:
+                print("Saldo de estoque consistente com o histórico.")
+        if "--rebuild-movimentacao" in sys.argv:
+            if rebuild_daily_flow(conn):
+                print("Movimentação diária reconstruída a partir do histórico.")
+        if "--check-movimentacao" in sys.argv:
+            divergencias = check_daily_flow(conn)
+            for d in divergencias[:20]:
+                print(f"Dia {d['dia']}, item {d['id_item']}: movimentação diferente das doações")
+            if divergencias:
+                print(f"{len(divergencias)} dia(s)/item(ns) divergente(s). Use --rebuild-movimentacao para corrigir.")
+            else:
+                print("Movimentação diária consistente com o histórico.")
         conn.close()
         print(f"Banco de dados \'{database}\' e tabelas criadas com sucesso.")
     else:
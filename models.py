@@ -1,13 +1,376 @@
+import queue
+import re
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+from query_trace import TracedCursor, active_tracer
+from validators import normalize_key
 
 DATABASE = 'estoque_doacoes.db'
 
-def get_db_connection(db_file):
-    conn = sqlite3.connect(db_file)
+# Quantidades restantes menores que isso são tratadas como lote esgotado
+LOT_EPSILON = 1e-9
+# Lotes lidos por vez na alocação FEFO
+FEFO_BATCH = 16
+
+# Linhas lidas por fetchmany nos métodos iter_*
+DEFAULT_FETCH_SIZE = 500
+# Busca textual (FTS5, migração 5): tabela -> (índice FTS, coluna de ID, colunas indexadas).
+# A primeira coluna é a do nome, usada na ordenação por relevância.
+FTS_TABLES = {
+    'doadores': ('doadores_fts', 'id_doador', ('nome', 'endereco', 'email', 'telefone')),
+    'beneficiarios': ('beneficiarios_fts', 'id_beneficiario', (
+        'nome', 'alimento_necessidade_1', 'alimento_necessidade_2', 'alimento_necessidade_3',
+        'endereco', 'email', 'telefone')),
+    'itens': ('itens_fts', 'id_item', ('nome_item', 'marca', 'unidade')),
+}
+# Resultados de leitura guardados por conexão (ver QueryCache)
+QUERY_CACHE_SIZE = 256
+# Tabelas alteradas pelos triggers quando se grava em outra (saldo_estoque, lotes e alocações)
+TRIGGER_WRITES = {
+    'beneficiarios': ('necessidades_beneficiario',),
+    'itens': ('doacoes_recebidas', 'doacoes_realizadas'),
+    'doacoes_recebidas': ('saldo_estoque', 'lotes', 'alocacoes_lote', 'movimentacao_diaria', 'retratos_saldo'),
+    'doacoes_realizadas': ('saldo_estoque', 'lotes', 'alocacoes_lote', 'movimentacao_diaria', 'retratos_saldo'),
+}
+# Início de cada período dos relatórios de movimentação, a partir do dia (ISO); semanas começam na segunda-feira
+REPORT_PERIODS = {
+    'dia': "m.dia",
+    'semana': "date(m.dia, 'weekday 0', '-6 days')",
+    'mes': "date(m.dia, 'start of month')",
+}
+# Dimensões do catálogo (migração 11): coluna de texto de itens -> (tabela, coluna de ID em itens).
+# Cada valor é gravado uma vez, identificado pela chave normalize_key ("Arroz", " arroz" e
+# "ARROZ" são o mesmo tipo de alimento); as colunas de texto de itens guardam o nome da dimensão
+ITEM_DIMENSIONS = {
+    'nome_item': ('tipos_alimento', 'id_tipo'),
+    'marca': ('marcas', 'id_marca'),
+    'unidade': ('unidades', 'id_unidade'),
+}
+# Intervalo entre os retratos do saldo (migração 13): fim de cada semana (domingo) ou de cada mês
+SNAPSHOT_PERIODS = ('semana', 'mes')
+# Conversão de unidades (migração 12): chave normalize_key -> (grandeza, chave da unidade base, fator).
+# quantidade na unidade * fator = quantidade na unidade base da grandeza; unidades fora da
+# tabela (pacote, lata...) são a própria base, com fator 1 e sem grandeza
+UNIT_REGISTRY = {
+    'kg': ('massa', 'kg', 1.0), 'kilo': ('massa', 'kg', 1.0), 'quilo': ('massa', 'kg', 1.0),
+    'quilos': ('massa', 'kg', 1.0), 'quilograma': ('massa', 'kg', 1.0), 'quilogramas': ('massa', 'kg', 1.0),
+    'g': ('massa', 'kg', 0.001), 'gr': ('massa', 'kg', 0.001), 'grama': ('massa', 'kg', 0.001),
+    'gramas': ('massa', 'kg', 0.001), 'mg': ('massa', 'kg', 0.000001),
+    'l': ('volume', 'l', 1.0), 'lt': ('volume', 'l', 1.0), 'litro': ('volume', 'l', 1.0), 'litros': ('volume', 'l', 1.0),
+    'ml': ('volume', 'l', 0.001), 'mililitro': ('volume', 'l', 0.001), 'mililitros': ('volume', 'l', 0.001),
+    'un': ('contagem', 'un', 1.0), 'und': ('contagem', 'un', 1.0), 'unid': ('contagem', 'un', 1.0),
+    'unidade': ('contagem', 'un', 1.0), 'unidades': ('contagem', 'un', 1.0),
+    'duzia': ('contagem', 'un', 12.0), 'duzias': ('contagem', 'un', 12.0), 'dz': ('contagem', 'un', 12.0),
+}
+# Unidades de embalagem: um número inteiro seguido de uma unidade da tabela ("500g", "5 kg").
+# A chave não guarda vírgula nem ponto ("1,5 kg" vira "1 5 kg"), então decimais ficam de fora
+PACKAGE_UNIT = re.compile(r'(\d+) ?([a-z]+)')
+# Nome gravado para cada unidade base quando ela ainda não existe em unidades
+UNIT_BASE_NAMES = {'kg': 'kg', 'l': 'L', 'un': 'un'}
+# Unidades sugeridas no formulário de doação recebida (além das já usadas por algum item)
+UNIT_CHOICES = ('kg', 'g', 'L', 'mL', 'un', 'dúzia')
+
+# Configuração aplicada por get_db_connection; None mantém o padrão do SQLite.
+# busy_timeout em milissegundos; cache_size negativo é em KiB (convenção do SQLite)
+ConnectionProfile = namedtuple('ConnectionProfile', ['journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size'],
+                               defaults=(None, None, None, None, None))
+
+# Várias estações (ou threads) no mesmo arquivo: com WAL leitores não bloqueiam quem grava,
+# e quem encontra o banco ocupado espera até busy_timeout em vez de falhar na hora.
+# O WAL exige que todos os processos estejam na mesma máquina (não funciona em pasta de rede)
+SHARED_PROFILE = ConnectionProfile(journal_mode='WAL', busy_timeout=10000, synchronous='NORMAL',
+                                   cache_size=-16000, mmap_size=64 * 1024 * 1024)
+# Diário de rollback e demais padrões do SQLite (comportamento anterior, usado nas comparações)
+LEGACY_PROFILE = ConnectionProfile()
+DEFAULT_PROFILE = SHARED_PROFILE
+
+class ModelConnection(sqlite3.Connection):
+    """ Conexão sqlite3 que guarda o estado compartilhado pelos modelos (ex.: transação ativa).
+
+    Com o rastreamento de query_trace ligado, os cursores (inclusive os de
+    execute/executemany) medem cada comando.
+    """
+
+    def cursor(self, factory=None):
+        if factory is None and active_tracer() is not None:
+            factory = TracedCursor
+        return super().cursor(factory or sqlite3.Cursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class _ConnectionState:
+    def __init__(self):
+        self.transaction_depth = 0
+        # Eventos gravados dentro de transaction(), publicados após o commit
+        self.pending_events = []
+        self.query_cache = QueryCache()
+
+def _connection_state(conn):
+    # O estado vive na própria conexão e some com ela. Conexões sqlite3 comuns não aceitam
+    # atributos nem referências fracas, e um dicionário por id() reaproveitaria o cache de
+    # uma conexão já fechada; por isso os modelos exigem ModelConnection
+    if not isinstance(conn, ModelConnection):
+        raise TypeError("Os modelos exigem uma conexão de get_db_connection (ModelConnection), "
+                        f"não {type(conn).__name__}")
+    state = getattr(conn, 'model_state', None)
+    if state is None:
+        state = conn.model_state = _ConnectionState()
+    return state
+
+# Alteração confirmada em uma tabela: operation é 'insert', 'update' ou 'delete';
+# pk é None quando a operação afetou várias linhas de uma vez (ex.: save_many)
+ChangeEvent = namedtuple('ChangeEvent', ['table', 'operation', 'pk'])
+
+class ChangeBus:
+    """ Distribui os eventos de alteração dos modelos para quem assinou cada tabela """
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, table, callback):
+        self._subscribers.setdefault(table, []).append(callback)
+
+    def unsubscribe(self, table, callback):
+        callbacks = self._subscribers.get(table, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def publish(self, event):
+        for callback in list(self._subscribers.get(event.table, [])):
+            callback(event)
+
+change_bus = ChangeBus()
+
+class QueryCache:
+    """ Cache LRU dos resultados de leitura de uma conexão.
+
+    Cada entrada registra as tabelas que a consulta lê. Uma gravação feita
+    pelos modelos nesta conexão descarta só as entradas dessas tabelas;
+    gravações de outras conexões (outro processo, as threads do QueryExecutor)
+    não são vistas uma a uma, e sim pela mudança de PRAGMA data_version, que
+    esvazia o cache inteiro.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.data_version = None
+        self._entries = OrderedDict()  # chave -> (tabelas, resultado)
+        self._keys_by_table = {}       # tabela -> {chaves}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def check_version(self, conn):
+        """ Esvazia o cache se outra conexão confirmou gravações desde a última consulta """
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version:
+            self.clear()
+            self.data_version = version
+
+    def get(self, key):
+        """ Retorna (True, resultado) ou (False, None) """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, key, tables, value):
+        self._discard(key)
+        self._entries[key] = (tables, value)
+        for table in tables:
+            self._keys_by_table.setdefault(table, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, *tables):
+        for table in tables:
+            for key in list(self._keys_by_table.get(table, ())):
+                self._discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_table.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for table in entry[0]:
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'taxa_acerto': self.hits / total if total else 0.0,
+            'entradas': len(self._entries),
+            'tamanho_maximo': self.maxsize,
+        }
+
+def query_cache(conn):
+    """ QueryCache da conexão (para consultar hits/misses ou esvaziar) """
+    return _connection_state(conn).query_cache
+
+def invalidate_cached_reads(conn, *tables):
+    """ Descarta os resultados em cache que leem as tabelas (e as alteradas por seus triggers).
+
+    Os modelos chamam isso a cada gravação; código que grava com SQL direto
+    na mesma conexão (importação em massa, manutenção) deve chamar também.
+    """
+    affected = set(tables)
+    for table in tables:
+        affected.update(TRIGGER_WRITES.get(table, ()))
+    query_cache(conn).invalidate(*affected)
+
+def _copy_result(value):
+    # O chamador recebe uma cópia: alterar o dicionário devolvido não altera o cache
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [dict(row) if isinstance(row, dict) else row for row in value]
+    return value
+
+def cached_read(*tables):
+    """ Guarda o resultado do método no QueryCache da conexão.
+
+    tables são as tabelas lidas pela consulta; sem tables, a tabela do
+    próprio modelo. Dentro de transaction() a consulta vai direto ao banco,
+    pois pode enxergar alterações que ainda serão desfeitas.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            state = _connection_state(self.conn)
+            if state.transaction_depth > 0:
+                return method(self, *args, **kwargs)
+            cache = state.query_cache
+            key = (self.table_name, method.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                cache.check_version(self.conn)
+                found, value = cache.get(key)
+            except (sqlite3.Error, TypeError):  # TypeError: argumento não hashable
+                return method(self, *args, **kwargs)
+            if not found:
+                value = method(self, *args, **kwargs)
+                cache.put(key, tables or (self.table_name,), value)
+            return _copy_result(value)
+        return wrapper
+    return decorator
+
+class InsufficientStockError(Exception):
+    """ Os lotes do item não cobrem a quantidade de uma doação realizada """
+
+def get_db_connection(db_file, profile=None, check_same_thread=True):
+    """ Abre uma conexão para os modelos com o perfil indicado (padrão: DEFAULT_PROFILE) """
+    profile = profile or DEFAULT_PROFILE
+    options = {}
+    if profile.busy_timeout is not None:
+        options['timeout'] = profile.busy_timeout / 1000
+    conn = sqlite3.connect(db_file, factory=ModelConnection, check_same_thread=check_same_thread, **options)
     conn.row_factory = sqlite3.Row  # Permite acessar colunas por nome
+    try:
+        if profile.journal_mode is not None:
+            conn.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+        if profile.synchronous is not None:
+            conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+        if profile.cache_size is not None:
+            conn.execute(f"PRAGMA cache_size = {int(profile.cache_size)}")
+        if profile.mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size = {int(profile.mmap_size)}")
+    except sqlite3.Error as e:
+        # Ex.: outra estação com o banco aberto no modo antigo impede a troca para WAL
+        print(f"Erro ao configurar a conexão com {db_file}: {e}")
     return conn
 
+class ConnectionPool:
+    """ Conexões reaproveitadas por threads de trabalho (servidor, consultas em segundo plano).
+
+    Enquanto segura uma conexão, a thread é a única a usá-la; connection() é
+    reentrante na mesma thread, então funções aninhadas recebem a mesma
+    conexão (e o mesmo transaction()). Ao sair do bloco mais externo a conexão
+    volta para as ociosas. No máximo size conexões ficam abertas; acima disso
+    connection() espera uma ser devolvida.
+    """
+
+    def __init__(self, db_file, size=4, profile=None):
+        self.db_file = db_file
+        self.size = size
+        self.profile = profile
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = []
+        self._closed = False
+
+    @contextmanager
+    def connection(self, timeout=None):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        if self._closed:
+            raise sqlite3.ProgrammingError("O pool de conexões foi fechado")
+        # timeout None espera indefinidamente (um timeout negativo faria o semáforo desistir na hora)
+        if not self._slots.acquire(timeout=timeout):
+            raise sqlite3.OperationalError(f"Nenhuma conexão livre no pool após {timeout} s")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            # A conexão passa de uma thread para outra, mas nunca é usada por duas ao mesmo tempo
+            conn = get_db_connection(self.db_file, self.profile, check_same_thread=False)
+            with self._lock:
+                self._opened.append(conn)
+        self._local.conn, self._local.depth = conn, 0
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                # Nada que não foi confirmado passa para o próximo usuário da conexão
+                conn.rollback()
+            self._idle.put(conn)
+            self._slots.release()
+
+    def stats(self):
+        return {'abertas': len(self._opened), 'ociosas': self._idle.qsize(), 'tamanho_maximo': self.size}
+
+    def close(self):
+        """ Fecha as conexões ociosas; as que estão em uso devem ser devolvidas antes """
+        self._closed = True
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._opened.remove(conn)
+
 class BaseModel:
     def __init__(self, table_name, conn):
         self.table_name = table_name
@@ -19,9 +382,68 @@ class BaseModel:
             'itens': 'id_item',
             'doacoes_recebidas': 'id_doacao_recebida',
             'doacoes_realizadas': 'id_doacao_realizada',
+            'lotes': 'id_lote',
         }
         self.id_column_name = self.id_column_map.get(table_name, f'id_{table_name[:-1]}')
 
+    @contextmanager
+    def transaction(self):
+        """ Unidade de trabalho: adia o commit até o fim do bloco.
+
+        Blocos aninhados (inclusive de outros modelos na mesma conexão) viram
+        SAVEPOINTs; uma exceção desfaz apenas o bloco em que ocorreu e é
+        propagada. O commit acontece quando o bloco mais externo termina.
+        """
+        state = _connection_state(self.conn)
+        savepoint = f"sp_{state.transaction_depth}"
+        events_mark = len(state.pending_events)
+        # O bloco mais externo reserva a escrita logo no início: com várias estações, uma
+        # transação que lê e depois grava não pode ser interrompida por "database is locked"
+        # no meio (a espera de busy_timeout só vale para o início da transação)
+        began = state.transaction_depth == 0 and not self.conn.in_transaction
+        if began:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(f"SAVEPOINT {savepoint}")
+        state.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            state.transaction_depth -= 1
+            self.conn.execute(f"ROLLBACK TO {savepoint}")
+            self.conn.execute(f"RELEASE {savepoint}")
+            if began:
+                self.conn.rollback()
+            # Alterações desfeitas não são anunciadas
+            del state.pending_events[events_mark:]
+            raise
+        else:
+            state.transaction_depth -= 1
+            self.conn.execute(f"RELEASE {savepoint}")
+            if state.transaction_depth == 0:
+                self.conn.commit()
+                events, state.pending_events = state.pending_events, []
+                for event in events:
+                    change_bus.publish(event)
+
+    def in_transaction(self):
+        """ Indica se há um bloco transaction() ativo nesta conexão """
+        return _connection_state(self.conn).transaction_depth > 0
+
+    def _commit(self):
+        # Dentro de transaction() o commit fica para o fim do bloco mais externo
+        if not self.in_transaction():
+            self.conn.commit()
+
+    def _notify(self, operation, pk):
+        """ Anuncia a alteração no change_bus; dentro de transaction(), só após o commit """
+        invalidate_cached_reads(self.conn, self.table_name)
+        event = ChangeEvent(self.table_name, operation, pk)
+        state = _connection_state(self.conn)
+        if state.transaction_depth > 0:
+            state.pending_events.append(event)
+        else:
+            change_bus.publish(event)
+
     def save(self, data):
         columns = ', '.join(data.keys())
         placeholders = ', '.join(['?' for _ in data.values()])
@@ -29,22 +451,92 @@ class BaseModel:
         cursor = self.conn.cursor()
         try:
             cursor.execute(sql, tuple(data.values()))
-            self.conn.commit()
+            self._commit()
+            self._notify('insert', cursor.lastrowid)
             return cursor.lastrowid
         except sqlite3.Error as e:
             print(f"Erro ao salvar em {self.table_name}: {e}")
             return None
 
-    def get_all(self):
+    def save_many(self, rows):
+        """ Insere vários registros (dicionários com as mesmas chaves) em uma única transação.
+
+        Retorna a quantidade de registros inseridos, ou None em caso de erro
+        (nenhum registro é gravado).
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = list(first.keys())
+        placeholders = ', '.join(['?' for _ in columns])
+        sql = f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({placeholders})"
         cursor = self.conn.cursor()
         try:
-            cursor.execute(f"SELECT * FROM {self.table_name}")
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            with self.transaction():
+                cursor.executemany(sql, (tuple(row[column] for column in columns) for row in chain([first], rows)))
+                self._notify('insert', None)
+            return cursor.rowcount
+        except (sqlite3.Error, KeyError) as e:
+            print(f"Erro ao salvar em lote em {self.table_name}: {e}")
+            return None
+
+    def _iter_query(self, sql, params, batch_size, error_message):
+        """ Executa a consulta e gera cada linha como dicionário, lendo em blocos com fetchmany """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
         except sqlite3.Error as e:
-            print(f"Erro ao buscar todos de {self.table_name}: {e}")
-            return []
+            print(f"{error_message}: {e}")
+
+    def _keyset(self, id_column, after_id, limit, before_id=None):
+        """ Monta o filtro de paginação por chave e seus parâmetros.
+
+        Retorna (where, order_by, limit_clause, params). Com after_id as linhas
+        vêm em ordem crescente de ID a partir dele; com before_id vêm em ordem
+        decrescente, terminando logo antes dele (página anterior).
+        """
+        params = []
+        where = ""
+        order_by = f"ORDER BY {id_column}"
+        if after_id is not None:
+            where = f"WHERE {id_column} > ?"
+            params.append(after_id)
+        elif before_id is not None:
+            where = f"WHERE {id_column} < ?"
+            order_by = f"ORDER BY {id_column} DESC"
+            params.append(before_id)
+        limit_clause = ""
+        if limit is not None:
+            limit_clause = "LIMIT ?"
+            params.append(limit)
+        return where, order_by, limit_clause, params
+
+    def iter_all(self, batch_size=DEFAULT_FETCH_SIZE, after_id=None, limit=None, before_id=None):
+        """ Gera os registros em ordem de ID; after_id/before_id/limit permitem paginar em memória constante """
+        where, order_by, limit_clause, params = self._keyset(self.id_column_name, after_id, limit, before_id)
+        sql = f"SELECT * FROM {self.table_name} {where} {order_by} {limit_clause}"
+        return self._iter_query(sql, params, batch_size, f"Erro ao buscar todos de {self.table_name}")
+
+    def count(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"SELECT COUNT(*) FROM {self.table_name}")
+            return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Erro ao contar registros de {self.table_name}: {e}")
+            return 0
+
+    def get_all(self):
+        return list(self.iter_all())
 
+    @cached_read()
     def get_by_id(self, id_value):
         cursor = self.conn.cursor()
         try:
@@ -56,29 +548,106 @@ class BaseModel:
             print(f"Erro ao buscar por ID em {self.table_name}: {e}")
             return None
 
+    def search(self, query, limit=20):
+        """ Busca textual: registros em que cada palavra da busca inicia uma palavra indexada.
+
+        Acentos e maiúsculas são ignorados ("joao" encontra "João"). Ordem dos
+        resultados: nome que começa com o texto buscado, nome que contém todas
+        as palavras, demais colunas (endereço, e-mail...); em cada grupo, os
+        mais recentes primeiro. Tabelas sem índice FTS retornam lista vazia.
+        """
+        fts = FTS_TABLES.get(self.table_name)
+        words = normalize_key(query).split()
+        if not fts or not words:
+            return []
+        fts_table, _, columns = fts
+        # Cada palavra vira um termo de prefixo entre aspas, o que neutraliza a sintaxe do FTS5 (AND, OR, NEAR, *)
+        match = " ".join(f'"{word}"*' for word in words)
+        # Um MATCH por grupo de relevância, do melhor para o pior: nome que começa com o texto
+        # (^ ancora no início da coluna), todas as palavras no nome, qualquer coluna. Cada um
+        # considera todos os registros que casam, mas o FTS5 os devolve já em ordem de rowid
+        # e para no LIMIT, sem ordenar a lista inteira
+        tiers = (f'{columns[0]} : ^"{" ".join(words)}"*', f"{columns[0]} : ({match})", match)
+        cursor = self.conn.cursor()
+        try:
+            ids = []
+            for tier_match in tiers:
+                cursor.execute(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ? ORDER BY rowid DESC LIMIT ?",
+                               (tier_match, limit + len(ids)))
+                found = set(ids)
+                ids.extend(row[0] for row in cursor.fetchall() if row[0] not in found)
+                if len(ids) >= limit:
+                    break
+            ids = ids[:limit]
+            if not ids:
+                return []
+            cursor.execute(f"SELECT * FROM {self.table_name} WHERE {self.id_column_name} IN ({', '.join('?' for _ in ids)})",
+                           ids)
+            rows = {row[self.id_column_name]: dict(row) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Erro na busca em {self.table_name}: {e}")
+            return []
+        return [rows[id_value] for id_value in ids if id_value in rows]
+
     def update(self, id_value, data):
         set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
         sql = f"UPDATE {self.table_name} SET {set_clause} WHERE {self.id_column_name} = ?"
         cursor = self.conn.cursor()
         try:
             cursor.execute(sql, tuple(list(data.values()) + [id_value]))
-            self.conn.commit()
+            self._commit()
+            self._notify('update', id_value)
             return cursor.rowcount
         except sqlite3.Error as e:
             print(f"Erro ao atualizar em {self.table_name}: {e}")
             return None
 
+    def update_many(self, changes):
+        """ Aplica vários pares (id, dados) em uma única transação.
+
+        Retorna o total de registros alterados, ou None se alguma atualização
+        falhar (nesse caso nenhuma é mantida).
+        """
+        total = 0
+        try:
+            with self.transaction():
+                for id_value, data in changes:
+                    rowcount = self.update(id_value, data)
+                    if rowcount is None:
+                        raise sqlite3.Error(f"falha ao atualizar o registro {id_value}")
+                    total += rowcount
+            return total
+        except sqlite3.Error as e:
+            print(f"Erro ao atualizar em lote em {self.table_name}: {e}")
+            return None
+
     def delete(self, id_value):
         sql = f"DELETE FROM {self.table_name} WHERE {self.id_column_name} = ?"
         cursor = self.conn.cursor()
         try:
             cursor.execute(sql, (id_value,))
-            self.conn.commit()
+            self._commit()
+            self._notify('delete', id_value)
             return cursor.rowcount
         except sqlite3.Error as e:
             print(f"Erro ao deletar de {self.table_name}: {e}")
             return None
 
+    def delete_many(self, id_values):
+        """ Exclui vários registros pelo ID em uma única transação; retorna a quantidade excluída """
+        sql = f"DELETE FROM {self.table_name} WHERE {self.id_column_name} = ?"
+        id_values = list(id_values)
+        cursor = self.conn.cursor()
+        try:
+            with self.transaction():
+                cursor.executemany(sql, ((id_value,) for id_value in id_values))
+                for id_value in id_values:
+                    self._notify('delete', id_value)
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Erro ao deletar em lote de {self.table_name}: {e}")
+            return None
+
 class Doador(BaseModel):
     def __init__(self, conn):
         super().__init__('doadores', conn)
@@ -87,204 +656,774 @@ class Beneficiario(BaseModel):
     def __init__(self, conn):
         super().__init__('beneficiarios', conn)
 
+    def get_needing(self, alimento):
+        """ Beneficiários que têm alimento entre os necessários (sem diferença de maiúsculas), por prioridade """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT b.*, n.prioridade FROM necessidades_beneficiario n
+                JOIN beneficiarios b ON b.id_beneficiario = n.id_beneficiario
+                WHERE n.alimento = ?
+                ORDER BY n.prioridade, b.id_beneficiario
+            """, (alimento.strip(),))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Erro ao buscar beneficiários que precisam de {alimento}: {e}")
+            return []
+
 class Item(BaseModel):
+    """ Catálogo de itens: cada item é uma combinação única de tipo de alimento, marca e unidade.
+
+    save, save_many e update gravam as dimensões (intern_dimension) e os IDs
+    id_tipo, id_marca e id_unidade junto com o item; as buscas comparam as
+    chaves normalizadas pelos índices das dimensões e de itens.
+    """
+
     def __init__(self, conn):
         super().__init__('itens', conn)
 
+    # Os métodos de BaseModel tratam o próprio erro e retornam None; a exceção levantada
+    # aqui desfaz também as dimensões criadas para o item que não foi gravado
+
+    def save(self, data):
+        try:
+            with self.transaction():
+                item_id = super().save(resolve_item_columns(self.conn.cursor(), data))
+                if item_id is None:
+                    raise sqlite3.Error("item não gravado")
+                return item_id
+        except sqlite3.Error as e:
+            print(f"Erro ao salvar em {self.table_name}: {e}")
+            return None
+
+    def save_many(self, rows):
+        try:
+            with self.transaction():
+                cursor = self.conn.cursor()
+                count = super().save_many([resolve_item_columns(cursor, row) for row in rows])
+                if count is None:
+                    raise sqlite3.Error("itens não gravados")
+                return count
+        except sqlite3.Error as e:
+            print(f"Erro ao salvar em lote em {self.table_name}: {e}")
+            return None
+
+    def update(self, id_value, data):
+        if not ITEM_DIMENSIONS.keys() & data.keys():
+            return super().update(id_value, data)
+        try:
+            with self.transaction():
+                rowcount = super().update(id_value, resolve_item_columns(self.conn.cursor(), data))
+                if rowcount is None:
+                    raise sqlite3.Error(f"falha ao atualizar o item {id_value}")
+                return rowcount
+        except sqlite3.Error as e:
+            print(f"Erro ao atualizar em {self.table_name}: {e}")
+            return None
+
+    @cached_read('itens')
     def get_by_name_brand_unit(self, nome_item, marca, unidade):
         cursor = self.conn.cursor()
         try:
-            cursor.execute("SELECT * FROM itens WHERE nome_item = ? AND marca = ? AND unidade = ?",
-                           (nome_item, marca, unidade))
+            # Cada chave vira o ID da dimensão pelo índice único de chave; o item vem de idx_itens_dimensoes
+            cursor.execute("""
+                SELECT * FROM itens
+                WHERE id_tipo = (SELECT id_tipo FROM tipos_alimento WHERE chave = ?)
+                  AND id_marca = (SELECT id_marca FROM marcas WHERE chave = ?)
+                  AND id_unidade = (SELECT id_unidade FROM unidades WHERE chave = ?)
+            """, (normalize_key(nome_item), normalize_key(marca), normalize_key(unidade)))
             row = cursor.fetchone()
             return dict(row) if row else None
         except sqlite3.Error as e:
             print(f"Erro ao buscar item por nome, marca e unidade: {e}")
             return None
 
+    @cached_read('itens')
     def get_by_name_brand(self, nome_item, marca):
         cursor = self.conn.cursor()
         try:
-            cursor.execute("SELECT * FROM itens WHERE nome_item = ? AND marca = ?",
-                           (nome_item, marca))
+            cursor.execute("""
+                SELECT * FROM itens
+                WHERE id_tipo = (SELECT id_tipo FROM tipos_alimento WHERE chave = ?)
+                  AND id_marca = (SELECT id_marca FROM marcas WHERE chave = ?)
+            """, (normalize_key(nome_item), normalize_key(marca)))
             row = cursor.fetchone()
             return dict(row) if row else None
         except sqlite3.Error as e:
             print(f"Erro ao buscar item por nome e marca: {e}")
             return None
 
-class DoacaoRecebida(BaseModel):
+    @cached_read('itens')
+    def get_dimension_names(self, column):
+        """ Nomes de tipos de alimento (column='nome_item'), marcas ('marca') ou unidades ('unidade') usados por algum item """
+        table, id_column = ITEM_DIMENSIONS[column]
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT nome FROM {table}
+                WHERE nome != '' AND {id_column} IN (SELECT {id_column} FROM itens)
+                ORDER BY chave
+            """)
+            return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Erro ao buscar os nomes de {table}: {e}")
+            return []
+
+def clean_name(text):
+    """ Nome sem espaços nas pontas e com um único espaço entre as palavras """
+    return ' '.join((text or '').split())
+
+def intern_dimension(cursor, column, text, convert_units=True):
+    """ (ID, nome gravado) do valor na dimensão da coluna de itens, criando-o se ainda não existe.
+
+    Unidades novas recebem grandeza, unidade base e fator de unit_conversion;
+    convert_units=False só é usado antes da migração 12, que cria essas colunas.
+    """
+    table, id_column = ITEM_DIMENSIONS[column]
+    key = normalize_key(text)
+    cursor.execute(f"SELECT {id_column}, nome FROM {table} WHERE chave = ?", (key,))
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0], row[1]
+    name = clean_name(text)
+    cursor.execute(f"INSERT INTO {table} (nome, chave) VALUES (?, ?)", (name, key))
+    new_id = cursor.lastrowid
+    if column == 'unidade' and convert_units:
+        set_unit_conversion(cursor, new_id, key)
+    return new_id, name
+
+def unit_conversion(key):
+    """ (grandeza, chave da unidade base, fator) da unidade pela chave normalize_key.
+
+    Embalagens ("500g", "5 kg") valem o número vezes o fator da unidade:
+    "500g" -> ('massa', 'kg', 0.5). Unidades fora da tabela são a própria base.
+    """
+    if key in UNIT_REGISTRY:
+        return UNIT_REGISTRY[key]
+    match = PACKAGE_UNIT.fullmatch(key)
+    if match and match.group(2) in UNIT_REGISTRY:
+        amount = int(match.group(1))
+        if amount > 0:
+            grandeza, base_key, factor = UNIT_REGISTRY[match.group(2)]
+            return grandeza, base_key, amount * factor
+    return None, key, 1.0
+
+def set_unit_conversion(cursor, id_unidade, key):
+    """ Grava grandeza, unidade base e fator da unidade conforme unit_conversion, criando a unidade base se preciso """
+    grandeza, base_key, factor = unit_conversion(key)
+    if base_key == key:
+        base_id = id_unidade
+    else:
+        base_id = intern_dimension(cursor, 'unidade', UNIT_BASE_NAMES[base_key])[0]
+    cursor.execute("UPDATE unidades SET grandeza = ?, id_unidade_base = ?, fator = ? WHERE id_unidade = ?",
+                   (grandeza, base_id, factor, id_unidade))
+
+def resolve_item_columns(cursor, data, convert_units=True):
+    """ Cópia de data com os IDs das dimensões das colunas de texto presentes e os textos trocados pelos nomes gravados """
+    resolved = dict(data)
+    for column, (_, id_column) in ITEM_DIMENSIONS.items():
+        if column in data:
+            resolved[id_column], resolved[column] = intern_dimension(cursor, column, data[column], convert_units)
+    return resolved
+
+def intern_item(cursor, nome_item, marca, unidade):
+    """ (id_item, criado) do item com essas chaves de tipo, marca e unidade, inserido se ainda não existe.
+
+    Para gravações em massa que não passam por Item (importação, dados sintéticos);
+    não publica eventos nem invalida o cache.
+    """
+    item = resolve_item_columns(cursor, {'nome_item': nome_item, 'marca': marca, 'unidade': unidade})
+    ids = (item['id_tipo'], item['id_marca'], item['id_unidade'])
+    cursor.execute("SELECT id_item FROM itens WHERE id_tipo = ? AND id_marca = ? AND id_unidade = ?", ids)
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0], False
+    cursor.execute("""
+        INSERT INTO itens (nome_item, marca, unidade, id_tipo, id_marca, id_unidade) VALUES (?, ?, ?, ?, ?, ?)
+    """, (item['nome_item'], item['marca'], item['unidade'], *ids))
+    return cursor.lastrowid, True
+
+def allocate_fefo(cursor, id_doacao_realizada, id_item, quantidade, day):
+    """ Consome os lotes do item em ordem de validade (FEFO) e registra as alocações.
+
+    day (YYYY-MM-DD) é a data da doação: só entram lotes que vencem nesse dia
+    ou depois, para que os vencidos não sejam entregues antes dos válidos.
+    day=None considera todos os lotes (só a migração 4, que reprocessa o
+    histórico como ele foi gravado). Deve ser chamada dentro da transação que
+    grava a doação realizada. Retorna a quantidade que não pôde ser alocada
+    (0 quando havia lotes suficientes).
+    """
+    valid, params = ("", (id_item, FEFO_BATCH)) if day is None else ("AND data_validade >= ?", (id_item, day, FEFO_BATCH))
+    remaining = quantidade
+    while remaining > LOT_EPSILON:
+        # Os lotes são lidos aos poucos: uma doação costuma consumir só os primeiros,
+        # e cada bloco lido é esgotado inteiro antes de buscar o próximo
+        cursor.execute(f"""
+            SELECT id_lote, quantidade_restante FROM lotes
+            WHERE id_item = ? AND quantidade_restante > 0 {valid}
+            ORDER BY data_validade, id_lote
+            LIMIT ?
+        """, params)
+        lots = cursor.fetchall()
+        if not lots:
+            break
+        for id_lote, available in lots:
+            if remaining <= LOT_EPSILON:
+                break
+            taken = min(available, remaining)
+            left = available - taken
+            cursor.execute("UPDATE lotes SET quantidade_restante = ? WHERE id_lote = ?",
+                           (left if left > LOT_EPSILON else 0, id_lote))
+            cursor.execute("INSERT INTO alocacoes_lote (id_doacao_realizada, id_lote, quantidade) VALUES (?, ?, ?)",
+                           (id_doacao_realizada, id_lote, taken))
+            remaining -= taken
+    return remaining if remaining > LOT_EPSILON else 0
+
+def release_allocations(cursor, id_doacao_realizada):
+    """ Devolve aos lotes as quantidades alocadas para uma doação realizada """
+    cursor.execute("""
+        UPDATE lotes SET quantidade_restante = quantidade_restante + (
+            SELECT SUM(a.quantidade) FROM alocacoes_lote a
+            WHERE a.id_lote = lotes.id_lote AND a.id_doacao_realizada = ?
+        )
+        WHERE id_lote IN (SELECT id_lote FROM alocacoes_lote WHERE id_doacao_realizada = ?)
+    """, (id_doacao_realizada, id_doacao_realizada))
+    cursor.execute("DELETE FROM alocacoes_lote WHERE id_doacao_realizada = ?", (id_doacao_realizada,))
+
+class Lote(BaseModel):
     def __init__(self, conn):
-        super().__init__('doacoes_recebidas', conn)
+        super().__init__('lotes', conn)
 
-    def get_all_with_details(self):
+    def get_available_lots(self, id_item, day=None):
+        """ Lotes com saldo do item, na ordem em que serão consumidos (FEFO).
+
+        Com day (YYYY-MM-DD), só os que allocate_fefo consome numa doação
+        desse dia (validade a partir de day); sem day, também os vencidos.
+        """
+        valid, params = ("", (id_item,)) if day is None else ("AND data_validade >= ?", (id_item, day))
         cursor = self.conn.cursor()
         try:
-            cursor.execute("""
-                SELECT
-                    dr.id_doacao_recebida,
-                    d.nome AS doador_nome,
-                    i.nome_item,
-                    i.marca,
-                    i.unidade,
-                    dr.quantidade,
-                    dr.data_recebimento,
-                    dr.data_validade
-                FROM doacoes_recebidas dr
-                JOIN doadores d ON dr.id_doador = d.id_doador
-                JOIN itens i ON dr.id_item = i.id_item
-            """)
+            cursor.execute(f"""
+                SELECT * FROM lotes
+                WHERE id_item = ? AND quantidade_restante > 0 {valid}
+                ORDER BY data_validade, id_lote
+            """, params)
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
         except sqlite3.Error as e:
-            print(f"Erro ao buscar doações recebidas com detalhes: {e}")
+            print(f"Erro ao buscar lotes do item {id_item}: {e}")
             return []
 
-    def get_expiring_items(self, days_threshold):
+    @cached_read('lotes')
+    def get_available_quantity(self, id_item, day=None):
+        """ Soma do que resta nos lotes do item; com day, só nos lotes válidos nesse dia (como get_available_lots) """
+        valid, params = ("", (id_item,)) if day is None else (" AND data_validade >= ?", (id_item, day))
         cursor = self.conn.cursor()
         try:
-            today = datetime.now().strftime('%Y-%m-%d')
-            future_date = (datetime.now() + timedelta(days=days_threshold)).strftime('%Y-%m-%d')
-            sql = """
-                SELECT
-                    dr.id_doacao_recebida,
-                    d.nome AS doador_nome,
-                    i.nome_item,
-                    i.marca,
-                    i.unidade,
-                    dr.quantidade,
-                    dr.data_recebimento,
-                    dr.data_validade
-                FROM doacoes_recebidas dr
-                JOIN doadores d ON dr.id_doador = d.id_doador
-                JOIN itens i ON dr.id_item = i.id_item
-                WHERE date(dr.data_validade) > date(?) AND date(dr.data_validade) <= date(?)
-                ORDER BY dr.data_validade ASC
-            """
-            cursor.execute(sql, (today, future_date))
+            cursor.execute(f"SELECT SUM(quantidade_restante) FROM lotes WHERE id_item = ? AND quantidade_restante > 0{valid}",
+                           params)
+            return cursor.fetchone()[0] or 0
+        except sqlite3.Error as e:
+            print(f"Erro ao calcular quantidade disponível em lotes para o item {id_item}: {e}")
+            return 0
+
+    def get_allocations(self, id_doacao_realizada):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT a.id_lote, l.id_doacao_recebida, l.data_validade, a.quantidade
+                FROM alocacoes_lote a
+                JOIN lotes l ON a.id_lote = l.id_lote
+                WHERE a.id_doacao_realizada = ?
+                ORDER BY l.data_validade, a.id_lote
+            """, (id_doacao_realizada,))
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
         except sqlite3.Error as e:
-            print(f"Erro ao buscar itens vencendo: {e}")
+            print(f"Erro ao buscar alocações da doação realizada {id_doacao_realizada}: {e}")
             return []
 
+class DoacaoRecebida(BaseModel):
+    DETAILS_SQL = """
+        SELECT
+            dr.id_doacao_recebida,
+            d.nome AS doador_nome,
+            i.nome_item,
+            i.marca,
+            i.unidade,
+            dr.quantidade,
+            dr.data_recebimento,
+            dr.data_validade
+        FROM doacoes_recebidas dr
+        JOIN doadores d ON dr.id_doador = d.id_doador
+        JOIN itens i ON dr.id_item = i.id_item
+    """
+
+    def __init__(self, conn):
+        super().__init__('doacoes_recebidas', conn)
+
+    def iter_all_with_details(self, batch_size=DEFAULT_FETCH_SIZE, after_id=None, limit=None, before_id=None):
+        where, order_by, limit_clause, params = self._keyset("dr.id_doacao_recebida", after_id, limit, before_id)
+        sql = f"{self.DETAILS_SQL} {where} {order_by} {limit_clause}"
+        return self._iter_query(sql, params, batch_size, "Erro ao buscar doações recebidas com detalhes")
+
+    def get_all_with_details(self):
+        return list(self.iter_all_with_details())
+
+    def get_with_details(self, id_value):
+        """ Uma única linha no formato de iter_all_with_details (usada nas atualizações incrementais da interface) """
+        rows = list(self._iter_query(f"{self.DETAILS_SQL} WHERE dr.id_doacao_recebida = ?", (id_value,),
+                                     1, "Erro ao buscar doação recebida com detalhes"))
+        return rows[0] if rows else None
+
+    def iter_expiring_items(self, days_threshold, batch_size=DEFAULT_FETCH_SIZE, today=None, donation_ids=None):
+        """ Lotes com saldo que vencem entre hoje e hoje + days_threshold (inclusive), por validade.
+
+        Um lote que vence hoje entra no alerta (data_validade >= hoje): ele ainda
+        pode ser distribuído hoje, pela mesma regra de allocate_fefo, e é o mais
+        urgente. Lotes com validade anterior a hoje ficam de fora.
+        quantidade é o que resta no lote (quantidade_recebida é o total doado).
+        As datas são comparadas como texto ISO, sem date() na coluna, para que
+        a faixa use o índice parcial idx_lotes_validade_disponiveis. today
+        (date ou datetime) fixa a data de referência; donation_ids restringe a
+        consulta a algumas doações recebidas (atualização incremental dos alertas).
+        """
+        today = today or datetime.now()
+        start = today.strftime('%Y-%m-%d')
+        end = (today + timedelta(days=days_threshold)).strftime('%Y-%m-%d')
+        params = [start, end]
+        donation_filter = ""
+        if donation_ids is not None:
+            donation_ids = list(donation_ids)
+            if not donation_ids:
+                return iter(())
+            donation_filter = f"AND l.id_doacao_recebida IN ({', '.join('?' for _ in donation_ids)})"
+            params.extend(donation_ids)
+        sql = f"""
+            SELECT
+                dr.id_doacao_recebida,
+                d.nome AS doador_nome,
+                i.nome_item,
+                i.marca,
+                i.unidade,
+                l.quantidade_restante AS quantidade,
+                dr.quantidade AS quantidade_recebida,
+                dr.data_recebimento,
+                l.data_validade
+            FROM lotes l
+            JOIN doacoes_recebidas dr ON dr.id_doacao_recebida = l.id_doacao_recebida
+            JOIN doadores d ON dr.id_doador = d.id_doador
+            JOIN itens i ON l.id_item = i.id_item
+            WHERE l.data_validade >= ? AND l.data_validade <= ? AND l.quantidade_restante > 0
+            {donation_filter}
+            ORDER BY l.data_validade, l.id_lote
+        """
+        return self._iter_query(sql, params, batch_size, "Erro ao buscar itens vencendo")
+
+    def get_expiring_items(self, days_threshold, today=None):
+        return list(self.iter_expiring_items(days_threshold, today=today))
+
+    @cached_read('saldo_estoque')
     def get_stock_by_item(self, item_id):
         cursor = self.conn.cursor()
         try:
-            # Quantidade total recebida para o item
-            cursor.execute("SELECT SUM(quantidade) FROM doacoes_recebidas WHERE id_item = ?", (item_id,))
-            received_qty = cursor.fetchone()[0] or 0
-
-            # Quantidade total realizada para o item
-            cursor.execute("SELECT SUM(quantidade) FROM doacoes_realizadas WHERE id_item = ?", (item_id,))
-            realized_qty = cursor.fetchone()[0] or 0
-
-            return received_qty - realized_qty
+            # Saldo materializado, mantido pelos triggers de saldo_estoque
+            cursor.execute("SELECT quantidade FROM saldo_estoque WHERE id_item = ?", (item_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
         except sqlite3.Error as e:
             print(f"Erro ao calcular estoque para o item {item_id}: {e}")
             return 0
 
+    @cached_read('saldo_estoque', 'itens')
     def get_grouped_stock(self):
+        """ Saldo por tipo de alimento na unidade base de cada grandeza (10 kg + 500 g = 10,5 kg) """
         cursor = self.conn.cursor()
         try:
+            # Agrupa o saldo materializado por tipo de alimento e unidade (IDs das dimensões,
+            # na ordem de idx_itens_tipo_unidade, sem ler a tabela itens); só então cada grupo
+            # é convertido pelo fator da unidade e somado por unidade base, filtrando tipos
+            # com estoque zero ou negativo
             sql = """
                 SELECT
-                    i.nome_item,
-                    i.unidade,
-                    SUM(dr.quantidade) AS total_recebido
-                FROM doacoes_recebidas dr
-                JOIN itens i ON dr.id_item = i.id_item
-                GROUP BY i.nome_item, i.unidade
+                    t.nome AS nome_item,
+                    b.nome AS unidade,
+                    SUM(g.quantidade * u.fator) AS quantidade_total
+                FROM (
+                    SELECT i.id_tipo, i.id_unidade, SUM(s.quantidade) AS quantidade
+                    FROM itens i
+                    JOIN saldo_estoque s ON s.id_item = i.id_item
+                    GROUP BY i.id_tipo, i.id_unidade
+                ) g
+                JOIN unidades u ON u.id_unidade = g.id_unidade
+                JOIN tipos_alimento t ON t.id_tipo = g.id_tipo
+                JOIN unidades b ON b.id_unidade = u.id_unidade_base
+                GROUP BY g.id_tipo, u.id_unidade_base
+                HAVING quantidade_total > ?
+                ORDER BY nome_item, unidade
             """
-            cursor.execute(sql)
-            received_items = cursor.fetchall()
-
-            sql = """
-                SELECT
-                    i.nome_item,
-                    i.unidade,
-                    SUM(dr.quantidade) AS total_realizado
-                FROM doacoes_realizadas dr
-                JOIN itens i ON dr.id_item = i.id_item
-                GROUP BY i.nome_item, i.unidade
-            """
-            cursor.execute(sql)
-            realized_items = cursor.fetchall()
-
-            stock = {}
-            for item in received_items:
-                key = (item['nome_item'], item['unidade'])
-                stock[key] = stock.get(key, 0) + item['total_recebido']
-            
-            for item in realized_items:
-                key = (item['nome_item'], item['unidade'])
-                stock[key] = stock.get(key, 0) - item['total_realizado']
-            
-            # Filtrar itens com estoque zero ou negativo e formatar
-            result = []
-            for (nome_item, unidade), quantidade in stock.items():
-                if quantidade > 0:
-                    result.append({
-                        'nome_item': nome_item,
-                        'unidade': unidade,
-                        'quantidade_total': quantidade
-                    })
-            return result
+            cursor.execute(sql, (LOT_EPSILON,))
+            rows = cursor.fetchall()
+            return [dict(row) for row in rows]
         except sqlite3.Error as e:
             print(f"Erro ao buscar estoque agrupado: {e}")
             return []
 
+    def iter_all_stock_items(self, batch_size=DEFAULT_FETCH_SIZE):
+        # Um registro por (item, validade) com a quantidade restante nos lotes,
+        # na ordem de consumo FEFO de cada item
+        sql = """
+            SELECT
+                i.id_item,
+                i.nome_item,
+                i.marca,
+                i.unidade,
+                l.data_validade,
+                SUM(l.quantidade_restante) AS quantidade_disponivel
+            FROM lotes l
+            JOIN itens i ON l.id_item = i.id_item
+            WHERE l.quantidade_restante > 0
+            GROUP BY l.id_item, l.data_validade
+            ORDER BY l.id_item, l.data_validade
+        """
+        return self._iter_query(sql, (), batch_size, "Erro ao buscar todos os itens em estoque")
+
+    @cached_read('lotes', 'itens')
     def get_all_stock_items(self):
+        return list(self.iter_all_stock_items())
+
+
+class DoacaoRealizada(BaseModel):
+    DETAILS_SQL = """
+        SELECT
+            dr.id_doacao_realizada,
+            b.nome AS beneficiario_nome,
+            i.nome_item,
+            i.marca,
+            i.unidade,
+            dr.quantidade,
+            dr.data_doacao
+        FROM doacoes_realizadas dr
+        JOIN beneficiarios b ON dr.id_beneficiario = b.id_beneficiario
+        JOIN itens i ON dr.id_item = i.id_item
+    """
+
+    def __init__(self, conn):
+        super().__init__('doacoes_realizadas', conn)
+
+    def save(self, data):
+        """ Registra a doação e consome os lotes do item (FEFO) na mesma transação.
+
+        Só são consumidos lotes que vencem em data_doacao ou depois. Se eles não
+        cobrem a quantidade, nada é gravado e retorna None.
+        """
+        columns = ', '.join(data.keys())
+        placeholders = ', '.join(['?' for _ in data.values()])
+        sql = f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
         cursor = self.conn.cursor()
         try:
-            # Retorna todos os itens que já foram recebidos e ainda têm estoque positivo
-            sql = """
+            with self.transaction():
+                cursor.execute(sql, tuple(data.values()))
+                donation_id = cursor.lastrowid
+                missing = allocate_fefo(cursor, donation_id, data['id_item'], data['quantidade'], data['data_doacao'])
+                if missing:
+                    raise InsufficientStockError(f"lotes insuficientes para o item {data['id_item']} (faltam {missing:.2f})")
+                self._notify('insert', donation_id)
+            return donation_id
+        except (sqlite3.Error, InsufficientStockError) as e:
+            print(f"Erro ao salvar em {self.table_name}: {e}")
+            return None
+
+    def save_many(self, rows):
+        """ Registra várias doações (cada uma com sua alocação FEFO) em uma única transação.
+
+        Retorna a quantidade registrada, ou None se alguma falhar (nenhuma é mantida).
+        """
+        count = 0
+        try:
+            with self.transaction():
+                for data in rows:
+                    if self.save(data) is None:
+                        raise InsufficientStockError(f"não foi possível registrar a doação {data}")
+                    count += 1
+            return count
+        except InsufficientStockError as e:
+            print(f"Erro ao salvar em lote em {self.table_name}: {e}")
+            return None
+
+    def update(self, id_value, data):
+        """ Atualiza a doação; se item ou quantidade mudam, refaz a alocação dos lotes """
+        if 'id_item' not in data and 'quantidade' not in data:
+            return super().update(id_value, data)
+        set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
+        sql = f"UPDATE {self.table_name} SET {set_clause} WHERE {self.id_column_name} = ?"
+        cursor = self.conn.cursor()
+        try:
+            with self.transaction():
+                release_allocations(cursor, id_value)
+                cursor.execute(sql, tuple(list(data.values()) + [id_value]))
+                rowcount = cursor.rowcount
+                cursor.execute(f"SELECT id_item, quantidade, data_doacao FROM {self.table_name} WHERE {self.id_column_name} = ?", (id_value,))
+                row = cursor.fetchone()
+                if row:
+                    missing = allocate_fefo(cursor, id_value, row[0], row[1], row[2])
+                    if missing:
+                        raise InsufficientStockError(f"lotes insuficientes para o item {row[0]} (faltam {missing:.2f})")
+                self._notify('update', id_value)
+            return rowcount
+        except (sqlite3.Error, InsufficientStockError) as e:
+            print(f"Erro ao atualizar em {self.table_name}: {e}")
+            return None
+
+    def iter_all_with_details(self, batch_size=DEFAULT_FETCH_SIZE, after_id=None, limit=None, before_id=None):
+        where, order_by, limit_clause, params = self._keyset("dr.id_doacao_realizada", after_id, limit, before_id)
+        sql = f"{self.DETAILS_SQL} {where} {order_by} {limit_clause}"
+        return self._iter_query(sql, params, batch_size, "Erro ao buscar doações realizadas com detalhes")
+
+    def get_all_with_details(self):
+        return list(self.iter_all_with_details())
+
+    def get_with_details(self, id_value):
+        rows = list(self._iter_query(f"{self.DETAILS_SQL} WHERE dr.id_doacao_realizada = ?", (id_value,),
+                                     1, "Erro ao buscar doação realizada com detalhes"))
+        return rows[0] if rows else None
+
+
+class MovimentacaoDiaria(BaseModel):
+    """ Entradas e saídas por (dia, item), mantidas pelos triggers de movimentacao_diaria """
+
+    def __init__(self, conn):
+        super().__init__('movimentacao_diaria', conn)
+
+    @cached_read('movimentacao_diaria', 'itens')
+    def get_flow_report(self, start, end, period='mes', nome_item=None, by_item=True):
+        """ Quantidades recebidas e distribuídas por período entre start e end (inclusive).
+
+        period é 'dia', 'semana' ou 'mes'; cada linha traz periodo (data de
+        início do período) e, com by_item, nome_item e unidade (a unidade base;
+        as quantidades são convertidas para ela). Só os dias
+        dentro da faixa entram nas somas, mesmo que o primeiro ou o último
+        período comece antes ou termine depois dela. start e end são date ou
+        texto ISO. Períodos sem movimentação não aparecem.
+        """
+        if period not in REPORT_PERIODS:
+            raise ValueError(f"período inválido: {period} (use {', '.join(REPORT_PERIODS)})")
+        start = start.isoformat() if hasattr(start, 'isoformat') else start
+        end = end.isoformat() if hasattr(end, 'isoformat') else end
+        params = [start, end]
+        item_filter = ""
+        if nome_item:
+            item_filter = "AND m.id_item IN (SELECT id_item FROM itens WHERE id_tipo = (SELECT id_tipo FROM tipos_alimento WHERE chave = ?))"
+            params.append(normalize_key(nome_item))
+        # Quantidades convertidas pelo fator da unidade do item e agrupadas pelo tipo de alimento
+        # e pela unidade base; os nomes vêm de tipos_alimento e unidades
+        group_columns = "p.periodo, i.id_tipo, u.id_unidade_base" if by_item else "p.periodo"
+        order_columns = "p.periodo, nome_item, unidade" if by_item else "p.periodo"
+        dimension_joins = """
+            JOIN tipos_alimento t ON t.id_tipo = i.id_tipo
+            JOIN unidades b ON b.id_unidade = u.id_unidade_base
+        """ if by_item else ""
+        # Semanas e meses são somados primeiro por (período, item) e só então juntados com
+        # itens: o JOIN é feito uma vez por item em cada período, e não por dia. Por dia
+        # a tabela já tem uma linha por (dia, item)
+        inner_sum = "" if period == 'dia' else "SUM"
+        inner_group = "" if period == 'dia' else "GROUP BY periodo, m.id_item"
+        sql = f"""
+            SELECT
+                p.periodo,
+                {"t.nome AS nome_item, b.nome AS unidade," if by_item else ""}
+                SUM(p.quantidade_recebida * u.fator) AS quantidade_recebida,
+                SUM(p.quantidade_distribuida * u.fator) AS quantidade_distribuida,
+                SUM(p.entradas) AS entradas,
+                SUM(p.saidas) AS saidas
+            FROM (
                 SELECT
-                    i.id_item,
-                    i.nome_item,
-                    i.marca,
-                    i.unidade,
-                    dr.data_validade
-                FROM itens i
-                JOIN doacoes_recebidas dr ON i.id_item = dr.id_item
-                GROUP BY i.id_item, i.nome_item, i.marca, i.unidade, dr.data_validade
-                HAVING SUM(dr.quantidade) - COALESCE((SELECT SUM(quantidade) FROM doacoes_realizadas WHERE id_item = i.id_item), 0) > 0
-            """
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+                    {REPORT_PERIODS[period]} AS periodo,
+                    m.id_item,
+                    {inner_sum}(m.quantidade_recebida) AS quantidade_recebida,
+                    {inner_sum}(m.quantidade_distribuida) AS quantidade_distribuida,
+                    {inner_sum}(m.entradas) AS entradas,
+                    {inner_sum}(m.saidas) AS saidas
+                FROM movimentacao_diaria m
+                WHERE m.dia >= ? AND m.dia <= ? {item_filter}
+                {inner_group}
+            ) p
+            JOIN itens i ON i.id_item = p.id_item
+            JOIN unidades u ON u.id_unidade = i.id_unidade
+            {dimension_joins}
+            GROUP BY {group_columns}
+            ORDER BY {order_columns}
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Erro ao buscar todos os itens em estoque: {e}")
+            print(f"Erro ao montar o relatório de movimentação: {e}")
             return []
 
 
-class DoacaoRealizada(BaseModel):
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+def _month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+def _period_ends(first, last, period):
+    """ Últimos dias (domingo ou fim do mês) de cada período de first até last, inclusive """
+    if period == 'semana':
+        day = first + timedelta(days=6 - first.weekday())
+    else:
+        day = _month_end(first)
+    while day <= last:
+        yield day
+        day = day + timedelta(days=7) if period == 'semana' else _month_end(day + timedelta(days=1))
+
+
+class RetratoSaldo(BaseModel):
+    """ Saldo de cada item em datas passadas, a partir dos retratos periódicos (retratos_saldo).
+
+    get_stock_as_of(dia) começa no retrato mais próximo do dia pedido (ou no
+    saldo atual, ou no início do histórico) e aplica só as linhas de
+    movimentacao_diaria entre os dois, pela chave (dia, id_item): o custo
+    depende do intervalo entre os retratos, e não do tamanho do histórico.
+    """
+
     def __init__(self, conn):
-        super().__init__('doacoes_realizadas', conn)
+        super().__init__('retratos_saldo', conn)
 
-    def get_all_with_details(self):
+    def _balances_as_of(self, cursor, day):
+        """ {id_item: saldo ao fim de day (texto ISO)}, com os saldos zerados incluídos """
+        cursor.execute("SELECT MAX(dia) FROM retratos_saldo WHERE dia <= ?", (day,))
+        before = cursor.fetchone()[0]
+        cursor.execute("SELECT MIN(dia) FROM retratos_saldo WHERE dia > ?", (day,))
+        after = cursor.fetchone()[0]
+        # MIN e MAX em consultas separadas: cada um sozinho lê uma ponta da chave primária
+        cursor.execute("SELECT MIN(dia) FROM movimentacao_diaria")
+        first = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(dia) FROM movimentacao_diaria")
+        last = cursor.fetchone()[0]
+        target = _as_date(day)
+
+        def distance(anchor):
+            try:
+                return abs((_as_date(anchor) - target).days)
+            except ValueError:
+                return float('inf')
+
+        # Ponto de partida: (dias de movimentação a aplicar, SQL do saldo inicial, parâmetros, sinal do delta, faixa)
+        start = [(distance(first) if first and first <= day else 0, None, (), 1, (None, day))]
+        if before:
+            start.append((distance(before), "SELECT id_item, quantidade FROM retratos_saldo_itens WHERE dia = ?",
+                          (before,), 1, (before, day)))
+        if after:
+            start.append((distance(after), "SELECT id_item, quantidade FROM retratos_saldo_itens WHERE dia = ?",
+                          (after,), -1, (day, after)))
+        # O saldo atual inclui toda a movimentação (inclusive datas futuras)
+        start.append((distance(last) if last and last > day else 0, "SELECT id_item, quantidade FROM saldo_estoque",
+                      (), -1, (day, None)))
+        _, base_sql, base_params, sign, (low, high) = min(start, key=lambda option: option[0])
+
+        balances = {}
+        if base_sql:
+            cursor.execute(base_sql, base_params)
+            balances = dict(cursor.fetchall())
+        conditions, params = [], []
+        if low is not None:
+            conditions.append("dia > ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("dia <= ?")
+            params.append(high)
+        cursor.execute(f"""
+            SELECT id_item, SUM(quantidade_recebida - quantidade_distribuida) FROM movimentacao_diaria
+            WHERE {" AND ".join(conditions)}
+            GROUP BY id_item
+        """, params)
+        for id_item, delta in cursor.fetchall():
+            balances[id_item] = balances.get(id_item, 0.0) + sign * delta
+        return balances
+
+    @cached_read('retratos_saldo', 'movimentacao_diaria', 'saldo_estoque', 'itens')
+    def get_stock_as_of(self, when):
+        """ Saldo de cada item ao fim do dia when (date ou texto ISO), só os itens com saldo.
+
+        Retorna dicionários com id_item, nome_item, marca, unidade e quantidade
+        (na unidade do item), ordenados por nome_item, marca e unidade.
+        """
+        day = _as_date(when).isoformat()
         cursor = self.conn.cursor()
+        cursor.row_factory = None
         try:
-            cursor.execute("""
-                SELECT
-                    dr.id_doacao_realizada,
-                    b.nome AS beneficiario_nome,
-                    i.nome_item,
-                    i.marca,
-                    i.unidade,
-                    dr.quantidade,
-                    dr.data_doacao
-                FROM doacoes_realizadas dr
-                JOIN beneficiarios b ON dr.id_beneficiario = b.id_beneficiario
-                JOIN itens i ON dr.id_item = i.id_item
-            """
-            )
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            balances = {id_item: quantity for id_item, quantity in self._balances_as_of(cursor, day).items()
+                        if abs(quantity) > LOT_EPSILON}
+            cursor.execute("SELECT id_item, nome_item, marca, unidade FROM itens")
+            rows = [{"id_item": id_item, "nome_item": nome_item, "marca": marca, "unidade": unidade, "quantidade": balances[id_item]}
+                    for id_item, nome_item, marca, unidade in cursor.fetchall() if id_item in balances]
         except sqlite3.Error as e:
-            print(f"Erro ao buscar doações realizadas com detalhes: {e}")
+            print(f"Erro ao calcular o saldo em {day}: {e}")
             return []
+        rows.sort(key=lambda row: (normalize_key(row["nome_item"]), normalize_key(row["marca"]), normalize_key(row["unidade"])))
+        return rows
 
+    def get_snapshot_days(self):
+        """ Dias com retrato gravado, do mais antigo para o mais recente """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT dia FROM retratos_saldo ORDER BY dia")
+            return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Erro ao buscar os retratos do saldo: {e}")
+            return []
 
+    def create_snapshot(self, when):
+        """ Grava (ou refaz) o retrato do saldo ao fim do dia when; retorna o número de itens com saldo, ou None """
+        day = _as_date(when).isoformat()
+        try:
+            with self.transaction():
+                cursor = self.conn.cursor()
+                cursor.execute("DELETE FROM retratos_saldo_itens WHERE dia = ?", (day,))
+                cursor.execute("DELETE FROM retratos_saldo WHERE dia = ?", (day,))
+                balances = [(day, id_item, quantity) for id_item, quantity in self._balances_as_of(cursor, day).items()
+                            if abs(quantity) > LOT_EPSILON]
+                cursor.execute("INSERT INTO retratos_saldo (dia, gerado_em) VALUES (?, ?)",
+                               (day, datetime.now().isoformat(timespec='seconds')))
+                cursor.executemany("INSERT INTO retratos_saldo_itens (dia, id_item, quantidade) VALUES (?, ?, ?)", balances)
+            invalidate_cached_reads(self.conn, 'retratos_saldo')
+            return len(balances)
+        except sqlite3.Error as e:
+            print(f"Erro ao gravar o retrato do saldo de {day}: {e}")
+            return None
+
+    def refresh_snapshots(self, period='mes', today=None):
+        """ Grava os retratos que faltam: um no último dia de cada período já encerrado.
 
+        Vai do período da primeira movimentação até o último terminado antes de
+        today; cada retrato novo parte do anterior. Retorna quantos foram
+        gravados (0 se já estavam em dia), ou None em caso de erro.
+        """
+        if period not in SNAPSHOT_PERIODS:
+            raise ValueError(f"período inválido: {period} (use {', '.join(SNAPSHOT_PERIODS)})")
+        today = _as_date(today or date.today())
+        cursor = self.conn.cursor()
+        try:
+            # Datas fora do formato ISO ficam de fora (date() devolve NULL)
+            cursor.execute("SELECT MIN(date(dia)) FROM movimentacao_diaria")
+            first = cursor.fetchone()[0]
+            existing = set(self.get_snapshot_days())
+        except sqlite3.Error as e:
+            print(f"Erro ao buscar a movimentação para os retratos: {e}")
+            return None
+        if first is None:
+            return 0
+        created = 0
+        for day in _period_ends(date.fromisoformat(first), today - timedelta(days=1), period):
+            if day.isoformat() in existing:
+                continue
+            if self.create_snapshot(day) is None:
+                return None
+            created += 1
+        return created
 
@@ -0,0 +1,113 @@
+""" Execução de consultas fora da thread da interface.
+
+O Tk só pode ser manipulado pela thread principal, e uma consulta lenta
+executada nela congela a janela. O QueryExecutor roda as consultas em threads
+de trabalho, cada uma com a sua própria conexão SQLite, e devolve os
+resultados por uma fila que a interface esvazia periodicamente com poll()
+(agendado com after()). Os callbacks são sempre chamados dentro de poll(),
+portanto na thread que o chamou.
+
+Cada pedido tem uma chave: um pedido novo com a mesma chave substitui o
+anterior, que deixa de ser executado (se ainda estava na fila) ou tem o
+resultado descartado (se já estava em execução). Assim, ao digitar numa busca,
+só a consulta do último texto chega à tela.
+"""
+
+import queue
+import threading
+
+from models import get_db_connection
+
+
+class QueryExecutor:
+    """ Fila de consultas atendida por threads com conexões próprias.
+
+    func recebe a conexão da thread de trabalho e deve apenas ler; as
+    gravações continuam na conexão da interface, que publica os eventos do
+    change_bus. Bancos ':memory:' não são compartilhados entre conexões, então
+    o executor precisa de um arquivo.
+    """
+
+    def __init__(self, db_file, workers=1, profile=None):
+        self.db_file = db_file
+        self.profile = profile
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"query-executor-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, func, callback=None, errback=None):
+        """ Agenda func(conn); callback(resultado) é chamado por poll() se o pedido não for substituído """
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+        self._jobs.put((key, generation, func, callback, errback))
+        return generation
+
+    def cancel(self, key):
+        """ Descarta o pedido pendente ou em execução com esta chave """
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _is_current(self, key, generation):
+        with self._lock:
+            return self._generations.get(key) == generation
+
+    def _run(self):
+        conn = get_db_connection(self.db_file, self.profile)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
+                key, generation, func, callback, errback = job
+                if not self._is_current(key, generation):
+                    continue
+                result, error = None, None
+                try:
+                    result = func(conn)
+                except Exception as e:
+                    error = e
+                finally:
+                    # As consultas só leem; nada deve ficar aberto na conexão
+                    if conn.in_transaction:
+                        conn.rollback()
+                self._results.put((key, generation, result, error, callback, errback))
+        finally:
+            conn.close()
+
+    def poll(self):
+        """ Entrega os resultados prontos aos callbacks e retorna quantos foram entregues """
+        delivered = 0
+        while True:
+            try:
+                key, generation, result, error, callback, errback = self._results.get_nowait()
+            except queue.Empty:
+                return delivered
+            if not self._is_current(key, generation):
+                continue
+            if error is not None:
+                if errback:
+                    errback(error)
+                else:
+                    print(f"Erro na consulta em segundo plano '{key}': {error}")
+            elif callback:
+                callback(result)
+            delivered += 1
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            # Invalida tudo o que ainda está na fila
+            for key in self._generations:
+                self._generations[key] += 1
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,307 @@
+""" Rastreamento das consultas SQL dos modelos.
+
+Com o rastreamento ligado (enable_tracing), as conexões de get_db_connection
+passam a criar TracedCursor: cada comando é agrupado pelo seu formato (o SQL
+com os valores literais trocados por ?) e contabilizado em execuções, tempo
+total, percentis de latência, linhas devolvidas e erros. O tempo de um
+SELECT inclui a leitura das linhas (fetch*), pois o SQLite só calcula cada
+linha quando ela é pedida. Comandos mais lentos que slow_ms entram no
+registro de consultas lentas junto com o EXPLAIN QUERY PLAN.
+
+Desligado (padrão), as conexões usam o cursor comum, sem custo adicional.
+A variável de ambiente ESTOQUE_TRACE=1 liga o rastreamento ao abrir a
+interface, com o resumo impresso ao sair (ESTOQUE_SLOW_MS muda o limite).
+"""
+
+import atexit
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+
+DEFAULT_SLOW_MS = 100
+# Latências guardadas por formato de consulta para os percentis (amostragem reservatório acima disso)
+LATENCY_SAMPLES = 2048
+SLOW_LOG_SIZE = 200
+# Comandos cujo plano faz sentido pedir
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def query_shape(sql):
+    """ Formato da consulta: espaços normalizados, literais viram ? e listas IN (?, ?, ...) viram (...) """
+    shape = _STRING_LITERAL.sub("?", sql)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _WHITESPACE.sub(" ", shape).strip()
+    return _PARAMETER_LIST.sub("(...)", shape)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _ShapeStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples = []
+
+    def add(self, elapsed, rows, rng):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.rows += rows
+        if len(self.samples) < LATENCY_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            slot = rng.randrange(self.count)
+            if slot < LATENCY_SAMPLES:
+                self.samples[slot] = elapsed
+
+
+class QueryTracer:
+    """ Estatísticas por formato de consulta e registro das consultas lentas (seguro entre threads) """
+
+    def __init__(self, slow_ms=DEFAULT_SLOW_MS, log_file=None):
+        self.slow_ms = slow_ms
+        self.log_file = log_file
+        self.started = datetime.now()
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+
+    def record(self, conn, sql, params, elapsed, rows, error=None):
+        shape = query_shape(sql)
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = _ShapeStats()
+            if error is not None:
+                stats.errors += 1
+            stats.add(elapsed, rows, self._rng)
+        if elapsed * 1000 >= self.slow_ms:
+            self._log_slow(conn, sql, params, elapsed, rows)
+
+    def _log_slow(self, conn, sql, params, elapsed, rows):
+        entry = {
+            "quando": datetime.now().isoformat(timespec="seconds"),
+            "ms": round(elapsed * 1000, 2),
+            "linhas": rows,
+            "sql": _WHITESPACE.sub(" ", sql).strip(),
+            "plano": explain(conn, sql, params),
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+            if self.log_file:
+                try:
+                    with open(self.log_file, "a", encoding="utf-8") as file:
+                        file.write(f"{entry['quando']} {entry['ms']:.2f} ms, {rows} linha(s): {entry['sql']}\n")
+                        for line in entry["plano"]:
+                            file.write(f"    {line}\n")
+                except OSError as e:
+                    print(f"Erro ao gravar o registro de consultas lentas: {e}")
+
+    def summary(self):
+        """ Uma linha por formato de consulta, da que consumiu mais tempo para a que consumiu menos """
+        with self._lock:
+            items = [(shape, stats, sorted(stats.samples)) for shape, stats in self._stats.items()]
+        rows = []
+        for shape, stats, ordered in items:
+            rows.append({
+                "consulta": shape,
+                "execucoes": stats.count,
+                "erros": stats.errors,
+                "total_ms": round(stats.total * 1000, 3),
+                "media_ms": round(stats.total * 1000 / stats.count, 3),
+                "p50_ms": round(_percentile(ordered, 0.5) * 1000, 3),
+                "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+                "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+                "max_ms": round(stats.max * 1000, 3),
+                "linhas": stats.rows,
+            })
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+
+    def format_summary(self, limit=30):
+        """ Resumo em texto (consultas mais custosas e as últimas lentas) """
+        lines = [f"Consultas SQL desde {self.started:%d/%m/%Y %H:%M:%S} (lentas: >= {self.slow_ms} ms)",
+                 f"{'execuções':>9} {'total ms':>10} {'média':>8} {'p95':>8} {'máx':>8} {'linhas':>9}  consulta"]
+        for row in self.summary()[:limit]:
+            lines.append(f"{row['execucoes']:>9} {row['total_ms']:>10.1f} {row['media_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                         f"{row['max_ms']:>8.2f} {row['linhas']:>9}  {row['consulta'][:160]}")
+        with self._lock:
+            slow = list(self.slow_queries)
+        if slow:
+            lines.append("")
+            lines.append(f"Últimas {len(slow)} consulta(s) lenta(s):")
+            for entry in slow[-10:]:
+                lines.append(f"  {entry['quando']} {entry['ms']:.2f} ms, {entry['linhas']} linha(s): {entry['sql'][:200]}")
+                lines.extend(f"      {line}" for line in entry["plano"])
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries.clear()
+            self.started = datetime.now()
+
+
+def explain(conn, sql, params=()):
+    """ Linhas do EXPLAIN QUERY PLAN (indentadas como na árvore do SQLite); lista vazia se não se aplica """
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    try:
+        # Cursor comum: o EXPLAIN não entra nas estatísticas
+        cursor = sqlite3.Cursor(conn)
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except (sqlite3.Error, ValueError) as e:
+        return [f"(plano indisponível: {e})"]
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node_id] - 1) + detail)
+    return lines
+
+
+class TracedCursor(sqlite3.Cursor):
+    """ Cursor que mede cada comando, da execução até a última linha lida ou o próximo comando """
+
+    _pending = None  # [sql, params, segundos acumulados, linhas]
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None and _tracer is not None:
+            _tracer.record(self.connection, pending[0], pending[1], pending[2], pending[3])
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except Exception as e:
+            if _tracer is not None:
+                _tracer.record(self.connection, sql, parameters, time.perf_counter() - started, 0, e)
+            raise
+        self._pending = [sql, parameters, time.perf_counter() - started, 0]
+        if self.description is None:
+            # Sem linhas para ler (INSERT, UPDATE, PRAGMA de escrita...)
+            self._pending[3] = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            if _tracer is not None:
+                _tracer.record(self.connection, sql, (), time.perf_counter() - started, 0, e)
+            raise
+        if _tracer is not None:
+            _tracer.record(self.connection, sql, (), time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        pending = self._pending
+        if pending is not None:
+            pending[2] += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        if self._pending is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._pending[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        pending = self._pending
+        if pending is not None:
+            pending[2] += time.perf_counter() - started
+            pending[3] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Cursores descartados sem ler até o fim (ex.: fetchone de um único registro)
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+_tracer = None
+
+
+def active_tracer():
+    """ QueryTracer em uso, ou None com o rastreamento desligado """
+    return _tracer
+
+
+def enable_tracing(slow_ms=DEFAULT_SLOW_MS, log_file=None, dump_on_exit=False):
+    """ Liga o rastreamento em todas as conexões dos modelos (inclusive as já abertas) """
+    global _tracer
+    if _tracer is None:
+        _tracer = QueryTracer(slow_ms, log_file)
+        if dump_on_exit:
+            atexit.register(_dump_on_exit)
+    else:
+        _tracer.slow_ms = slow_ms
+        _tracer.log_file = log_file
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    _tracer = None
+
+
+def _dump_on_exit():
+    if _tracer is not None:
+        print(_tracer.format_summary())
@@ -0,0 +1,438 @@
+""" Exportação dos relatórios de entradas, saídas, estoque e alertas para CSV, JSON Lines ou XLSX.
+
+As linhas vão do cursor direto para o arquivo, uma de cada vez (tuplas, sem
+sqlite3.Row nem listas intermediárias): a memória usada não depende do número
+de linhas exportadas. Os filtros de data (recebimento, doação ou validade,
+conforme o relatório) e de tipo de alimento entram no WHERE; sem o filtro de
+tipo, a ordem segue os índices de data, sem ordenação temporária.
+
+O XLSX é montado com zipfile: a planilha é escrita aos poucos dentro do zip,
+com textos inline (sem a tabela de textos compartilhados, que exigiria todos
+os valores em memória). Acima do limite de linhas do Excel o relatório
+continua em uma nova aba. CSV e JSON Lines podem ser compactados com gzip
+(arquivo terminado em .gz).
+
+Uso: python3 report_export.py entradas entradas.csv --inicio 01/01/2025 --fim 31/12/2025
+     python3 report_export.py saidas saidas.jsonl.gz --tipo Arroz
+     python3 report_export.py estoque estoque.xlsx --db outro.db
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import validators
+from alerts import ALERT_THRESHOLDS
+from models import DATABASE, DEFAULT_FETCH_SIZE, DoacaoRecebida, DoacaoRealizada, get_db_connection
+
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'xlsx')
+# Intervalo, em linhas, entre as chamadas de progress (múltiplo de DEFAULT_FETCH_SIZE)
+PROGRESS_EVERY = 10000
+# Limite de linhas de uma aba do Excel (o cabeçalho conta)
+XLSX_MAX_ROWS = 1048576
+
+# Para cada relatório: título, colunas (campo, cabeçalho), consulta sem WHERE, condições fixas,
+# coluna filtrada pelas datas e o restante da consulta (agrupamento e ordem)
+REPORTS = {
+    'entradas': {
+        "titulo": "Entradas",
+        "colunas": (("id_doacao_recebida", "ID Doação"), ("doador_nome", "Doador"), ("nome_item", "Tipo de Alimento"),
+                    ("marca", "Marca"), ("unidade", "Unidade"), ("quantidade", "Quantidade"),
+                    ("data_recebimento", "Data Recebimento"), ("data_validade", "Data Validade")),
+        "sql": DoacaoRecebida.DETAILS_SQL,
+        "condicoes": (),
+        "data": "dr.data_recebimento",
+        "fim_sql": "ORDER BY dr.data_recebimento, dr.id_doacao_recebida",
+    },
+    'saidas': {
+        "titulo": "Saídas",
+        "colunas": (("id_doacao_realizada", "ID Doação"), ("beneficiario_nome", "Beneficiário"),
+                    ("nome_item", "Tipo de Alimento"), ("marca", "Marca"), ("unidade", "Unidade"),
+                    ("quantidade", "Quantidade"), ("data_doacao", "Data Doação")),
+        "sql": DoacaoRealizada.DETAILS_SQL,
+        "condicoes": (),
+        "data": "dr.data_doacao",
+        "fim_sql": "ORDER BY dr.data_doacao, dr.id_doacao_realizada",
+    },
+    # Quantidade restante por item e validade, como DoacaoRecebida.iter_all_stock_items
+    'estoque': {
+        "titulo": "Estoque",
+        "colunas": (("id_item", "ID Item"), ("nome_item", "Tipo de Alimento"), ("marca", "Marca"),
+                    ("unidade", "Unidade"), ("data_validade", "Data Validade"),
+                    ("quantidade_disponivel", "Quantidade Disponível")),
+        "sql": """
+            SELECT i.id_item, i.nome_item, i.marca, i.unidade, l.data_validade,
+                   SUM(l.quantidade_restante) AS quantidade_disponivel
+            FROM lotes l
+            JOIN itens i ON l.id_item = i.id_item
+        """,
+        "condicoes": ("l.quantidade_restante > 0",),
+        "data": "l.data_validade",
+        "fim_sql": "GROUP BY l.id_item, l.data_validade ORDER BY l.id_item, l.data_validade",
+    },
+    # Lotes com saldo que vencem na faixa de datas (padrão: de hoje até o maior prazo dos alertas)
+    'alertas': {
+        "titulo": "Alertas",
+        "colunas": (("id_doacao_recebida", "ID Doação"), ("doador_nome", "Doador"), ("nome_item", "Tipo de Alimento"),
+                    ("marca", "Marca"), ("unidade", "Unidade"), ("quantidade", "Quantidade Restante"),
+                    ("data_recebimento", "Data Recebimento"), ("data_validade", "Data Validade")),
+        "sql": """
+            SELECT dr.id_doacao_recebida, d.nome AS doador_nome, i.nome_item, i.marca, i.unidade,
+                   l.quantidade_restante AS quantidade, dr.data_recebimento, l.data_validade
+            FROM lotes l
+            JOIN doacoes_recebidas dr ON dr.id_doacao_recebida = l.id_doacao_recebida
+            JOIN doadores d ON dr.id_doador = d.id_doador
+            JOIN itens i ON l.id_item = i.id_item
+        """,
+        "condicoes": ("l.quantidade_restante > 0",),
+        "data": "l.data_validade",
+        "fim_sql": "ORDER BY l.data_validade, l.id_lote",
+    },
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def detect_format(path):
+    """ (formato, gzip) pela extensão do arquivo: .csv, .jsonl/.ndjson ou .xlsx, com .gz opcional """
+    name = path.lower()
+    compress = name.endswith(".gz")
+    if compress:
+        name = name[:-3]
+    for extension, fmt in ((".csv", 'csv'), (".jsonl", 'jsonl'), (".ndjson", 'jsonl'), (".xlsx", 'xlsx')):
+        if name.endswith(extension):
+            return fmt, compress
+    return None, compress
+
+
+def build_query(report, start=None, end=None, nome_item=None, today=None):
+    """ (sql, parâmetros) do relatório com os filtros; start e end são datas ISO (inclusive) """
+    spec = REPORTS[report]
+    conditions = list(spec["condicoes"])
+    params = []
+    if report == 'alertas':
+        today = today or date.today()
+        start = start or today.isoformat()
+        end = end or (today + timedelta(days=ALERT_THRESHOLDS[-1])).isoformat()
+    # Datas comparadas como texto ISO, para que a faixa use o índice da coluna
+    if start:
+        conditions.append(f"{spec['data']} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{spec['data']} <= ?")
+        params.append(end)
+    if nome_item:
+        conditions.append("i.id_tipo IN (SELECT id_tipo FROM tipos_alimento WHERE chave = ?)")
+        params.append(validators.normalize_key(nome_item))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{spec['sql']} {where} {spec['fim_sql']}", params
+
+
+def _read_rows(cursor, counter, total, progress, cancel):
+    """ Gera as linhas do cursor em blocos de fetchmany, contando em counter[0].
+
+    progress(linhas, total) é chamado a cada PROGRESS_EVERY linhas e ao final;
+    cancel é verificado a cada bloco.
+    """
+    while True:
+        rows = cursor.fetchmany(DEFAULT_FETCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+        counter[0] += len(rows)
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+        if progress and counter[0] % PROGRESS_EVERY < len(rows):
+            progress(counter[0], total)
+    if progress:
+        progress(counter[0], total)
+
+
+def _iso(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return validators.parse_date(value) if value else None
+
+
+def write_csv(file, headers, rows, delimiter=";"):
+    writer = csv.writer(file, delimiter=delimiter)
+    writer.writerow(headers)
+    writer.writerows(rows)
+
+
+def write_jsonl(file, fields, rows):
+    for row in rows:
+        file.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+        file.write("\n")
+
+
+# Caracteres que o XML precisa escapar ou não aceita
+_XML_SPECIAL = re.compile("[&<>\x00-\x08\x0b\x0c\x0e-\x1f]")
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_EXCEL_EPOCH = date(1899, 12, 30)
+_XLSX_NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+_XLSX_REL_NS = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+# Estilos: 0 padrão, 1 data (formato 14, data curta do sistema), 2 cabeçalho em negrito
+_XLSX_STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet {_XLSX_NS}>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/><xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>
+</styleSheet>"""
+
+
+@lru_cache(maxsize=8192)
+def _date_cell(value):
+    """ Célula de data (número de série do Excel, estilo 1); None se value não é uma data ISO """
+    try:
+        return f'<c s="1"><v>{(date.fromisoformat(value) - _EXCEL_EPOCH).days}</v></c>'
+    except (TypeError, ValueError):
+        return None
+
+
+def _xlsx_cell(value, is_date):
+    # Células sem a referência (r): a posição na linha define a coluna, por isso None vira <c/>
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value!r}</v></c>"
+    if is_date:
+        cell = _date_cell(value)
+        if cell:
+            return cell
+    text = str(value)
+    if _XML_SPECIAL.search(text):
+        text = escape(_XML_INVALID.sub("", text))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def write_xlsx(file, title, fields, headers, rows, max_rows=XLSX_MAX_ROWS):
+    """ Grava um XLSX em file (caminho ou arquivo binário com seek); datas ISO nas colunas data_* viram datas do Excel """
+    date_columns = [field.startswith("data_") for field in fields]
+    header_xml = "".join(f'<c s="2" t="inlineStr"><is><t>{escape(header)}</t></is></c>' for header in headers)
+    sheets = 0
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as archive:
+        rows = iter(rows)
+        row = next(rows, None)
+        # Sempre ao menos uma aba (só com o cabeçalho, se não há linhas)
+        while sheets == 0 or row is not None:
+            sheets += 1
+            with archive.open(f"xl/worksheets/sheet{sheets}.xml", "w") as sheet:
+                sheet.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet {_XLSX_NS}>'
+                            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                            'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+                            f'<sheetData><row r="1">{header_xml}</row>'.encode("utf-8"))
+                number = 1
+                buffer = []
+                while row is not None and number < max_rows:
+                    number += 1
+                    cells = "".join([_xlsx_cell(value, is_date) for value, is_date in zip(row, date_columns)])
+                    buffer.append(f'<row r="{number}">{cells}</row>')
+                    # Escreve em blocos: cada write no zip passa pelo compressor
+                    if len(buffer) == 1000:
+                        sheet.write("".join(buffer).encode("utf-8"))
+                        buffer.clear()
+                    row = next(rows, None)
+                buffer.append("</sheetData></worksheet>")
+                sheet.write("".join(buffer).encode("utf-8"))
+
+        names = [title if index == 1 else f"{title} {index}" for index in range(1, sheets + 1)]
+        archive.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            + "".join(f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for index in range(1, sheets + 1))
+            + '</Types>'))
+        archive.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'))
+        archive.writestr("xl/workbook.xml", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<workbook {_XLSX_NS} {_XLSX_REL_NS}><sheets>'
+            + "".join(f'<sheet name="{escape(name)}" sheetId="{index}" r:id="rId{index}"/>'
+                      for index, name in enumerate(names, start=1))
+            + '</sheets></workbook>'))
+        archive.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(f'<Relationship Id="rId{index}" '
+                      'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                      f'Target="worksheets/sheet{index}.xml"/>' for index in range(1, sheets + 1))
+            + f'<Relationship Id="rId{sheets + 1}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            '</Relationships>'))
+        archive.writestr("xl/styles.xml", _XLSX_STYLES)
+    return sheets
+
+
+def export_report(conn, report, path, fmt=None, compress=None, start=None, end=None, nome_item=None,
+                  progress=None, cancel=None, today=None):
+    """ Exporta um relatório de REPORTS para path e retorna o número de linhas gravadas.
+
+    fmt ('csv', 'jsonl' ou 'xlsx') e compress (gzip) são deduzidos da
+    extensão quando não informados. start e end (date ou texto DD/MM/YYYY ou
+    ISO, inclusive) filtram pela data do relatório; nome_item pelo tipo de
+    alimento (maiúsculas e acentos ignorados). progress(linhas, total) é
+    chamado a cada PROGRESS_EVERY linhas e ao final; cancel é um
+    threading.Event que interrompe a exportação (ExportCancelled). Em caso de
+    erro ou cancelamento o arquivo parcial é apagado. Relatório, formato ou
+    data inválidos levantam ValueError.
+    """
+    if report not in REPORTS:
+        raise ValueError(f"relatório inválido: {report} (use {', '.join(REPORTS)})")
+    detected, detected_compress = detect_format(path)
+    fmt = fmt or detected
+    compress = detected_compress if compress is None else compress
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"formato inválido: {fmt} (use {', '.join(EXPORT_FORMATS)})")
+    if fmt == 'xlsx' and compress:
+        raise ValueError("o XLSX já é compactado; use gzip só com CSV ou JSON Lines")
+    start, end = _iso(start), _iso(end)
+
+    spec = REPORTS[report]
+    fields = [field for field, _ in spec["colunas"]]
+    headers = [header for _, header in spec["colunas"]]
+    sql, params = build_query(report, start, end, nome_item, today)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    total = None
+    if progress:
+        cursor.execute(f"SELECT COUNT(*) FROM ({sql})", params)
+        total = cursor.fetchone()[0]
+    cursor.execute(sql, params)
+    counter = [0]
+    rows = _read_rows(cursor, counter, total, progress, cancel)
+    try:
+        if fmt == 'xlsx':
+            write_xlsx(path, spec["titulo"], fields, headers, rows)
+        else:
+            # utf-8-sig: o Excel reconhece os acentos do CSV
+            encoding = "utf-8-sig" if fmt == 'csv' else "utf-8"
+            if compress:
+                file = gzip.open(path, "wt", encoding=encoding, newline="", compresslevel=6)
+            else:
+                file = open(path, "w", encoding=encoding, newline="")
+            with file:
+                if fmt == 'csv':
+                    write_csv(file, headers, rows)
+                else:
+                    write_jsonl(file, fields, rows)
+    except BaseException:
+        cursor.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return counter[0]
+
+
+class ExportJob:
+    """ Exportação em uma thread daemon com conexão própria, acompanhada pela interface por polling """
+
+    def __init__(self, db_file, report, path, profile=None, **options):
+        self.db_file = db_file
+        self.report = report
+        self.path = path
+        self.profile = profile
+        self.options = options
+        # Linhas gravadas até agora, total previsto (None antes da contagem), resultado e erro
+        self.done = 0
+        self.total = None
+        self.rows = None
+        self.error = None
+        self.elapsed = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="report-export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _progress(self, done, total):
+        self.done, self.total = done, total
+
+    def _run(self):
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = get_db_connection(self.db_file, self.profile)
+            self.rows = export_report(conn, self.report, self.path, progress=self._progress, cancel=self._cancel,
+                                      **self.options)
+        except (sqlite3.Error, OSError, ValueError, ExportCancelled) as e:
+            self.error = e
+        finally:
+            if conn is not None:
+                conn.close()
+            self.elapsed = time.perf_counter() - started
+            self._finished.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta entradas, saídas, estoque ou alertas para CSV, JSON Lines ou XLSX")
+    parser.add_argument("relatorio", choices=list(REPORTS))
+    parser.add_argument("arquivo", help="arquivo de saída (.csv, .jsonl ou .xlsx, com .gz para compactar)")
+    parser.add_argument("--db", default=DATABASE)
+    parser.add_argument("--formato", choices=EXPORT_FORMATS, help="formato, se não for o da extensão")
+    parser.add_argument("--gzip", action="store_true", help="compacta com gzip (CSV e JSON Lines)")
+    parser.add_argument("--inicio", help="data inicial (DD/MM/YYYY ou YYYY-MM-DD)")
+    parser.add_argument("--fim", help="data final, inclusive")
+    parser.add_argument("--tipo", help="só este tipo de alimento")
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        percent = f" ({done * 100 // total}%)" if total else ""
+        print(f"\r{done}/{total} linhas{percent}", end="", file=sys.stderr, flush=True)
+
+    conn = get_db_connection(args.db)
+    try:
+        started = time.perf_counter()
+        rows = export_report(conn, args.relatorio, args.arquivo, args.formato, args.gzip or None, args.inicio,
+                             args.fim, args.tipo, progress=progress)
+        print(file=sys.stderr)
+        print(f"{rows} linhas exportadas para {args.arquivo} em {time.perf_counter() - started:.1f} s.")
+    except ValueError as e:
+        parser.error(str(e))
+    except (sqlite3.Error, OSError) as e:
+        print(f"\nErro ao exportar o relatório: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,109 @@
+""" Índice em memória para o autocompletar dos comboboxes.
+
+Os nomes são guardados com chave normalizada (validators.normalize_key) em duas
+listas ordenadas: uma com o nome inteiro e outra com cada palavra do nome. Uma
+busca é uma bissecção seguida da leitura das entradas que começam com o texto
+digitado, parando quando o limite de resultados é atingido, então o custo não
+depende do tamanho da tabela.
+"""
+
+from bisect import bisect_left, insort
+
+from validators import normalize_key
+
+
+# Maior caractere possível: (prefixo + _END,) fica depois de toda chave que começa com o prefixo
+_END = "\U0010ffff"
+
+
+class NameIndex:
+    """ Busca por prefixo em nomes, com os resultados mais relevantes primeiro.
+
+    Cada entrada tem um id (ID do registro ou o próprio texto, para listas de
+    valores distintos), o nome indexado e o rótulo exibido no combobox. Os
+    ids de um índice devem ser todos do mesmo tipo.
+    Ordem dos resultados: nomes que começam com o texto digitado, em ordem
+    alfabética; depois nomes em que outra palavra começa com ele.
+    """
+
+    def __init__(self, limit=100):
+        self.limit = limit
+        self._entries = {}  # id -> (rótulo, chave, palavras)
+        self._names = []    # [(chave, id)] em ordem
+        self._words = []    # [(palavra, id)] em ordem
+
+    @classmethod
+    def build(cls, rows, limit=100):
+        """ Cria o índice a partir de (id, nome, rótulo), ordenando uma única vez """
+        index = cls(limit)
+        for entry_id, name, label in rows:
+            key = normalize_key(name)
+            index._entries[entry_id] = (label, key, tuple(sorted(set(key.split()))))
+        index._names = sorted((key, entry_id) for entry_id, (_, key, _) in index._entries.items())
+        index._words = sorted((word, entry_id) for entry_id, (_, _, words) in index._entries.items() for word in words)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._entries
+
+    def add(self, entry_id, name, label=None):
+        """ Inclui ou atualiza uma entrada """
+        if entry_id in self._entries:
+            self.remove(entry_id)
+        key = normalize_key(name)
+        words = tuple(sorted(set(key.split())))
+        self._entries[entry_id] = (name if label is None else label, key, words)
+        insort(self._names, (key, entry_id))
+        for word in words:
+            insort(self._words, (word, entry_id))
+
+    def remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        _, key, words = entry
+        self._delete(self._names, (key, entry_id))
+        for word in words:
+            self._delete(self._words, (word, entry_id))
+
+    @staticmethod
+    def _delete(entries, value):
+        position = bisect_left(entries, value)
+        if position < len(entries) and entries[position] == value:
+            del entries[position]
+
+    def search(self, query, limit=None):
+        """ Rótulos das entradas em que cada palavra da busca é início de uma palavra do nome """
+        limit = limit or self.limit
+        query_words = normalize_key(query).split()
+        if not query_words:
+            return [self._entries[entry_id][0] for _, entry_id in self._names[:limit]]
+
+        query_key = " ".join(query_words)
+        found = []
+        seen = set()
+        position = bisect_left(self._names, (query_key,))
+        end = bisect_left(self._names, (query_key + _END,))
+        for _, entry_id in self._names[position:min(end, position + limit)]:
+            found.append(entry_id)
+            seen.add(entry_id)
+
+        # A palavra mais longa da busca é a que menos candidatos devolve
+        longest = max(query_words, key=len)
+        others = list(query_words)
+        others.remove(longest)
+        position = bisect_left(self._words, (longest,))
+        end = bisect_left(self._words, (longest + _END,))
+        while position < end and len(found) < limit:
+            entry_id = self._words[position][1]
+            position += 1
+            if entry_id in seen:
+                continue
+            words = self._entries[entry_id][2]
+            if all(any(word.startswith(other) for word in words) for other in others):
+                found.append(entry_id)
+                seen.add(entry_id)
+        return [self._entries[entry_id][0] for entry_id in found]
@@ -0,0 +1,108 @@
+""" Retratos periódicos do saldo de estoque, gravados em segundo plano, e consulta do saldo em uma data.
+
+SnapshotWorker é uma thread com conexão própria que chama
+RetratoSaldo.refresh_snapshots ao iniciar e depois a cada interval segundos:
+os retratos dos períodos já encerrados (fins de mês, por padrão) que ainda não
+existem, ou que foram apagados por uma doação com data retroativa, são
+gravados a partir do anterior. A interface inicia o worker ao abrir e o para
+ao fechar. Sem retratos a consulta continua correta, só percorre mais linhas
+de movimentacao_diaria.
+
+Uso: python stock_snapshots.py estoque_doacoes.db --data 2025-06-30
+     python stock_snapshots.py estoque_doacoes.db --atualizar --periodo semana
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+
+import validators
+from models import DATABASE, SNAPSHOT_PERIODS, RetratoSaldo, get_db_connection
+
+
+# Segundos entre as verificações do worker (um novo período termina no máximo uma vez por dia)
+DEFAULT_INTERVAL = 6 * 60 * 60
+
+
+class SnapshotWorker:
+    """ Atualiza os retratos do saldo em uma thread daemon, com conexão própria """
+
+    def __init__(self, db_file, period='mes', interval=DEFAULT_INTERVAL, profile=None):
+        if period not in SNAPSHOT_PERIODS:
+            raise ValueError(f"período inválido: {period} (use {', '.join(SNAPSHOT_PERIODS)})")
+        self.db_file = db_file
+        self.period = period
+        self.interval = interval
+        self.profile = profile
+        # Retratos gravados na última atualização (None antes da primeira ou após um erro)
+        self.last_created = None
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stock-snapshots", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wait_idle(self, timeout=None):
+        """ Espera a primeira atualização terminar; retorna False se o tempo acabou antes """
+        return self._done.wait(timeout)
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        try:
+            conn = get_db_connection(self.db_file, self.profile)
+        except sqlite3.Error as e:
+            print(f"Erro ao abrir o banco para os retratos do saldo: {e}")
+            self._done.set()
+            return
+        try:
+            while not self._stop.is_set():
+                self.last_created = RetratoSaldo(conn).refresh_snapshots(self.period)
+                self._done.set()
+                self._stop.wait(self.interval)
+        finally:
+            conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retratos periódicos do saldo e saldo de cada item em uma data")
+    parser.add_argument("db", nargs="?", default=DATABASE)
+    parser.add_argument("--data", help="mostra o saldo de cada item ao fim desta data (DD/MM/YYYY ou YYYY-MM-DD)")
+    parser.add_argument("--atualizar", action="store_true", help="grava os retratos que faltam")
+    parser.add_argument("--periodo", choices=SNAPSHOT_PERIODS, default='mes', help="intervalo entre os retratos")
+    args = parser.parse_args(argv)
+    try:
+        day = validators.parse_date(args.data) if args.data else None
+    except ValueError:
+        parser.error(f"data inválida: {args.data}")
+
+    conn = get_db_connection(args.db)
+    try:
+        model = RetratoSaldo(conn)
+        if args.atualizar or not day:
+            started = time.perf_counter()
+            created = model.refresh_snapshots(args.periodo)
+            if created is None:
+                return 1
+            print(f"{created} retrato(s) gravado(s) em {time.perf_counter() - started:.3f} s; "
+                  f"{len(model.get_snapshot_days())} no total.")
+        if day:
+            started = time.perf_counter()
+            rows = model.get_stock_as_of(day)
+            elapsed = time.perf_counter() - started
+            for row in rows:
+                print(f"{row['nome_item']} ({row['marca']}): {row['quantidade']:.2f} {row['unidade']}")
+            print(f"{len(rows)} itens com saldo em {day}, calculado em {elapsed:.3f} s.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+""" Gerador de dados sintéticos para medir o sistema em escala realista.
+
+Com a mesma semente o banco gerado é sempre o mesmo, o que permite comparar
+medições entre versões do código. As distribuições imitam as de um banco de
+alimentos: poucos doadores respondem pela maior parte das doações, há mais
+entradas aos sábados e nas campanhas de fim de ano, cada tipo de alimento
+tem algumas marcas dominantes e uma validade típica, e as doações realizadas
+consomem os lotes em ordem de validade (FEFO), como DoacaoRealizada.save.
+
+As doações são gravadas com executemany em lotes de batch_size, e a alocação
+FEFO é simulada em memória (a memória usada cresce com o número de doações).
+
+Uso: python synthetic_data.py banco_teste.db --doacoes-recebidas 1000000 --doacoes-realizadas 800000
+"""
+
+import argparse
+import heapq
+import random
+import time
+from bisect import bisect_right
+from datetime import date, timedelta
+from itertools import accumulate
+
+from database import create_tables
+from models import LOT_EPSILON, get_db_connection, intern_item, invalidate_cached_reads
+
+
+# (tipo de alimento, unidade, validade típica em dias, marcas em ordem de preferência, quantidades comuns)
+FOODS = [
+    ("Arroz", "kg", 365, ["Tio João", "Camil", "Prato Fino", "Namorado", "Blue Ville"], [1, 2, 5, 5, 10, 25]),
+    ("Feijão", "kg", 270, ["Camil", "Kicaldo", "Broto Legal", "Tio João"], [1, 1, 2, 5, 10]),
+    ("Macarrão", "pacote", 540, ["Renata", "Adria", "Santa Amália", "Barilla"], [1, 2, 5, 10, 20]),
+    ("Óleo de soja", "L", 365, ["Soya", "Liza", "Cocamar"], [1, 2, 6, 12]),
+    ("Açúcar", "kg", 720, ["União", "Caravelas", "Da Barra"], [1, 2, 5, 10]),
+    ("Café", "pacote", 240, ["Pilão", "Melitta", "3 Corações", "Café do Ponto"], [1, 2, 4, 10]),
+    ("Leite UHT", "L", 120, ["Italac", "Piracanjuba", "Parmalat", "Ninho"], [1, 6, 12, 12, 24]),
+    ("Leite em pó", "lata", 540, ["Ninho", "Itambé", "Piracanjuba"], [1, 2, 4, 6]),
+    ("Farinha de mandioca", "kg", 180, ["Yoki", "Da Terrinha", "Pinduca"], [1, 2, 5]),
+    ("Fubá", "kg", 180, ["Yoki", "Sinhá", "Granfino"], [1, 2, 5]),
+    ("Sardinha", "lata", 900, ["Gomes da Costa", "Coqueiro", "88"], [1, 3, 6, 12, 24]),
+    ("Molho de tomate", "unidade", 365, ["Quero", "Pomarola", "Fugini", "Heinz"], [1, 3, 6, 12]),
+    ("Biscoito", "pacote", 180, ["Piraquê", "Marilan", "Vitarella", "Bauducco"], [1, 2, 5, 10, 20]),
+    ("Sal", "kg", 1080, ["Cisne", "Lebre", "Mossoró"], [1, 1, 2, 5]),
+    ("Achocolatado", "lata", 360, ["Nescau", "Toddy", "Ovomaltine"], [1, 2, 4]),
+    ("Pão de forma", "pacote", 10, ["Pullman", "Wickbold", "Seven Boys"], [1, 2, 5, 10]),
+]
+FIRST_NAMES = ["Maria", "José", "Ana", "João", "Francisca", "Antônio", "Adriana", "Carlos", "Juliana", "Paulo",
+               "Márcia", "Pedro", "Fernanda", "Lucas", "Patrícia", "Luiz", "Aline", "Marcos", "Sandra", "Rafael"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+              "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo", "Melo", "Barbosa", "Rocha", "Dias", "Nascimento"]
+COMPANIES = ["Supermercado", "Padaria", "Mercearia", "Atacadão", "Distribuidora", "Igreja", "Escola", "Condomínio"]
+INSTITUTIONS = ["Creche", "Associação de Moradores", "Casa de Acolhida", "Abrigo", "Projeto Social", "Lar de Idosos"]
+NEIGHBORHOODS = ["Centro", "Vila Nova", "Jardim América", "São José", "Boa Vista", "Santa Cruz", "Bela Vista"]
+
+DEFAULT_SEED = 42
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _zipf_weights(count, exponent=1.0):
+    """ Pesos acumulados em que o primeiro é o mais frequente (poucos concentram a maior parte) """
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def _person(rng, index, organizations):
+    if rng.random() < 0.3:
+        name = f"{rng.choice(organizations)} {rng.choice(LAST_NAMES)} {rng.choice(NEIGHBORHOODS)}"
+    else:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+    phone = f"({rng.randint(11, 99)}) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}" if rng.random() < 0.8 else ""
+    email = f"contato{index}@exemplo.org" if rng.random() < 0.5 else ""
+    address = f"Rua {rng.choice(LAST_NAMES)}, {rng.randint(1, 2000)} - {rng.choice(NEIGHBORHOODS)}"
+    return name, phone, email, address
+
+
+def _item_rows(rng, count):
+    """ count itens (tipo, marca, unidade): as marcas conhecidas primeiro, depois marcas regionais """
+    rows = []
+    for food_name, unit, _, brands, _ in FOODS:
+        rows.extend((food_name, brand, unit) for brand in brands)
+    regional = 1
+    while len(rows) < count:
+        food_name, unit = rng.choice(FOODS)[:2]
+        rows.append((food_name, f"Marca Regional {regional}", unit))
+        regional += 1
+    return rows[:count]
+
+
+def _day_weights(start, days):
+    """ Peso de cada dia: sábados e as campanhas de novembro/dezembro recebem mais doações """
+    weights = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        weight = 1.0
+        if day.weekday() == 5:
+            weight *= 2.0
+        elif day.weekday() == 6:
+            weight *= 0.3
+        if day.month in (11, 12):
+            weight *= 1.8
+        weights.append(weight)
+    return list(accumulate(weights))
+
+
+def _next_id(conn, table, id_column):
+    row = conn.execute(f"SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0), "
+                       f"COALESCE((SELECT MAX({id_column}) FROM {table}), 0))", (table,)).fetchone()
+    return row[0] + 1
+
+
+def _insert_batches(conn, sql, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def generate(conn, donors=500, beneficiaries=100, items=200, received=100000, distributed=80000,
+             seed=DEFAULT_SEED, days=730, end_date=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """ Acrescenta dados sintéticos ao banco (com as tabelas já criadas) em uma única transação.
+
+    As datas vão de end_date - days até end_date (padrão: hoje). progress(etapa)
+    é chamado no início de cada etapa. Retorna a quantidade gravada de cada
+    tabela e as doações realizadas descartadas por falta de estoque.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=days - 1)
+    report = progress or (lambda stage: None)
+    food_by_name = {food[0]: food for food in FOODS}
+    try:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+
+        report("cadastros")
+        first_donor = _next_id(conn, "doadores", "id_doador")
+        conn.executemany("INSERT INTO doadores (nome, telefone, email, endereco) VALUES (?, ?, ?, ?)",
+                         [_person(rng, first_donor + i, COMPANIES) for i in range(donors)])
+        first_beneficiary = _next_id(conn, "beneficiarios", "id_beneficiario")
+        beneficiary_rows = []
+        for i in range(beneficiaries):
+            name, phone, email, address = _person(rng, first_beneficiary + i, INSTITUTIONS)
+            needs = rng.sample([food[0] for food in FOODS], 3)
+            beneficiary_rows.append((name, phone, email, address, *needs))
+        conn.executemany("""
+            INSERT INTO beneficiarios (nome, telefone, email, endereco,
+                                       alimento_necessidade_1, alimento_necessidade_2, alimento_necessidade_3)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, beneficiary_rows)
+        item_rows = _item_rows(rng, items)
+        # Itens passam pelas dimensões de tipo, marca e unidade; os que já existem são reaproveitados
+        cursor = conn.cursor()
+        item_ids = [intern_item(cursor, *row)[0] for row in item_rows]
+        # Dentro de cada tipo, a ordem de FOODS já põe as marcas mais doadas primeiro
+        item_weights = _zipf_weights(len(item_ids), 0.7)
+        donor_weights = _zipf_weights(donors, 0.9)
+
+        report("doacoes_recebidas")
+        day_weights = _day_weights(start_date, days)
+        start_ordinal = start_date.toordinal()
+        received_days = sorted(rng.choices(range(days), cum_weights=day_weights, k=received))
+        received_items = rng.choices(range(len(item_ids)), cum_weights=item_weights, k=received)
+        received_quantities = []
+        validity_ordinals = []
+
+        def received_rows():
+            for day, item_index in zip(received_days, received_items):
+                food_name, _, shelf_life, _, quantities = food_by_name[item_rows[item_index][0]]
+                quantity = float(rng.choice(quantities))
+                # Doações costumam chegar com parte da validade já consumida
+                validity = start_ordinal + day + max(1, int(shelf_life * rng.uniform(0.25, 1.0)))
+                received_quantities.append(quantity)
+                validity_ordinals.append(validity)
+                received_on = date.fromordinal(start_ordinal + day).isoformat()
+                yield (first_donor + rng.choices(range(donors), cum_weights=donor_weights)[0], item_ids[item_index],
+                       quantity, received_on, date.fromordinal(validity).isoformat())
+        first_received = _next_id(conn, "doacoes_recebidas", "id_doacao_recebida")
+        _insert_batches(conn, """
+            INSERT INTO doacoes_recebidas (id_doador, id_item, quantidade, data_recebimento, data_validade)
+            VALUES (?, ?, ?, ?, ?)
+        """, received_rows(), batch_size)
+        lot_ids = [row[0] for row in conn.execute(
+            "SELECT id_lote FROM lotes WHERE id_doacao_recebida >= ? ORDER BY id_doacao_recebida", (first_received,))]
+
+        report("doacoes_realizadas")
+        # Simulação da alocação FEFO em ordem cronológica: cada item tem os lotes já recebidos
+        # válidos em um heap por (validade, id_lote), a mesma ordem de allocate_fefo
+        remaining = list(received_quantities)
+        lots_by_item = {}
+        for index, item_index in enumerate(received_items):
+            lots_by_item.setdefault(item_index, []).append(index)
+        next_lot = dict.fromkeys(lots_by_item, 0)
+        heaps = {item_index: [] for item_index in lots_by_item}
+        distributed_days = sorted(rng.choices(range(days), cum_weights=day_weights, k=distributed))
+        first_distributed = _next_id(conn, "doacoes_realizadas", "id_doacao_realizada")
+        distributed_rows, allocation_rows = [], []
+        skipped = 0
+        donation_id = first_distributed
+        for day in distributed_days:
+            # Um lote já recebido sorteado define o item: itens mais doados saem mais
+            available_lots = bisect_right(received_days, day)
+            if not available_lots:
+                skipped += 1
+                continue
+            item_index = received_items[rng.randrange(available_lots)]
+            item_lots, heap = lots_by_item[item_index], heaps[item_index]
+            while next_lot[item_index] < len(item_lots) and received_days[item_lots[next_lot[item_index]]] <= day:
+                lot_index = item_lots[next_lot[item_index]]
+                heapq.heappush(heap, (validity_ordinals[lot_index], lot_ids[lot_index], lot_index))
+                next_lot[item_index] += 1
+            # Como em allocate_fefo, lotes vencidos na data da doação não são entregues (e os dias só avançam)
+            while heap and heap[0][0] < start_ordinal + day:
+                heapq.heappop(heap)
+            if not heap:
+                skipped += 1
+                continue
+            wanted = float(rng.choice(food_by_name[item_rows[item_index][0]][4]))
+            taken_total = 0.0
+            while heap and taken_total < wanted - LOT_EPSILON:
+                _, lot_id, lot_index = heap[0]
+                taken = min(remaining[lot_index], wanted - taken_total)
+                remaining[lot_index] -= taken
+                taken_total += taken
+                allocation_rows.append((donation_id, lot_id, taken))
+                if remaining[lot_index] <= LOT_EPSILON:
+                    remaining[lot_index] = 0.0
+                    heapq.heappop(heap)
+            distributed_rows.append((donation_id, first_beneficiary + rng.randrange(beneficiaries), item_ids[item_index],
+                                     taken_total, date.fromordinal(start_ordinal + day).isoformat()))
+            donation_id += 1
+        _insert_batches(conn, """
+            INSERT INTO doacoes_realizadas (id_doacao_realizada, id_beneficiario, id_item, quantidade, data_doacao)
+            VALUES (?, ?, ?, ?, ?)
+        """, distributed_rows, batch_size)
+        _insert_batches(conn, "INSERT INTO alocacoes_lote (id_doacao_realizada, id_lote, quantidade) VALUES (?, ?, ?)",
+                        allocation_rows, batch_size)
+        _insert_batches(conn, "UPDATE lotes SET quantidade_restante = ? WHERE id_lote = ?",
+                        ((left, lot_ids[index]) for index, left in enumerate(remaining) if left != received_quantities[index]),
+                        batch_size)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        invalidate_cached_reads(conn, "doadores", "beneficiarios", "itens", "doacoes_recebidas", "doacoes_realizadas")
+    return {
+        "doadores": donors,
+        "beneficiarios": beneficiaries,
+        "itens": len(item_rows),
+        "doacoes_recebidas": received,
+        "doacoes_realizadas": len(distributed_rows),
+        "alocacoes_lote": len(allocation_rows),
+        "realizadas_sem_estoque": skipped,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera um banco de dados sintético para testes de desempenho")
+    parser.add_argument("db", help="arquivo do banco (os dados são acrescentados se ele já existir)")
+    parser.add_argument("--doadores", type=int, default=500)
+    parser.add_argument("--beneficiarios", type=int, default=100)
+    parser.add_argument("--itens", type=int, default=200)
+    parser.add_argument("--doacoes-recebidas", type=int, default=100000)
+    parser.add_argument("--doacoes-realizadas", type=int, default=80000)
+    parser.add_argument("--dias", type=int, default=730, help="período coberto, terminando hoje")
+    parser.add_argument("--semente", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection(args.db)
+    create_tables(conn)
+    started = time.perf_counter()
+    try:
+        summary = generate(conn, args.doadores, args.beneficiarios, args.itens, args.doacoes_recebidas,
+                           args.doacoes_realizadas, seed=args.semente, days=args.dias,
+                           progress=lambda stage: print(f"Gerando {stage}..."))
+    finally:
+        conn.close()
+    for table, count in summary.items():
+        print(f"{table}: {count}")
+    print(f"Concluído em {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+import unittest
+from datetime import date, timedelta
+from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, ChangeEvent, get_db_connection
+from database import create_tables
+from alerts import AlertEngine
+
+class TestAlertEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_db_connection(":memory:")
+        create_tables(self.conn)
+        self.today = date(2025, 6, 19)
+        self.doador_id = Doador(conn=self.conn).save({"nome": "Doador Alerta", "telefone": "", "email": "", "endereco": ""})
+        self.beneficiario_id = Beneficiario(conn=self.conn).save({"nome": "Beneficiario Alerta", "telefone": "", "email": "", "endereco": ""})
+        self.item_id = Item(conn=self.conn).save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+        self.doacao_recebida_model = DoacaoRecebida(conn=self.conn)
+        self.doacao_realizada_model = DoacaoRealizada(conn=self.conn)
+        self.engine = AlertEngine(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def receive(self, days, quantity=1.0):
+        return self.doacao_recebida_model.save({"id_doador": self.doador_id, "id_item": self.item_id, "quantidade": quantity,
+                                                "data_recebimento": self.today.isoformat(),
+                                                "data_validade": (self.today + timedelta(days=days)).isoformat()})
+
+    def test_buckets_and_incremental_updates(self):
+        ids = [self.receive(days) for days in (0, 3, 7, 10, 20, 31)]
+        self.engine.refresh(self.today)
+        self.assertEqual(self.engine.counts(), {7: 3, 15: 1, 30: 1}) # vence hoje conta; 31 dias fica de fora
+        self.assertEqual([a["id_doacao_recebida"] for a in self.engine.items(7)], ids[:3])
+        self.assertEqual(self.engine.days_left(self.engine.items()[-1]), 20)
+
+        # Nova doação recebida entra sem recarregar tudo
+        new_id = self.receive(12)
+        self.assertTrue(self.engine.apply_change(ChangeEvent("doacoes_recebidas", "insert", new_id)))
+        self.assertEqual(self.engine.counts()[15], 2)
+
+        # Doação realizada consome o lote que vence hoje (FEFO) e ele sai dos alertas
+        distribution_id = self.doacao_realizada_model.save({"id_beneficiario": self.beneficiario_id, "id_item": self.item_id, "quantidade": 1.5, "data_doacao": self.today.isoformat()})
+        self.assertTrue(self.engine.apply_change(ChangeEvent("doacoes_realizadas", "insert", distribution_id)))
+        self.assertEqual([a["id_doacao_recebida"] for a in self.engine.items(7)], ids[1:3])
+        self.assertEqual(self.engine.items(7)[0]["quantidade"], 0.5)
+
+        self.doacao_recebida_model.delete(ids[4])
+        self.assertTrue(self.engine.apply_change(ChangeEvent("doacoes_recebidas", "delete", ids[4])))
+        self.assertEqual(self.engine.counts()[30], 0)
+        # Eventos que não dá para aplicar pedem recarga
+        self.assertFalse(self.engine.apply_change(ChangeEvent("doacoes_realizadas", "delete", distribution_id)))
+        self.assertFalse(self.engine.apply_change(ChangeEvent("doacoes_recebidas", "insert", None)))
+
+    def test_day_boundary(self):
+        self.receive(8)
+        self.engine.refresh(self.today)
+        self.assertEqual(self.engine.counts(), {7: 0, 15: 1, 30: 0})
+        self.assertFalse(self.engine.check_day(self.today))
+        tomorrow = self.today + timedelta(days=1)
+        self.assertTrue(self.engine.check_day(tomorrow))
+        self.engine.refresh(tomorrow)
+        self.assertEqual(self.engine.counts(), {7: 1, 15: 0, 30: 0})
+
+    def test_expiring_today_is_alert(self):
+        today_id = self.receive(0)
+        self.receive(-1)
+        rows = self.doacao_recebida_model.get_expiring_items(7, today=self.today)
+        self.assertEqual([row["id_doacao_recebida"] for row in rows], [today_id])
+        self.engine.refresh(self.today)
+        self.assertEqual(self.engine.days_left(self.engine.items(7)[0]), 0)
+        self.assertEqual(self.engine.counts(), {7: 1, 15: 0, 30: 0})
+        # No dia seguinte o lote venceu e sai dos alertas
+        self.engine.refresh(self.today + timedelta(days=1))
+        self.assertEqual(self.engine.items(), [])
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,86 @@
+import unittest
+from datetime import date
+from models import Doador, Beneficiario, Item, Lote, DoacaoRecebida, DoacaoRealizada, get_db_connection
+from database import create_tables
+from allocation_planner import plan_distribution, commit_plan
+
+class TestAllocationPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_db_connection(":memory:")
+        create_tables(self.conn)
+        self.today = date(2025, 6, 1)
+        self.donor_id = Doador(self.conn).save({"nome": "Mercado", "telefone": "", "email": "", "endereco": ""})
+        self.arroz_camil = Item(self.conn).save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        self.arroz_tio = Item(self.conn).save({"nome_item": "arroz", "marca": "Tio João", "unidade": "kg"})
+        self.feijao = Item(self.conn).save({"nome_item": "Feijão", "marca": "Kicaldo", "unidade": "kg"})
+        # Arroz: 3 kg vencem antes (Tio João), 4 kg depois (Camil) e 5 kg já vencidos
+        for item_id, quantidade, validade in ((self.arroz_camil, 4.0, "2025-08-01"), (self.arroz_tio, 3.0, "2025-06-10"),
+                                              (self.arroz_camil, 5.0, "2025-05-01"), (self.feijao, 10.0, "2025-12-01")):
+            DoacaoRecebida(self.conn).save({"id_doador": self.donor_id, "id_item": item_id, "quantidade": quantidade,
+                                            "data_recebimento": "2025-04-01", "data_validade": validade})
+        model = Beneficiario(self.conn)
+        self.ana = model.save({"nome": "Ana", "telefone": "", "email": "", "endereco": "",
+                               "alimento_necessidade_1": "Feijao", "alimento_necessidade_2": "ARROZ"})
+        self.bia = model.save({"nome": "Bia", "telefone": "", "email": "", "endereco": "",
+                               "alimento_necessidade_1": "arroz", "alimento_necessidade_2": "arroz"})
+        self.caio = model.save({"nome": "Caio", "telefone": "", "email": "", "endereco": "",
+                                "alimento_necessidade_1": "Leite", "alimento_necessidade_3": "Arroz"})
+
+    def tearDown(self):
+        self.conn.close()
+
+    def lines(self, plan):
+        return [(line["id_beneficiario"], line["id_item"], line["quantidade"]) for line in plan]
+
+    def test_plan_by_priority_and_expiry(self):
+        plan = plan_distribution(self.conn, portion=2.0, today=self.today)
+        # Arroz: Bia (necessidade 1), Ana (2), Caio (3); os lotes que vencem antes saem primeiro
+        self.assertEqual(self.lines(plan), [
+            (self.ana, self.arroz_camil, 1.0), (self.ana, self.arroz_tio, 1.0), (self.ana, self.feijao, 2.0),
+            (self.bia, self.arroz_tio, 2.0),
+            (self.caio, self.arroz_camil, 2.0),
+        ])
+        self.assertEqual([line["data_validade"] for line in plan[:2]], ["2025-08-01", "2025-06-10"])
+        self.assertEqual((plan[0]["beneficiario_nome"], plan[0]["prioridade"], plan[0]["unidade"]), ("Ana", 2, "kg"))
+
+        # Porções por tipo de alimento e horizonte de validade
+        plan = plan_distribution(self.conn, portion=1.0, portions={"ARROZ": 3.0}, max_days=30, today=self.today)
+        self.assertEqual(self.lines(plan), [(self.bia, self.arroz_tio, 3.0)])
+        self.assertEqual(plan_distribution(self.conn, today=date(2026, 1, 1)), [])
+
+    def test_commit_plan(self):
+        plan = plan_distribution(self.conn, portion=2.0, today=self.today)
+        self.assertEqual(commit_plan(self.conn, plan, self.today), len(plan))
+        self.assertEqual(Lote(self.conn).get_available_quantity(self.arroz_tio), 0)
+        # O lote vencido de Camil fica como estava; as doações saem do lote válido, como no plano
+        self.assertAlmostEqual(Lote(self.conn).get_available_quantity(self.arroz_camil, self.today.isoformat()), 1.0)
+        self.assertAlmostEqual(Lote(self.conn).get_available_quantity(self.arroz_camil), 6.0)
+        self.assertEqual(len(DoacaoRealizada(self.conn).get_all()), len(plan))
+        self.assertEqual({row["data_doacao"] for row in DoacaoRealizada(self.conn).get_all()}, {"2025-06-01"})
+
+        # Um plano desatualizado (estoque já consumido) não grava nada
+        stale = [dict(plan[1], quantidade=100.0)]
+        self.assertIsNone(commit_plan(self.conn, plan + stale, self.today))
+        self.assertEqual(len(DoacaoRealizada(self.conn).get_all()), len(plan))
+
+    def test_commit_uses_planned_lots(self):
+        # Segundo lote válido de Tio João: Bia (necessidade 1) leva o primeiro inteiro, Ana o segundo
+        DoacaoRecebida(self.conn).save({"id_doador": self.donor_id, "id_item": self.arroz_tio, "quantidade": 3.0,
+                                        "data_recebimento": "2025-04-01", "data_validade": "2025-07-01"})
+        plan = plan_distribution(self.conn, portion=2.0, portions={"arroz": 3.0}, today=self.today)
+        shown = {(line["id_beneficiario"], line["id_item"]): line["data_validade"] for line in plan}
+        self.assertEqual({key: validity for key, validity in shown.items() if key[1] != self.feijao},
+                         {(self.bia, self.arroz_tio): "2025-06-10", (self.ana, self.arroz_tio): "2025-07-01",
+                          (self.caio, self.arroz_camil): "2025-08-01"})
+
+        self.assertEqual(commit_plan(self.conn, plan, self.today), len(plan))
+        lots = Lote(self.conn)
+        for donation in DoacaoRealizada(self.conn).get_all():
+            allocations = lots.get_allocations(donation["id_doacao_realizada"])
+            # Cada doação sai dos lotes que o plano mostrou, nunca do lote de Camil vencido em 2025-05-01
+            self.assertEqual({a["data_validade"] for a in allocations},
+                             {shown[(donation["id_beneficiario"], donation["id_item"])]})
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,124 @@
+import unittest
+import os
+import tempfile
+from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, MovimentacaoDiaria, get_db_connection
+from database import create_tables
+import analytics
+from analytics import LedgerSnapshot
+
+@unittest.skipIf(not analytics.HAS_NUMPY, "NumPy não instalado")
+class TestLedgerSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        self.conn = get_db_connection(os.path.join(self.tmpdir.name, "estoque.db"))
+        create_tables(self.conn)
+        self.donors = [Doador(self.conn).save({"nome": f"Doador {i}", "telefone": "", "email": "", "endereco": ""}) for i in range(2)]
+        self.beneficiary = Beneficiario(self.conn).save({"nome": "Creche", "telefone": "", "email": "", "endereco": ""})
+        self.rice = Item(self.conn).save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        self.milk = Item(self.conn).save({"nome_item": "Leite", "marca": "Italac", "unidade": "L"})
+        self.received = DoacaoRecebida(self.conn)
+        self.distributed = DoacaoRealizada(self.conn)
+        for donor, item, quantidade, dia in ((0, self.rice, 10.0, "2025-03-03"), (1, self.rice, 5.0, "2025-03-09"),
+                                             (1, self.milk, 12.0, "2025-03-10"), (0, self.rice, 8.0, "2025-04-01")):
+            self.received.save({"id_doador": self.donors[donor], "id_item": item, "quantidade": quantidade,
+                                "data_recebimento": dia, "data_validade": "2026-01-01"})
+        self.exit_id = self.distributed.save({"id_beneficiario": self.beneficiary, "id_item": self.rice,
+                                              "quantidade": 4.0, "data_doacao": "2025-03-04"})
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def load(self):
+        return LedgerSnapshot.load(self.conn, self.cache_dir, chunk_size=2)
+
+    def test_operations(self):
+        snapshot = self.load()
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(snapshot.received['dia'].dtype.name, "int32")
+        self.assertEqual(snapshot.stock_as_of("2025-03-09")[self.rice], 11.0)
+        stock = snapshot.stock_as_of("2025-12-31")
+        saldo = {row["id_item"]: row["quantidade"] for row in self.conn.execute("SELECT * FROM saldo_estoque")}
+        self.assertEqual({item: stock[item] for item in saldo}, saldo)
+
+        starts, inflow, outflow = snapshot.flow_histogram("2025-03-01", "2025-04-30", "mes")
+        self.assertEqual([str(start) for start in starts], ["2025-03-01", "2025-04-01"])
+        self.assertEqual((list(inflow), list(outflow)), ([27.0, 8.0], [4.0, 0.0]))
+        report = MovimentacaoDiaria(self.conn).get_flow_report("2025-03-01", "2025-04-30", "mes", by_item=False)
+        self.assertEqual([row["quantidade_recebida"] for row in report], list(inflow))
+        starts, inflow, _ = snapshot.flow_histogram("2025-03-01", "2025-03-16", "semana", id_item=self.rice)
+        self.assertEqual([str(start) for start in starts], ["2025-02-24", "2025-03-03", "2025-03-10"])
+        self.assertEqual(list(inflow), [0.0, 15.0, 0.0])
+        self.assertEqual(len(snapshot.flow_histogram("2025-03-01", "2025-03-31")[0]), 31)
+        with self.assertRaises(ValueError):
+            snapshot.flow_histogram("2025-03-01", "2025-03-31", "ano")
+
+        ids, totals, counts = snapshot.donor_totals()
+        self.assertEqual((list(ids), list(totals), list(counts)), (self.donors, [18.0, 17.0], [2, 2]))
+        ids, totals, counts = snapshot.donor_totals(start="2025-03-05", end="2025-03-31")
+        self.assertEqual((list(ids), list(totals)), ([self.donors[1]], [17.0]))
+        ids, totals, _ = snapshot.beneficiary_totals()
+        self.assertEqual((list(ids), list(totals)), ([self.beneficiary], [4.0]))
+
+    def test_depletion_forecast(self):
+        # Lote de arroz que vence em 11 dias e leite já vencido (fora da previsão)
+        for item, quantidade, validade in ((self.rice, 3.0, "2025-04-20"), (self.milk, 2.0, "2025-04-01")):
+            self.received.save({"id_doador": self.donors[0], "id_item": item, "quantidade": quantidade,
+                                "data_recebimento": "2025-03-20", "data_validade": validade})
+        forecast = {row["nome_item"]: row for row in analytics.depletion_forecast(self.conn, today="2025-04-10", window=40)}
+        rice = forecast["Arroz"]
+        # 4 kg saíram nos últimos 40 dias: 0,1 kg/dia. O lote de 3 kg dura 11 dias (1,1 kg usado)
+        # e os 19 kg restantes, 190 dias
+        self.assertAlmostEqual(rice["saida_diaria"], 0.1)
+        self.assertAlmostEqual(rice["quantidade_em_lotes"], 22.0)
+        self.assertAlmostEqual(rice["dias_cobertura"], 220.0)
+        self.assertAlmostEqual(rice["dias_ate_esgotar"], 201.0)
+        self.assertAlmostEqual(rice["quantidade_vencendo"], 1.9)
+        self.assertEqual(rice["data_esgotamento"], "2025-10-28")
+        milk = forecast["Leite"]
+        self.assertEqual((milk["saida_diaria"], milk["dias_ate_esgotar"], milk["data_esgotamento"]), (0.0, None, None))
+        self.assertEqual((milk["quantidade_em_lotes"], milk["quantidade_vencendo"]), (12.0, 12.0))
+        # Fora da janela de saídas e sem lotes válidos o tipo não aparece
+        self.assertEqual(analytics.depletion_forecast(self.conn, today="2030-01-01"), [])
+
+    def test_base_unit_conversion(self):
+        # Leite em mL entra no mesmo tipo que o leite em L, convertido pelo fator da unidade
+        milk_ml = Item(self.conn).save({"nome_item": "leite", "marca": "Italac", "unidade": "mL"})
+        self.received.save({"id_doador": self.donors[1], "id_item": milk_ml, "quantidade": 500.0,
+                            "data_recebimento": "2025-03-10", "data_validade": "2026-01-01"})
+        forecast = [row for row in analytics.depletion_forecast(self.conn, today="2025-04-10") if row["nome_item"] == "Leite"]
+        self.assertEqual([(row["unidade"], row["quantidade_em_lotes"]) for row in forecast], [("L", 12.5)])
+        ids, totals, _ = self.load().donor_totals()
+        self.assertEqual((list(ids), list(totals)), (self.donors, [18.0, 17.5]))
+
+    def test_disk_cache(self):
+        self.load()
+        snapshot = self.load()
+        # Segunda carga abre os arquivos do cache
+        self.assertIsInstance(snapshot.received['quantidade'], analytics.np.memmap)
+
+        # Inserções acrescentam linhas sem mudar a versão
+        self.received.save({"id_doador": self.donors[0], "id_item": self.milk, "quantidade": 3.0,
+                            "data_recebimento": "2025-05-01", "data_validade": "2026-01-01"})
+        snapshot = self.load()
+        self.assertEqual((snapshot.versions["doacoes_recebidas"], len(snapshot.received['id'])), (0, 5))
+        self.assertEqual(snapshot.stock_as_of("2025-12-31")[self.milk], 15.0)
+
+        # Alterações e exclusões mudam a versão e descartam o cache anterior
+        self.distributed.update(self.exit_id, {"quantidade": 6.0})
+        # Só um lote ainda não distribuído pode ser excluído (o primeiro atendeu a saída)
+        self.received.delete(self.received.get_all()[1]["id_doacao_recebida"])
+        snapshot = self.load()
+        self.assertGreater(snapshot.versions["doacoes_realizadas"], 0)
+        self.assertEqual(snapshot.stock_as_of("2025-12-31")[self.rice], 12.0)
+        self.assertFalse(any("-v0-" in name for name in os.listdir(self.cache_dir) if name.startswith("doacoes_realizadas")))
+        self.assertEqual(len(os.listdir(self.cache_dir)), sum(len(columns) for _, columns in analytics.LEDGER_TABLES.values()))
+
+        # Sem cache nada é gravado
+        snapshot = LedgerSnapshot.load(self.conn, use_cache=False)
+        self.assertNotIsInstance(snapshot.received['quantidade'], analytics.np.memmap)
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,147 @@
+import unittest
+import asyncio
+import http.client
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from models import Doador, Beneficiario, get_db_connection
+from database import create_tables
+from api_server import ApiServer
+
+class TestApiServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "estoque.db")
+        conn = get_db_connection(self.db_file)
+        create_tables(conn)
+        for i in range(5):
+            Doador(conn).save({"nome": f"Doador {i}", "telefone": "", "email": "", "endereco": ""})
+        self.beneficiary_id = Beneficiario(conn).save({"nome": "Creche", "telefone": "", "email": "", "endereco": "",
+                                                       "alimento_necessidade_1": "", "alimento_necessidade_2": "",
+                                                       "alimento_necessidade_3": ""})
+        conn.close()
+
+        # O servidor roda no laço de eventos de uma thread separada
+        self.loop = asyncio.new_event_loop()
+        self.server = ApiServer(self.db_file, workers=2)
+        ready = threading.Event()
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.server.start("127.0.0.1", 0))
+            ready.set()
+            self.loop.run_forever()
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        self.assertTrue(ready.wait(5))
+        self.client = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def request(self, method, path, body=None, headers=None):
+        payload = json.dumps(body) if body is not None else None
+        self.client.request(method, path, payload, headers or {})
+        response = self.client.getresponse()
+        data = response.read()
+        return response.status, (json.loads(data) if data else None), response
+
+    def test_pagination_and_records(self):
+        status, page, _ = self.request("GET", "/doadores?limit=2")
+        self.assertEqual(status, 200)
+        self.assertEqual([d["nome"] for d in page["registros"]], ["Doador 0", "Doador 1"])
+        status, page, _ = self.request("GET", f"/doadores?limit=2&after_id={page['proximo']}")
+        self.assertEqual([d["nome"] for d in page["registros"]], ["Doador 2", "Doador 3"])
+        status, page, _ = self.request("GET", f"/doadores?limit=2&after_id={page['proximo']}")
+        self.assertEqual(([d["nome"] for d in page["registros"]], page["proximo"]), (["Doador 4"], None))
+
+        self.assertEqual(self.request("GET", "/doadores/1")[1]["nome"], "Doador 0")
+        self.assertEqual(self.request("GET", "/doadores/99")[0], 404)
+        self.assertEqual(self.request("GET", "/doadores/99999999999999999999")[0], 404)
+        self.assertEqual(self.request("GET", "/doacoes-recebidas/99999999999999999999")[:2], (404, {"erro": "Doação não encontrada."}))
+        self.assertEqual(self.request("GET", "/doadores?after_id=99999999999999999999")[0], 400)
+        self.assertEqual(self.request("GET", "/doadores?limit=abc")[0], 400)
+        self.assertEqual(self.request("GET", "/inexistente")[0], 404)
+        self.assertEqual(self.request("DELETE", "/doadores")[0], 405)
+
+        status, donor, _ = self.request("POST", "/doadores", {"nome": "Mercado São José", "email": "contato@mercado.com"})
+        self.assertEqual(status, 201)
+        self.assertEqual(self.request("GET", "/doadores?busca=s%C3%A3o+jose")[1]["registros"][0]["id_doador"], donor["id_doador"])
+        status, error, _ = self.request("POST", "/doadores", {"nome": "X", "telefone": "123"})
+        self.assertEqual(status, 400)
+        self.assertIn("Telefone", error["erro"])
+
+    def test_donations_stock_and_etag(self):
+        validade = (datetime.now() + timedelta(days=5)).strftime("%d/%m/%Y")
+        status, received, _ = self.request("POST", "/doacoes-recebidas", {"id_doador": 1, "nome_item": "Arroz", "marca": "Camil",
+                                                                          "unidade": "kg", "quantidade": "10,5", "data_validade": validade})
+        self.assertEqual(status, 201)
+        self.assertEqual((received["nome_item"], received["quantidade"]), ("Arroz", 10.5))
+        self.assertEqual(self.request("POST", "/doacoes-recebidas", {"id_doador": 1, "nome_item": "Feijão", "unidade": "kg",
+                                                                    "quantidade": 0, "data_validade": validade})[0], 400)
+        self.assertEqual(self.request("POST", "/doacoes-recebidas", {"id_doador": 1, "nome_item": "Feijão", "unidade": "kg",
+                                                                    "quantidade": "1e400", "data_validade": validade})[0], 400)
+        self.assertEqual(self.request("POST", "/doacoes-recebidas", {"id_doador": 99999999999999999999, "nome_item": "Feijão", "unidade": "kg",
+                                                                    "quantidade": 1, "data_validade": validade})[0], 400)
+
+        status, stock, response = self.request("GET", "/estoque")
+        self.assertEqual(stock, [{"nome_item": "Arroz", "unidade": "kg", "quantidade_total": 10.5}])
+        etag = response.getheader("ETag")
+        status, body, _ = self.request("GET", "/estoque", headers={"If-None-Match": etag})
+        self.assertEqual((status, body), (304, None))
+
+        item_id = self.request("GET", "/itens?busca=arroz")[1]["registros"][0]["id_item"]
+        status, error, _ = self.request("POST", "/doacoes-realizadas", {"id_beneficiario": self.beneficiary_id, "id_item": item_id, "quantidade": 11})
+        self.assertEqual(status, 409)
+        status, distributed, _ = self.request("POST", "/doacoes-realizadas", {"id_beneficiario": self.beneficiary_id, "id_item": item_id, "quantidade": 4})
+        self.assertEqual((status, distributed["beneficiario_nome"]), (201, "Creche"))
+        # Depois da validade o lote não é mais entregue
+        depois = (datetime.now() + timedelta(days=6)).strftime("%d/%m/%Y")
+        status, error, _ = self.request("POST", "/doacoes-realizadas", {"id_beneficiario": self.beneficiary_id, "id_item": item_id,
+                                                                        "quantidade": 1, "data_doacao": depois})
+        self.assertEqual(status, 409)
+        self.assertIn("Disponível: 0.00", error["erro"])
+
+        # Depois da gravação o ETag antigo não vale mais
+        status, stock, response = self.request("GET", "/estoque", headers={"If-None-Match": etag})
+        self.assertEqual((status, stock[0]["quantidade_total"]), (200, 6.5))
+        self.assertNotEqual(response.getheader("ETag"), etag)
+
+        status, alerts, _ = self.request("GET", "/alertas?dias=7")
+        self.assertEqual(alerts["contagens"], {"7": 1, "15": 0, "30": 0})
+        self.assertEqual((alerts["alertas"][0]["quantidade"], alerts["alertas"][0]["dias_restantes"]), (6.5, 5))
+        self.assertEqual(self.request("GET", "/doacoes-realizadas")[1]["registros"][0]["quantidade"], 4)
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        status, report, _ = self.request("GET", f"/relatorios/movimentacao?inicio={today}&fim={today}&periodo=dia&por_item=0")
+        self.assertEqual(report["series"], [{"periodo": today, "quantidade_recebida": 10.5, "quantidade_distribuida": 4.0,
+                                             "entradas": 1, "saidas": 1}])
+        self.assertEqual(self.request("GET", "/relatorios/movimentacao?periodo=ano")[0], 400)
+        self.assertEqual(self.request("GET", "/relatorios/movimentacao?inicio=31/02/2025")[0], 400)
+
+        status, history, _ = self.request("GET", f"/estoque/historico?data={today}")
+        self.assertEqual([(row["nome_item"], row["quantidade"]) for row in history["itens"]], [("Arroz", 6.5)])
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%d/%m/%Y")
+        self.assertEqual(self.request("GET", f"/estoque/historico?data={yesterday}")[1]["itens"], [])
+
+    def test_invalid_content_length(self):
+        for length in ("abc", "-5"):
+            client = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+            client.putrequest("POST", "/doadores")
+            client.putheader("Content-Length", length)
+            client.endheaders()
+            response = client.getresponse()
+            self.assertEqual(response.status, 400)
+            self.assertIn("Content-Length", json.loads(response.read())["erro"])
+            client.close()
+        self.assertEqual(self.request("POST", "/doadores", headers={"Content-Length": str(2 * 1024 * 1024)})[0], 413)
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
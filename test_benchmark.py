@@ -0,0 +1,43 @@
+import unittest
+import json
+import os
+import tempfile
+from datetime import date
+from models import get_db_connection
+from database import create_tables
+from synthetic_data import generate
+import benchmark
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "bench.db")
+        conn = get_db_connection(self.db_file)
+        create_tables(conn)
+        generate(conn, donors=20, beneficiaries=5, items=40, received=500, distributed=400, days=60, end_date=date(2026, 6, 30))
+        conn.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_runner_writes_json_and_compares(self):
+        output = os.path.join(self.tmpdir.name, "resultado.json")
+        self.assertEqual(benchmark.main([self.db_file, "--repeticoes", "2", "--saida", output, "--sem-interface"]), 0)
+        with open(output, encoding="utf-8") as file:
+            report = json.load(file)
+        names = [result["nome"] for result in report["resultados"]]
+        self.assertIn("DoacaoRecebida.get_grouped_stock", names)
+        self.assertIn("DoacaoRecebida.get_expiring_items", names)
+        self.assertEqual(report["meta"]["tabelas"]["doacoes_recebidas"], 500)
+        self.assertTrue(all(result["repeticoes"] == 2 and result["min_ms"] <= result["max_ms"] for result in report["resultados"]))
+
+        slower = json.loads(json.dumps(report))
+        for result in slower["resultados"]:
+            result["mediana_ms"] = result["mediana_ms"] * 2 + 1
+        regressions = [row[0] for row in benchmark.compare(report, slower) if row[4]]
+        self.assertEqual(len(regressions), len(names))
+        self.assertFalse(any(row[4] for row in benchmark.compare(slower, report)))
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,96 @@
+import unittest
+import csv
+import json
+import os
+import tempfile
+from models import Doador, Item, DoacaoRecebida, get_db_connection
+from database import create_tables
+from bulk_import import RejectWriter, import_file, validated_rows
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_db_connection(":memory:")
+        create_tables(self.conn)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.doador_model = Doador(conn=self.conn)
+        self.item_model = Item(conn=self.conn)
+        self.doacao_recebida_model = DoacaoRecebida(conn=self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def write_csv(self, name, header, rows, delimiter=";"):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return path
+
+    def test_import_donors_jsonl(self):
+        path = os.path.join(self.tmpdir.name, "doadores.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"nome": "Maria", "telefone": "(11)98765-4321", "email": "maria@teste.com"}) + "\n")
+            f.write(json.dumps({"nome": "Jose", "telefone": "123"}) + "\n")
+            f.write("{quebrado\n")
+            f.write(json.dumps({"nome": "", "email": "x@y.com"}) + "\n")
+        rejects = os.path.join(self.tmpdir.name, "rejeitados.csv")
+        summary = import_file(self.conn, "doadores", path, rejects_path=rejects)
+        self.assertEqual(summary["importados"], 1)
+        self.assertEqual(summary["rejeitados"], 3)
+        self.assertEqual([d["nome"] for d in self.doador_model.get_all()], ["Maria"])
+        with open(rejects, encoding="utf-8") as f:
+            lines = [row["linha"] for row in csv.DictReader(f)]
+        self.assertEqual(lines, ["2", "3", "4"])
+
+    def test_import_rejects_non_object_json_lines(self):
+        path = os.path.join(self.tmpdir.name, "doadores.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for line in ("123", "[1, 2]", '"x"', "null", json.dumps({"nome": "Maria"})):
+                f.write(line + "\n")
+        rejects = os.path.join(self.tmpdir.name, "rejeitados.csv")
+        summary = import_file(self.conn, "doadores", path, rejects_path=rejects)
+        self.assertEqual((summary["importados"], summary["rejeitados"]), (1, 4))
+        self.assertEqual([d["nome"] for d in self.doador_model.get_all()], ["Maria"])
+        with open(rejects, encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row["linha"] for row in rows], ["1", "2", "3", "4"])
+        self.assertEqual(json.loads(rows[1]["registro"]), "[1, 2]")
+
+        # Erros inesperados do conversor rejeitam só a linha
+        def converter(record):
+            raise KeyError("id_doador")
+        writer = RejectWriter(os.path.join(self.tmpdir.name, "outros.csv"))
+        self.assertEqual(list(validated_rows([(1, {"a": 1})], converter, writer)), [])
+        writer.close()
+        self.assertEqual(writer.count, 1)
+
+    def test_import_donations_csv(self):
+        doador_id = self.doador_model.save({"nome": "Mercado", "telefone": "", "email": "", "endereco": ""})
+        existing_id = self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        path = self.write_csv("doacoes.csv", ["id_doador", "nome_item", "marca", "unidade", "quantidade", "data_validade", "data_recebimento"], [
+            [doador_id, "Arroz", "Camil", "kg", "2,5", "31/12/2026", "01/06/2026"],
+            [doador_id, "Feijao", "", "kg", "3", "2026-11-30", ""],
+            [doador_id, "Feijao", "", "kg", "1", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "0", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "inf", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "1e400", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "infinity", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "nan", "30/11/2026", ""],
+            [999, "Leite", "", "L", "1", "30/11/2026", ""],
+            [doador_id, "Leite", "", "L", "1", "31/02/2026", ""],
+        ])
+        summary = import_file(self.conn, "doacoes", path, batch_size=2)
+        self.assertEqual(summary["importados"], 3)
+        self.assertEqual(summary["rejeitados"], 7)
+        self.assertEqual(summary["itens_criados"], 1)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(existing_id), 2.5)
+        feijao = self.item_model.get_by_name_brand_unit("Feijao", "", "kg")
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(feijao["id_item"]), 4.0)
+        donation = self.doacao_recebida_model.get_by_id(1)
+        self.assertEqual((donation["data_recebimento"], donation["data_validade"]), ("2026-06-01", "2026-12-31"))
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
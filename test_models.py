@@ -1,9 +1,12 @@
 import unittest
 import os
+import tempfile
+import threading
 from datetime import datetime, timedelta
-from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, get_db_connection
-from database import create_tables # Importar create_tables
+from models import Doador, Beneficiario, Item, Lote, DoacaoRecebida, DoacaoRealizada, ChangeEvent, change_bus, get_db_connection, query_cache, QueryCache, ConnectionPool, LEGACY_PROFILE, MovimentacaoDiaria, intern_item, resolve_item_columns
+from database import create_tables, rebuild_stock_balance, check_stock_balance, rebuild_daily_flow, check_daily_flow, get_schema_version, MIGRATIONS
 import sqlite3
+from unittest.mock import patch
 
 class TestDatabaseAndModels(unittest.TestCase):
 
@@ -21,6 +24,7 @@ class TestDatabaseAndModels(unittest.TestCase):
         self.item_model = Item(conn=self.conn)
         self.doacao_recebida_model = DoacaoRecebida(conn=self.conn)
         self.doacao_realizada_model = DoacaoRealizada(conn=self.conn)
+        self.lote_model = Lote(conn=self.conn)
 
     def tearDown(self):
         # Fecha a conexão do banco de dados de teste
@@ -89,6 +93,9 @@ class TestDatabaseAndModels(unittest.TestCase):
     def test_doacao_realizada_crud(self):
         beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario DR", "telefone": "", "email": "", "endereco": ""})
         item_id = self.item_model.save({"nome_item": "Macarrao", "marca": "Adria", "unidade": "500g"})
+        # A doação realizada consome lotes, então o item precisa ter estoque
+        doador_id = self.doador_model.save({"nome": "Doador DR", "telefone": "", "email": "", "endereco": ""})
+        self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 5.0, "data_recebimento": "2025-06-18", "data_validade": "2025-12-31"})
 
         doacao_id = self.doacao_realizada_model.save({
             "id_beneficiario": beneficiario_id,
@@ -128,20 +135,727 @@ class TestDatabaseAndModels(unittest.TestCase):
         self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id_3, "quantidade": 1.0, "data_recebimento": fixed_today.strftime("%Y-%m-%d"), "data_validade": validade_25_dias})
 
         # Teste para 10 dias
-        expiring_10 = self.doacao_recebida_model.get_expiring_items(10)
+        expiring_10 = self.doacao_recebida_model.get_expiring_items(10, today=fixed_today)
         self.assertEqual(len(expiring_10), 1) # Apenas o item de 5 dias
         self.assertEqual(expiring_10[0]["nome_item"], "Leite")
 
         # Teste para 15 dias
-        expiring_15 = self.doacao_recebida_model.get_expiring_items(15)
+        expiring_15 = self.doacao_recebida_model.get_expiring_items(15, today=fixed_today)
         self.assertEqual(len(expiring_15), 2) # Itens de 5 e 12 dias
         self.assertEqual(expiring_15[0]["nome_item"], "Leite")
         self.assertEqual(expiring_15[1]["nome_item"], "Biscoito")
 
         # Teste para 30 dias
-        expiring_30 = self.doacao_recebida_model.get_expiring_items(30)
+        expiring_30 = self.doacao_recebida_model.get_expiring_items(30, today=fixed_today)
         self.assertEqual(len(expiring_30), 3) # Itens de 5, 12 e 25 dias
 
+        # Lotes já distribuídos por completo não geram alerta
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Exp", "telefone": "", "email": "", "endereco": ""})
+        self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id_1, "quantidade": 2.0, "data_doacao": fixed_today.strftime("%Y-%m-%d")})
+        self.assertEqual([i["nome_item"] for i in self.doacao_recebida_model.get_expiring_items(30, today=fixed_today)], ["Biscoito", "Cafe"])
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT id_lote FROM lotes WHERE data_validade >= ? AND data_validade <= ? AND quantidade_restante > 0", ("a", "b")).fetchall()
+        self.assertIn("idx_lotes_validade_disponiveis", plan[0]["detail"])
+
+    def test_saldo_estoque(self):
+        doador_id = self.doador_model.save({"nome": "Doador Saldo", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Saldo", "telefone": "", "email": "", "endereco": ""})
+        arroz_id = self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        arroz2_id = self.item_model.save({"nome_item": "Arroz", "marca": "Tio Joao", "unidade": "kg"})
+
+        recebida_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": arroz_id, "quantidade": 10.0, "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"})
+        self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": arroz2_id, "quantidade": 4.0, "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"})
+        realizada_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": arroz_id, "quantidade": 3.0, "data_doacao": "2025-06-20"})
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz_id), 7.0)
+
+        # Atualização e exclusão também ajustam o saldo
+        self.doacao_recebida_model.update(recebida_id, {"quantidade": 12.0})
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz_id), 9.0)
+        self.doacao_realizada_model.update(realizada_id, {"id_item": arroz2_id})
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz_id), 12.0)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz2_id), 1.0)
+        self.doacao_realizada_model.delete(realizada_id)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz2_id), 4.0)
+
+        grouped = self.doacao_recebida_model.get_grouped_stock()
+        self.assertEqual(grouped, [{"nome_item": "Arroz", "unidade": "kg", "quantidade_total": 16.0}])
+        self.assertEqual(check_stock_balance(self.conn), [])
+
+        # Divergência detectada e corrigida pela reconstrução
+        self.conn.execute("UPDATE saldo_estoque SET quantidade = 0 WHERE id_item = ?", (arroz_id,))
+        self.conn.commit()
+        divergencias = check_stock_balance(self.conn)
+        self.assertEqual(len(divergencias), 1)
+        self.assertEqual(divergencias[0]["esperado"], 12.0)
+        self.assertTrue(rebuild_stock_balance(self.conn))
+        self.assertEqual(check_stock_balance(self.conn), [])
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(arroz_id), 12.0)
+
+    def test_migrations(self):
+        # Todas as migrações aplicadas uma única vez
+        self.assertEqual(get_schema_version(self.conn), MIGRATIONS[-1][0])
+        create_tables(self.conn)
+        self.assertEqual(get_schema_version(self.conn), MIGRATIONS[-1][0])
+
+        # Banco antigo (sem versão) que já tinha as colunas de necessidade
+        legacy_conn = get_db_connection(":memory:")
+        legacy_conn.execute("CREATE TABLE beneficiarios (id_beneficiario INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL, telefone TEXT, email TEXT, endereco TEXT, alimento_necessidade_1 TEXT, alimento_necessidade_2 TEXT, alimento_necessidade_3 TEXT)")
+        create_tables(legacy_conn)
+        self.assertEqual(get_schema_version(legacy_conn), MIGRATIONS[-1][0])
+        tables = {row[0] for row in legacy_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertTrue({"itens", "doacoes_recebidas", "doacoes_realizadas", "saldo_estoque"} <= tables)
+        legacy_conn.close()
+
+    def _query_plan(self, method, model, *args):
+        """ EXPLAIN QUERY PLAN dos comandos executados pelo método (sem o cache de consultas) """
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            method.__wrapped__(model, *args)
+        finally:
+            self.conn.set_trace_callback(None)
+        select = next(sql for sql in statements if sql.lstrip().upper().startswith("SELECT"))
+        return "\n".join(row["detail"] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {select}"))
+
+    def test_query_indexes(self):
+        # Busca de item pelas chaves: índices únicos das dimensões e idx_itens_dimensoes, sem varrer tabelas
+        self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        self.conn.execute("ANALYZE")
+        plan = self._query_plan(Item.get_by_name_brand_unit, self.item_model, "arroz", "camil", "KG")
+        self.assertIn("SEARCH itens USING INDEX idx_itens_dimensoes", plan)
+        self.assertNotIn("SCAN", plan)
+        # Estoque agrupado: percorre idx_itens_tipo_unidade na ordem do GROUP BY, sem ler itens;
+        # só a soma por unidade base, feita sobre os grupos já formados, usa B-tree temporária
+        plan = self._query_plan(DoacaoRecebida.get_grouped_stock, self.doacao_recebida_model)
+        self.assertIn("SCAN i USING COVERING INDEX idx_itens_tipo_unidade", plan)
+        self.assertEqual(plan.count("TEMP B-TREE FOR GROUP BY"), 1)
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT SUM(quantidade) FROM doacoes_realizadas WHERE id_item = ?", (1,)).fetchall()
+        self.assertIn("idx_doacoes_realizadas_item", plan[0]["detail"])
+        # Lotes com saldo na ordem FEFO, sem ler a tabela
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT id_lote, quantidade_restante FROM lotes WHERE id_item = ? AND quantidade_restante > 0 ORDER BY data_validade, id_lote", (1,)).fetchall()
+        self.assertEqual(len(plan), 1)
+        self.assertIn("COVERING INDEX idx_lotes_disponiveis_saldo", plan[0]["detail"])
+
+    def test_fefo_allocation(self):
+        doador_id = self.doador_model.save({"nome": "Doador Lote", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Lote", "telefone": "", "email": "", "endereco": ""})
+        item_id = self.item_model.save({"nome_item": "Leite", "marca": "Piracanjuba", "unidade": "L"})
+
+        # Lote que vence depois é recebido primeiro
+        tardio_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 10.0, "data_recebimento": "2025-06-01", "data_validade": "2025-09-30"})
+        cedo_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 4.0, "data_recebimento": "2025-06-02", "data_validade": "2025-07-31"})
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 14.0)
+
+        realizada_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 6.0, "data_doacao": "2025-06-10"})
+        self.assertIsNotNone(realizada_id)
+        allocations = self.lote_model.get_allocations(realizada_id)
+        self.assertEqual([(a["id_doacao_recebida"], a["quantidade"]) for a in allocations], [(cedo_id, 4.0), (tardio_id, 2.0)])
+
+        stock_items = self.doacao_recebida_model.get_all_stock_items()
+        self.assertEqual(len(stock_items), 1)
+        self.assertEqual(stock_items[0]["data_validade"], "2025-09-30")
+        self.assertEqual(stock_items[0]["quantidade_disponivel"], 8.0)
+
+        # Sem lotes suficientes nada é gravado
+        self.assertIsNone(self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 9.0, "data_doacao": "2025-06-11"}))
+        self.assertEqual(len(self.doacao_realizada_model.get_all()), 1)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 8.0)
+
+        # Alterar a quantidade refaz a alocação; excluir devolve aos lotes
+        self.assertEqual(self.doacao_realizada_model.update(realizada_id, {"quantidade": 3.0}), 1)
+        self.assertEqual([a["quantidade"] for a in self.lote_model.get_allocations(realizada_id)], [3.0])
+        self.doacao_realizada_model.delete(realizada_id)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 14.0)
+        self.assertEqual(self.lote_model.get_allocations(realizada_id), [])
+
+    def test_fefo_skips_expired_lots(self):
+        doador_id = self.doador_model.save({"nome": "Doador Lote", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Lote", "telefone": "", "email": "", "endereco": ""})
+        item_id = self.item_model.save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+        vencido_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 5.0, "data_recebimento": "2025-05-01", "data_validade": "2025-06-09"})
+        valido_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 3.0, "data_recebimento": "2025-05-02", "data_validade": "2025-06-10"})
+
+        # Na data da doação o primeiro lote já venceu: só o que vence no próprio dia ou depois conta
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 8.0)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id, "2025-06-10"), 3.0)
+        self.assertEqual([lot["id_doacao_recebida"] for lot in self.lote_model.get_available_lots(item_id, "2025-06-10")], [valido_id])
+        realizada_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 2.0, "data_doacao": "2025-06-10"})
+        self.assertEqual([(a["id_doacao_recebida"], a["quantidade"]) for a in self.lote_model.get_allocations(realizada_id)], [(valido_id, 2.0)])
+        # O lote vencido não completa uma saída maior que os válidos
+        self.assertIsNone(self.doacao_realizada_model.update(realizada_id, {"quantidade": 4.0}))
+        self.assertIsNone(self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 2.0, "data_doacao": "2025-06-10"}))
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 6.0)
+        self.assertEqual(self.doacao_recebida_model.get_by_id(vencido_id)["quantidade"], 5.0)
+        self.assertEqual(self.conn.execute("SELECT quantidade_restante FROM lotes WHERE id_doacao_recebida = ?", (vencido_id,)).fetchone()[0], 5.0)
+
+    def test_received_update_keeps_lots_consistent(self):
+        doador_id = self.doador_model.save({"nome": "Doador Lote", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Lote", "telefone": "", "email": "", "endereco": ""})
+        leite_id = self.item_model.save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+        suco_id = self.item_model.save({"nome_item": "Suco", "marca": "", "unidade": "L"})
+        recebida_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": leite_id, "quantidade": 10.0, "data_recebimento": "2025-06-01", "data_validade": "2025-09-30"})
+        self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": leite_id, "quantidade": 6.0, "data_doacao": "2025-06-10"})
+
+        # Abaixo do que já saiu do lote, a alteração é recusada e nada muda
+        self.assertIsNone(self.doacao_recebida_model.update(recebida_id, {"quantidade": 5.0}))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("UPDATE doacoes_recebidas SET quantidade = 5 WHERE id_doacao_recebida = ?", (recebida_id,))
+        self.assertEqual(self.lote_model.get_available_quantity(leite_id), 4.0)
+        # Até o distribuído, ou para cima, o lote acompanha
+        self.assertEqual(self.doacao_recebida_model.update(recebida_id, {"quantidade": 6.0}), 1)
+        self.assertEqual(self.lote_model.get_available_quantity(leite_id), 0.0)
+        self.assertEqual(self.doacao_recebida_model.update(recebida_id, {"quantidade": 12.0}), 1)
+        self.assertEqual(self.lote_model.get_available_quantity(leite_id), 6.0)
+
+        # Lote já consumido não muda de item; a validade pode mudar
+        self.assertIsNone(self.doacao_recebida_model.update(recebida_id, {"id_item": suco_id}))
+        self.assertEqual((self.lote_model.get_available_quantity(leite_id), self.lote_model.get_available_quantity(suco_id)), (6.0, 0))
+        self.assertEqual(self.doacao_recebida_model.update(recebida_id, {"data_validade": "2025-10-31"}), 1)
+        self.assertEqual(check_stock_balance(self.conn), [])
+
+        # Sem alocações, trocar o item leva o lote inteiro
+        livre_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": leite_id, "quantidade": 3.0, "data_recebimento": "2025-06-02", "data_validade": "2025-08-31"})
+        self.assertEqual(self.doacao_recebida_model.update(livre_id, {"id_item": suco_id, "quantidade": 2.0}), 1)
+        self.assertEqual((self.lote_model.get_available_quantity(leite_id), self.lote_model.get_available_quantity(suco_id)), (6.0, 2.0))
+
+    def test_received_delete_keeps_lots_consistent(self):
+        doador_id = self.doador_model.save({"nome": "Doador Lote", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Lote", "telefone": "", "email": "", "endereco": ""})
+        item_id = self.item_model.save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+        recebida = {"id_doador": doador_id, "id_item": item_id, "quantidade": 10.0, "data_recebimento": "2025-06-01", "data_validade": "2099-09-30"}
+        recebida_id = self.doacao_recebida_model.save(recebida)
+        realizada_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 4.0, "data_doacao": "2025-06-10"})
+
+        # Lote já distribuído não pode ser excluído: saldo e lotes deixariam de bater
+        self.assertIsNone(self.doacao_recebida_model.delete(recebida_id))
+        self.assertIsNone(self.doacao_recebida_model.delete_many([recebida_id]))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("DELETE FROM doacoes_recebidas WHERE id_doacao_recebida = ?", (recebida_id,))
+        self.conn.rollback()
+        self.doacao_recebida_model.save(recebida)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(item_id), 16.0)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 16.0)
+        self.assertEqual(check_stock_balance(self.conn), [])
+
+        # Sem a saída, o lote volta inteiro e a doação pode ser excluída
+        self.doacao_realizada_model.delete(realizada_id)
+        self.assertEqual(self.doacao_recebida_model.delete(recebida_id), 1)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 10.0)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(item_id), 10.0)
+
+    def test_transaction_and_batch_api(self):
+        # Gravações dentro do bloco só são confirmadas no final
+        with self.doador_model.transaction():
+            doador_id = self.doador_model.save({"nome": "Doador Tx", "telefone": "", "email": "", "endereco": ""})
+            item_id = self.item_model.save({"nome_item": "Arroz", "marca": "", "unidade": "kg"})
+            self.assertTrue(self.doador_model.in_transaction())
+            self.assertTrue(self.conn.in_transaction)
+        self.assertFalse(self.conn.in_transaction)
+
+        # Exceção desfaz o bloco inteiro, inclusive gravações de outros modelos
+        with self.assertRaises(RuntimeError):
+            with self.item_model.transaction():
+                self.item_model.save({"nome_item": "Feijao", "marca": "", "unidade": "kg"})
+                raise RuntimeError("falha")
+        self.assertIsNone(self.item_model.get_by_name_brand_unit("Feijao", "", "kg"))
+
+        # Blocos aninhados: só o interno é desfeito
+        with self.item_model.transaction():
+            self.item_model.save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+            with self.assertRaises(RuntimeError):
+                with self.item_model.transaction():
+                    self.item_model.save({"nome_item": "Cafe", "marca": "", "unidade": "kg"})
+                    raise RuntimeError("falha interna")
+        self.assertIsNotNone(self.item_model.get_by_name_brand_unit("Leite", "", "L"))
+        self.assertIsNone(self.item_model.get_by_name_brand_unit("Cafe", "", "kg"))
+
+        rows = [{"id_doador": doador_id, "id_item": item_id, "quantidade": float(q), "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"} for q in range(1, 6)]
+        self.assertEqual(self.doacao_recebida_model.save_many(rows), 5)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(item_id), 15.0)
+        ids = [d["id_doacao_recebida"] for d in self.doacao_recebida_model.get_all()]
+        self.assertEqual(self.doacao_recebida_model.update_many([(i, {"quantidade": 2.0}) for i in ids]), 5)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(item_id), 10.0)
+        self.assertEqual(self.doacao_recebida_model.delete_many(ids[:2]), 2)
+        self.assertEqual(self.doacao_recebida_model.get_stock_by_item(item_id), 6.0)
+
+        # Lote de doações realizadas é atômico: a segunda não tem estoque
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Tx", "telefone": "", "email": "", "endereco": ""})
+        distributions = [{"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": q, "data_doacao": "2025-06-20"} for q in (4.0, 5.0)]
+        self.assertIsNone(self.doacao_realizada_model.save_many(distributions))
+        self.assertEqual(self.doacao_realizada_model.get_all(), [])
+        self.assertEqual(self.doacao_realizada_model.save_many(distributions[:1]), 1)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 2.0)
+
+    def test_streaming_and_keyset_pagination(self):
+        doador_id = self.doador_model.save({"nome": "Doador Stream", "telefone": "", "email": "", "endereco": ""})
+        item_id = self.item_model.save({"nome_item": "Arroz", "marca": "", "unidade": "kg"})
+        self.doacao_recebida_model.save_many({"id_doador": doador_id, "id_item": item_id, "quantidade": 1.0, "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"} for _ in range(25))
+
+        stream = self.doacao_recebida_model.iter_all_with_details(batch_size=4)
+        self.assertEqual([e["id_doacao_recebida"] for e in stream], list(range(1, 26)))
+
+        # Paginação por chave: cada página começa depois do último ID da anterior
+        pages = []
+        after_id = None
+        while True:
+            page = list(self.doacao_recebida_model.iter_all_with_details(after_id=after_id, limit=10))
+            if not page:
+                break
+            pages.append(len(page))
+            after_id = page[-1]["id_doacao_recebida"]
+        self.assertEqual(pages, [10, 10, 5])
+        self.assertEqual([d["id_doacao_recebida"] for d in self.doacao_recebida_model.iter_all(after_id=20)], [21, 22, 23, 24, 25])
+        self.assertEqual(len(self.doacao_recebida_model.get_all_with_details()), 25)
+
+    def test_change_bus(self):
+        events = []
+        for table in ("itens", "doacoes_recebidas"):
+            change_bus.subscribe(table, events.append)
+            self.addCleanup(change_bus.unsubscribe, table, events.append)
+        doador_id = self.doador_model.save({"nome": "Doador Bus", "telefone": "", "email": "", "endereco": ""})
+
+        item_id = self.item_model.save({"nome_item": "Arroz", "marca": "", "unidade": "kg"})
+        self.assertEqual(events, [ChangeEvent("itens", "insert", item_id)]) # doadores não foi assinada
+
+        # Dentro de transaction() os eventos só saem depois do commit, e os desfeitos são descartados
+        del events[:]
+        with self.item_model.transaction():
+            leite_id = self.item_model.save({"nome_item": "Leite", "marca": "", "unidade": "L"})
+            with self.assertRaises(RuntimeError):
+                with self.item_model.transaction():
+                    self.item_model.save({"nome_item": "Cafe", "marca": "", "unidade": "kg"})
+                    raise RuntimeError("falha interna")
+            donation_id = self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 3.0, "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"})
+            self.assertEqual(events, [])
+        self.assertEqual(events, [ChangeEvent("itens", "insert", leite_id), ChangeEvent("doacoes_recebidas", "insert", donation_id)])
+
+        del events[:]
+        self.doacao_recebida_model.update(donation_id, {"quantidade": 4.0})
+        self.doacao_recebida_model.save_many([{"id_doador": doador_id, "id_item": item_id, "quantidade": 1.0, "data_recebimento": "2025-06-19", "data_validade": "2025-12-31"}])
+        self.doacao_recebida_model.delete(donation_id)
+        self.assertEqual(events, [
+            ChangeEvent("doacoes_recebidas", "update", donation_id),
+            ChangeEvent("doacoes_recebidas", "insert", None),
+            ChangeEvent("doacoes_recebidas", "delete", donation_id),
+        ])
+        self.assertIsNone(self.doacao_recebida_model.get_with_details(donation_id))
+        self.assertEqual(self.doacao_recebida_model.get_with_details(donation_id + 1)["doador_nome"], "Doador Bus")
+
+        # Rollback de uma transação inteira não publica nada
+        del events[:]
+        with self.assertRaises(RuntimeError):
+            with self.item_model.transaction():
+                self.item_model.save({"nome_item": "Feijao", "marca": "", "unidade": "kg"})
+                raise RuntimeError("falha")
+        self.assertEqual(events, [])
+
+    def test_full_text_search(self):
+        joao_id = self.doador_model.save({"nome": "João Araújo", "telefone": "", "email": "joao@teste.com", "endereco": "Rua das Flores, 10"})
+        maria_id = self.doador_model.save({"nome": "Maria Flores", "telefone": "", "email": "", "endereco": "Av. São João, 20"})
+        # Sem acentos e por início de palavra; o nome vem antes do endereço
+        self.assertEqual([d["id_doador"] for d in self.doador_model.search("joao")], [joao_id, maria_id])
+        self.assertEqual([d["id_doador"] for d in self.doador_model.search("FLOR")], [maria_id, joao_id])
+        self.assertEqual([d["nome"] for d in self.doador_model.search("araujo jo")], ["João Araújo"])
+        self.assertEqual(self.doador_model.search('flores" OR *'), self.doador_model.search("flores or"))
+        self.assertEqual(self.doador_model.search("  "), [])
+        self.assertEqual(len(self.doador_model.search("joao", limit=1)), 1)
+
+        # Triggers mantêm o índice em alterações e exclusões
+        self.doador_model.update(joao_id, {"nome": "José Araújo", "email": "jose@teste.com", "endereco": "Rua Augusta"})
+        self.assertEqual([d["id_doador"] for d in self.doador_model.search("joao")], [maria_id])
+        self.assertEqual([d["nome"] for d in self.doador_model.search("jose")], ["José Araújo"])
+        self.doador_model.delete(maria_id)
+        self.assertEqual(self.doador_model.search("flores"), [])
+
+        beneficiario_id = self.beneficiario_model.save({"nome": "Creche Esperança", "telefone": "", "email": "", "endereco": "",
+                                                        "alimento_necessidade_1": "Feijão", "alimento_necessidade_2": "Açúcar",
+                                                        "alimento_necessidade_3": ""})
+        self.assertEqual([b["id_beneficiario"] for b in self.beneficiario_model.search("acucar")], [beneficiario_id])
+        self.item_model.save({"nome_item": "Leite em pó", "marca": "Ninho", "unidade": "lata"})
+        self.assertEqual([i["nome_item"] for i in self.item_model.search("leite po")], ["Leite em pó"])
+        self.assertEqual(self.lote_model.search("leite"), []) # tabela sem índice FTS
+
+    def test_full_text_search_ranks_all_matches(self):
+        # O melhor resultado é o mais antigo, atrás de centenas de registros que casam só pelo endereço
+        oldest_id = self.doador_model.save({"nome": "Joana Lima", "telefone": "", "email": "", "endereco": ""})
+        self.conn.executemany("INSERT INTO doadores (nome, telefone, email, endereco) VALUES (?, '', '', 'Rua Joaquim Nabuco')",
+                              [(f"Ana {i}",) for i in range(800)])
+        self.conn.commit()
+        results = self.doador_model.search("jo", limit=5)
+        self.assertEqual(results[0]["id_doador"], oldest_id)
+        self.assertEqual(len(results), 5)
+        self.assertEqual([d["nome"] for d in self.doador_model.search("lima joa")], ["Joana Lima"])
+
+    def test_query_cache(self):
+        doador_id = self.doador_model.save({"nome": "Doador Cache", "telefone": "", "email": "", "endereco": ""})
+        item_id = self.item_model.save({"nome_item": "Arroz", "marca": "Tio João", "unidade": "kg"})
+        validade = (datetime.now() + timedelta(days=60)).strftime('%Y-%m-%d')
+        self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": 10,
+                                         "data_recebimento": datetime.now().strftime('%Y-%m-%d'), "data_validade": validade})
+        cache = query_cache(self.conn)
+        hits, misses = cache.hits, cache.misses
+
+        # Leituras repetidas vêm do cache, como cópias
+        stock = self.doacao_recebida_model.get_all_stock_items()
+        stock[0]["quantidade_disponivel"] = 999
+        self.assertEqual(self.doacao_recebida_model.get_all_stock_items()[0]["quantidade_disponivel"], 10)
+        self.assertEqual(DoacaoRecebida(self.conn).get_all_stock_items()[0]["quantidade_disponivel"], 10)
+        self.assertEqual((cache.hits - hits, cache.misses - misses), (2, 1))
+        self.assertEqual(self.item_model.get_by_name_brand_unit("Arroz", "Tio João", "kg")["id_item"], item_id)
+        self.assertEqual(self.doacao_recebida_model.get_grouped_stock()[0]["quantidade_total"], 10)
+
+        # Uma gravação descarta só as leituras das tabelas afetadas (inclusive pelos triggers)
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiário Cache", "telefone": "", "email": "", "endereco": "",
+                                                        "alimento_necessidade_1": "", "alimento_necessidade_2": "", "alimento_necessidade_3": ""})
+        misses = cache.misses
+        self.item_model.get_by_name_brand_unit("Arroz", "Tio João", "kg")
+        self.assertEqual(cache.misses, misses)
+        self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": item_id, "quantidade": 4,
+                                          "data_doacao": datetime.now().strftime('%Y-%m-%d')})
+        self.assertEqual(self.doacao_recebida_model.get_all_stock_items()[0]["quantidade_disponivel"], 6)
+        self.assertEqual(self.doacao_recebida_model.get_grouped_stock()[0]["quantidade_total"], 6)
+        self.assertEqual(self.lote_model.get_available_quantity(item_id), 6)
+        self.item_model.update(item_id, {"marca": "Camil"})
+        self.assertIsNone(self.item_model.get_by_name_brand_unit("Arroz", "Tio João", "kg"))
+        self.assertEqual(self.item_model.get_by_id(item_id)["marca"], "Camil")
+
+        # Dentro de transaction() não há cache: o que for desfeito não fica guardado
+        with self.assertRaises(RuntimeError):
+            with self.item_model.transaction():
+                self.item_model.update(item_id, {"marca": "Desfeita"})
+                self.assertEqual(self.item_model.get_by_id(item_id)["marca"], "Desfeita")
+                raise RuntimeError("desfaz")
+        self.assertEqual(self.item_model.get_by_id(item_id)["marca"], "Camil")
+
+        # LRU limitado pelo tamanho máximo
+        small = QueryCache(maxsize=2)
+        for key in ("a", "b", "a", "c"):
+            if not small.get(key)[0]:
+                small.put(key, ("itens",), key)
+        self.assertEqual((len(small), small.get("b")[0], small.get("a")[0]), (2, False, True))
+        self.assertEqual(small.stats()["hits"], 2)
+
+    def test_connection_state_requires_model_connection(self):
+        # Cada conexão tem o próprio cache, que não passa para outra conexão aberta depois
+        other = get_db_connection(":memory:")
+        self.assertIsNot(query_cache(other), query_cache(self.conn))
+        other.close()
+        plain = sqlite3.connect(":memory:")
+        with self.assertRaises(TypeError):
+            query_cache(plain)
+        with self.assertRaises(TypeError):
+            Doador(plain).get_by_id(1)
+        plain.close()
+
+    def test_query_cache_other_connection(self):
+        # Gravações de outra conexão são detectadas por PRAGMA data_version
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "estoque.db")
+            conn = get_db_connection(db_file)
+            other = get_db_connection(db_file)
+            try:
+                create_tables(conn)
+                item_id = Item(conn).save({"nome_item": "Feijão", "marca": "Kicaldo", "unidade": "kg"})
+                self.assertEqual(Item(conn).get_by_id(item_id)["marca"], "Kicaldo")
+                other.execute("UPDATE itens SET marca = 'Camil' WHERE id_item = ?", (item_id,))
+                other.commit()
+                self.assertEqual(Item(conn).get_by_id(item_id)["marca"], "Camil")
+            finally:
+                other.close()
+                conn.close()
+
+    def test_connection_profile_and_pool(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "estoque.db")
+            legacy = get_db_connection(os.path.join(tmpdir, "antigo.db"), LEGACY_PROFILE)
+            self.assertEqual(legacy.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+            legacy.close()
+
+            pool = ConnectionPool(db_file, size=2)
+            with pool.connection() as conn:
+                self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 10000)
+                create_tables(conn)
+                # Reentrante: a mesma thread recebe a mesma conexão
+                with pool.connection() as inner:
+                    self.assertIs(inner, conn)
+                # Transação esquecida aberta é desfeita ao devolver a conexão
+                intern_item(conn.cursor(), "Sal", "", "kg")
+
+            seen = {}
+            both_inside = threading.Barrier(2)
+            def worker(name):
+                with pool.connection() as conn:
+                    seen[name] = conn
+                    both_inside.wait(5)
+                    seen[name + "_itens"] = Item(conn).count()
+            threads = [threading.Thread(target=worker, args=(name,)) for name in ("a", "b")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertIsNot(seen["a"], seen["b"]) # threads simultâneas usam conexões diferentes
+            self.assertEqual((seen["a_itens"], seen["b_itens"]), (0, 0))
+
+            # Com todas as conexões em uso, connection() espera e desiste após o timeout
+            holding, release = threading.Event(), threading.Event()
+            def hold():
+                with pool.connection():
+                    holding.set()
+                    release.wait(5)
+            holder = threading.Thread(target=hold)
+            holder.start()
+            self.assertTrue(holding.wait(5))
+            errors = []
+            def third():
+                try:
+                    with pool.connection(timeout=0.05):
+                        pass
+                except sqlite3.OperationalError as e:
+                    errors.append(e)
+            acquired = threading.Event()
+            def patient():
+                with pool.connection():
+                    acquired.set()
+            with pool.connection():
+                waiting = threading.Thread(target=third)
+                waiting.start()
+                waiting.join()
+                # Sem timeout, connection() espera até uma conexão ser devolvida
+                patient_thread = threading.Thread(target=patient)
+                patient_thread.start()
+                self.assertFalse(acquired.wait(0.2))
+            self.assertTrue(acquired.wait(5))
+            patient_thread.join()
+            release.set()
+            holder.join()
+            self.assertEqual(len(errors), 1)
+            self.assertIn("após 0.05 s", str(errors[0]))
+            self.assertEqual(pool.stats()["abertas"], 2)
+            pool.close()
+
+    def test_beneficiary_needs(self):
+        familia_id = self.beneficiario_model.save({"nome": "Família A", "telefone": "", "email": "", "endereco": "",
+                                                   "alimento_necessidade_1": " Arroz ", "alimento_necessidade_2": "",
+                                                   "alimento_necessidade_3": "Leite"})
+        creche_id = self.beneficiario_model.save({"nome": "Creche B", "telefone": "", "email": "", "endereco": "",
+                                                  "alimento_necessidade_1": "leite", "alimento_necessidade_2": "arroz"})
+        self.assertEqual([tuple(row) for row in self.conn.execute("SELECT prioridade, alimento FROM necessidades_beneficiario WHERE id_beneficiario = ? ORDER BY prioridade",
+                                           (familia_id,)).fetchall()], [(1, "Arroz"), (3, "Leite")])
+        self.assertEqual([(b["id_beneficiario"], b["prioridade"]) for b in self.beneficiario_model.get_needing("LEITE")],
+                         [(creche_id, 1), (familia_id, 3)])
+
+        self.beneficiario_model.update(familia_id, {"alimento_necessidade_1": "Feijão", "alimento_necessidade_3": None})
+        self.assertEqual([b["id_beneficiario"] for b in self.beneficiario_model.get_needing("arroz")], [creche_id])
+        self.assertEqual([b["nome"] for b in self.beneficiario_model.get_needing("feijão")], ["Família A"])
+        self.assertEqual([b["id_beneficiario"] for b in self.beneficiario_model.get_needing("leite")], [creche_id])
+        self.beneficiario_model.delete(creche_id)
+        self.assertEqual(self.beneficiario_model.get_needing("leite"), [])
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT id_beneficiario FROM necessidades_beneficiario WHERE alimento = ?", ("arroz",)).fetchall()
+        self.assertIn("idx_necessidades_alimento", plan[0]["detail"])
+
+    def test_item_catalog_dimensions(self):
+        arroz_id = self.item_model.save({"nome_item": "  Arroz  Integral", "marca": "Camil", "unidade": "kg"})
+        # Mesmas chaves (maiúsculas, acentos e espaços não contam): o item é o mesmo
+        self.assertEqual(self.item_model.get_by_name_brand_unit("ARROZ integral", " camil", "KG")["id_item"], arroz_id)
+        self.assertEqual(self.item_model.get_by_name_brand("arroz integral", "CAMIL")["nome_item"], "Arroz Integral")
+        self.assertIsNone(self.item_model.save({"nome_item": "arroz integral", "marca": "CAMIL", "unidade": "Kg"}))
+        feijao_id = self.item_model.save({"nome_item": "Feijão", "marca": "", "unidade": "kg"})
+        self.assertEqual(self.item_model.get_by_name_brand_unit("feijao", None, "kg")["id_item"], feijao_id)
+        self.assertEqual(intern_item(self.conn.cursor(), "FEIJAO", "", "KG"), (feijao_id, False))
+        self.assertEqual(self.item_model.get_dimension_names("nome_item"), ["Arroz Integral", "Feijão"])
+        self.assertEqual(self.item_model.get_dimension_names("marca"), ["Camil"])
+        # Renomear aponta o item para outra dimensão
+        self.item_model.update(feijao_id, {"nome_item": "feijão preto"})
+        item = self.item_model.get_by_id(feijao_id)
+        self.assertEqual((item["nome_item"], item["id_tipo"] != self.item_model.get_by_id(arroz_id)["id_tipo"]), ("feijão preto", True))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("INSERT INTO itens (nome_item, marca, unidade) VALUES ('Sal', '', 'kg')")
+
+        # Item que não chega a ser gravado não deixa dimensões novas para trás
+        self.assertIsNone(self.item_model.save({"nome_item": "Sal", "marca": "Cisne", "unidade": "kg", "coluna_inexistente": 1}))
+        self.assertIsNone(self.item_model.save_many([{"nome_item": "Sal", "marca": "Cisne", "unidade": "kg"},
+                                                     {"nome_item": "SAL", "marca": "cisne", "unidade": "kg"}]))
+        self.assertIsNone(self.item_model.update(feijao_id, {"nome_item": "Açúcar", "coluna_inexistente": 1}))
+        self.assertEqual([row[0] for row in self.conn.execute("SELECT chave FROM tipos_alimento ORDER BY chave")],
+                         ["arroz integral", "feijao", "feijao preto"])
+        self.assertEqual([row[0] for row in self.conn.execute("SELECT chave FROM marcas ORDER BY chave")], ["", "camil"])
+
+        # Pontuação separa palavras na chave: "Coca-Cola" é a marca "Coca Cola", mas "A.B." não é "AB"
+        refri_id = self.item_model.save({"nome_item": "Refrigerante", "marca": "Coca-Cola", "unidade": "L"})
+        self.assertIsNone(self.item_model.save({"nome_item": "refrigerante", "marca": "coca cola", "unidade": "l"}))
+        self.assertEqual(self.item_model.get_by_name_brand_unit("Refrigerante", "COCA COLA", "L")["id_item"], refri_id)
+        self.assertIsNotNone(self.item_model.save({"nome_item": "Refrigerante", "marca": "A.B.", "unidade": "L"}))
+        self.assertIsNotNone(self.item_model.save({"nome_item": "Refrigerante", "marca": "AB", "unidade": "L"}))
+
+    def test_item_dimensions_migration_merges_duplicates(self):
+        conn = get_db_connection(":memory:")
+        with patch("database.MIGRATIONS", MIGRATIONS[:10]):
+            create_tables(conn)
+        item_ids = [conn.execute("INSERT INTO itens (nome_item, marca, unidade) VALUES (?, ?, ?)", texts).lastrowid
+                    for texts in (("Arroz", "Camil", "kg"), ("arroz ", "CAMIL", "Kg"), ("Arroz", "Tio João", "kg"), ("ARROZ", None, "kg"))]
+        conn.commit()
+        donor_id = Doador(conn).save({"nome": "Doador", "telefone": "", "email": "", "endereco": ""})
+        beneficiary_id = Beneficiario(conn).save({"nome": "Beneficiario", "telefone": "", "email": "", "endereco": ""})
+        for item_id, quantidade, dia in ((item_ids[0], 10.0, "2025-01-02"), (item_ids[1], 5.0, "2025-01-02"), (item_ids[2], 3.0, "2025-01-03")):
+            DoacaoRecebida(conn).save({"id_doador": donor_id, "id_item": item_id, "quantidade": quantidade,
+                                       "data_recebimento": dia, "data_validade": "2026-01-01"})
+        DoacaoRealizada(conn).save({"id_beneficiario": beneficiary_id, "id_item": item_ids[1], "quantidade": 4.0, "data_doacao": "2025-01-04"})
+
+        create_tables(conn)
+        self.assertEqual(get_schema_version(conn), MIGRATIONS[-1][0])
+        items = {row["id_item"]: (row["nome_item"], row["marca"], row["unidade"]) for row in Item(conn).get_all()}
+        self.assertEqual(items, {item_ids[0]: ("Arroz", "Camil", "kg"), item_ids[2]: ("Arroz", "Tio João", "kg"),
+                                 item_ids[3]: ("Arroz", "", "kg")})
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM tipos_alimento").fetchone()[0], 1)
+        self.assertEqual(DoacaoRecebida(conn).get_stock_by_item(item_ids[0]), 11.0)
+        self.assertEqual(Lote(conn).get_available_quantity(item_ids[0]), 11.0)
+        self.assertEqual(DoacaoRecebida(conn).get_grouped_stock(), [{"nome_item": "Arroz", "unidade": "kg", "quantidade_total": 14.0}])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM doacoes_recebidas WHERE id_item = ?", (item_ids[1],)).fetchone()[0], 0)
+        self.assertEqual(check_stock_balance(conn), [])
+        self.assertEqual(check_daily_flow(conn), [])
+        self.assertEqual([row["nome_item"] for row in Item(conn).search("arroz")].count("Arroz"), 3)
+        conn.close()
+
+    def test_unit_conversion(self):
+        doador_id = self.doador_model.save({"nome": "Doador Unidades", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Unidades", "telefone": "", "email": "", "endereco": ""})
+        # "g" cria também a unidade base "kg"; pacote não tem conversão e é a própria base
+        arroz_g = self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "g"})
+        arroz_kg = self.item_model.save({"nome_item": "arroz", "marca": "Tio João", "unidade": "Kg"})
+        leite_ml = self.item_model.save({"nome_item": "Leite", "marca": "Italac", "unidade": "mL"})
+        pacote = self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "pacote"})
+        units = {row["chave"]: (row["grandeza"], row["fator"], row["id_unidade_base"] == row["id_unidade"])
+                 for row in self.conn.execute("SELECT * FROM unidades")}
+        self.assertEqual(units, {"g": ("massa", 0.001, False), "kg": ("massa", 1.0, True), "ml": ("volume", 0.001, False),
+                                 "l": ("volume", 1.0, True), "pacote": (None, 1.0, True)})
+        self.assertEqual(self.item_model.get_by_id(arroz_kg)["unidade"], "kg")
+
+        for item_id, quantidade in ((arroz_kg, 10.0), (arroz_g, 500.0), (leite_ml, 1500.0), (pacote, 2.0)):
+            self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": quantidade,
+                                             "data_recebimento": "2025-06-02", "data_validade": "2026-01-01"})
+        saida_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": arroz_g,
+                                                     "quantidade": 200.0, "data_doacao": "2025-06-03"})
+        canonical = [row[0] for row in self.conn.execute("SELECT quantidade_canonica FROM doacoes_recebidas ORDER BY id_doacao_recebida")]
+        self.assertEqual(canonical, [10.0, 0.5, 1.5, 2.0])
+        self.assertAlmostEqual(self.doacao_realizada_model.get_by_id(saida_id)["quantidade_canonica"], 0.2)
+        # Inserções não mudam a versão das doações (analytics.py lê só as linhas novas)
+        self.assertEqual(self.conn.execute("SELECT MAX(versao) FROM versao_dados").fetchone()[0], 0)
+
+        # Uma linha por tipo de alimento e unidade base, qualquer que seja a unidade de entrada
+        grouped = [(row["nome_item"], row["unidade"], round(row["quantidade_total"], 9))
+                   for row in self.doacao_recebida_model.get_grouped_stock()]
+        self.assertEqual(grouped, [("Arroz", "kg", 10.3), ("Arroz", "pacote", 2.0), ("Leite", "L", 1.5)])
+        report = MovimentacaoDiaria(self.conn).get_flow_report("2025-06-01", "2025-06-30", "mes")
+        self.assertEqual([(row["nome_item"], row["unidade"], round(row["quantidade_recebida"], 9), round(row["quantidade_distribuida"], 9))
+                          for row in report], [("Arroz", "kg", 10.5, 0.2), ("Arroz", "pacote", 2.0, 0.0), ("Leite", "L", 1.5, 0.0)])
+
+        # Alterar a quantidade ou a unidade do item recalcula a coluna canônica (e muda a versão)
+        self.doacao_realizada_model.update(saida_id, {"quantidade": 300.0})
+        self.assertAlmostEqual(self.doacao_realizada_model.get_by_id(saida_id)["quantidade_canonica"], 0.3)
+        self.item_model.update(leite_ml, {"unidade": "litro"})
+        self.assertEqual(self.conn.execute("SELECT quantidade_canonica FROM doacoes_recebidas WHERE id_item = ?", (leite_ml,)).fetchone()[0], 1500.0)
+        self.assertGreater(self.conn.execute("SELECT versao FROM versao_dados WHERE tabela = 'doacoes_recebidas'").fetchone()[0], 0)
+
+    def test_unit_conversion_migration_backfill(self):
+        conn = get_db_connection(":memory:")
+        with patch("database.MIGRATIONS", MIGRATIONS[:11]):
+            create_tables(conn)
+        donor_id = Doador(conn).save({"nome": "Doador", "telefone": "", "email": "", "endereco": ""})
+        for unidade, quantidade in (("g", 250.0), ("kg", 2.0), ("lata", 3.0)):
+            # Itens gravados como antes da migração 12 (sem as colunas de conversão em unidades)
+            item = resolve_item_columns(conn.cursor(), {"nome_item": "Feijão", "marca": "Kicaldo", "unidade": unidade}, convert_units=False)
+            item_id = conn.execute("INSERT INTO itens (nome_item, marca, unidade, id_tipo, id_marca, id_unidade) VALUES (?, ?, ?, ?, ?, ?)",
+                                   [item[column] for column in ("nome_item", "marca", "unidade", "id_tipo", "id_marca", "id_unidade")]).lastrowid
+            DoacaoRecebida(conn).save({"id_doador": donor_id, "id_item": item_id, "quantidade": quantidade,
+                                       "data_recebimento": "2025-01-02", "data_validade": "2026-01-01"})
+
+        create_tables(conn)
+        self.assertEqual(get_schema_version(conn), MIGRATIONS[-1][0])
+        canonical = [row[0] for row in conn.execute("SELECT quantidade_canonica FROM doacoes_recebidas ORDER BY id_doacao_recebida")]
+        self.assertEqual(canonical, [0.25, 2.0, 3.0])
+        self.assertEqual([(row["unidade"], row["quantidade_total"]) for row in DoacaoRecebida(conn).get_grouped_stock()],
+                         [("kg", 2.25), ("lata", 3.0)])
+        conn.close()
+
+    def test_package_units(self):
+        doador_id = self.doador_model.save({"nome": "Doador Embalagens", "telefone": "", "email": "", "endereco": ""})
+        # Número seguido de uma unidade conhecida: a embalagem vale o número vezes o fator
+        for unidade, quantidade in (("5kg", 2.0), ("500 g", 3.0), ("1L", 4.0), ("2x500g", 1.0), ("0kg", 1.0), ("1,5 kg", 1.0)):
+            item_id = self.item_model.save({"nome_item": "Arroz" if "g" in unidade else "Leite", "marca": "", "unidade": unidade})
+            self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": quantidade,
+                                             "data_recebimento": "2025-06-02", "data_validade": "2026-01-01"})
+        units = {row["chave"]: (row["grandeza"], row["fator"]) for row in self.conn.execute("SELECT * FROM unidades")}
+        self.assertEqual(units, {"5kg": ("massa", 5.0), "kg": ("massa", 1.0), "500 g": ("massa", 0.5), "1l": ("volume", 1.0),
+                                 "l": ("volume", 1.0), "2x500g": (None, 1.0), "0kg": (None, 1.0),
+                                 "1 5 kg": (None, 1.0)})
+        # Formatos que não são "número unidade" continuam separados, como unidades próprias
+        grouped = [(row["nome_item"], row["unidade"], row["quantidade_total"]) for row in self.doacao_recebida_model.get_grouped_stock()]
+        self.assertEqual(grouped, [("Arroz", "0kg", 1.0), ("Arroz", "1,5 kg", 1.0), ("Arroz", "2x500g", 1.0), ("Arroz", "kg", 11.5),
+                                   ("Leite", "L", 4.0)])
+
+        # Unidades de embalagem gravadas antes da migração 15 (sem grandeza e com fator 1) são convertidas
+        conn = get_db_connection(":memory:")
+        with patch("database.MIGRATIONS", MIGRATIONS[:14]):
+            create_tables(conn)
+        item_id = Item(conn).save({"nome_item": "Feijão", "marca": "", "unidade": "2kg"})
+        conn.execute("UPDATE unidades SET grandeza = NULL, id_unidade_base = id_unidade, fator = 1")
+        DoacaoRecebida(conn).save({"id_doador": Doador(conn).save({"nome": "Doador", "telefone": "", "email": "", "endereco": ""}),
+                                   "id_item": item_id, "quantidade": 3.0, "data_recebimento": "2025-01-02", "data_validade": "2026-01-01"})
+        self.assertEqual(conn.execute("SELECT quantidade_canonica FROM doacoes_recebidas").fetchone()[0], 3.0)
+        create_tables(conn)
+        self.assertEqual(conn.execute("SELECT quantidade_canonica FROM doacoes_recebidas").fetchone()[0], 6.0)
+        self.assertEqual([(row["unidade"], row["quantidade_total"]) for row in DoacaoRecebida(conn).get_grouped_stock()], [("kg", 6.0)])
+        conn.close()
+
+    def test_daily_flow_report(self):
+        doador_id = self.doador_model.save({"nome": "Doador Relatório", "telefone": "", "email": "", "endereco": ""})
+        beneficiario_id = self.beneficiario_model.save({"nome": "Beneficiario Relatório", "telefone": "", "email": "", "endereco": ""})
+        arroz_id = self.item_model.save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        arroz2_id = self.item_model.save({"nome_item": "Arroz", "marca": "Tio João", "unidade": "kg"})
+        leite_id = self.item_model.save({"nome_item": "Leite", "marca": "Italac", "unidade": "L"})
+        # 2025-03-03 é segunda-feira; 2025-03-09 é domingo
+        for item_id, quantidade, dia in ((arroz_id, 10.0, "2025-03-03"), (arroz2_id, 5.0, "2025-03-09"),
+                                         (leite_id, 12.0, "2025-03-10"), (arroz_id, 8.0, "2025-04-01")):
+            self.doacao_recebida_model.save({"id_doador": doador_id, "id_item": item_id, "quantidade": quantidade,
+                                             "data_recebimento": dia, "data_validade": "2026-01-01"})
+        saida_id = self.doacao_realizada_model.save({"id_beneficiario": beneficiario_id, "id_item": arroz_id,
+                                                     "quantidade": 4.0, "data_doacao": "2025-03-04"})
+        model = MovimentacaoDiaria(self.conn)
+
+        self.assertEqual(model.get_flow_report("2025-03-01", "2025-04-30", "mes"), [
+            {"periodo": "2025-03-01", "nome_item": "Arroz", "unidade": "kg", "quantidade_recebida": 15.0,
+             "quantidade_distribuida": 4.0, "entradas": 2, "saidas": 1},
+            {"periodo": "2025-03-01", "nome_item": "Leite", "unidade": "L", "quantidade_recebida": 12.0,
+             "quantidade_distribuida": 0.0, "entradas": 1, "saidas": 0},
+            {"periodo": "2025-04-01", "nome_item": "Arroz", "unidade": "kg", "quantidade_recebida": 8.0,
+             "quantidade_distribuida": 0.0, "entradas": 1, "saidas": 0},
+        ])
+        weeks = model.get_flow_report("2025-03-01", "2025-03-31", "semana", by_item=False)
+        self.assertEqual([(w["periodo"], w["quantidade_recebida"]) for w in weeks], [("2025-03-03", 15.0), ("2025-03-10", 12.0)])
+        days = model.get_flow_report(datetime(2025, 3, 3).date(), "2025-03-04", "dia", nome_item="Arroz")
+        self.assertEqual([(d["periodo"], d["quantidade_recebida"], d["quantidade_distribuida"]) for d in days],
+                         [("2025-03-03", 10.0, 0.0), ("2025-03-04", 0.0, 4.0)])
+        with self.assertRaises(ValueError):
+            model.get_flow_report("2025-03-01", "2025-03-31", "ano")
+
+        # Alterações e exclusões movem as quantidades entre dias e itens
+        self.doacao_realizada_model.update(saida_id, {"quantidade": 6.0, "data_doacao": "2025-03-05"})
+        self.doacao_recebida_model.update(self.doacao_recebida_model.get_all()[3]["id_doacao_recebida"], {"data_recebimento": "2025-03-31"})
+        self.doacao_recebida_model.delete(self.doacao_recebida_model.get_all()[2]["id_doacao_recebida"])
+        totals = model.get_flow_report("2025-01-01", "2025-12-31", "mes", by_item=False)
+        self.assertEqual([(t["periodo"], t["quantidade_recebida"], t["quantidade_distribuida"], t["entradas"]) for t in totals],
+                         [("2025-03-01", 23.0, 6.0, 3)])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM movimentacao_diaria WHERE dia = '2025-03-04'").fetchone()[0], 0)
+        self.assertEqual(check_daily_flow(self.conn), [])
+
+        # Divergência proposital corrigida pela reconstrução
+        self.conn.execute("UPDATE movimentacao_diaria SET quantidade_recebida = 0")
+        self.conn.commit()
+        self.assertEqual(len(check_daily_flow(self.conn)), 3)
+        self.assertTrue(rebuild_daily_flow(self.conn))
+        self.assertEqual(check_daily_flow(self.conn), [])
+        self.assertEqual(model.get_flow_report("2025-01-01", "2025-12-31", "mes", by_item=False)[0]["quantidade_recebida"], 23.0)
+
 if __name__ == '__main__':
     unittest.main(argv=["first-arg-is-ignored"], exit=False)
 
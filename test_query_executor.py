@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+from models import Doador, get_db_connection
+from database import create_tables
+from query_executor import QueryExecutor
+
+class TestQueryExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "estoque.db")
+        self.conn = get_db_connection(self.db_file)
+        create_tables(self.conn)
+        Doador(conn=self.conn).save({"nome": "Doador Thread", "telefone": "", "email": "", "endereco": ""})
+        self.executor = QueryExecutor(self.db_file)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def wait_results(self, expected, timeout=5):
+        delivered = 0
+        deadline = time.monotonic() + timeout
+        while delivered < expected and time.monotonic() < deadline:
+            delivered += self.executor.poll()
+            time.sleep(0.01)
+        return delivered
+
+    def test_results_delivered_by_poll(self):
+        results = []
+        self.executor.submit("doadores", lambda conn: (threading.current_thread().name, Doador(conn).get_all()), results.append)
+        self.assertEqual(results, []) # nada é entregue fora de poll()
+        self.assertEqual(self.wait_results(1), 1)
+        thread_name, donors = results[0]
+        self.assertTrue(thread_name.startswith("query-executor"))
+        self.assertEqual([d["nome"] for d in donors], ["Doador Thread"])
+
+        errors = []
+        self.executor.submit("erro", lambda conn: conn.execute("SELECT * FROM tabela_inexistente"), results.append, errors.append)
+        self.assertEqual(self.wait_results(1), 1)
+        self.assertEqual(len(errors), 1)
+
+    def test_superseded_requests_are_dropped(self):
+        started, release = threading.Event(), threading.Event()
+        executed, results = [], []
+
+        def slow(conn):
+            started.set()
+            release.wait(5)
+            return "primeira"
+
+        def query(text):
+            def run(conn):
+                executed.append(text)
+                return text
+            return run
+
+        self.executor.submit("busca", slow, results.append)
+        self.assertTrue(started.wait(5))
+        # Enquanto a primeira roda, chegam outras com a mesma chave: só a última vale
+        self.executor.submit("busca", query("ar"), results.append)
+        self.executor.submit("busca", query("arr"), results.append)
+        self.executor.submit("outra", query("independente"), results.append)
+        release.set()
+        self.assertEqual(self.wait_results(2), 2)
+        self.assertEqual(sorted(results), ["arr", "independente"])
+        self.assertNotIn("ar", executed) # substituída ainda na fila, nem chegou a rodar
+
+        self.executor.submit("busca", query("cancelada"), results.append)
+        self.executor.cancel("busca")
+        self.executor.submit("fim", query("fim"), results.append)
+        self.wait_results(1)
+        self.assertNotIn("cancelada", results)
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
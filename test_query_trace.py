@@ -0,0 +1,79 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from models import Doador, get_db_connection
+from database import create_tables
+import query_trace
+from query_trace import TracedCursor, query_shape
+
+class TestQueryTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.conn = get_db_connection(os.path.join(self.tmpdir.name, "estoque.db"))
+        create_tables(self.conn)
+        for i in range(10):
+            Doador(self.conn).save({"nome": f"Doador {i}", "telefone": "", "email": "", "endereco": ""})
+
+    def tearDown(self):
+        query_trace.disable_tracing()
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape("SELECT *\n  FROM itens WHERE nome_item = 'Arroz' AND id_item = 12"),
+                         "SELECT * FROM itens WHERE nome_item = ? AND id_item = ?")
+        self.assertEqual(query_shape("SELECT * FROM lotes WHERE id_item IN (?, ?,?) LIMIT 5"),
+                         "SELECT * FROM lotes WHERE id_item IN (...) LIMIT ?")
+        # Números dentro de nomes não são literais
+        self.assertEqual(query_shape("SELECT alimento_necessidade_1 FROM beneficiarios"),
+                         "SELECT alimento_necessidade_1 FROM beneficiarios")
+
+    def test_disabled_uses_plain_cursor(self):
+        self.assertIsNone(query_trace.active_tracer())
+        self.assertIs(type(self.conn.cursor()), sqlite3.Cursor)
+        self.assertIs(type(self.conn.execute("SELECT 1")), sqlite3.Cursor)
+
+    def test_statistics_by_shape(self):
+        tracer = query_trace.enable_tracing(slow_ms=10000)
+        self.assertIsInstance(self.conn.cursor(), TracedCursor)
+        for i in range(1, 6):
+            self.conn.execute(f"SELECT nome FROM doadores WHERE id_doador = {i}").fetchone()
+        self.assertEqual(len(self.conn.execute("SELECT * FROM doadores").fetchall()), 10)
+        self.assertEqual(sum(1 for _ in self.conn.execute("SELECT * FROM doadores WHERE id_doador > ?", (5,))), 5)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.conn.execute("SELECT * FROM inexistente")
+
+        stats = {row["consulta"]: row for row in tracer.summary()}
+        by_id = stats["SELECT nome FROM doadores WHERE id_doador = ?"]
+        self.assertEqual((by_id["execucoes"], by_id["linhas"], by_id["erros"]), (5, 5, 0))
+        self.assertLessEqual(by_id["p50_ms"], by_id["max_ms"])
+        self.assertEqual(stats["SELECT * FROM doadores"]["linhas"], 10)
+        self.assertEqual(stats["SELECT * FROM doadores WHERE id_doador > ?"]["linhas"], 5)
+        self.assertEqual(stats["SELECT * FROM inexistente"]["erros"], 1)
+        self.assertEqual(tracer.summary()[0]["total_ms"], max(row["total_ms"] for row in stats.values()))
+        self.assertEqual(list(tracer.slow_queries), [])
+
+        # As consultas dos modelos passam pela mesma conexão
+        Doador(self.conn).get_all()
+        self.assertTrue(any("FROM doadores" in row["consulta"] and row["linhas"] == 10
+                            for row in tracer.summary() if row["consulta"] != "SELECT * FROM doadores"))
+        tracer.reset()
+        self.assertEqual(tracer.summary(), [])
+
+    def test_slow_query_log_with_plan(self):
+        log_file = os.path.join(self.tmpdir.name, "lentas.log")
+        tracer = query_trace.enable_tracing(slow_ms=0, log_file=log_file)
+        self.conn.execute("SELECT * FROM doadores WHERE id_doador = ?", (3,)).fetchall()
+        entry = tracer.slow_queries[-1]
+        self.assertEqual((entry["sql"], entry["linhas"]), ("SELECT * FROM doadores WHERE id_doador = ?", 1))
+        self.assertTrue(any(line.startswith(("SEARCH", "SCAN")) for line in entry["plano"]))
+        with open(log_file, encoding="utf-8") as file:
+            log = file.read()
+        self.assertIn("SELECT * FROM doadores WHERE id_doador = ?", log)
+        self.assertIn("SEARCH", log)
+        self.assertIn("SELECT * FROM doadores WHERE id_doador = ?", tracer.format_summary())
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,159 @@
+import unittest
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+from datetime import date
+from xml.etree import ElementTree
+from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, get_db_connection
+from database import create_tables
+from synthetic_data import generate
+import report_export
+from report_export import ExportCancelled, ExportJob, export_report, write_xlsx
+
+XLSX_NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+class TestReportExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "estoque.db")
+        self.conn = get_db_connection(self.db_file)
+        create_tables(self.conn)
+        donor_id = Doador(self.conn).save({"nome": "Mercado; Central", "telefone": "", "email": "", "endereco": ""})
+        beneficiary_id = Beneficiario(self.conn).save({"nome": "Ana", "telefone": "", "email": "", "endereco": ""})
+        self.arroz = Item(self.conn).save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        self.feijao = Item(self.conn).save({"nome_item": "Feijão", "marca": "Kicaldo", "unidade": "kg"})
+        for item_id, quantidade, recebimento, validade in ((self.arroz, 10.0, "2025-01-10", "2025-06-20"),
+                                                           (self.feijao, 4.0, "2025-02-15", "2025-12-31"),
+                                                           (self.arroz, 5.0, "2025-03-20", "2025-07-15")):
+            DoacaoRecebida(self.conn).save({"id_doador": donor_id, "id_item": item_id, "quantidade": quantidade,
+                                            "data_recebimento": recebimento, "data_validade": validade})
+        DoacaoRealizada(self.conn).save({"id_beneficiario": beneficiary_id, "id_item": self.arroz,
+                                         "quantidade": 3.0, "data_doacao": "2025-02-01"})
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def read_csv(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8-sig", newline="") as file:
+            return list(csv.reader(file, delimiter=";"))
+
+    def test_csv_with_filters(self):
+        path = self.path("entradas.csv")
+        self.assertEqual(export_report(self.conn, "entradas", path), 3)
+        rows = self.read_csv(path)
+        self.assertEqual(rows[0], ["ID Doação", "Doador", "Tipo de Alimento", "Marca", "Unidade", "Quantidade",
+                                   "Data Recebimento", "Data Validade"])
+        self.assertEqual(rows[1], ["1", "Mercado; Central", "Arroz", "Camil", "kg", "10.0", "2025-01-10", "2025-06-20"])
+        self.assertEqual([row[6] for row in rows[1:]], ["2025-01-10", "2025-02-15", "2025-03-20"])
+
+        # Datas da interface (DD/MM/YYYY) e tipo de alimento sem acento
+        self.assertEqual(export_report(self.conn, "entradas", path, start="01/02/2025", nome_item="feijao"), 1)
+        self.assertEqual([row[2] for row in self.read_csv(path)[1:]], ["Feijão"])
+        self.assertEqual(export_report(self.conn, "entradas", path, end=date(2025, 1, 31)), 1)
+        self.assertEqual(export_report(self.conn, "saidas", self.path("saidas.csv.gz")), 1)
+        self.assertEqual(self.read_csv(self.path("saidas.csv.gz"))[1][1:], ["Ana", "Arroz", "Camil", "kg", "3.0", "2025-02-01"])
+
+    def test_jsonl_stock_and_alerts(self):
+        path = self.path("estoque.jsonl.gz")
+        self.assertEqual(export_report(self.conn, "estoque", path), 3)
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual([(row["id_item"], row["data_validade"], row["quantidade_disponivel"]) for row in rows],
+                         [(self.arroz, "2025-06-20", 7.0), (self.arroz, "2025-07-15", 5.0), (self.feijao, "2025-12-31", 4.0)])
+
+        # Alertas: por padrão, lotes com saldo que vencem nos próximos 30 dias
+        path = self.path("alertas.jsonl")
+        self.assertEqual(export_report(self.conn, "alertas", path, today=date(2025, 6, 1)), 1)
+        with open(path, encoding="utf-8") as file:
+            row = json.loads(file.readline())
+        self.assertEqual((row["nome_item"], row["quantidade"], row["data_validade"]), ("Arroz", 7.0, "2025-06-20"))
+        self.assertEqual(export_report(self.conn, "alertas", path, start="2025-06-01", end="2025-12-31"), 3)
+
+    def test_xlsx(self):
+        path = self.path("entradas.xlsx")
+        self.assertEqual(export_report(self.conn, "entradas", path), 3)
+        with zipfile.ZipFile(path) as archive:
+            self.assertIn("xl/styles.xml", archive.namelist())
+            sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+            workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        self.assertEqual([element.get("name") for element in workbook.iter(f"{{{XLSX_NS['x']}}}sheet")], ["Entradas"])
+        rows = sheet.findall(".//x:row", XLSX_NS)
+        self.assertEqual(len(rows), 4)
+        cells = rows[1].findall("x:c", XLSX_NS)
+        self.assertEqual(cells[1].find("x:is/x:t", XLSX_NS).text, "Mercado; Central")
+        self.assertEqual(cells[5].find("x:v", XLSX_NS).text, "10.0")
+        # Datas viram números de série do Excel com o estilo de data
+        self.assertEqual((cells[6].get("s"), cells[6].find("x:v", XLSX_NS).text),
+                         ("1", str((date(2025, 1, 10) - date(1899, 12, 30)).days)))
+
+        # Acima do limite de linhas, o relatório continua em outra aba
+        path = self.path("abas.xlsx")
+        self.assertEqual(write_xlsx(path, "Teste", ["a", "data_b"], ["A", "B"],
+                                    [(i, "texto <&>") for i in range(5)], max_rows=3), 3)
+        with zipfile.ZipFile(path) as archive:
+            workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+            last = ElementTree.fromstring(archive.read("xl/worksheets/sheet3.xml"))
+        self.assertEqual([element.get("name") for element in workbook.iter(f"{{{XLSX_NS['x']}}}sheet")],
+                         ["Teste", "Teste 2", "Teste 3"])
+        self.assertEqual(last.findall(".//x:row", XLSX_NS)[-1].find("x:c/x:is/x:t", XLSX_NS).text, "texto <&>")
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            export_report(self.conn, "doadores", self.path("a.csv"))
+        with self.assertRaises(ValueError):
+            export_report(self.conn, "entradas", self.path("a.txt"))
+        with self.assertRaises(ValueError):
+            export_report(self.conn, "entradas", self.path("a.xlsx.gz"))
+        with self.assertRaises(ValueError):
+            export_report(self.conn, "entradas", self.path("a.csv"), start="31/02/2025")
+
+    def test_progress_and_cancel_in_constant_memory(self):
+        generate(self.conn, donors=20, beneficiaries=5, items=30, received=30000, distributed=0,
+                 seed=3, days=90, end_date=date(2025, 6, 30), batch_size=5000)
+        calls = []
+        tracemalloc.start()
+        try:
+            rows = export_report(self.conn, "entradas", self.path("grande.csv"), progress=lambda done, total: calls.append((done, total)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(rows, 30003)
+        self.assertEqual(calls[-1], (30003, 30003))
+        self.assertEqual([done for done, _ in calls[:3]], [10000, 20000, 30000])
+        # As linhas não se acumulam em memória (30.000 tuplas ocupariam vários MB)
+        self.assertLess(peak, 1024 * 1024)
+
+        cancel = threading.Event()
+        path = self.path("cancelada.jsonl")
+        with self.assertRaises(ExportCancelled):
+            export_report(self.conn, "entradas", path, progress=lambda done, total: cancel.set(), cancel=cancel)
+        self.assertFalse(os.path.exists(path))
+
+    def test_export_job(self):
+        path = self.path("saidas.xlsx")
+        job = ExportJob(self.db_file, "saidas", path, start="2025-01-01").start()
+        self.assertTrue(job.wait(10))
+        self.assertIsNone(job.error)
+        self.assertEqual((job.rows, job.done, job.total), (1, 1, 1))
+        job = ExportJob(self.db_file, "saidas", self.path("saidas.pdf")).start()
+        self.assertTrue(job.wait(10))
+        self.assertIsInstance(job.error, ValueError)
+
+    def test_cli(self):
+        path = self.path("estoque.csv")
+        self.assertEqual(report_export.main(["estoque", path, "--db", self.db_file, "--tipo", "ARROZ"]), 0)
+        self.assertEqual(len(self.read_csv(path)), 3)
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
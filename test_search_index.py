@@ -0,0 +1,49 @@
+import unittest
+from search_index import NameIndex
+from validators import normalize_key
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        names = ["Maria Silva", "José Antônio", "Ana Maria Souza", "Mariana Costa", "Antonio Carlos", "Associação São José"]
+        self.index = NameIndex.build(((i, name, f"{name} (ID: {i})") for i, name in enumerate(names, start=1)), limit=10)
+
+    def test_normalize_key(self):
+        self.assertEqual(normalize_key("  José da SILVA-Araújo "), "jose da silva araujo")
+        self.assertEqual(normalize_key("AÇÚCAR"), normalize_key("acucar"))
+        self.assertEqual(normalize_key(None), "")
+        # Pontuação separa palavras como um espaço, sem juntar as letras
+        self.assertEqual(normalize_key("Coca-Cola"), normalize_key("coca  cola"))
+        self.assertEqual((normalize_key("A.B."), normalize_key("AB")), ("a b", "ab"))
+
+    def test_search_ranking(self):
+        # Nomes que começam com a busca vêm antes dos que só têm uma palavra começando com ela
+        self.assertEqual(self.index.search("mari"), ["Maria Silva (ID: 1)", "Mariana Costa (ID: 4)", "Ana Maria Souza (ID: 3)"])
+        # Sem diferença de acentos e maiúsculas
+        self.assertEqual(self.index.search("ANTÔN"), ["Antonio Carlos (ID: 5)", "José Antônio (ID: 2)"])
+        self.assertEqual(self.index.search("sao jo"), ["Associação São José (ID: 6)"])
+        # Todas as palavras precisam casar
+        self.assertEqual(self.index.search("maria souza"), ["Ana Maria Souza (ID: 3)"])
+        self.assertEqual(self.index.search("maria xyz"), [])
+        self.assertEqual(self.index.search("", limit=2), ["Ana Maria Souza (ID: 3)", "Antonio Carlos (ID: 5)"])
+        self.assertEqual(len(self.index.search("a", limit=3)), 3)
+
+    def test_incremental_updates(self):
+        self.index.add(7, "Marcos Lima", "Marcos Lima (ID: 7)")
+        self.assertEqual(self.index.search("marc"), ["Marcos Lima (ID: 7)"])
+        self.index.add(7, "Pedro Lima", "Pedro Lima (ID: 7)") # atualização substitui a entrada
+        self.assertEqual(self.index.search("marc"), [])
+        self.assertEqual(self.index.search("lima"), ["Pedro Lima (ID: 7)"])
+        self.index.remove(1)
+        self.assertNotIn(1, self.index)
+        self.assertEqual(self.index.search("silva"), [])
+        self.assertEqual(len(self.index), 6)
+
+        # Listas de valores distintos usam o próprio texto como id
+        brands = NameIndex.build((brand, brand, brand) for brand in {"Camil", "Tio João"})
+        brands.add("Camil", "Camil")
+        self.assertEqual(brands.search("joao"), ["Tio João"])
+        self.assertEqual(brands.search(""), ["Camil", "Tio João"])
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,94 @@
+import unittest
+import os
+import tempfile
+from datetime import date
+from models import Doador, Beneficiario, Item, DoacaoRecebida, DoacaoRealizada, RetratoSaldo, get_db_connection, _period_ends
+from database import create_tables
+from stock_snapshots import SnapshotWorker
+
+class TestStockSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "estoque.db")
+        self.conn = get_db_connection(self.db_file)
+        create_tables(self.conn)
+        self.donor_id = Doador(self.conn).save({"nome": "Mercado", "telefone": "", "email": "", "endereco": ""})
+        self.beneficiary_id = Beneficiario(self.conn).save({"nome": "Ana", "telefone": "", "email": "", "endereco": ""})
+        self.arroz = Item(self.conn).save({"nome_item": "Arroz", "marca": "Camil", "unidade": "kg"})
+        self.feijao = Item(self.conn).save({"nome_item": "Feijão", "marca": "Kicaldo", "unidade": "kg"})
+        for item_id, quantidade, dia in ((self.arroz, 10.0, "2025-01-10"), (self.feijao, 4.0, "2025-02-15"),
+                                         (self.arroz, 5.0, "2025-03-20")):
+            self.receive(item_id, quantidade, dia)
+        self.give(self.arroz, 3.0, "2025-02-01")
+        self.give(self.feijao, 4.0, "2025-03-05")
+        self.model = RetratoSaldo(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def receive(self, item_id, quantidade, dia):
+        DoacaoRecebida(self.conn).save({"id_doador": self.donor_id, "id_item": item_id, "quantidade": quantidade,
+                                        "data_recebimento": dia, "data_validade": "2026-12-31"})
+
+    def give(self, item_id, quantidade, dia):
+        DoacaoRealizada(self.conn).save({"id_beneficiario": self.beneficiary_id, "id_item": item_id,
+                                         "quantidade": quantidade, "data_doacao": dia})
+
+    def stock(self, day):
+        return {row["id_item"]: row["quantidade"] for row in self.model.get_stock_as_of(day)}
+
+    def expected(self):
+        return {
+            "2024-12-31": {},
+            "2025-01-10": {self.arroz: 10.0},
+            "2025-02-01": {self.arroz: 7.0},
+            "2025-02-28": {self.arroz: 7.0, self.feijao: 4.0},
+            "2025-03-05": {self.arroz: 7.0},
+            "2025-03-31": {self.arroz: 12.0},
+        }
+
+    def test_period_ends(self):
+        self.assertEqual(list(_period_ends(date(2025, 1, 10), date(2025, 3, 30), 'mes')),
+                         [date(2025, 1, 31), date(2025, 2, 28)])
+        self.assertEqual(list(_period_ends(date(2025, 6, 4), date(2025, 6, 22), 'semana')),
+                         [date(2025, 6, 8), date(2025, 6, 15), date(2025, 6, 22)])
+
+    def test_stock_as_of_with_and_without_snapshots(self):
+        for day, balances in self.expected().items():
+            self.assertEqual(self.stock(day), balances, day)
+        self.assertEqual(self.model.refresh_snapshots('semana', today="2025-04-01"), 12)
+        self.assertEqual(self.model.refresh_snapshots('semana', today="2025-04-01"), 0)
+        self.assertEqual(self.model.refresh_snapshots('mes', today="2025-04-01"), 3)
+        self.assertIn("2025-02-28", self.model.get_snapshot_days())
+        for day, balances in self.expected().items():
+            self.assertEqual(self.stock(day), balances, day)
+        row = self.model.get_stock_as_of(date(2025, 2, 28))[0]
+        self.assertEqual((row["nome_item"], row["marca"], row["unidade"]), ("Arroz", "Camil", "kg"))
+        with self.assertRaises(ValueError):
+            self.model.refresh_snapshots('ano')
+
+    def test_backdated_donation_invalidates_snapshots(self):
+        self.assertEqual(self.model.refresh_snapshots('mes', today="2025-04-01"), 3)
+        self.give(self.arroz, 2.0, "2025-02-10")
+        # Os retratos de 28/02 e 31/03 deixam de valer; o de 31/01 continua
+        self.assertEqual(self.model.get_snapshot_days(), ["2025-01-31"])
+        self.assertEqual(self.stock("2025-02-28"), {self.arroz: 5.0, self.feijao: 4.0})
+        self.assertEqual(self.model.refresh_snapshots('mes', today="2025-04-01"), 2)
+        self.assertEqual(self.stock("2025-03-31"), {self.arroz: 10.0})
+        self.assertEqual(self.stock("2025-03-15"), {self.arroz: 5.0})
+
+    def test_worker(self):
+        worker = SnapshotWorker(self.db_file, period='semana').start()
+        try:
+            self.assertTrue(worker.wait_idle(10))
+        finally:
+            worker.stop()
+        self.assertGreater(worker.last_created, 0)
+        self.assertEqual(len(self.model.get_snapshot_days()), worker.last_created)
+        with self.assertRaises(ValueError):
+            SnapshotWorker(self.db_file, period='dia')
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,59 @@
+import unittest
+from datetime import date
+from models import get_db_connection
+from database import create_tables, check_stock_balance
+from synthetic_data import generate
+
+class TestSyntheticData(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_db_connection(":memory:")
+        create_tables(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def generate(self, conn, seed=7):
+        return generate(conn, donors=30, beneficiaries=10, items=60, received=3000, distributed=2500,
+                        seed=seed, days=120, end_date=date(2026, 6, 30), batch_size=500)
+
+    def table(self, conn, sql):
+        return [tuple(row) for row in conn.execute(sql)]
+
+    def test_generated_data_is_consistent(self):
+        summary = self.generate(self.conn)
+        self.assertEqual(summary["doacoes_recebidas"], 3000)
+        self.assertEqual(summary["doacoes_realizadas"] + summary["realizadas_sem_estoque"], 2500)
+        self.assertEqual(self.table(self.conn, "SELECT COUNT(*) FROM itens"), [(60,)])
+        self.assertEqual(check_stock_balance(self.conn), [])
+        # Cada lote perdeu exatamente o que foi alocado dele, e nenhum ficou negativo
+        self.assertEqual(self.table(self.conn, """
+            SELECT COUNT(*) FROM lotes l JOIN doacoes_recebidas dr USING (id_doacao_recebida)
+            WHERE l.quantidade_restante < 0 OR ABS(dr.quantidade - l.quantidade_restante
+                - COALESCE((SELECT SUM(a.quantidade) FROM alocacoes_lote a WHERE a.id_lote = l.id_lote), 0)) > 1e-6
+        """), [(0,)])
+        # Doações realizadas só consomem lotes recebidos até a data delas, ainda válidos, e sempre do mesmo item
+        self.assertEqual(self.table(self.conn, """
+            SELECT COUNT(*) FROM alocacoes_lote a
+            JOIN doacoes_realizadas r USING (id_doacao_realizada)
+            JOIN lotes l USING (id_lote)
+            JOIN doacoes_recebidas dr USING (id_doacao_recebida)
+            WHERE dr.data_recebimento > r.data_doacao OR l.id_item != r.id_item OR l.data_validade < r.data_doacao
+        """), [(0,)])
+        self.assertEqual(self.table(self.conn, "SELECT MIN(data_recebimento), MAX(data_recebimento) <= '2026-06-30' FROM doacoes_recebidas")[0][1], 1)
+
+    def test_same_seed_same_database(self):
+        self.generate(self.conn)
+        other = get_db_connection(":memory:")
+        create_tables(other)
+        try:
+            self.generate(other)
+            sql = "SELECT id_doador, id_item, quantidade, data_recebimento, data_validade FROM doacoes_recebidas"
+            self.assertEqual(self.table(self.conn, sql), self.table(other, sql))
+            sql = "SELECT * FROM alocacoes_lote"
+            self.assertEqual(self.table(self.conn, sql), self.table(other, sql))
+        finally:
+            other.close()
+
+if __name__ == '__main__':
+    unittest.main(argv=["first-arg-is-ignored"], exit=False)
@@ -0,0 +1,70 @@
+import math
+import re
+import unicodedata
+from datetime import date
+from functools import lru_cache
+
+# Regras de validação compartilhadas entre a interface (app.py) e o importador (bulk_import.py)
+
+PHONE_PATTERN = re.compile(r'\(?\d{2}\)?\s?\d{4,5}-?\d{4}')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+NON_DIGITS = re.compile(r'\D')
+BR_DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+ISO_DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+NON_WORD = re.compile(r'[\W_]+')
+
+def validate_phone(phone):
+    # Remove caracteres não numéricos para validação do comprimento
+    phone_digits = NON_DIGITS.sub('', phone)
+    # Regex para (DD)NNNNN-NNNN ou NNNNN-NNNN (com ou sem parênteses no DDD)
+    # Permite espaços e hífens, mas valida apenas dígitos
+    # O número deve ter 10 ou 11 dígitos (com DDD)
+    return PHONE_PATTERN.fullmatch(phone) is not None and (len(phone_digits) == 10 or len(phone_digits) == 11)
+
+def validate_email(email):
+    # Regex para validação de email mais robusta
+    return EMAIL_PATTERN.fullmatch(email) is not None
+
+@lru_cache(maxsize=4096)
+def parse_date(date_str):
+    """ Converte DD/MM/YYYY (formato da interface) ou YYYY-MM-DD para YYYY-MM-DD.
+
+    Levanta ValueError se a data for inválida. O resultado é memorizado, pois
+    importações repetem as mesmas datas em milhares de linhas.
+    """
+    date_str = date_str.strip()
+    match = BR_DATE_PATTERN.fullmatch(date_str)
+    if match:
+        day, month, year = match.groups()
+    else:
+        match = ISO_DATE_PATTERN.fullmatch(date_str)
+        if not match:
+            raise ValueError(f"Data inválida: {date_str!r}")
+        year, month, day = match.groups()
+    # date() valida dia/mês (ex.: 31/02 levanta ValueError)
+    return date(int(year), int(month), int(day)).isoformat()
+
+def parse_quantity(quantity_str):
+    """ Converte a quantidade aceitando vírgula decimal; levanta ValueError se não for um número
+    positivo e finito ("inf", "1e400" e "nan" são recusados) """
+    try:
+        quantity = float(str(quantity_str).strip().replace(',', '.'))
+    except ValueError:
+        raise ValueError("Quantidade inválida. Digite um número.")
+    if not (math.isfinite(quantity) and quantity > 0):
+        raise ValueError("A quantidade deve ser um número positivo.")
+    return quantity
+
+@lru_cache(maxsize=65536)
+def normalize_key(text):
+    """ Chave de busca: sem acentos, sem diferença de maiúsculas e com palavras separadas por um espaço.
+
+    "  José da SILVA-Araújo " -> "jose da silva araujo"
+
+    Pontuação conta como separador de palavras, não é apagada: "Coca-Cola" e
+    "Coca Cola" têm a mesma chave (e são a mesma marca nas dimensões de itens),
+    mas "A.B." ("a b") continua diferente de "AB" ("ab").
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', without_accents.casefold()).strip()
@@ -0,0 +1,263 @@
+from functools import lru_cache
+from tkinter import ttk
+
+
+@lru_cache(maxsize=8192)
+def format_date_br(iso_date):
+    """ Converte YYYY-MM-DD para DD/MM/YYYY sem passar por strptime """
+    if not iso_date or len(iso_date) < 10:
+        return iso_date or ""
+    return f"{iso_date[8:10]}/{iso_date[5:7]}/{iso_date[0:4]}"
+
+
+def apply_rows_diff(tree, rows):
+    """ Sincroniza um Treeview com rows [(iid, valores)] mexendo só nas linhas que mudaram.
+
+    Linhas novas, alteradas ou removidas são tratadas individualmente e a ordem
+    de rows é respeitada, então a seleção e a rolagem das demais linhas ficam
+    como estavam.
+    """
+    wanted = {iid for iid, _ in rows}
+    stale = [iid for iid in tree.get_children() if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+    for index, (iid, values) in enumerate(rows):
+        values = tuple(values)
+        if tree.exists(iid):
+            # O Tk pode devolver números como int: a comparação é feita sobre o texto
+            if tuple(str(value) for value in tree.item(iid, "values")) != tuple(str(value) for value in values):
+                tree.item(iid, values=values)
+            if tree.index(iid) != index:
+                tree.move(iid, "", index)
+        else:
+            tree.insert("", index, iid=iid, values=values)
+
+
+def apply_row_change(tree, event, fetch_values):
+    """ Aplica um ChangeEvent de uma única linha a um Treeview cujos iids são os IDs.
+
+    fetch_values(pk) devolve a tupla exibida para a linha (ou None se ela não
+    existir mais). Retorna False quando o evento não pôde ser aplicado
+    incrementalmente (pk None, alteração em massa) e a tela deve ser recarregada.
+    """
+    if event.pk is None:
+        return False
+    iid = str(event.pk)
+    if event.operation == "delete":
+        if tree.exists(iid):
+            tree.delete(iid)
+        return True
+    values = fetch_values(event.pk)
+    if values is None:
+        if tree.exists(iid):
+            tree.delete(iid)
+    elif tree.exists(iid):
+        tree.item(iid, values=values)
+    else:
+        tree.insert("", "end", iid=iid, values=values)
+    return True
+
+
+class PagedTreeview(ttk.Frame):
+    """ Treeview que mantém apenas uma janela de linhas, buscando páginas do banco conforme a rolagem.
+
+    fetch_page(conn, after_id=..., before_id=..., limit=...) deve devolver as
+    linhas (dicionários) seguintes a after_id em ordem crescente de ID ou, com
+    before_id, as anteriores em ordem decrescente. format_page recebe a página
+    inteira e devolve as tuplas exibidas, de modo que a formatação (datas,
+    números) é feita uma vez por página. count_rows(conn) devolve o total de
+    linhas. As duas consultas rodam no executor (QueryExecutor), com a conexão
+    da thread de trabalho; os resultados chegam pelo poll() da interface, então
+    rolar um histórico grande não congela a janela. No máximo
+    page_size * max_pages linhas ficam no Treeview, então memória e tempo de
+    atualização não dependem do tamanho do histórico.
+    """
+
+    # Fração da janela carregada a partir da qual a próxima página é buscada
+    PREFETCH_THRESHOLD = 0.1
+
+    def __init__(self, parent, columns, id_key, fetch_page, format_page, count_rows, executor, key,
+                 page_size=200, max_pages=3):
+        super().__init__(parent)
+        self.id_key = id_key
+        self.fetch_page = fetch_page
+        self.format_page = format_page
+        self.count_rows = count_rows
+        self.executor = executor
+        self.key = key
+        # Chave própria das páginas da rolagem: uma recarga não é descartada por elas (nem o contrário)
+        self.page_key = f"{key}_page"
+        self.page_size = page_size
+        self.max_rows = page_size * max_pages
+        self.at_start = True
+        self.at_end = False
+        self.total = 0
+        self._loading = False
+
+        column_ids = [f"#{i}" for i in range(1, len(columns) + 1)]
+        self.tree = ttk.Treeview(self, columns=column_ids, show="headings")
+        for column_id, (heading, width, anchor) in zip(column_ids, columns):
+            self.tree.heading(column_id, text=heading)
+            if anchor:
+                self.tree.column(column_id, width=width, anchor=anchor)
+            else:
+                self.tree.column(column_id, width=width)
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+        self.status_label = ttk.Label(self, text="")
+
+        self.status_label.pack(side="bottom", fill="x")
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", expand=True, fill="both")
+
+    def refresh(self):
+        """ Recarrega, em segundo plano, a primeira página e o total de linhas """
+        # Uma página da rolagem ainda pendente se referia ao conteúdo antigo
+        self.executor.cancel(self.page_key)
+        self._loading = False
+        fetch_page, count_rows, limit = self.fetch_page, self.count_rows, self.page_size
+        self.executor.submit(
+            self.key,
+            lambda conn: (count_rows(conn), fetch_page(conn, after_id=None, before_id=None, limit=limit)),
+            lambda result: self.show_first_page(*result))
+
+    def show_first_page(self, total, rows):
+        """ Substitui o conteúdo pela primeira página já consultada """
+        self.tree.delete(*self.tree.get_children())
+        self.at_start = True
+        self.at_end = False
+        self.total = total
+        self._append(rows)
+        self.tree.yview_moveto(0)
+        self._update_status()
+
+    def apply_change(self, event, fetch_row):
+        """ Atualiza a janela carregada a partir de um ChangeEvent, sem recarregar as páginas.
+
+        fetch_row(pk) devolve a linha (dicionário) no formato de fetch_page. Ela
+        é chamada na thread da interface: é a leitura de uma linha pela chave,
+        logo após a gravação feita pela própria interface, e aplicá-la na hora
+        mantém a ordem dos eventos. Inserções só aparecem se o fim da lista já
+        estiver carregado; fora da janela, apenas o total muda. Eventos em massa
+        (pk None) recarregam.
+        """
+        if event.pk is None:
+            self.refresh()
+            return
+        iid = str(event.pk)
+        if event.operation == "delete":
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+            self.total = max(self.total - 1, 0)
+        elif event.operation == "insert":
+            self.total += 1
+            if self.at_end and not self.tree.exists(iid):
+                row = fetch_row(event.pk)
+                if row:
+                    self.tree.insert("", "end", iid=iid, values=self.format_page([row])[0])
+                    children = self.tree.get_children()
+                    if len(children) > self.max_rows:
+                        self.tree.delete(children[0])
+                        self.at_start = False
+        elif self.tree.exists(iid):
+            row = fetch_row(event.pk)
+            if row:
+                self.tree.item(iid, values=self.format_page([row])[0])
+            else:
+                self.tree.delete(iid)
+        self._update_status()
+
+    def _on_tree_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._loading:
+            return
+        first, last = float(first), float(last)
+        if last >= 1 - self.PREFETCH_THRESHOLD and not self.at_end:
+            self._request_page(forward=True)
+        elif first <= self.PREFETCH_THRESHOLD and not self.at_start:
+            self._request_page(forward=False)
+
+    def _request_page(self, forward):
+        """ Pede ao executor a página seguinte (forward) ou anterior à janela carregada """
+        children = self.tree.get_children()
+        if not children:
+            return
+        anchor = children[-1] if forward else children[0]
+        after_id, before_id = (self._row_id(anchor), None) if forward else (None, self._row_id(anchor))
+        fetch_page, limit = self.fetch_page, self.page_size
+        self._loading = True
+        self.executor.submit(
+            self.page_key,
+            lambda conn: fetch_page(conn, after_id=after_id, before_id=before_id, limit=limit),
+            lambda rows: self._show_page(forward, anchor, rows),
+            self._page_failed)
+
+    def _page_failed(self, error):
+        self._loading = False
+        print(f"Erro ao buscar página de {self.key}: {error}")
+
+    def _show_page(self, forward, anchor, rows):
+        try:
+            children = self.tree.get_children()
+            # Eventos aplicados enquanto a página era buscada podem ter mudado a borda da janela
+            if not children or children[-1 if forward else 0] != anchor:
+                return
+            if forward:
+                self._load_next(rows)
+            else:
+                self._load_previous(rows)
+        finally:
+            self._loading = False
+
+    def _load_next(self, rows):
+        top_item = self._top_visible_item()
+        self._append(rows)
+        children = self.tree.get_children()
+        excess = len(children) - self.max_rows
+        if excess > 0:
+            self.tree.delete(*children[:excess])
+            self.at_start = False
+        self._keep_visible(top_item)
+        self._update_status()
+
+    def _load_previous(self, rows):
+        top_item = self._top_visible_item()
+        if len(rows) < self.page_size:
+            self.at_start = True
+        # A página anterior vem em ordem decrescente: cada linha entra no topo
+        for row_id, values in zip((row[self.id_key] for row in rows), self.format_page(rows)):
+            self.tree.insert("", 0, iid=str(row_id), values=values)
+        children = self.tree.get_children()
+        excess = len(children) - self.max_rows
+        if excess > 0:
+            self.tree.delete(*children[-excess:])
+            self.at_end = False
+        self._keep_visible(top_item)
+        self._update_status()
+
+    def _append(self, rows):
+        if len(rows) < self.page_size:
+            self.at_end = True
+        for row_id, values in zip((row[self.id_key] for row in rows), self.format_page(rows)):
+            self.tree.insert("", "end", iid=str(row_id), values=values)
+
+    def _row_id(self, iid):
+        return int(iid)
+
+    def _top_visible_item(self):
+        return self.tree.identify_row(5) or None
+
+    def _keep_visible(self, item):
+        # Mantém na mesma posição a linha que estava no topo antes de carregar/descartar páginas
+        children = self.tree.get_children()
+        if item and self.tree.exists(item) and children:
+            self.tree.yview_moveto(self.tree.index(item) / len(children))
+
+    def _update_status(self):
+        children = self.tree.get_children()
+        if not children:
+            self.status_label.config(text=f"Nenhum registro (total: {self.total})")
+            return
+        self.status_label.config(
+            text=f"Exibindo IDs {children[0]} a {children[-1]} ({len(children)} carregados) de {self.total} registros")